@@ -0,0 +1,327 @@
+"""analysis_cache.py: persistent cache of per-file analysis results"""
+#
+# Copyright (C) 2021 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# The same files (libc, libstdc++, OpenSSL, Qt, Electron, ...) are in many
+# snaps, so with SNAP_REVIEW_ANALYSIS_CACHE=1 (or =/path/to/cache.db) the
+# results of analyzing a file are kept in an SQLite database keyed by the
+# sha256 and size of the file and the analyzer version. Least recently used
+# entries are evicted when the cache is bigger than
+# SNAP_REVIEW_ANALYSIS_CACHE_SIZE megabytes. Results that also depend on
+# other inputs (eg, the resquash verdict) are keyed by a digest of the file
+# and those inputs instead (see get_inputs_digest()).
+
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+import reviewtools.common
+from reviewtools.common import debug, warn
+
+# Bump the version of an analyzer when its results change so old entries
+# aren't used
+ANALYZER_VERSIONS = {
+    "mime": 1,  # _list_all_compiled_binaries()
+    "execstack": 1,  # check_execstack()
+    "symbols": 1,  # _find_symbols()
+    "resquash": 1,  # check_squashfs_resquash()
+}
+
+ANALYSIS_CACHE_FILENAME = "%sanalysis-cache.db" % reviewtools.common.MKDTEMP_PREFIX
+ANALYSIS_CACHE_MAX_SIZE = 256  # megabytes
+
+# the opened cache, False when disabled or unusable
+ANALYSIS_CACHE = None
+
+# cache the (sha256, size) of files by (path, size, mtime, inode) so each
+# file is read once per review
+FILE_DIGESTS = {}
+FILE_DIGESTS_LOCK = threading.Lock()
+
+
+class AnalysisCache(object):
+    """SQLite-backed cache of analysis results
+
+    Example:
+        cache = AnalysisCache("/tmp/cache.db")
+        (found, value) = cache.get(sha256, size, "symbols")
+        if not found:
+            cache.put(sha256, size, "symbols", value)
+        cache.close()
+    """
+
+    def __init__(self, path, max_size=ANALYSIS_CACHE_MAX_SIZE):
+        self.path = path
+        self.max_size = max_size * 1024 * 1024
+        self.hits = 0
+        self.misses = 0
+        # the last_used times of hits are updated on close()
+        self._used = set()
+        self._lock = threading.Lock()
+        # other reviews may be using the database at the same time
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS analysis ("
+                "sha256 TEXT NOT NULL, "
+                "size INTEGER NOT NULL, "
+                "analyzer TEXT NOT NULL, "
+                "version INTEGER NOT NULL, "
+                "value TEXT NOT NULL, "
+                "last_used REAL NOT NULL, "
+                "PRIMARY KEY (sha256, size, analyzer, version))"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS analysis_last_used "
+                "ON analysis (last_used)"
+            )
+
+    def _key(self, sha256, size, analyzer):
+        return (sha256, size, analyzer, ANALYZER_VERSIONS[analyzer])
+
+    def get(self, sha256, size, analyzer):
+        """Return (True, value) for cached results, otherwise (False, None)"""
+        key = self._key(sha256, size, analyzer)
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value FROM analysis "
+                "WHERE sha256 = ? AND size = ? AND analyzer = ? AND version = ?",
+                key,
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return (False, None)
+            self.hits += 1
+            self._used.add(key)
+        return (True, json.loads(row[0]))
+
+    def put(self, sha256, size, analyzer, value):
+        """Add the result of analyzing a file"""
+        key = self._key(sha256, size, analyzer)
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO analysis VALUES (?, ?, ?, ?, ?, ?)",
+                key + (json.dumps(value), time.time()),
+            )
+
+    def prune(self):
+        """Remove the least recently used entries until the cache fits in
+           max_size
+        """
+        # sizes are estimated from the keys and values plus some overhead
+        entry_size = "length(sha256) + length(analyzer) + length(value) + 32"
+        with self._lock, self._db:
+            (total,) = self._db.execute(
+                "SELECT sum(%s) FROM analysis" % entry_size
+            ).fetchone()
+            if total is None or total <= self.max_size:
+                return
+
+            total = 0
+            evict = []
+            for row in self._db.execute(
+                "SELECT rowid, %s FROM analysis ORDER BY last_used DESC" % entry_size
+            ):
+                total += row[1]
+                if total > self.max_size:
+                    evict.append((row[0],))
+            if evict:
+                self._db.executemany("DELETE FROM analysis WHERE rowid = ?", evict)
+                debug("evicted %d analysis cache entries" % len(evict))
+
+    def close(self):
+        """Record which entries were used, prune and close the cache"""
+        now = time.time()
+        with self._lock, self._db:
+            self._db.executemany(
+                "UPDATE analysis SET last_used = ? "
+                "WHERE sha256 = ? AND size = ? AND analyzer = ? AND version = ?",
+                [(now,) + key for key in self._used],
+            )
+            self._used = set()
+        self.prune()
+        self._db.close()
+
+
+def analysis_cache_enabled():
+    """Check if the opt-in analysis cache is enabled"""
+    return os.environ.get("SNAP_REVIEW_ANALYSIS_CACHE", "") not in ["", "0"]
+
+
+def get_analysis_cache_path():
+    """Return the path of the analysis cache database"""
+    path = os.environ.get("SNAP_REVIEW_ANALYSIS_CACHE", "")
+    if path not in ["", "0", "1"]:
+        return path
+    tmpdir = tempfile.gettempdir()
+    if reviewtools.common.MKDTEMP_DIR is not None:
+        tmpdir = reviewtools.common.MKDTEMP_DIR
+    return os.path.join(tmpdir, ANALYSIS_CACHE_FILENAME)
+
+
+def get_analysis_cache():
+    """Return the opened AnalysisCache or None if not enabled"""
+    global ANALYSIS_CACHE
+    if ANALYSIS_CACHE is None:
+        ANALYSIS_CACHE = False
+        if analysis_cache_enabled():
+            max_size = ANALYSIS_CACHE_MAX_SIZE
+            try:
+                if "SNAP_REVIEW_ANALYSIS_CACHE_SIZE" in os.environ:
+                    max_size = float(os.environ["SNAP_REVIEW_ANALYSIS_CACHE_SIZE"])
+                ANALYSIS_CACHE = AnalysisCache(get_analysis_cache_path(), max_size)
+            except ValueError as e:
+                warn("invalid analysis cache size: %s" % e)
+            except sqlite3.Error as e:
+                warn("could not open analysis cache: %s" % e)
+    if ANALYSIS_CACHE is False:
+        return None
+    return ANALYSIS_CACHE
+
+
+def close_analysis_cache():
+    """Close the analysis cache (if opened) and show the hits and misses"""
+    global ANALYSIS_CACHE
+    global FILE_DIGESTS
+    if ANALYSIS_CACHE:
+        debug(
+            "analysis cache: %d hits, %d misses"
+            % (ANALYSIS_CACHE.hits, ANALYSIS_CACHE.misses)
+        )
+        try:
+            ANALYSIS_CACHE.close()
+        except sqlite3.Error as e:
+            warn("could not update analysis cache: %s" % e)
+    ANALYSIS_CACHE = None
+    with FILE_DIGESTS_LOCK:
+        FILE_DIGESTS = {}
+
+
+def get_file_digest(fn, compute=True):
+    """Return the (sha256, size) of the file, or None if it couldn't be read
+       or, with compute=False, the file wasn't hashed yet
+    """
+    try:
+        st = os.stat(fn)
+    except OSError:
+        return None
+    key = (fn, st.st_size, st.st_mtime_ns, st.st_ino)
+    with FILE_DIGESTS_LOCK:
+        if key in FILE_DIGESTS or not compute:
+            return FILE_DIGESTS.get(key)
+
+    h = hashlib.sha256()
+    try:
+        with open(fn, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(chunk)
+    except OSError:
+        return None
+    with FILE_DIGESTS_LOCK:
+        FILE_DIGESTS[key] = (h.hexdigest(), st.st_size)
+    return FILE_DIGESTS[key]
+
+
+def cached_analyses(fns, analyzer, func, hash_file=True):
+    """Return func(fns), a dict of file to result, using the analysis cache
+       when enabled so func is only called for the files not in the cache.
+       Hashing a file reads all of it, so analyzers cheaper than that use
+       hash_file=False to only use the cache for files that were already
+       hashed.
+    """
+    cache = get_analysis_cache()
+    if cache is None:
+        return func(fns)
+
+    results = {}
+    digests = {}
+    for fn in fns:
+        digest = get_file_digest(fn, compute=hash_file)
+        if digest is None:
+            continue
+        try:
+            (found, value) = cache.get(digest[0], digest[1], analyzer)
+        except sqlite3.Error as e:
+            debug("analysis cache error for '%s': %s" % (fn, e))
+            continue
+        if found:
+            results[fn] = value
+        else:
+            digests[fn] = digest
+
+    misses = [fn for fn in fns if fn not in results]
+    if len(misses) > 0:
+        computed = func(misses)
+        for fn in misses:
+            results[fn] = computed[fn]
+            if fn not in digests:
+                continue
+            try:
+                cache.put(digests[fn][0], digests[fn][1], analyzer, computed[fn])
+            except sqlite3.Error as e:
+                debug("analysis cache error for '%s': %s" % (fn, e))
+    return results
+
+
+def cached_analysis(fn, analyzer, func, hash_file=True):
+    """Return func(fn), using the analysis cache when enabled (see
+       cached_analyses())
+    """
+    return cached_analyses(
+        [fn], analyzer, lambda fns: {fn: func(fn)}, hash_file=hash_file
+    )[fn]
+
+
+def get_inputs_digest(fn, inputs):
+    """Return a (sha256, size) key for the results of analyzing fn with the
+       given (JSON serializable) inputs, or None if fn couldn't be read
+    """
+    digest = get_file_digest(fn)
+    if digest is None:
+        return None
+    h = hashlib.sha256()
+    h.update(digest[0].encode())
+    h.update(json.dumps(inputs, sort_keys=True).encode())
+    return (h.hexdigest(), digest[1])
+
+
+def get_cached_result(digest, analyzer):
+    """Return (True, value) if a result for the (sha256, size) digest is in
+       the analysis cache, otherwise (False, None)
+    """
+    cache = get_analysis_cache()
+    if cache is None:
+        return (False, None)
+    try:
+        return cache.get(digest[0], digest[1], analyzer)
+    except sqlite3.Error as e:
+        debug("analysis cache error for '%s': %s" % (digest[0], e))
+    return (False, None)
+
+
+def put_cached_result(digest, analyzer, value):
+    """Add a result for the (sha256, size) digest to the analysis cache"""
+    cache = get_analysis_cache()
+    if cache is None:
+        return
+    try:
+        cache.put(digest[0], digest[1], analyzer, value)
+    except sqlite3.Error as e:
+        debug("analysis cache error for '%s': %s" % (digest[0], e))
@@ -15,18 +15,21 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from __future__ import print_function
+import array
 import atexit
+import bisect
 import codecs
+import collections
 import copy
 from enum import Enum
+import fcntl
+import fnmatch
 import glob
-import inspect
+import hashlib
 import json
-import logging
-import magic
 import os
-from pkg_resources import resource_filename
 import re
+import resource
 import shutil
 import stat
 import subprocess
@@ -36,15 +39,12 @@ import tarfile
 import tempfile
 import time
 import types
-import yaml
 
 from reviewtools.overrides import common_external_symlink_override
 
-REPORT_OUTPUT = "json"
 RESULT_TYPES = ["info", "warn", "error"]
-UNPACK_DIR = None
-RAW_UNPACK_DIR = None
-TMP_DIR = None
+# unpacked up front, everything else is unpacked on first use
+UNPACK_ITEMS_DEFAULT = ["meta", "snap"]
 MKDTEMP_PREFIX = "review-tools-"
 MKDTEMP_DIR = None
 VALID_SYSCALL = r"^[a-z0-9_]{2,64}$"
@@ -92,11 +92,38 @@ MAX_COMPRESSED_SIZE = 5
 # 90% of disk but not larger than this
 MAX_UNCOMPRESSED_SIZE = 25
 
-# cache the expensive magic calls
-PKG_BIN_FILES = None
-
-# cache gathering all the files
-PKG_FILES = None
+# compare_files() reads this much at a time, after the first
+# COMPARE_HEADER_SIZE bytes when the sizes differ
+COMPARE_CHUNK_SIZE = 4 * 1024 * 1024
+COMPARE_HEADER_SIZE = 4096
+
+# the number of subprocesses started, for profiling (see ProfileTimer)
+SUBPROCESS_COUNT = 0
+
+# cache the (process-wide) capabilities of the installed squashfs-tools
+UNSQUASHFS_SUPPORTS_IGNORE_ERRORS = None
+SQUASHFS_TOOLS_VERSION = None
+
+# Opt-in (SNAP_REVIEW_UNPACK_CACHE=1) cache of unpacked packages in
+# MKDTEMP_DIR, keyed by the sha512 and size of the package. Entries are
+# evicted when not used for SNAP_REVIEW_UNPACK_CACHE_AGE days or, least
+# recently used first, when the cache is bigger than
+# SNAP_REVIEW_UNPACK_CACHE_SIZE megabytes
+UNPACK_CACHE_DIRNAME = "%sunpack-cache" % MKDTEMP_PREFIX
+UNPACK_CACHE_MAX_AGE = 7  # days
+UNPACK_CACHE_MAX_SIZE = 20 * 1024  # megabytes
+# entries used this recently may be in use by other reviews, so keep them
+UNPACK_CACHE_MIN_AGE = 60 * 60 * 3
+
+# the BaseDeclaration of the snapd base declaration and the (path, mtime,
+# size) it was read from, since it is used several times per review
+SNAPD_BASE_DECLARATION = None
+
+# Opt-in (SNAP_REVIEW_BASE_DECL_CACHE=1 or =/path/to/cache.json) cache of the
+# parsed snapd base declaration as JSON, keyed by the sha256 of the yaml, so
+# the yaml doesn't need to be parsed
+BASE_DECL_CACHE_FILENAME = "%sbase-decl-cache.json" % MKDTEMP_PREFIX
+BASE_DECL_CACHE_FORMAT = 1
 
 # os release map
 OS_RELEASE_MAP = {
@@ -141,19 +168,98 @@ OS_RELEASE_MAP = {
 }
 
 
-def cleanup_unpack():
-    global UNPACK_DIR
-    if UNPACK_DIR is not None and os.path.isdir(UNPACK_DIR):
-        recursive_rm(UNPACK_DIR)
-        UNPACK_DIR = None
-    global RAW_UNPACK_DIR
-    if RAW_UNPACK_DIR is not None and os.path.isdir(RAW_UNPACK_DIR):
-        recursive_rm(RAW_UNPACK_DIR)
-        RAW_UNPACK_DIR = None
-    global TMP_DIR
-    if TMP_DIR is not None and os.path.isdir(TMP_DIR):
-        recursive_rm(TMP_DIR)
-        TMP_DIR = None
+class ReviewContext(object):
+    """The state of the review of a package: where it is unpacked, the
+    caches of its files and how to report. The modules reviewing a package
+    share it, so the package is unpacked and listed once. Reviews use
+    DEFAULT_REVIEW_CONTEXT unless given their own, so several packages can
+    be reviewed one after the other in one process. Some state is still
+    process-wide (eg, the working directory and umask while resquashing,
+    set_lang() and the module-level caches and counters), so only one
+    review may run at a time in a process: concurrent reviews need
+    separate processes (eg, 'snap-review --jobs' or bin/snap-review-daemon).
+
+    Example:
+        context = ReviewContext()
+        review = SnapReviewLint(fn, context=context)
+        review.do_checks()
+        cleanup_unpack(context)
+    """
+
+    def __init__(self, report_output="json"):
+        self.report_output = report_output
+        self._reset_package_state()
+
+    def _reset_package_state(self):
+        """Forget the package (see cleanup())"""
+        self.unpack_dir = None
+        # paths (relative to the package root) unpacked into unpack_dir so
+        # far or None when the whole package is unpacked
+        self.unpack_items = None
+        # the unpack cache entry unpack_dir is in, if any
+        self.unpack_cache_entry = None
+        self.raw_unpack_dir = None
+        self.tmp_dir = None
+        # cache gathering all the files
+        self.pkg_files = None
+        # cache the expensive magic calls
+        self.pkg_bin_files = None
+        # cache the parsed 'unsquashfs -lln' listing of the package
+        self.pkg_listing = None
+        # cache the PackageIndex of the unpacked package
+        self.pkg_index = None
+        # the parsed snap.yaml, etc shared by the snap reviews (see
+        # sr_common.SnapState)
+        self.snap_state = None
+
+    def set_report_output(self, t):
+        """Report as 'console' or 'json' (other values are ignored)"""
+        if t is not None and t in ["console", "json"]:
+            self.report_output = t
+
+    def cleanup(self):
+        """Remove what was unpacked and reset the caches"""
+        if self.unpack_cache_entry is not None:
+            # cached entries are shared, see prune_unpack_cache()
+            self.unpack_cache_entry = None
+        elif self.unpack_dir is not None and os.path.isdir(self.unpack_dir):
+            recursive_rm(self.unpack_dir)
+        self._reset_package_state()
+
+    def cleanup_tmp_dir(self):
+        """Remove the temporary directory (see create_tempdir())"""
+        if self.tmp_dir is not None and os.path.isdir(self.tmp_dir):
+            recursive_rm(self.tmp_dir)
+        self.tmp_dir = None
+
+
+# the context of the reviews that aren't given one, eg by bin/snap-review
+DEFAULT_REVIEW_CONTEXT = ReviewContext()
+
+
+def get_review_context(context=None):
+    """Return context or, if None, DEFAULT_REVIEW_CONTEXT"""
+    if context is None:
+        return DEFAULT_REVIEW_CONTEXT
+    return context
+
+
+def cleanup_unpack(context=None):
+    """Clean up after the review with context (default:
+       DEFAULT_REVIEW_CONTEXT) and remove stale review directories
+    """
+    context = get_review_context(context)
+    for d in [context.raw_unpack_dir, context.tmp_dir]:
+        if d is not None and os.path.isdir(d):
+            recursive_rm(d)
+    context.cleanup()
+
+    if context is DEFAULT_REVIEW_CONTEXT:
+        # imported here since reviewtools.analysis_cache imports this module
+        from reviewtools.analysis_cache import close_analysis_cache
+
+        # the analysis cache is per-process
+        close_analysis_cache()
 
     # Also cleanup any stale review directories
     global MKDTEMP_PREFIX
@@ -163,11 +269,11 @@ def cleanup_unpack():
     if MKDTEMP_DIR is not None:
         tmpdir = MKDTEMP_DIR
     for d in glob.glob("%s/%s*" % (tmpdir, MKDTEMP_PREFIX)):
-        if not os.path.isdir(d):
+        if not os.path.isdir(d) or os.path.basename(d) == UNPACK_CACHE_DIRNAME:
             continue
-        # since we tell unsquashfs to use UNPACK_DIR, unsquashfs sets the mtime
-        # to the mtime of squashfs-root in the snap after the unpack, so check
-        # the ctime instead of the mtime
+        # since we tell unsquashfs to use the unpack dir, unsquashfs sets the
+        # mtime to the mtime of squashfs-root in the snap after the unpack, so
+        # check the ctime instead of the mtime
         if time.time() - os.path.getctime(d) > maxage:
             debug("Removing old review '%s'" % d)
             try:
@@ -182,16 +288,65 @@ def cleanup_unpack():
                 syslog.syslog("Could not remove '%s'" % d)
                 syslog.closelog()
 
-    # For the testsuite
-    global PKG_FILES
-    PKG_FILES = None
-    global PKG_BIN_FILES
-    PKG_BIN_FILES = None
-
 
 atexit.register(cleanup_unpack)
 
 
+def cleanup_worker(shared_dirs=None, context=None):
+    """Clean up after running checks in a worker process forked by
+       modules.run_modules_parallel(). What was unpacked before forking
+       (shared_dirs) is shared with the parent, so only what the worker
+       created is removed. Pool workers exit without running the atexit
+       handlers, so this is done after each module
+    """
+    if shared_dirs is None:
+        shared_dirs = []
+    context = get_review_context(context)
+    context.cleanup_tmp_dir()
+    d = context.raw_unpack_dir
+    if d is not None and d not in shared_dirs:
+        if os.path.isdir(d):
+            recursive_rm(d)
+        context.raw_unpack_dir = None
+    if context.unpack_dir is not None and context.unpack_dir not in shared_dirs:
+        context.cleanup()
+
+    # imported here since reviewtools.analysis_cache imports this module
+    from reviewtools.analysis_cache import close_analysis_cache
+
+    close_analysis_cache()
+
+
+def init_mkdtemp_dir():
+    """Use SNAP_USER_COMMON for temporary directories when in a snap"""
+    global MKDTEMP_DIR
+    if (
+        MKDTEMP_DIR is None
+        and "SNAP_USER_COMMON" in os.environ
+        and os.path.exists(os.environ["SNAP_USER_COMMON"])
+    ):
+        MKDTEMP_DIR = os.environ["SNAP_USER_COMMON"]
+
+
+def unpack_pkg_shared(fn, context=None):
+    """Unpack all of fn (and its raw unpack) where the reviews with context
+       and the workers forked from this process find it, so workers running
+       in parallel don't unpack lazily into the shared directory
+    """
+    init_mkdtemp_dir()
+
+    context = get_review_context(context)
+    if context.unpack_dir is None and unpack_cache_enabled():
+        context.unpack_cache_entry = unpack_pkg_cached(fn, context)
+        context.unpack_dir = os.path.join(context.unpack_cache_entry, "squashfs-root")
+    elif context.unpack_dir is None:
+        context.unpack_dir = unpack_pkg(fn, context=context)
+        context.unpack_items = None
+
+    if context.raw_unpack_dir is None:
+        context.raw_unpack_dir = raw_unpack_pkg(fn)
+
+
 #
 # Utility classes
 #
@@ -205,11 +360,137 @@ class ReviewException(Exception):
         return repr(self.value)
 
 
+class DuplicateYamlKeyError(ReviewException):
+    """This class represents yaml mappings with duplicated keys (see
+       load_yaml())
+    """
+
+
+class FatalReviewError(Exception):
+    """This class represents errors that stop the review (see error()). The
+       bin/ entry points show them and exit with exit_code (see
+       exit_on_fatal_error())
+    """
+
+    def __init__(self, value, exit_code=1, output_type=None):
+        # pass the arguments along so it can be pickled, eg by
+        # modules.run_modules_parallel()
+        Exception.__init__(self, value, exit_code, output_type)
+        self.value = value
+        self.exit_code = exit_code
+        self.output_type = output_type
+
+    def __str__(self):
+        return str(self.value)
+
+
+# The check_* methods of the review classes are registered when the classes
+# are defined, along with (optional) metadata from @check_metadata(): the
+# estimated cost class of the check, what it needs from the package and
+# whether its errors block the package. With RT_FAIL_FAST=1 (or
+# 'snap-review --fail-fast') the cheap and blocking checks are run first and
+# no more checks are run after one of them found an error.
+CHECK_COSTS = ["cheap", "normal", "expensive"]
+# what a check needs from the package: only the snap.yaml (and other meta
+# files), the file listing, the unpacked files or the binaries among them
+CHECK_INPUTS = ["yaml", "listing", "unpack", "binaries"]
+CHECK_METADATA_DEFAULT = ("normal", "unpack", True)
+
+CheckInfo = collections.namedtuple("CheckInfo", ["name", "cost", "needs", "blocking"])
+
+
+def check_metadata(cost="normal", needs="unpack", blocking=True):
+    """Decorator for the registry metadata of a check_* method
+
+    Example:
+        @check_metadata(cost="cheap", needs="yaml")
+        def check_name(self):
+            ...
+    """
+    if cost not in CHECK_COSTS:
+        raise ValueError("invalid check cost '%s'" % cost)
+    if needs not in CHECK_INPUTS:
+        raise ValueError("invalid check input '%s'" % needs)
+
+    def decorator(func):
+        func._check_metadata = (cost, needs, blocking)
+        return func
+
+    return decorator
+
+
+def fail_fast_enabled():
+    """Check if the fail-fast mode (RT_FAIL_FAST=1) is enabled"""
+    return os.environ.get("RT_FAIL_FAST", "") not in ["", "0"]
+
+
+def get_check_selection():
+    """Return the (only, skip) lists of check name globs given with
+       RT_ONLY_CHECKS and RT_SKIP_CHECKS (comma separated)
+    """
+    selection = []
+    for var in ["RT_ONLY_CHECKS", "RT_SKIP_CHECKS"]:
+        selection.append(
+            [g.strip() for g in os.environ.get(var, "").split(",") if g.strip()]
+        )
+    return tuple(selection)
+
+
+def check_selection_enabled():
+    """Check if only some checks are run (RT_ONLY_CHECKS or RT_SKIP_CHECKS)"""
+    (only, skip) = get_check_selection()
+    return len(only) > 0 or len(skip) > 0
+
+
+def check_selected(review_type, name):
+    """Check if the check_* method name of review_type is selected by the
+       RT_ONLY_CHECKS and RT_SKIP_CHECKS globs. Checks are named
+       <review_type>:<name without check_> (eg,
+       security-snap-v2:squashfs_resquash) and globs without ':' match the
+       name alone.
+    """
+    (only, skip) = get_check_selection()
+    short = name[len("check_") :]
+    full = "%s:%s" % (review_type, short)
+
+    def _matches(globs):
+        for g in globs:
+            if ":" not in g and fnmatch.fnmatchcase(short, g):
+                return True
+            elif fnmatch.fnmatchcase(full, g):
+                return True
+        return False
+
+    if len(only) > 0 and not _matches(only):
+        return False
+    return not _matches(skip)
+
+
 class ReviewBase(object):
     """Base review class"""
 
-    def __init__(self, review_type, overrides=None):
+    # the CheckInfo of the check_* methods by name (see __init_subclass__())
+    checks = {}
+
+    def __init_subclass__(cls, **kwargs):
+        """Register the check_* methods of the class and its bases"""
+        super().__init_subclass__(**kwargs)
+        checks = {}
+        for klass in reversed(cls.__mro__):
+            for (name, member) in vars(klass).items():
+                if not name.startswith("check_"):
+                    continue
+                if not isinstance(member, types.FunctionType):
+                    # eg, a check disabled with 'check_foo = None'
+                    checks.pop(name, None)
+                    continue
+                metadata = getattr(member, "_check_metadata", CHECK_METADATA_DEFAULT)
+                checks[name] = CheckInfo(name, *metadata)
+        cls.checks = checks
+
+    def __init__(self, review_type, overrides=None, context=None):
         self.review_type = review_type
+        self.context = get_review_context(context)
         # TODO: rename as pkg_report
         self.review_report = dict()
         self.stage_report = dict()
@@ -223,10 +504,11 @@ class ReviewBase(object):
 
         self.override_result_type = None
 
+        # with RT_PROFILE=1, the cost of each check (see ProfileTimer)
+        self.timings = dict()
+
     def set_report_type(self, t):
-        global REPORT_OUTPUT
-        if t is not None and t in ["console", "json"]:
-            REPORT_OUTPUT = t
+        self.context.set_report_output(t)
 
     def _get_check_name(self, name, app="", extra=""):
         name = ":".join([self.review_type, name])
@@ -279,6 +561,8 @@ class ReviewBase(object):
             msg = "CHECK|{}|{}"
             name = ":".join(review_name.split(":")[:2])
             link_text = link if link is not None else ""
+            import logging
+
             logging.debug(msg.format(name, link_text))
             report[result_type][review_name] = dict()
 
@@ -308,14 +592,17 @@ class ReviewBase(object):
     # Only called by ./bin/* individually, not 'snap-review'
     def do_report(self):
         """Print report"""
-        global REPORT_OUTPUT
+        report = self.review_report
+        if self.timings:
+            report = dict(report)
+            report["timings"] = self.timings
 
-        if REPORT_OUTPUT == "json":
-            jsonmsg(self.review_report)
+        if self.context.report_output == "json":
+            jsonmsg(report)
         else:
             import pprint
 
-            pprint.pprint(self.review_report)
+            pprint.pprint(report)
 
         rc = 0
         if len(self.review_report["error"]):
@@ -324,18 +611,71 @@ class ReviewBase(object):
             rc = 1
         return rc
 
-    def do_checks(self):
-        """Run all methods that start with check_"""
-        methodList = [
-            name
-            for name, member in inspect.getmembers(self, inspect.ismethod)
-            if isinstance(member, types.MethodType)
+    @classmethod
+    def get_checks(cls, fail_fast=False):
+        """Return the CheckInfo of the registered checks in the order they
+           are run: alphabetical or, for fail_fast, cheapest first with the
+           blocking checks before the others of the same cost
+        """
+        checks = [cls.checks[name] for name in sorted(cls.checks)]
+        if fail_fast:
+            checks.sort(key=lambda c: (CHECK_COSTS.index(c.cost), not c.blocking))
+        return checks
+
+    def get_selected_checks(self, fail_fast=False):
+        """Return the CheckInfo of the checks selected with RT_ONLY_CHECKS
+           and RT_SKIP_CHECKS (see get_checks())
+        """
+        return [
+            c
+            for c in self.get_checks(fail_fast)
+            if check_selected(self.review_type, c.name)
         ]
-        for methodname in methodList:
-            if not methodname.startswith("check_"):
+
+    def is_check_selected(self, name):
+        """Check if the check_* method name is selected"""
+        return name in self.checks and check_selected(self.review_type, name)
+
+    def get_needed_input(self):
+        """Return what the selected checks need from the package (see
+           CHECK_INPUTS) or None if no checks are selected
+        """
+        if not check_selection_enabled():
+            return CHECK_INPUTS[-1]
+        needs = [CHECK_INPUTS.index(c.needs) for c in self.get_selected_checks()]
+        if len(needs) == 0:
+            return None
+        return CHECK_INPUTS[max(needs)]
+
+    def do_checks(self, costs=None, fail_fast=None, callback=None):
+        """Run the selected check_* methods (only those of the given cost
+           classes if costs is set). With fail_fast (RT_FAIL_FAST=1 by
+           default) no more checks are run after a blocking check added an
+           error. callback(name, results) is called as each check completes
+           with the {result_type: {review_name: result}} it added. Returns
+           True if checks were skipped because of fail_fast.
+        """
+        if fail_fast is None:
+            fail_fast = fail_fast_enabled()
+        for check in self.get_selected_checks(fail_fast):
+            if costs is not None and check.cost not in costs:
                 continue
-            func = getattr(self, methodname)
-            func()
+            before = dict((r, set(self.review_report[r])) for r in RESULT_TYPES)
+            with ProfileTimer(self.timings, check.name):
+                getattr(self, check.name)()
+            added = dict()
+            for r in RESULT_TYPES:
+                added[r] = dict(
+                    (k, v)
+                    for (k, v) in self.review_report[r].items()
+                    if k not in before[r]
+                )
+            if callback is not None:
+                callback(check.name, added)
+            if fail_fast and check.blocking and added["error"]:
+                debug("%s failed, skipping the remaining checks" % check.name)
+                return True
+        return False
 
     def set_review_type(self, name):
         """Set review name"""
@@ -356,51 +696,202 @@ class Review(ReviewBase):
         "application/x-pie-executable",
     ]
 
-    def __init__(self, fn, review_type, overrides=None):
-        ReviewBase.__init__(self, review_type, overrides)
+    def __init__(self, fn, review_type, overrides=None, context=None):
+        ReviewBase.__init__(self, review_type, overrides, context)
 
         self.pkg_filename = fn
         self._check_package_exists()
 
-        global MKDTEMP_DIR
-        if (
-            MKDTEMP_DIR is None
-            and "SNAP_USER_COMMON" in os.environ
-            and os.path.exists(os.environ["SNAP_USER_COMMON"])
-        ):
-            MKDTEMP_DIR = os.environ["SNAP_USER_COMMON"]
+        init_mkdtemp_dir()
 
-        global UNPACK_DIR
-        if UNPACK_DIR is None:
-            UNPACK_DIR = unpack_pkg(fn)
-        self.unpack_dir = UNPACK_DIR
+        # with RT_ONLY_CHECKS/RT_SKIP_CHECKS, only prepare what the selected
+        # checks need
+        self.needs = self.get_needed_input()
+        partial = self.needs in [None, "yaml", "listing"]
+
+        context = self.context
+        with ProfileTimer(self.timings, "unpack"):
+            if context.unpack_dir is None and unpack_cache_enabled() and not partial:
+                context.unpack_cache_entry = unpack_pkg_cached(fn, context)
+                context.unpack_dir = os.path.join(
+                    context.unpack_cache_entry, "squashfs-root"
+                )
+            elif context.unpack_dir is None:
+                items = self._get_lazy_unpack_items()
+                if items is None:
+                    context.unpack_dir = unpack_pkg(fn, context=context)
+                else:
+                    context.unpack_dir = unpack_pkg(fn, items=items, context=context)
+                    context.unpack_items = set(items)
+        self.unpack_dir = context.unpack_dir
 
         # unpack_pkg() now only supports snap v2, so just hardcode these
         self.is_snap2 = True
         self.pkgfmt = {"type": "snap", "version": "16.04"}
 
-        global RAW_UNPACK_DIR
-        if RAW_UNPACK_DIR is None:
-            RAW_UNPACK_DIR = raw_unpack_pkg(fn)
-        self.raw_unpack_dir = RAW_UNPACK_DIR
+        if context.raw_unpack_dir is None and not partial:
+            with ProfileTimer(self.timings, "raw_unpack"):
+                context.raw_unpack_dir = raw_unpack_pkg(fn)
+        self.raw_unpack_dir = context.raw_unpack_dir
 
         # Get a list of all unpacked files
         self.pkg_files = []
         # self._list_all_files() sets self.pkg_files so we can mock it
-        self._list_all_files()
+        if self.needs not in [None, "yaml"]:
+            with ProfileTimer(self.timings, "list_files"):
+                self._list_all_files()
+
+        # The list of all unpacked compiled binaries needs the whole package
+        # unpacked so it is setup on first use of self.pkg_bin_files
+        self._pkg_bin_files = None
+
+    @property
+    def pkg_bin_files(self):
+        """List of all compiled binaries in this package"""
+        if self._pkg_bin_files is None:
+            self._pkg_bin_files = []
+            # self._list_all_compiled_binaries() sets self.pkg_bin_files so we
+            # can mock it
+            with ProfileTimer(self.timings, "magic"):
+                self._list_all_compiled_binaries()
+        return self._pkg_bin_files
+
+    @pkg_bin_files.setter
+    def pkg_bin_files(self, value):
+        self._pkg_bin_files = value
+
+    @property
+    def pkg_index(self):
+        """PackageIndex of the unpacked package"""
+        context = self.context
+        if self.unpack_dir is None:  # nothing is unpacked
+            return PackageIndex(None)
+        if context.pkg_index is None:
+            if context.unpack_items is None:
+                context.pkg_index = PackageIndex.from_dir(self.unpack_dir)
+            else:
+                # not everything is unpacked, so index what unsquashfs would
+                # unpack
+                context.pkg_index = PackageIndex.from_listing(
+                    get_pkg_listing(self.pkg_filename, context), self.unpack_dir
+                )
+        return context.pkg_index
+
+    def _get_lazy_unpack_items(self):
+        """Return the items to unpack up front or None to unpack the whole
+           package
+        """
+        try:
+            listing = get_pkg_listing(self.pkg_filename, self.context)
+            if listing.rc != 0:
+                return None
+            paths = listing.paths()
+        except ReviewException:
+            # the checks report a malformed listing, so unpack everything
+            return None
 
-        # Setup what is needed to get a list of all unpacked compiled binaries
-        self.pkg_bin_files = []
-        # self._list_all_compiled_binaries() sets self.pkg_files so we can
-        # mock it
-        self._list_all_compiled_binaries()
+        items = set()
+        for i in UNPACK_ITEMS_DEFAULT:
+            if i not in paths:
+                continue
+            items.add(i)
+
+            # make sure symlinks under the item can be followed
+            for p in paths:
+                if not p.startswith(i + "/") or paths[p][0] != "l":
+                    continue
+                rp = listing.resolve(p, items)
+                if rp == "":
+                    return None
+                elif rp is not None and rp in paths:
+                    items.add(rp)
+
+        if len(items) == 0:
+            return None
+        return sorted(items)
+
+    def _is_unpacked(self, rel):
+        """Check if rel (relative to the package root) is already unpacked"""
+        if self.context.unpack_items is None:
+            return True
+        for i in self.context.unpack_items:
+            if rel == i or rel.startswith(i + "/"):
+                return True
+        return False
+
+    def _unpack_items(self, items):
+        """Unpack items (relative to the package root) on first use. Symlinks
+           are followed so the items can be used as if the whole package was
+           unpacked.
+        """
+        context = self.context
+        if context.unpack_dir is None or context.unpack_items is None:
+            return
+
+        listing = get_pkg_listing(self.pkg_filename, context)
+        paths = listing.paths()
+        needed = set()
+        for i in items:
+            rp = listing.resolve(os.path.normpath(i), needed)
+            if rp == "":
+                self._unpack_all()
+                return
+            elif rp is not None:
+                needed.add(rp)
+
+        todo = []
+        for i in sorted(needed):
+            if i in paths and not self._is_unpacked(i):
+                todo.append(i)
+        if len(todo) == 0:
+            return
+
+        if not unpack_pkg_items(self.pkg_filename, context.unpack_dir, todo):
+            self._unpack_all()
+            return
+        context.unpack_items |= set(todo)
+
+    def _unpack_path(self, fn):
+        """Unpack the absolute path fn in the unpack dir on first use"""
+        if self.unpack_dir is None or not fn.startswith(self.unpack_dir + "/"):
+            return
+        self._unpack_items([os.path.relpath(fn, self.unpack_dir)])
+
+    def _is_fully_unpacked(self):
+        """Check if the whole package is unpacked in unpack_dir"""
+        return (
+            self.unpack_dir is not None
+            and self.context.unpack_items is None
+            and os.path.isdir(self.unpack_dir)
+        )
+
+    def _unpack_all(self):
+        """Unpack the whole package for checks that need the whole tree"""
+        context = self.context
+        if context.unpack_dir is None or context.unpack_items is None:
+            return
+
+        debug("unpacking all of '%s'" % self.pkg_filename)
+        recursive_rm(context.unpack_dir)
+        unpack_pkg(self.pkg_filename, context.unpack_dir, context=context)
+        context.unpack_items = None
+
+        # the listing may not have the exact names (eg, non-ascii), so use
+        # what was unpacked. pkg_files is shared, so update it in place
+        context.pkg_index = None
+        if context.pkg_files is not None:
+            context.pkg_files[:] = [
+                os.path.join(self.unpack_dir, f) for f in self.pkg_index.files()
+            ]
 
     def _check_innerpath_executable(self, fn):
         """Check that the provided path exists and is executable"""
+        self._unpack_path(fn)
         return os.access(fn, os.X_OK)
 
     def _extract_statinfo(self, fn):
         """Extract statinfo from file"""
+        self._unpack_path(fn)
         try:
             st = os.stat(fn)
         except Exception:
@@ -413,6 +904,7 @@ class Review(ReviewBase):
             error("_extract_file() expects absolute path")
         rel = os.path.relpath(fn, self.unpack_dir)
 
+        self._unpack_path(fn)
         if not os.path.isfile(fn):
             error("Could not find '%s'" % rel)
         return open_file_read(fn)
@@ -422,10 +914,10 @@ class Review(ReviewBase):
 
     def _get_sha512sum(self, fn):
         """Get sha512sum of file"""
-        (rc, out) = cmd(["sha512sum", fn])
-        if rc != 0:
+        try:
+            return get_sha512sum(fn)
+        except OSError:
             return None
-        return out.split()[0]
 
     def _pkgfmt_type(self):
         """Return the package format type"""
@@ -446,14 +938,25 @@ class Review(ReviewBase):
 
     def _list_all_files(self):
         """List all files included in this package."""
-        global PKG_FILES
-        if PKG_FILES is None:
-            PKG_FILES = []
-            for root, dirnames, filenames in os.walk(self.unpack_dir):
-                for f in filenames:
-                    PKG_FILES.append(os.path.join(root, f))
+        context = self.context
+        if context.pkg_files is None and context.unpack_cache_entry is not None:
+            files = get_unpack_cache_info("files", context)
+            if files is not None:
+                context.pkg_files = [os.path.join(self.unpack_dir, f) for f in files]
+
+        if context.pkg_files is None:
+            context.pkg_files = [
+                os.path.join(self.unpack_dir, f) for f in self.pkg_index.files()
+            ]
+
+            if context.unpack_cache_entry is not None:
+                set_unpack_cache_info(
+                    "files",
+                    [os.path.relpath(f, self.unpack_dir) for f in context.pkg_files],
+                    context,
+                )
 
-        self.pkg_files = PKG_FILES
+        self.pkg_files = context.pkg_files
 
     def _check_if_message_catalog(self, fn):
         """Check if file is a message catalog (.mo file)."""
@@ -463,27 +966,67 @@ class Review(ReviewBase):
 
     def _list_all_compiled_binaries(self):
         """List all compiled binaries in this package."""
-        global PKG_BIN_FILES
-        if PKG_BIN_FILES is None:
-            self.mime = magic.open(magic.MAGIC_MIME)
-            self.mime.load()
-            PKG_BIN_FILES = []
-            for i in self.pkg_files:
-                try:
-                    res = self.mime.file(i)
-                except Exception:  # pragma: nocover
-                    # workaround for zesty python3-magic
-                    debug("could not detemine mime type of '%s'" % i)
-                    continue
+        context = self.context
+        if context.pkg_bin_files is None and context.unpack_cache_entry is not None:
+            files = get_unpack_cache_info("bin_files", context)
+            if files is not None:
+                context.pkg_bin_files = [
+                    os.path.join(self.unpack_dir, f) for f in files
+                ]
+
+        if context.pkg_bin_files is None:
+            # libmagic needs the file contents
+            self._unpack_all()
+
+            # imported here since these modules import from this module
+            from reviewtools.analysis_cache import cached_analysis
+            from reviewtools.elf import elf_mime_type
+            import concurrent.futures
+
+            # Most files can be classified from the ELF header, so only use
+            # libmagic when that isn't enough
+            with concurrent.futures.ThreadPoolExecutor() as executor:
+                mime_types = list(executor.map(elf_mime_type, self.pkg_files))
+
+            pkg_bin_files = []
+            found = set()
+            for (i, res) in zip(self.pkg_files, mime_types):
+                if res is None:
+                    res = cached_analysis(i, "mime", self._magic_mime_type)
 
                 if (
                     res in self.magic_binary_file_descriptions
                     and not self._check_if_message_catalog(i)
-                    and i not in PKG_BIN_FILES
+                    and i not in found
                 ):
-                    PKG_BIN_FILES.append(i)
+                    pkg_bin_files.append(i)
+                    found.add(i)
+            context.pkg_bin_files = pkg_bin_files
+
+            if context.unpack_cache_entry is not None:
+                set_unpack_cache_info(
+                    "bin_files",
+                    [os.path.relpath(f, self.unpack_dir) for f in pkg_bin_files],
+                    context,
+                )
+
+        self.pkg_bin_files = context.pkg_bin_files
+
+    def _magic_mime_type(self, fn):
+        """Get the mime type of fn from libmagic"""
+        if not hasattr(self, "mime"):
+            # slow to import and only needed for some files
+            import magic
+
+            self.mime = magic.open(magic.MAGIC_MIME)
+            self.mime.load()
 
-        self.pkg_bin_files = PKG_BIN_FILES
+        try:
+            return self.mime.file(fn)
+        except Exception:  # pragma: nocover
+            # workaround for zesty python3-magic
+            debug("could not detemine mime type of '%s'" % fn)
+            return None
 
     def _verify_pkgversion(self, v):
         """Verify package name"""
@@ -504,16 +1047,118 @@ class Review(ReviewBase):
 #
 
 
+def profiling_enabled():
+    """Check if the per-check profiling (RT_PROFILE=1) is enabled"""
+    return os.environ.get("RT_PROFILE", "") not in ["", "0"]
+
+
+class ProfileTimer(object):
+    """Record the cost of a block in timings[name] when profiling: the wall
+       and CPU time (seconds), the CPU time of waited for subprocesses, the
+       number of subprocesses started and how much the peak RSS grew (KiB).
+       Nested blocks are counted in both and repeated names are added up.
+
+    Example:
+        with ProfileTimer(self.timings, "check_foo"):
+            self.check_foo()
+    """
+
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+        self.enabled = profiling_enabled()
+
+    def _sample(self):
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        return (
+            time.perf_counter(),
+            time.process_time(),
+            children.ru_utime + children.ru_stime,
+            SUBPROCESS_COUNT,
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        )
+
+    def __enter__(self):
+        if self.enabled:
+            self.start = self._sample()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if not self.enabled:
+            return
+        end = self._sample()
+        if self.name not in self.timings:
+            self.timings[self.name] = {
+                "wall": 0.0,
+                "cpu": 0.0,
+                "children_cpu": 0.0,
+                "subprocesses": 0,
+                "max_rss_delta": 0,
+            }
+        t = self.timings[self.name]
+        t["wall"] = round(t["wall"] + end[0] - self.start[0], 6)
+        t["cpu"] = round(t["cpu"] + end[1] - self.start[1], 6)
+        t["children_cpu"] = round(t["children_cpu"] + end[2] - self.start[2], 6)
+        t["subprocesses"] += end[3] - self.start[3]
+        t["max_rss_delta"] += end[4] - self.start[4]
+
+
+def format_timings(timings):
+    """Format {section: {name: timing}} as a table, slowest first"""
+    rows = []
+    for section in timings:
+        for name in timings[section]:
+            rows.append(("%s:%s" % (section, name), timings[section][name]))
+    rows.sort(key=lambda r: (-r[1]["wall"], r[0]))
+
+    width = max([len("Check")] + [len(r[0]) for r in rows])
+    fmt = "%%-%ds %%9s %%9s %%9s %%7s %%10s" % width
+    lines = [
+        fmt % ("Check", "Wall (s)", "CPU (s)", "Sub (s)", "Subproc", "RSS+ (KiB)")
+    ]
+    for (name, t) in rows:
+        lines.append(
+            fmt
+            % (
+                name,
+                "%.3f" % t["wall"],
+                "%.3f" % t["cpu"],
+                "%.3f" % t["children_cpu"],
+                t["subprocesses"],
+                t["max_rss_delta"],
+            )
+        )
+    return "\n".join(lines)
+
+
 def error(out, exit_code=1, do_exit=True, output_type=None):
-    """Print error message and exit"""
-    global REPORT_OUTPUT
+    """Raise FatalReviewError for the bin/ entry points to print and exit
+       with exit_code or, without do_exit, just print the error message
+    """
+    if do_exit:
+        raise FatalReviewError(out, exit_code, output_type)
+    print_error(out, output_type)
+
+
+def exit_on_fatal_error(e, context=None):
+    """Print the FatalReviewError like the review with context reports and
+       exit with its exit code
+    """
+    print_error(e.value, e.output_type, context)
+    sys.exit(e.exit_code)
+
+
+def print_error(out, output_type=None, context=None):
+    """Print error message in the report format of the review with context
+       or output_type
+    """
     global RESULT_TYPES
 
-    if output_type is not None:
-        Review.set_report_type(None, output_type)
+    context = get_review_context(context)
+    context.set_report_output(output_type)
 
     try:
-        if REPORT_OUTPUT == "json":
+        if context.report_output == "json":
             # mock up expected json format:
             #  {
             #    "test-family": {
@@ -544,9 +1189,6 @@ def error(out, exit_code=1, do_exit=True, output_type=None):
     except IOError:
         pass
 
-    if do_exit:
-        sys.exit(exit_code)
-
 
 def warn(out):
     """Print warning message"""
@@ -556,8 +1198,11 @@ def warn(out):
         pass
 
 
-def msg(out, output=sys.stdout):
+def msg(out, output=None):
     """Print message"""
+    if output is None:
+        # not the default so redirecting sys.stdout works
+        output = sys.stdout
     try:
         print("%s" % (out), file=output)
     except IOError:
@@ -580,7 +1225,9 @@ def jsonmsg(out):
 
 def cmd(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT):
     """Try to execute the given command."""
+    global SUBPROCESS_COUNT
     debug(" ".join(command))
+    SUBPROCESS_COUNT += 1
     try:
         sp = subprocess.Popen(command, stdout=stdout, stderr=stderr)
     except OSError as ex:
@@ -596,6 +1243,8 @@ def cmd(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT):
 
 def cmd_pipe(command1, command2):
     """Try to pipe command1 into command2."""
+    global SUBPROCESS_COUNT
+    SUBPROCESS_COUNT += 2
     try:
         sp1 = subprocess.Popen(command1, stdout=subprocess.PIPE)
         sp2 = subprocess.Popen(command2, stdin=sp1.stdout)
@@ -865,22 +1514,435 @@ def unsquashfs_lln_parse(lln_out):
     return hdr, entries
 
 
-def _calculate_snap_unsquashfs_uncompressed_size(snap_pkg):
-    """Calculate size of the uncompressed snap"""
-    (rc, out) = cmd(["unsquashfs", "-lln", snap_pkg])
-    if rc != 0:
-        error("unsquashfs -lln '%s' failed: %s" % (snap_pkg, out))
+class PkgListing(object):
+    """List the package once and cache the parsed output. The squashfs is
+       read in-process when possible, otherwise 'unsquashfs -lln' is used.
+    """
+
+    def __init__(self, snap_pkg, lln_out=None):
+        self.pkg = os.path.abspath(snap_pkg)
+        st = os.stat(self.pkg)
+        self.key = (self.pkg, st.st_size, st.st_mtime)
+
+        self.rc = 0
+        self.out = lln_out
+        self._parsed = None
+        self._parse_error = None
+        self._paths = None
+        if self.out is not None:  # eg, from the unpack cache
+            return
+
+        # imported here since reviewtools.squashfs imports from this module
+        from reviewtools.squashfs import SquashfsImage, SquashfsException
 
-    size = 0
-    for line in out.splitlines():
-        if not line.startswith("-"):  # skip non-regular files
-            continue
         try:
-            size += int(line.split()[2])
-        except ValueError:  # skip non-numbers
-            continue
+            with SquashfsImage(self.pkg) as sq:
+                self._parsed = ([], list(sq.lln_entries()))
+            return
+        except SquashfsException as e:
+            # eg, lzo compression
+            debug("falling back to unsquashfs -lln: %s" % e)
 
-    return size
+        (self.rc, self.out) = unsquashfs_lln(self.pkg)
+
+    def parse(self):
+        """Return (hdr, entries) as from unsquashfs_lln_parse()"""
+        if self._parse_error is not None:
+            raise self._parse_error
+
+        if self._parsed is None:
+            try:
+                self._parsed = unsquashfs_lln_parse(self.out)
+            except ReviewException as e:
+                self._parse_error = e
+                raise
+            # the entries retain each line, so no need to keep the raw output
+            self.out = None
+
+        return self._parsed
+
+    def uncompressed_size(self):
+        """Return the size of all regular files in the package"""
+        size = 0
+        try:
+            hdr, entries = self.parse()
+        except ReviewException:
+            # malformed output is reported by the checks, so just skip the
+            # lines that can't be parsed here
+            entries = [(line, None) for line in self.out.splitlines()]
+
+        for (line, item) in entries:
+            if item is not None:
+                if item[StatLLN.FILETYPE] == "-":
+                    size += int(item[StatLLN.SIZE])
+                continue
+
+            if not line.startswith("-"):  # skip non-regular files
+                continue
+            try:
+                size += int(line.split()[2])
+            except (IndexError, ValueError):  # skip non-numbers
+                continue
+
+        return size
+
+    def paths(self):
+        """Return {path: (filetype, symlink target)} for all entries with
+           paths relative to the package root (the root itself is omitted)
+        """
+        if self._paths is None:
+            paths = {}
+            (hdr, entries) = self.parse()
+            for (line, item) in entries:
+                fname = item[StatLLN.FILENAME]
+                target = None
+                if item[StatLLN.FILETYPE] == "l":
+                    (fname, _, target) = fname.partition(" -> ")
+                if fname == ".":
+                    continue
+                paths[fname[2:]] = (item[StatLLN.FILETYPE], target)
+            self._paths = paths
+
+        return self._paths
+
+    def resolve(self, path, symlinks=None):
+        """Resolve path relative to the package root like os.path.realpath()
+           would in the unpacked package. Returns the resolved path ('' for
+           the root) or None if it points outside of the package. Symlinks
+           followed along the way are added to the symlinks set.
+        """
+        paths = self.paths()
+        resolved = ""
+        parts = [p for p in path.split("/") if p not in ["", "."]]
+        count = 0
+        while len(parts) > 0:
+            cur = parts.pop(0)
+            if cur == "..":
+                if resolved == "":
+                    return None
+                resolved = os.path.dirname(resolved)
+                continue
+
+            cand = os.path.join(resolved, cur)
+            if cand not in paths or paths[cand][0] != "l":
+                resolved = cand
+                continue
+
+            if symlinks is not None:
+                symlinks.add(cand)
+            count += 1
+            target = paths[cand][1]
+            if count > 40 or target.startswith("/"):
+                return None
+            parts = [p for p in target.split("/") if p not in ["", "."]] + parts
+
+        return resolved
+
+
+def get_pkg_listing(snap_pkg, context=None):
+    """Return the PkgListing for snap_pkg (cached in context)"""
+    context = get_review_context(context)
+    pkg = os.path.abspath(snap_pkg)
+    st = os.stat(pkg)
+    listing = context.pkg_listing
+    if listing is None or listing.key != (pkg, st.st_size, st.st_mtime):
+        listing = PkgListing(pkg)
+        context.pkg_listing = listing
+    return listing
+
+
+def set_pkg_listing(snap_pkg, lln_out, context=None):
+    """Use lln_out as the 'unsquashfs -lln' output for snap_pkg"""
+    listing = PkgListing(snap_pkg, lln_out)
+    get_review_context(context).pkg_listing = listing
+    return listing
+
+
+PackageIndexEntry = collections.namedtuple(
+    "PackageIndexEntry", ["path", "ftype", "size", "mode", "target"]
+)
+
+
+def _stat_ftype(mode):
+    """Return the 'unsquashfs -lln' file type for a st_mode"""
+    if stat.S_ISDIR(mode):
+        return "d"
+    elif stat.S_ISLNK(mode):
+        return "l"
+    elif stat.S_ISCHR(mode):
+        return "c"
+    elif stat.S_ISBLK(mode):
+        return "b"
+    elif stat.S_ISFIFO(mode):
+        return "p"
+    elif stat.S_ISSOCK(mode):
+        return "s"
+    return "-"
+
+
+def _lln_perms(modestr):
+    """Return the permission bits of an 'unsquashfs -lln' mode string"""
+    perms = 0
+    for (i, (r, w, x, special)) in enumerate(
+        [
+            (stat.S_IRUSR, stat.S_IWUSR, stat.S_IXUSR, stat.S_ISUID),
+            (stat.S_IRGRP, stat.S_IWGRP, stat.S_IXGRP, stat.S_ISGID),
+            (stat.S_IROTH, stat.S_IWOTH, stat.S_IXOTH, stat.S_ISVTX),
+        ]
+    ):
+        bits = modestr[i * 3 : i * 3 + 3]
+        if bits[0] == "r":
+            perms |= r
+        if bits[1] == "w":
+            perms |= w
+        if bits[2] in "xst":
+            perms |= x
+        if bits[2] in "sStT":
+            perms |= special
+    return perms
+
+
+class PackageIndex(object):
+    """Index of the entries of an unpacked package, gathered in one pass so
+       checks don't need to walk, glob or stat the tree again. Paths are
+       relative to the package root and file types are those of
+       'unsquashfs -lln'. Entries are kept in the order os.walk() would find
+       them (a directory's entries before those of its subdirectories).
+
+    Example:
+        index = PackageIndex.from_dir(unpack_dir)
+        for f in index.with_prefix("meta/gui/"):
+            print(f, index.get(f).size)
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.paths = []
+        self.ftypes = bytearray()
+        self.sizes = array.array("Q")
+        self.modes = array.array("H")  # permission bits
+        self.targets = {}  # symlink targets by entry number
+        # file types after following symlinks ('?' if they can't be followed)
+        self._rftypes = bytearray()
+        self._elf_classes = bytearray()  # 0xff until read
+        self._by_path = {}
+        self._by_basename = {}
+        self._sorted = None
+
+    def _add(self, path, ftype, size, mode, target=None, rftype=None):
+        n = len(self.paths)
+        self.paths.append(path)
+        self.ftypes.append(ord(ftype))
+        self.sizes.append(size)
+        self.modes.append(mode)
+        if target is not None:
+            self.targets[n] = target
+        self._rftypes.append(ord(ftype if rftype is None else rftype))
+        self._elf_classes.append(0xFF)
+        self._by_path[path] = n
+        self._by_basename.setdefault(os.path.basename(path), []).append(n)
+
+    @classmethod
+    def from_dir(cls, root):
+        """Index root with a single os.scandir() walk"""
+        index = cls(root)
+        todo = [""]
+        while len(todo) > 0:
+            d = todo.pop()
+            subdirs = []
+            try:
+                it = os.scandir(os.path.join(root, d))
+            except OSError:
+                continue  # os.walk() skips these too
+            with it:
+                for entry in it:
+                    rel = os.path.join(d, entry.name)
+                    try:
+                        st = entry.stat(follow_symlinks=False)
+                        ftype = _stat_ftype(st.st_mode)
+                        target = None
+                        rftype = None
+                        if ftype == "l":
+                            target = os.readlink(entry.path)
+                            try:
+                                rftype = _stat_ftype(os.stat(entry.path).st_mode)
+                            except OSError:
+                                rftype = "?"
+                    except OSError:
+                        continue
+                    if ftype == "d":
+                        subdirs.append(rel)
+                    index._add(
+                        rel, ftype, st.st_size, stat.S_IMODE(st.st_mode), target, rftype
+                    )
+            todo += reversed(subdirs)
+        return index
+
+    @classmethod
+    def from_listing(cls, listing, root):
+        """Index what unsquashfs would unpack to root from a PkgListing"""
+        info = {}
+        children = {}
+        (hdr, entries) = listing.parse()
+        for (line, item) in entries:
+            ftype = item[StatLLN.FILETYPE]
+            fname = item[StatLLN.FILENAME]
+            target = None
+            if ftype == "l":
+                (fname, _, target) = fname.partition(" -> ")
+            if fname == ".":
+                continue
+            elif ftype == "s":
+                continue  # unsquashfs skips sockets
+            elif ftype in ["b", "c"] and os.geteuid() != 0:
+                continue  # unsquashfs can only create devices as root
+
+            rel = fname[2:]
+            size = item.get(StatLLN.SIZE)  # not for devices
+            info[rel] = (
+                ftype,
+                int(size) if size is not None and size.isdigit() else 0,
+                _lln_perms(item[StatLLN.MODE]),
+                target,
+            )
+            children.setdefault(os.path.dirname(rel), []).append(rel)
+
+        index = cls(root)
+        todo = [""]
+        while len(todo) > 0:
+            d = todo.pop()
+            subdirs = []
+            for rel in sorted(children.get(d, [])):
+                (ftype, size, mode, target) = info[rel]
+                rftype = None
+                if ftype == "l":
+                    rp = listing.resolve(rel)
+                    if rp is None:
+                        rftype = "?"
+                        if target.startswith("/"):
+                            try:
+                                rftype = _stat_ftype(os.stat(target).st_mode)
+                            except OSError:
+                                pass
+                    elif rp == "":
+                        rftype = "d"
+                    else:
+                        rftype = info[rp][0] if rp in info else "?"
+                elif ftype == "d":
+                    subdirs.append(rel)
+                index._add(rel, ftype, size, mode, target, rftype)
+            todo += reversed(subdirs)
+        return index
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __contains__(self, path):
+        return path in self._by_path
+
+    def get(self, path):
+        """Return the PackageIndexEntry for path or None"""
+        n = self._by_path.get(path)
+        if n is None:
+            return None
+        return PackageIndexEntry(
+            path,
+            chr(self.ftypes[n]),
+            self.sizes[n],
+            self.modes[n],
+            self.targets.get(n),
+        )
+
+    def filetype(self, path, follow_symlinks=True):
+        """Return the file type of path ('?' for dangling symlinks) or None"""
+        n = self._by_path.get(path)
+        if n is None:
+            return None
+        if follow_symlinks:
+            return chr(self._rftypes[n])
+        return chr(self.ftypes[n])
+
+    def isfile(self, path):
+        """Like os.path.isfile()"""
+        return self.filetype(path) == "-"
+
+    def isdir(self, path):
+        """Like os.path.isdir()"""
+        return self.filetype(path) == "d"
+
+    def files(self):
+        """Return what os.walk() would list as files, in its order"""
+        return [
+            self.paths[n]
+            for n in range(len(self.paths))
+            if self.ftypes[n] != ord("d") and self._rftypes[n] != ord("d")
+        ]
+
+    def symlinks(self):
+        """Return (path, target) for the symlinks in files()"""
+        return [
+            (self.paths[n], self.targets[n])
+            for n in sorted(self.targets)
+            if self._rftypes[n] != ord("d")
+        ]
+
+    def with_prefix(self, prefix):
+        """Return the paths starting with prefix, in index order"""
+        if self._sorted is None:
+            self._sorted = sorted(self.paths)
+        found = []
+        for p in self._sorted[bisect.bisect_left(self._sorted, prefix) :]:
+            if not p.startswith(prefix):
+                break
+            found.append(self._by_path[p])
+        return [self.paths[n] for n in sorted(found)]
+
+    def with_basename(self, name):
+        """Return the paths with the basename name, in index order"""
+        return [self.paths[n] for n in self._by_basename.get(name, [])]
+
+    def glob(self, pattern, dirname=""):
+        """Return the entries of dirname matching pattern like glob.glob()
+           (hidden entries only match patterns starting with '.')
+        """
+        found = []
+        for (name, ns) in self._by_basename.items():
+            if name.startswith(".") and not pattern.startswith("."):
+                continue
+            if not fnmatch.fnmatchcase(name, pattern):
+                continue
+            found += [n for n in ns if os.path.dirname(self.paths[n]) == dirname]
+        return [self.paths[n] for n in sorted(found)]
+
+    def elf_class(self, path):
+        """Return the EI_CLASS of path (1 for 32-bit, 2 for 64-bit) or None
+           if it isn't an ELF file. path needs to be unpacked.
+        """
+        n = self._by_path.get(path)
+        if n is None:
+            return None
+        if self._elf_classes[n] == 0xFF:
+            self._elf_classes[n] = 0
+            if self.ftypes[n] == ord("-"):
+                try:
+                    with open(os.path.join(self.root, path), "rb") as f:
+                        ident = f.read(5)
+                    if len(ident) == 5 and ident.startswith(b"\x7fELF"):
+                        self._elf_classes[n] = ident[4]
+                except OSError:
+                    pass
+        if self._elf_classes[n] in [1, 2]:
+            return self._elf_classes[n]
+        return None
+
+
+def _calculate_snap_unsquashfs_uncompressed_size(snap_pkg, context=None):
+    """Calculate size of the uncompressed snap"""
+    listing = get_pkg_listing(snap_pkg, context)
+    if listing.rc != 0:
+        error("unsquashfs -lln '%s' failed: %s" % (snap_pkg, listing.out))
+
+    return listing.uncompressed_size()
 
 
 def _calculate_rock_untar_uncompressed_size(rock_pkg):
@@ -895,14 +1957,46 @@ def _calculate_rock_untar_uncompressed_size(rock_pkg):
 
 def unsquashfs_supports_ignore_errors():
     """Detect if unsquashfs supports the -ignore-errors option"""
-    (rc, out) = cmd(["unsquashfs", "-help"])
-    # unsquashfs -help returns non-zero, so just search for the option
-    return "-ig[nore-errors]" in out
+    global UNSQUASHFS_SUPPORTS_IGNORE_ERRORS
+    if UNSQUASHFS_SUPPORTS_IGNORE_ERRORS is None:
+        (rc, out) = cmd(["unsquashfs", "-help"])
+        # unsquashfs -help returns non-zero, so just search for the option
+        UNSQUASHFS_SUPPORTS_IGNORE_ERRORS = "-ig[nore-errors]" in out
+    return UNSQUASHFS_SUPPORTS_IGNORE_ERRORS
+
+
+def get_squashfs_tools_version():
+    """Return a description of the installed unsquashfs and mksquashfs (their
+       versions and binaries) that changes when they are upgraded, or None if
+       it can't be determined
+    """
+    global SQUASHFS_TOOLS_VERSION
+    if SQUASHFS_TOOLS_VERSION is None:
+        SQUASHFS_TOOLS_VERSION = False
+        versions = []
+        for tool in ["unsquashfs", "mksquashfs"]:
+            path = shutil.which(tool)
+            if path is None:
+                return None
+            (rc, out) = cmd([tool, "-version"])
+            if rc != 0 or " version " not in out:
+                debug("could not determine %s version: %s" % (tool, out))
+                return None
+            # distro rebuilds may not change the version
+            st = os.stat(path)
+            versions.append(
+                "%s (%s, %d bytes, mtime %d)"
+                % (out.splitlines()[0], path, st.st_size, st.st_mtime)
+            )
+        SQUASHFS_TOOLS_VERSION = "; ".join(versions)
+    if SQUASHFS_TOOLS_VERSION is False:
+        return None
+    return SQUASHFS_TOOLS_VERSION
 
 
-def _unpack_snap_squashfs(snap_pkg, dest, items=[]):
+def _unpack_snap_squashfs(snap_pkg, dest, items=[], context=None):
     """Unpack a squashfs based snap package to dest"""
-    size = _calculate_snap_unsquashfs_uncompressed_size(snap_pkg)
+    size = _calculate_snap_unsquashfs_uncompressed_size(snap_pkg, context)
 
     snap_max_size = MAX_UNCOMPRESSED_SIZE * 1024 * 1024 * 1024
     valid_size, error_msg = is_pkg_uncompressed_size_valid(
@@ -923,11 +2017,284 @@ def _unpack_snap_squashfs(snap_pkg, dest, items=[]):
 
         if len(items) != 0:
             cmd += items
-        return _unpack_cmd(cmd, d, dest)
+
+        from reviewtools.cpu_budget import CpuTokens, add_processors_option
+
+        with CpuTokens() as processors:
+            return _unpack_cmd(add_processors_option(cmd, processors), d, dest)
     else:
         error(error_msg)
 
 
+def unpack_pkg_items(fn, dest, items):
+    """Unpack items from a squashfs based snap package into the existing
+       dest. Returns False if unpacking failed
+    """
+    cmd = ["unsquashfs", "-no-progress", "-f", "-d", dest]
+    if unsquashfs_supports_ignore_errors():
+        cmd.append("-ignore-errors")
+        cmd.append("-quiet")
+    cmd.append(os.path.abspath(fn))
+
+    # unsquashfs treats the items as wildcards, so escape them
+    for i in items:
+        cmd.append(re.sub(r"([\\*?\[\]+@!()])", r"\\\1", i))
+
+    from reviewtools.cpu_budget import CpuTokens, add_processors_option
+
+    with CpuTokens() as processors:
+        (rc, out) = cmdIgnoreErrorStrings(
+            add_processors_option(cmd, processors), UNSQUASHFS_IGNORED_ERRORS
+        )
+    if rc != 0:
+        debug("unpacking '%s' failed with '%d':\n%s" % (", ".join(items), rc, out))
+        return False
+    return True
+
+
+def unpack_cache_enabled():
+    """Check if the opt-in unpack cache is enabled"""
+    return os.environ.get("SNAP_REVIEW_UNPACK_CACHE", "") not in ["", "0"]
+
+
+def get_unpack_cache_dir():
+    """Return the directory of the unpack cache"""
+    tmpdir = tempfile.gettempdir()
+    if MKDTEMP_DIR is not None:
+        tmpdir = MKDTEMP_DIR
+    return os.path.join(tmpdir, UNPACK_CACHE_DIRNAME)
+
+
+def get_sha512sum(fn):
+    """Get sha512sum of file"""
+    h = hashlib.sha512()
+    buf = memoryview(bytearray(COMPARE_CHUNK_SIZE))
+    with open(fn, "rb") as f:
+        for n in iter(lambda: f.readinto(buf), 0):
+            h.update(buf[:n])
+    return h.hexdigest()
+
+
+def _first_difference(buf1, buf2):
+    """Return the index of the first difference of two buffers of the same
+       length that aren't equal
+    """
+    (lo, hi) = (0, len(buf1))
+    # the first difference is in [lo, hi)
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if buf1[lo:mid] != buf2[lo:mid]:
+            hi = mid
+        else:
+            lo = mid
+    return lo
+
+
+def compare_files(fn1, fn2, chunk_size=COMPARE_CHUNK_SIZE):
+    """Compare two files, stopping at the first difference. Returns None if
+       they are the same, otherwise the offset of the first difference (the
+       size of the smaller file if it is the start of the other). Raises
+       OSError if a file can't be read.
+    """
+    with open(fn1, "rb") as f1, open(fn2, "rb") as f2:
+        size1 = os.fstat(f1.fileno()).st_size
+        size2 = os.fstat(f2.fileno()).st_size
+        buf1 = memoryview(bytearray(chunk_size))
+        buf2 = memoryview(bytearray(chunk_size))
+        # a different size is usually in the headers (eg, the squashfs
+        # superblock), so check those before reading large chunks
+        n = COMPARE_HEADER_SIZE if size1 != size2 else chunk_size
+        offset = 0
+        while True:
+            n1 = f1.readinto(buf1[:n])
+            n2 = f2.readinto(buf2[:n])
+            common = min(n1, n2)
+            if buf1[:common] != buf2[:common]:
+                return offset + _first_difference(buf1[:common], buf2[:common])
+            if n1 != n2:
+                return offset + common
+            if n1 == 0:
+                return None
+            offset += n1
+            n = chunk_size
+
+
+def _read_unpack_cache_info(entry):
+    try:
+        with open(os.path.join(entry, "info.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def get_unpack_cache_info(key, context=None):
+    """Get key from the info of the cache entry used by the review with
+       context
+    """
+    entry = get_review_context(context).unpack_cache_entry
+    if entry is None:
+        return None
+    return _read_unpack_cache_info(entry).get(key)
+
+
+def set_unpack_cache_info(key, value, context=None):
+    """Set key in the info of the cache entry used by the review with
+       context
+    """
+    entry = get_review_context(context).unpack_cache_entry
+    if entry is None:
+        return
+    # other reviews may be updating it too, so don't lose their keys
+    fd = os.open(entry, os.O_RDONLY)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        info = _read_unpack_cache_info(entry)
+        info[key] = value
+        # and reading it, so replace it atomically
+        with tempfile.NamedTemporaryFile(
+            "w", dir=entry, prefix="info.json.", delete=False
+        ) as f:
+            json.dump(info, f)
+        os.replace(f.name, os.path.join(entry, "info.json"))
+    finally:
+        os.close(fd)
+
+
+def _set_tree_writable(path, writable):
+    """Add the owner write permission to the files and directories under
+       path or remove all the write permissions (symlinks are skipped)
+    """
+    for (root, dirs, files) in os.walk(path):
+        for fn in [root] + [os.path.join(root, name) for name in files]:
+            st = os.lstat(fn)
+            if stat.S_ISLNK(st.st_mode):
+                continue
+            mode = stat.S_IMODE(st.st_mode)
+            if writable:
+                os.chmod(fn, mode | stat.S_IWUSR)
+            else:
+                os.chmod(fn, mode & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+
+
+def _remove_unpack_cache_entry(entry):
+    """Remove the (possibly unfinished) unpack cache entry"""
+    squashfs_root = os.path.join(entry, "squashfs-root")
+    if os.path.isdir(squashfs_root):
+        # read-only once cached (see unpack_pkg_cached())
+        _set_tree_writable(squashfs_root, True)
+    recursive_rm(entry)
+
+
+def unpack_pkg_cached(fn, context=None):
+    """Return the unpack cache entry for the package, unpacking it into the
+       cache first if needed. Each entry has:
+       - squashfs-root/: the unpacked package, read-only once cached
+       - lln: the package listing
+       - info.json: the uncompressed size, and the package files and
+         compiled binaries (relative to squashfs-root) once known
+    """
+    pkg = check_fn(fn)
+    cache_dir = get_unpack_cache_dir()
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+
+    entry = os.path.join(
+        cache_dir, "%s-%d" % (get_sha512sum(pkg), os.stat(pkg).st_size)
+    )
+    if not os.path.isdir(entry):
+        tmp = tempfile.mkdtemp(prefix="tmp-", dir=cache_dir)
+        try:
+            unpack_pkg(pkg, os.path.join(tmp, "squashfs-root"), context=context)
+
+            listing = get_pkg_listing(pkg, context)
+            info = {"size": listing.uncompressed_size()}
+            with open(os.path.join(tmp, "info.json"), "w") as f:
+                json.dump(info, f)
+            try:
+                (hdr, entries) = listing.parse()
+                with open(os.path.join(tmp, "lln"), "w") as f:
+                    for (line, item) in entries:
+                        f.write("%s\n" % line)
+            except ReviewException:
+                pass  # the checks report the malformed listing
+
+            # later reviews use it as is, so nothing may write to it
+            _set_tree_writable(os.path.join(tmp, "squashfs-root"), False)
+            try:
+                os.rename(tmp, entry)
+                debug("added '%s' to the unpack cache" % pkg)
+            except OSError:
+                pass  # another review added it first
+        finally:
+            if os.path.isdir(tmp):
+                _remove_unpack_cache_entry(tmp)
+
+    debug("using unpack cache entry '%s'" % entry)
+    os.utime(entry)  # for prune_unpack_cache()
+    prune_unpack_cache()
+
+    lln = os.path.join(entry, "lln")
+    if os.path.exists(lln):
+        with open(lln) as f:
+            set_pkg_listing(pkg, f.read(), context)
+
+    return entry
+
+
+def prune_unpack_cache():
+    """Remove unpack cache entries that weren't used within
+       SNAP_REVIEW_UNPACK_CACHE_AGE days, then the least recently used entries
+       until the cache fits in SNAP_REVIEW_UNPACK_CACHE_SIZE megabytes
+    """
+    cache_dir = get_unpack_cache_dir()
+    if not os.path.isdir(cache_dir):
+        return
+
+    max_age = UNPACK_CACHE_MAX_AGE
+    max_size = UNPACK_CACHE_MAX_SIZE
+    try:
+        if "SNAP_REVIEW_UNPACK_CACHE_AGE" in os.environ:
+            max_age = float(os.environ["SNAP_REVIEW_UNPACK_CACHE_AGE"])
+        if "SNAP_REVIEW_UNPACK_CACHE_SIZE" in os.environ:
+            max_size = float(os.environ["SNAP_REVIEW_UNPACK_CACHE_SIZE"])
+    except ValueError as e:
+        warn("invalid unpack cache limit: %s" % e)
+        return
+    max_age = max(max_age * 24 * 60 * 60, UNPACK_CACHE_MIN_AGE)
+    max_size = max_size * 1024 * 1024
+
+    now = time.time()
+    entries = []
+    for name in os.listdir(cache_dir):
+        entry = os.path.join(cache_dir, name)
+        try:
+            age = now - os.path.getmtime(entry)
+        except OSError:
+            continue  # removed by another review
+        if name.startswith("tmp-"):
+            # left behind by an interrupted review
+            if age > UNPACK_CACHE_MIN_AGE:
+                _remove_unpack_cache_entry(entry)
+            continue
+        size = _read_unpack_cache_info(entry).get("size", 0)
+        entries.append((age, entry, size))
+
+    # most recently used first
+    entries.sort()
+    total = 0
+    for (age, entry, size) in entries:
+        total += size
+        if age < UNPACK_CACHE_MIN_AGE:
+            continue
+        if age > max_age or total > max_size:
+            debug("removing '%s' from the unpack cache" % entry)
+            total -= size
+            try:
+                _remove_unpack_cache_entry(entry)
+            except OSError:
+                continue  # removed by another review
+
+
 def is_pkg_uncompressed_size_valid(pkg_max_size, size, pkg):
     st = os.statvfs(pkg)
     avail = st.f_bsize * st.f_bavail * 0.9  # 90% of available space
@@ -997,6 +2364,8 @@ def _unpack_rock_tar(rock_pkg, dest):
                     
                 
                 safe_extract(tar, path=d)
+        except FatalReviewError:
+            raise
         except Exception as e:
             error("Unexpected exception while unpacking rock %s" % e)
             if os.path.isdir(d):
@@ -1014,8 +2383,8 @@ def _unpack_rock_tar(rock_pkg, dest):
         error(error_msg)
 
 
-def unpack_pkg(fn, dest=None, items=[]):
-    """Unpack package"""
+def unpack_pkg(fn, dest=None, items=[], context=None):
+    """Unpack package (the listing of a snap is cached in context)"""
     pkg = check_fn(fn)
     check_dir(dest)
 
@@ -1024,7 +2393,7 @@ def unpack_pkg(fn, dest=None, items=[]):
 
     # check if its a squashfs based snap
     if is_squashfs(pkg):
-        return _unpack_snap_squashfs(fn, dest, items)
+        return _unpack_snap_squashfs(fn, dest, items, context)
 
     error("Unsupported package format (not squashfs)")
 
@@ -1111,14 +2480,16 @@ def raw_unpack_pkg(fn, dest=None):
     return dest
 
 
-def create_tempdir():
-    """Create/reuse a temporary directory that is automatically cleaned up"""
-    global TMP_DIR
+def create_tempdir(context=None):
+    """Create/reuse a temporary directory that is automatically cleaned up
+       with context (see cleanup_unpack())
+    """
     global MKDTEMP_PREFIX
     global MKDTEMP_DIR
-    if TMP_DIR is None:
-        TMP_DIR = tempfile.mkdtemp(prefix=MKDTEMP_PREFIX, dir=MKDTEMP_DIR)
-    return TMP_DIR
+    context = get_review_context(context)
+    if context.tmp_dir is None:
+        context.tmp_dir = tempfile.mkdtemp(prefix=MKDTEMP_PREFIX, dir=MKDTEMP_DIR)
+    return context.tmp_dir
 
 
 def open_file_read(path):
@@ -1172,24 +2543,60 @@ def recursive_rm(dirPath, contents_only=False, top=True):
 
 
 def run_check(cls):
+    """Run the checks of the review class cls on the package given on the
+       command line and exit (for the bin/snap-check-* entry points)
+    """
+    try:
+        rc = _run_check(cls)
+    except FatalReviewError as e:
+        exit_on_fatal_error(e)
+    sys.exit(rc)
+
+
+def _run_check(cls):
     if len(sys.argv) < 2:
         error("Must give path to package")
 
     # extract args
-    fn = sys.argv[1]
-    if len(sys.argv) > 2:
-        overrides = json.loads(sys.argv[2])
-    else:
-        overrides = None
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("filename", help="package to be inspected")
+    parser.add_argument("overrides", nargs="?", default=None)
+    parser.add_argument(
+        "--only",
+        action="append",
+        default=[],
+        metavar="GLOB",
+        help="only run the checks matching GLOB (RT_ONLY_CHECKS)",
+    )
+    parser.add_argument(
+        "--skip",
+        action="append",
+        default=[],
+        metavar="GLOB",
+        help="skip the checks matching GLOB (RT_SKIP_CHECKS)",
+    )
+    args = parser.parse_args()
+
+    fn = args.filename
+    overrides = None
+    if args.overrides is not None:
+        overrides = json.loads(args.overrides)
+    if args.only:
+        os.environ["RT_ONLY_CHECKS"] = ",".join(args.only)
+    if args.skip:
+        os.environ["RT_SKIP_CHECKS"] = ",".join(args.skip)
 
     review = cls(fn, overrides=overrides)
     review.do_checks()
-    rc = review.do_report()
-    sys.exit(rc)
+    return review.do_report()
 
 
-def find_external_symlinks(unpack_dir, pkg_files, pkgname, prefix_ok=None):
-    """Check if symlinks in the package go out to the system."""
+def find_external_symlinks(unpack_dir, pkg_files, pkgname, prefix_ok=None, index=None):
+    """Check if symlinks in the package go out to the system. If the
+       PackageIndex of unpack_dir is given, only its symlinks are checked.
+    """
     common = r"(-[0-9.]+)?\.so(\.[0-9.]+)?"
     libc6_libs = [
         "ld-*.so",
@@ -1236,17 +2643,19 @@ def find_external_symlinks(unpack_dir, pkg_files, pkgname, prefix_ok=None):
         return False
 
     def _is_external(link, linkname_pats, abs_pats, pkgname, prefix_ok=None):
-        if not os.path.islink(link):
+        if link in targets:
+            rl = targets[link]
+        elif index is not None or not os.path.islink(link):
             return False
+        else:
+            # Perform a 'readlink' so we can check the path of the unresolved
+            # target against specific target patterns
+            rl = os.readlink(link)
 
         # Perform a realpath so we can check if the file is in the unpack
         # dir (which indicates it is inside the snap)
         rp = os.path.realpath(link)
 
-        # Perform a 'readlink' so we can check the path of the unresolved
-        # target against specific target patterns
-        rl = os.readlink(link)
-
         if (
             rp.startswith("/")
             and len(rp) > 1
@@ -1313,6 +2722,11 @@ def find_external_symlinks(unpack_dir, pkg_files, pkgname, prefix_ok=None):
             return True
         return False
 
+    targets = {}
+    if index is not None:
+        for (rel, target) in index.symlinks():
+            targets[os.path.join(unpack_dir, rel)] = target
+
     external_symlinks = list(
         filter(
             lambda link: _is_external(
@@ -1406,7 +2820,7 @@ def get_snap_manifest(fn):
 
     with open_file_read(man_fn) as fd:
         try:
-            man_yaml = yaml.safe_load(fd)
+            man_yaml = load_yaml(fd, allow_duplicate_keys=True)
         except Exception:
             recursive_rm(dir)
             error("Could not load %s. Is it properly formatted?" % man)
@@ -1581,23 +2995,207 @@ def get_os_codename(os, ver):
     return OS_RELEASE_MAP[os][ver]
 
 
-def read_snapd_base_declaration():
-    """Read snapd base declaration"""
+def get_package_data_filename(name):
+    """Return the path of the data file name shipped in the reviewtools
+       package
+    """
+    try:
+        from importlib.resources import files
+    except ImportError:  # pragma: nocover
+        # python3 < 3.9
+        return os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", name)
+    return str(files("reviewtools") / "data" / name)
+
+
+# the yaml loader classes used by load_yaml(), created on first use since
+# yaml is slow to import: {<allow_duplicate_keys>: <loader class>}
+YAML_LOADERS = {}
+
+
+def _get_yaml_loader(allow_duplicate_keys):
+    """Return the (libyaml when available) safe yaml loader class"""
+    if allow_duplicate_keys in YAML_LOADERS:
+        return YAML_LOADERS[allow_duplicate_keys]
+
+    import yaml
+
+    base = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+    if allow_duplicate_keys:
+        YAML_LOADERS[allow_duplicate_keys] = base
+        return base
+
+    class _NoDuplicatesLoader(base):
+        def construct_mapping(self, node, deep=False):
+            if isinstance(node, yaml.MappingNode):
+                seen = {}
+                for (key_node, value_node) in node.value:
+                    # merged keys ('<<: *anchor') may be overridden
+                    if key_node.tag == "tag:yaml.org,2002:merge":
+                        continue
+                    key = self.construct_object(key_node, deep=deep)
+                    try:
+                        dupe = key in seen
+                    except TypeError:
+                        # reported by construct_mapping()
+                        break
+                    value = self.construct_object(value_node, deep=deep)
+                    if dupe:
+                        # like ruamel.yaml's DuplicateKeyError
+                        raise DuplicateYamlKeyError(
+                            'found duplicate key "%s" with value "%s" '
+                            '(original value: "%s")' % (key, value, seen[key])
+                        )
+                    seen[key] = value
+            return base.construct_mapping(self, node, deep=deep)
+
+    YAML_LOADERS[allow_duplicate_keys] = _NoDuplicatesLoader
+    return _NoDuplicatesLoader
+
+
+def load_yaml(contents, allow_duplicate_keys=False):
+    """Load the yaml contents (str, bytes or file) like yaml.safe_load(),
+       but faster with libyaml and, unless allow_duplicate_keys, raising
+       DuplicateYamlKeyError if a mapping has duplicated keys
+    """
+    import yaml
+
+    return yaml.load(contents, Loader=_get_yaml_loader(allow_duplicate_keys))
+
+
+class BaseDeclaration(object):
+    """The parsed snapd base declaration of a series. decl is the base
+    declaration ({"plugs": {<iface>: <rules>}, "slots": {...}}). It is
+    shared by everything in the process so it must not be modified (see
+    read_snapd_base_declaration() for a copy).
+    """
+
+    def __init__(self, series, decl, sha256=None):
+        self.series = series
+        self.decl = decl
+        self.sha256 = sha256
+
+
+def base_decl_cache_enabled():
+    """Check if the opt-in base declaration cache is enabled"""
+    return os.environ.get("SNAP_REVIEW_BASE_DECL_CACHE", "") not in ["", "0"]
+
+
+def get_base_decl_cache_path():
+    """Return the path of the base declaration cache"""
+    path = os.environ.get("SNAP_REVIEW_BASE_DECL_CACHE", "")
+    if path not in ["", "0", "1"]:
+        return path
+    tmpdir = tempfile.gettempdir()
+    if MKDTEMP_DIR is not None:
+        tmpdir = MKDTEMP_DIR
+    return os.path.join(tmpdir, BASE_DECL_CACHE_FILENAME)
+
+
+def _read_base_decl_cache(path, sha256):
+    """Return the cached base declaration for the yaml with sha256 or None"""
+    try:
+        with open(path, "r") as f:
+            cached = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        debug("could not read base declaration cache '%s': %s" % (path, e))
+        return None
+
+    if (
+        not isinstance(cached, dict)
+        or cached.get("format") != BASE_DECL_CACHE_FORMAT
+        or cached.get("sha256") != sha256
+        or not isinstance(cached.get("decl"), dict)
+    ):
+        return None
+    return cached["decl"]
+
+
+def _write_base_decl_cache(path, sha256, decl):
+    """Cache the base declaration parsed from the yaml with sha256"""
+    cached = {"format": BASE_DECL_CACHE_FORMAT, "sha256": sha256, "decl": decl}
+    try:
+        contents = json.dumps(cached, sort_keys=True)
+        # yaml has types json doesn't
+        if json.loads(contents) != cached:
+            debug("not caching base declaration (not json)")
+            return
+        (fd, tmp_fn) = tempfile.mkstemp(
+            prefix="tmp-", dir=os.path.dirname(os.path.abspath(path))
+        )
+        with os.fdopen(fd, "w") as f:
+            f.write(contents)
+        # readers never see it partially written
+        os.rename(tmp_fn, path)
+    except (OSError, TypeError, ValueError) as e:
+        debug("could not write base declaration cache '%s': %s" % (path, e))
+
+
+def _parse_snapd_base_declaration(bd_fn):
+    """Parse the snapd base declaration yaml, using the cache if enabled.
+       Returns (sha256, parsed yaml)
+    """
+    with open(bd_fn, "rb") as f:
+        contents = f.read()
+    sha256 = hashlib.sha256(contents).hexdigest()
+
+    cache_path = None
+    if base_decl_cache_enabled():
+        cache_path = get_base_decl_cache_path()
+        decl = _read_base_decl_cache(cache_path, sha256)
+        if decl is not None:
+            return (sha256, decl)
+
+    decl = load_yaml(contents, allow_duplicate_keys=True)
+    if cache_path is not None:
+        _write_base_decl_cache(cache_path, sha256, decl)
+    return (sha256, decl)
+
+
+def get_snapd_base_declaration():
+    """Return the (shared) BaseDeclaration of the snapd base declaration"""
+    global SNAPD_BASE_DECLARATION
     # prefer local copy if it exists, otherwise, use one shipped in the
     # package
     bd_fn = "./reviewtools/data/snapd-base-declaration.yaml"
     if not os.path.exists(bd_fn):
-        bd_fn = resource_filename(__name__, "data/snapd-base-declaration.yaml")
+        bd_fn = get_package_data_filename("snapd-base-declaration.yaml")
         if not os.path.exists(bd_fn):
             error("could not find '%s'" % bd_fn)
-    fd = open_file_read(bd_fn)
-    contents = fd.read()
-    fd.close()
 
-    bd_yaml = yaml.safe_load(contents)
+    st = os.stat(bd_fn)
+    key = (os.path.abspath(bd_fn), st.st_mtime_ns, st.st_size)
+    if SNAPD_BASE_DECLARATION is None or SNAPD_BASE_DECLARATION[0] != key:
+        SNAPD_BASE_DECLARATION = (key, read_base_declaration_file(bd_fn))
+    return SNAPD_BASE_DECLARATION[1]
+
+
+def read_base_declaration_file(bd_fn):
+    """Return the BaseDeclaration of the base declaration yaml bd_fn (eg,
+       another version of data/snapd-base-declaration.yaml)
+    """
     # FIXME: don't hardcode series
     series = "16"
-    return series, bd_yaml[series]
+    try:
+        (sha256, decl) = _parse_snapd_base_declaration(bd_fn)
+    except Exception as e:
+        error("Could not load '%s': %s" % (bd_fn, e))
+    if (
+        not isinstance(decl, dict)
+        or not isinstance(decl.get(series), dict)
+        or not isinstance(decl[series].get("plugs"), dict)
+        or not isinstance(decl[series].get("slots"), dict)
+    ):
+        error("'%s' is not a series %s base declaration" % (bd_fn, series))
+    return BaseDeclaration(series, decl[series], sha256)
+
+
+def read_snapd_base_declaration():
+    """Read snapd base declaration"""
+    bd = get_snapd_base_declaration()
+    # callers may modify it
+    return bd.series, copy.deepcopy(bd.decl)
 
 
 # TODO: make this a class
@@ -0,0 +1,230 @@
+"""cpu_budget.py: share a CPU budget between squashfs-tools runs"""
+#
+# Copyright (C) 2021 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# unsquashfs and mksquashfs use every core by default, so several reviews
+# running on the same host oversubscribe it. With SNAP_REVIEW_CPUS=<N> (or
+# 'snap-review --cpus=<N>') they are run with '-processors' so that all the
+# review-tools processes on the host together use at most N CPUs. The budget
+# is a directory of N token files (one per CPU) that are taken with flock()
+# while a tool runs. Every process that wants tokens holds a client lock
+# file while waiting for and using them and takes at most its share (N
+# divided by the number of clients), so concurrent reviews share the budget
+# fairly. Locks are released by the kernel when a process dies, so nothing
+# needs to be cleaned up after crashes.
+
+import fcntl
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from reviewtools.common import MKDTEMP_PREFIX, debug, warn
+
+CPU_BUDGET_DIRNAME = "%scpu-budget" % MKDTEMP_PREFIX
+CPU_TOKENS_POLL_INTERVAL = 0.1  # seconds
+# shared by the review-tools processes of all the users on the host
+CPU_BUDGET_DIR_MODE = 0o1777
+CPU_BUDGET_FILE_MODE = 0o644
+
+
+def get_cpu_budget():
+    """Return the number of CPUs squashfs-tools may use on this host
+       (SNAP_REVIEW_CPUS) or None if not limited
+    """
+    val = os.environ.get("SNAP_REVIEW_CPUS", "")
+    if val in ["", "0"]:
+        return None
+    try:
+        budget = int(val)
+    except ValueError:
+        budget = 0
+    if budget < 1:
+        warn("ignoring invalid SNAP_REVIEW_CPUS '%s'" % val)
+        return None
+    return budget
+
+
+def get_cpu_budget_dir():
+    """Return the directory of the CPU tokens shared by the review-tools
+       processes on this host (SNAP_REVIEW_CPUS_DIR)
+    """
+    if "SNAP_REVIEW_CPUS_DIR" in os.environ:
+        return os.environ["SNAP_REVIEW_CPUS_DIR"]
+    return os.path.join(tempfile.gettempdir(), CPU_BUDGET_DIRNAME)
+
+
+def _try_lock(fn, create=True):
+    """Open and lock fn without blocking. Returns the open file or None if
+       locked by another process
+    """
+    # flock() doesn't need write access, so the processes of other users
+    # can lock it too
+    flags = os.O_RDONLY
+    if create:
+        flags |= os.O_CREAT
+    fd = os.open(fn, flags, CPU_BUDGET_FILE_MODE)
+    if create and os.fstat(fd).st_uid == os.getuid():
+        os.fchmod(fd, CPU_BUDGET_FILE_MODE)  # whatever the umask
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return None
+    return fd
+
+
+class CpuTokens(object):
+    """Take a share of the CPU budget while running squashfs-tools
+
+    Example:
+        with CpuTokens() as processors:
+            cmdline = add_processors_option(cmdline, processors)
+            cmd(cmdline)
+
+    processors is None when the budget isn't limited.
+    """
+
+    def __init__(self, budget=None, path=None):
+        if budget is None:
+            budget = get_cpu_budget()
+        if path is None:
+            path = get_cpu_budget_dir()
+        self.budget = budget
+        self.path = path
+        self._client = None
+        self._client_fn = None
+        self._tokens = []
+
+    def _register(self):
+        """Hold a client lock file while waiting for and using tokens"""
+        try:
+            os.makedirs(self.path)
+        except FileExistsError:
+            pass
+        else:
+            os.chmod(self.path, CPU_BUDGET_DIR_MODE)  # whatever the umask
+        # lock before renaming so other clients never see it unlocked
+        (fd, tmp_fn) = tempfile.mkstemp(prefix="tmp-client.", dir=self.path)
+        # so the other clients can count it
+        os.fchmod(fd, CPU_BUDGET_FILE_MODE)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        self._client_fn = os.path.join(self.path, os.path.basename(tmp_fn)[4:])
+        os.rename(tmp_fn, self._client_fn)
+        self._client = fd
+
+    def _count_clients(self):
+        """Count the clients holding their lock, removing stale ones"""
+        count = 0
+        for entry in os.listdir(self.path):
+            if not entry.startswith("client."):
+                continue
+            fn = os.path.join(self.path, entry)
+            if fn == self._client_fn:
+                count += 1
+                continue
+            try:
+                fd = _try_lock(fn, create=False)
+            except OSError:
+                continue
+            if fd is None:
+                count += 1
+                continue
+            # its process exited without removing it
+            try:
+                os.unlink(fn)
+            except OSError:
+                pass
+            os.close(fd)
+        return count
+
+    def _take_tokens(self, share):
+        for i in range(self.budget):
+            if len(self._tokens) >= share:
+                break
+            fd = _try_lock(os.path.join(self.path, "token.%d" % i))
+            if fd is not None:
+                self._tokens.append(fd)
+
+    def acquire(self):
+        """Wait for at least one token and return the number taken (or None
+           if the budget isn't limited)
+        """
+        if self.budget is None:
+            return None
+        self._register()
+        waited = False
+        while True:
+            share = max(1, self.budget // self._count_clients())
+            self._take_tokens(share)
+            if len(self._tokens) > 0:
+                break
+            if not waited:
+                debug("waiting for a share of %d CPUs" % self.budget)
+                waited = True
+            time.sleep(CPU_TOKENS_POLL_INTERVAL)
+        return len(self._tokens)
+
+    def release(self):
+        """Release the tokens"""
+        # unregister first so waiting clients can take a bigger share
+        if self._client is not None:
+            try:
+                os.unlink(self._client_fn)
+            except OSError:
+                pass
+            os.close(self._client)
+            self._client = None
+        for fd in self._tokens:
+            os.close(fd)
+        self._tokens = []
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+def add_processors_option(cmdline, processors):
+    """Return the unsquashfs or mksquashfs command line (possibly run with
+       fakeroot) using processors threads
+    """
+    if processors is None:
+        return cmdline
+    for (idx, arg) in enumerate(cmdline):
+        tool = os.path.basename(arg)
+        if tool == "unsquashfs":
+            # options come before the image
+            opts = ["-processors", str(processors)]
+            return cmdline[: idx + 1] + opts + cmdline[idx + 1 :]
+        elif tool == "mksquashfs":
+            # options come after the sources and destination
+            return cmdline + ["-processors", str(processors)]
+    return cmdline
+
+
+def main():  # pragma: nocover
+    """Run an unsquashfs or mksquashfs command within the CPU budget"""
+    if len(sys.argv) < 2:
+        print("Usage: %s unsquashfs|mksquashfs <args>" % sys.argv[0], file=sys.stderr)
+        sys.exit(1)
+    with CpuTokens() as processors:
+        sys.exit(subprocess.call(add_processors_option(sys.argv[1:], processors)))
+
+
+if __name__ == "__main__":  # pragma: nocover
+    main()
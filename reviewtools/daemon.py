@@ -0,0 +1,296 @@
+"""daemon.py: review packages in warm, pre-forked worker processes"""
+#
+# Copyright (C) 2021 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# For small snaps most of the time of a review is spent starting the
+# interpreter, importing the review modules and parsing the base declaration.
+# snap-review-daemon does that once and then forks workers that accept jobs
+# on a Unix socket. A job is one line of JSON:
+#
+#   {"args": ["--json", "/path/to/foo.snap"], "cwd": "/path", "env": {}}
+#
+# where args are the snap-review arguments, cwd the directory to run it in
+# (default: the daemon's) and env extra environment variables (eg,
+# SNAP_REVIEW_ANALYSIS_CACHE). The reply is one line of JSON with the exit
+# code, stdout and stderr of the review:
+#
+#   {"rc": 0, "output": "<what snap-review printed>", "stderr": ""}
+#
+# so 'output' is the same as the output of 'snap-review --json ...'. Workers
+# are replaced after DAEMON_MAX_JOBS jobs to bound the memory they leak.
+# Anyone who can connect to the socket can review any file the daemon can
+# read, so access is controlled with the permissions of the socket's
+# directory.
+
+import json
+import os
+import signal
+import socket
+import sys
+import tempfile
+
+DAEMON_MAX_JOBS = 100
+DAEMON_SOCKET_NAME = "review-tools-daemon.sock"
+
+
+def get_default_socket_path():
+    """Return the path of the daemon's socket ($XDG_RUNTIME_DIR or the
+       temporary directory)
+    """
+    d = os.environ.get("XDG_RUNTIME_DIR", "")
+    if d == "" or not os.path.isdir(d):
+        d = tempfile.gettempdir()
+    return os.path.join(d, DAEMON_SOCKET_NAME)
+
+
+def _exit_code(code):
+    """Return the exit code of sys.exit(code)"""
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        return code
+    print(code, file=sys.stderr)
+    return 1
+
+
+def _validate_job(job):
+    """Raise ValueError if the job isn't valid"""
+    if not isinstance(job, dict):
+        raise ValueError("job is not a dict")
+    if not isinstance(job.get("args"), list) or not all(
+        isinstance(a, str) for a in job["args"]
+    ):
+        raise ValueError("'args' is not a list of strings")
+    if not isinstance(job.get("cwd", ""), str):
+        raise ValueError("'cwd' is not a string")
+    env = job.get("env", {})
+    if not isinstance(env, dict) or not all(
+        isinstance(k, str) and isinstance(v, str) for (k, v) in env.items()
+    ):
+        raise ValueError("'env' is not a dict of strings")
+
+
+class ReviewDaemon(object):
+    """Run snap-review jobs in warm worker processes
+
+    Example:
+        daemon = ReviewDaemon("/run/review.sock", "/usr/bin/snap-review")
+        daemon.serve()
+    """
+
+    def __init__(self, socket_path, snap_review, workers=None, max_jobs=None):
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if max_jobs is None:
+            max_jobs = DAEMON_MAX_JOBS
+        self.socket_path = socket_path
+        self.snap_review = snap_review
+        self.workers = workers
+        self.max_jobs = max_jobs
+        self._code = None
+        self._sock = None
+        self._pids = set()
+        self._busy = False
+        self._stopping = False
+
+    def warm_up(self):
+        """Do what every review does once so the forked workers don't"""
+        from reviewtools import modules
+        from reviewtools.common import get_snapd_base_declaration
+
+        for module_name in modules.get_modules():
+            modules.find_main_class(module_name)
+        get_snapd_base_declaration()
+
+        # imported lazily by the reviews
+        import argparse  # noqa: F401
+        import yaml  # noqa: F401
+
+        try:
+            import magic  # noqa: F401
+        except ImportError:  # pragma: nocover
+            pass
+
+        with open(self.snap_review) as f:
+            self._code = compile(f.read(), self.snap_review, "exec")
+
+    def run_job(self, job):
+        """Run snap-review with the job's arguments in this process and
+           return the reply
+        """
+        import contextlib
+        import io
+        import traceback
+
+        from reviewtools.common import cleanup_unpack
+
+        if self._code is None:
+            self.warm_up()
+
+        _validate_job(job)
+        out = io.StringIO()
+        err = io.StringIO()
+        saved_env = os.environ.copy()
+        saved_argv = sys.argv
+        saved_cwd = os.getcwd()
+        rc = 0
+        try:
+            with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+                try:
+                    os.environ.update(job.get("env", {}))
+                    sys.argv = [self.snap_review] + job["args"]
+                    if job.get("cwd"):
+                        os.chdir(job["cwd"])
+                    exec(
+                        self._code,
+                        {"__name__": "__main__", "__file__": self.snap_review},
+                    )
+                except SystemExit as e:
+                    rc = _exit_code(e.code)
+                except Exception:
+                    traceback.print_exc()
+                    rc = 1
+                finally:
+                    cleanup_unpack()
+        finally:
+            os.environ.clear()
+            os.environ.update(saved_env)
+            sys.argv = saved_argv
+            os.chdir(saved_cwd)
+
+        return {"rc": rc, "output": out.getvalue(), "stderr": err.getvalue()}
+
+    def _handle(self, conn):
+        """Read a job from conn, run it and send the reply"""
+        with conn, conn.makefile("rwb") as f:
+            line = f.readline()
+            try:
+                reply = self.run_job(json.loads(line.decode("utf-8")))
+            except ValueError as e:
+                reply = {"rc": 1, "output": "", "stderr": "invalid job: %s\n" % e}
+            try:
+                f.write(json.dumps(reply).encode("utf-8") + b"\n")
+                f.flush()
+            except OSError:
+                # the client went away
+                pass
+
+    def _worker_sigterm(self, signum, frame):
+        if not self._busy:
+            os._exit(0)
+        self._stopping = True
+
+    def _worker(self):
+        """Serve jobs until max_jobs were run or asked to stop"""
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, self._worker_sigterm)
+        jobs = 0
+        while jobs < self.max_jobs and not self._stopping:
+            (conn, addr) = self._sock.accept()
+            self._busy = True
+            try:
+                self._handle(conn)
+            finally:
+                self._busy = False
+            jobs += 1
+
+    def _spawn(self):
+        pid = os.fork()
+        if pid == 0:  # pragma: nocover
+            rc = 0
+            try:
+                self._worker()
+            except Exception:
+                import traceback
+
+                traceback.print_exc()
+                rc = 1
+            finally:
+                os._exit(rc)
+        self._pids.add(pid)
+
+    def _bind(self):
+        """Listen on the socket, replacing it if no daemon is using it"""
+        if os.path.exists(self.socket_path):
+            s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                s.connect(self.socket_path)
+                raise OSError("'%s' is in use" % self.socket_path)
+            except ConnectionRefusedError:
+                os.unlink(self.socket_path)
+            finally:
+                s.close()
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.bind(self.socket_path)
+        self._sock.listen(max(16, self.workers * 4))
+
+    def _stop(self, signum, frame):
+        raise SystemExit(0)
+
+    def serve(self):
+        """Warm up, fork the workers and replace them when they exit, until
+           SIGTERM or SIGINT
+        """
+        from reviewtools.common import debug
+
+        self.warm_up()
+        self._bind()
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        try:
+            for i in range(self.workers):
+                self._spawn()
+            while True:
+                (pid, status) = os.wait()
+                if pid not in self._pids:
+                    continue
+                self._pids.remove(pid)
+                debug("replacing worker %d (status %d)" % (pid, status))
+                self._spawn()
+        finally:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            for pid in self._pids:
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+            for pid in self._pids:
+                try:
+                    os.waitpid(pid, 0)
+                except ChildProcessError:
+                    pass
+            self._pids = set()
+            self._sock.close()
+            os.unlink(self.socket_path)
+
+
+def submit_review(socket_path, args, cwd=None, env=None):
+    """Run 'snap-review <args>' in the daemon listening on socket_path and
+       return (rc, output, stderr)
+    """
+    if cwd is None:
+        cwd = os.getcwd()
+    job = {"args": args, "cwd": cwd, "env": env if env is not None else {}}
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.connect(socket_path)
+        with s.makefile("rwb") as f:
+            f.write(json.dumps(job).encode("utf-8") + b"\n")
+            f.flush()
+            line = f.readline()
+    if not line:
+        raise OSError("no reply from the review daemon")
+    reply = json.loads(line.decode("utf-8"))
+    return (reply["rc"], reply["output"], reply["stderr"])
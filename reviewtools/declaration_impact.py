@@ -0,0 +1,152 @@
+"""declaration_impact.py: evaluate base declaration changes on a store dump"""
+#
+# Copyright (C) 2021 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Finding the published snaps affected by a base declaration change doesn't
+# need the packages: the installation and connection checks of
+# SnapReviewDeclaration only use snap.yaml. So the snap.yaml database of
+# bin/dump-tool:
+#
+#   {<snap id>: {<revision>: {"name": <name>, "yaml": <snap.yaml>}}}
+#
+# is evaluated with the old and the new base declaration, along with the
+# snap declarations of the snaps that have one:
+#
+#   {<snap id>: {"plugs": {...}, "slots": {...}}}
+#
+# and the revisions where the errors and warnings of the declaration checks
+# (the verdict) differ are reported. The revisions are evaluated in chunks
+# by forked worker processes that share the database and compile each base
+# declaration once.
+
+import copy
+
+from reviewtools.common import FatalReviewError
+from reviewtools.sr_common import SnapReview
+from reviewtools.sr_declaration import (
+    CompiledDeclaration,
+    evaluate_snap_declaration,
+)
+
+IMPACT_CHUNK_SIZE = 500
+
+# what the forked workers evaluate (see evaluate_impact()):
+# (db, snap declarations, (old CompiledDeclaration, new CompiledDeclaration))
+IMPACT_STATE = None
+
+
+def compile_base_declaration(bd):
+    """Return the CompiledDeclaration of the BaseDeclaration bd with the
+       in-progress interfaces, like for the reviews
+    """
+    review = SnapReview(None, None)  # for using utility functions
+    return CompiledDeclaration(review._add_inprogress_interfaces(bd.series, bd.decl))
+
+
+def evaluate_revision(snap_yaml, compiled_base, snap_decl=None):
+    """Return the verdict of the declaration checks for the parsed snap_yaml
+       with compiled_base and the snap declaration, if any: the errors and
+       warnings of the report, {"fatal": <error>} if the review stopped or
+       {"exception": <exception>} if the checks raised another exception
+    """
+    overrides = None
+    if snap_decl is not None:
+        # the review adds the defaults to it
+        snap_decl = copy.deepcopy(snap_decl)
+        overrides = {
+            "snap_decl_plugs": snap_decl.get("plugs", {}),
+            "snap_decl_slots": snap_decl.get("slots", {}),
+        }
+
+    try:
+        review = evaluate_snap_declaration(snap_yaml, compiled_base, overrides)
+    except FatalReviewError as e:
+        return {"fatal": str(e)}
+    except Exception as e:
+        return {"exception": "%s: %s" % (type(e).__name__, e)}
+
+    verdict = {}
+    for result_type in ["error", "warn"]:
+        if len(review.review_report[result_type]) > 0:
+            verdict[result_type] = review.review_report[result_type]
+    return verdict
+
+
+def _evaluate_revisions(keys):
+    """Evaluate the revisions [(<snap id>, <revision>)] of IMPACT_STATE.
+       Returns [(<snap id>, <revision>, <old verdict>, <new verdict>)] for
+       the ones whose verdict changes
+    """
+    (db, snap_decls, (old, new)) = IMPACT_STATE
+    changed = []
+    for (snap_id, rev) in keys:
+        snap_yaml = db[snap_id][rev]["yaml"]
+        snap_decl = snap_decls.get(snap_id)
+        old_verdict = evaluate_revision(snap_yaml, old, snap_decl)
+        new_verdict = evaluate_revision(snap_yaml, new, snap_decl)
+        if old_verdict != new_verdict:
+            changed.append((snap_id, rev, old_verdict, new_verdict))
+    return changed
+
+
+def evaluate_impact(db, old_base, new_base, snap_decls=None, jobs=None):
+    """Evaluate the declaration checks for every revision of the dump-tool
+       db with the old and the new base declaration (BaseDeclaration objects)
+       and the snap declarations by snap id, in up to jobs processes
+       (default: number of CPUs). Returns
+       {<snap id>: {<revision>: {"name": <name>, "old": <verdict>,
+       "new": <verdict>}}} for the revisions whose verdict changes (see
+       evaluate_revision()). The snap.yaml of the db get the review
+       defaults (eg, 'type: app')
+    """
+    global IMPACT_STATE
+    if snap_decls is None:
+        snap_decls = {}
+
+    keys = [(snap_id, rev) for snap_id in db for rev in db[snap_id]]
+    chunks = [
+        keys[i : i + IMPACT_CHUNK_SIZE] for i in range(0, len(keys), IMPACT_CHUNK_SIZE)
+    ]
+
+    bases = (compile_base_declaration(old_base), compile_base_declaration(new_base))
+    IMPACT_STATE = (db, snap_decls, bases)
+    try:
+        if jobs == 1 or len(chunks) < 2:
+            results = [_evaluate_revisions(chunk) for chunk in chunks]
+        else:
+            # only needed for big databases
+            import concurrent.futures
+            import multiprocessing
+
+            # forked, so the workers share IMPACT_STATE
+            ctx = multiprocessing.get_context("fork")
+            with concurrent.futures.ProcessPoolExecutor(
+                max_workers=jobs, mp_context=ctx
+            ) as executor:
+                results = list(executor.map(_evaluate_revisions, chunks))
+    finally:
+        IMPACT_STATE = None
+
+    impact = {}
+    for changed in results:
+        for (snap_id, rev, old_verdict, new_verdict) in changed:
+            if snap_id not in impact:
+                impact[snap_id] = {}
+            impact[snap_id][rev] = {
+                "name": db[snap_id][rev].get("name"),
+                "old": old_verdict,
+                "new": new_verdict,
+            }
+    return impact
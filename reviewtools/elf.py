@@ -0,0 +1,671 @@
+"""elf.py: read ELF headers without external tools"""
+#
+# Copyright (C) 2021 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# See elf(5) for the on-disk format.
+
+import concurrent.futures
+import mmap
+import os
+import stat
+import struct
+import subprocess
+
+from reviewtools.common import ReviewException, debug
+
+ELF_MAGIC = b"\x7fELF"
+ELFCLASS32 = 1
+ELFCLASS64 = 2
+ELFDATA2LSB = 1
+ELFDATA2MSB = 2
+
+# e_type
+ET_REL = 1
+ET_EXEC = 2
+ET_DYN = 3
+ET_CORE = 4
+
+# e_machine
+EM_MIPS = 8
+
+# p_type
+PT_DYNAMIC = 2
+PT_GNU_STACK = 0x6474E551
+
+# p_flags
+PF_X = 0x1
+
+# d_tag
+DT_NULL = 0
+DT_FLAGS_1 = 0x6FFFFFFB
+DF_1_PIE = 0x08000000
+
+# sh_type
+SHT_NULL = 0
+SHT_SYMTAB = 2
+SHT_STRTAB = 3
+SHT_NOBITS = 8
+SHT_DYNSYM = 11
+SHT_SYMTAB_SHNDX = 18
+SHT_GNU_VERDEF = 0x6FFFFFFD
+SHT_GNU_VERNEED = 0x6FFFFFFE
+SHT_GNU_VERSYM = 0x6FFFFFFF
+
+# sh_flags
+SHF_WRITE = 0x1
+SHF_ALLOC = 0x2
+SHF_EXECINSTR = 0x4
+SHF_MIPS_GPREL = 0x10000000
+
+# special section indexes
+SHN_UNDEF = 0
+SHN_LORESERVE = 0xFF00
+SHN_ABS = 0xFFF1
+SHN_COMMON = 0xFFF2
+SHN_XINDEX = 0xFFFF
+
+# st_info
+STB_LOCAL = 0
+STB_GLOBAL = 1
+STB_WEAK = 2
+STB_GNU_UNIQUE = 10
+STT_OBJECT = 1
+STT_SECTION = 3
+STT_FILE = 4
+STT_COMMON = 5
+STT_GNU_IFUNC = 10
+
+# versions
+VER_FLG_BASE = 0x1
+VERSYM_HIDDEN = 0x8000
+
+# sections nm reports as debugging ('N') when they aren't allocated
+debug_section_prefixes = (
+    ".debug",
+    ".gnu.debuglto_.debug_",
+    ".gnu.linkonce.wi.",
+    ".zdebug",
+    ".line",
+    ".stab",
+)
+
+# Mime types libmagic reports for ELF files (see file's magic/Magdir/elf)
+elf_mime_types = {
+    ET_REL: "application/x-object",
+    ET_EXEC: "application/x-executable",
+    ET_DYN: "application/x-sharedlib",
+    ET_CORE: "application/x-coredump",
+    0xFE01: "application/x-executable",  # OS-specific
+}
+ELF_MIME_PIE = "application/x-pie-executable"
+ELF_MIME_PS2_IOP = "application/x-sharedlib"  # 0xFF80 on MIPS
+# for everything that isn't an object, executable or shared library
+ELF_MIME_OTHER = "application/octet-stream"
+
+
+class ElfException(ReviewException):
+    """This class represents ELF reader exceptions"""
+
+
+class ElfFile(object):
+    """Read the ELF header, program headers, section headers and dynamic
+       symbols of a (mmap'ed) file
+
+    Example:
+        with ElfFile("foo.so") as elf:
+            print(elf.e_type)
+    """
+
+    def __init__(self, fn):
+        self.fn = fn
+        self._map = None
+        try:
+            with open(fn, "rb") as f:
+                if os.fstat(f.fileno()).st_size < 16:
+                    raise ElfException("'%s' is not an ELF file" % fn)
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            raise ElfException("could not read '%s': %s" % (fn, e))
+
+        try:
+            self._read_header()
+        except Exception:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Close the file"""
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def _read(self, offset, size):
+        if offset + size > len(self._map):
+            raise ElfException("truncated ELF file '%s'" % self.fn)
+        return self._map[offset : offset + size]
+
+    def _read_header(self):
+        ident = self._read(0, 16)
+        if not ident.startswith(ELF_MAGIC):
+            raise ElfException("'%s' is not an ELF file" % self.fn)
+
+        self.ei_class = ident[4]
+        self.ei_data = ident[5]
+        if self.ei_class not in [ELFCLASS32, ELFCLASS64]:
+            raise ElfException("invalid ELF class in '%s'" % self.fn)
+        if self.ei_data not in [ELFDATA2LSB, ELFDATA2MSB]:
+            raise ElfException("invalid ELF byte order in '%s'" % self.fn)
+
+        self.endian = "<" if self.ei_data == ELFDATA2LSB else ">"
+        if self.ei_class == ELFCLASS64:
+            fmt = "HHIQQQIHHHHHH"
+        else:
+            fmt = "HHIIIIIHHHHHH"
+        hdr = struct.Struct(self.endian + fmt)
+        (
+            self.e_type,
+            self.e_machine,
+            self.e_version,
+            self.e_entry,
+            self.e_phoff,
+            self.e_shoff,
+            self.e_flags,
+            self.e_ehsize,
+            self.e_phentsize,
+            self.e_phnum,
+            self.e_shentsize,
+            self.e_shnum,
+            self.e_shstrndx,
+        ) = hdr.unpack(self._read(16, hdr.size))
+
+    def program_headers(self):
+        """Return a list of (p_type, p_offset, p_filesz, p_flags)"""
+        if self.ei_class == ELFCLASS64:
+            phdr = struct.Struct(self.endian + "IIQQQQQQ")
+        else:
+            phdr = struct.Struct(self.endian + "IIIIIIII")
+        if self.e_phnum == 0:
+            return []
+        if self.e_phentsize < phdr.size:
+            raise ElfException("invalid program header size in '%s'" % self.fn)
+
+        buf = self._read(self.e_phoff, self.e_phentsize * self.e_phnum)
+        phdrs = []
+        for i in range(self.e_phnum):
+            fields = phdr.unpack_from(buf, i * self.e_phentsize)
+            if self.ei_class == ELFCLASS64:
+                (p_type, p_flags, p_offset) = fields[0:3]
+                p_filesz = fields[5]
+            else:
+                (p_type, p_offset) = fields[0:2]
+                p_filesz = fields[4]
+                p_flags = fields[6]
+            phdrs.append((p_type, p_offset, p_filesz, p_flags))
+        return phdrs
+
+    def dynamic_entries(self, phdrs=None):
+        """Return the (d_tag, d_val) entries of the dynamic section"""
+        if phdrs is None:
+            phdrs = self.program_headers()
+        if self.ei_class == ELFCLASS64:
+            dyn = struct.Struct(self.endian + "qQ")
+        else:
+            dyn = struct.Struct(self.endian + "iI")
+
+        entries = []
+        for (p_type, p_offset, p_filesz, p_flags) in phdrs:
+            if p_type != PT_DYNAMIC:
+                continue
+            buf = self._read(p_offset, p_filesz - p_filesz % dyn.size)
+            for (d_tag, d_val) in dyn.iter_unpack(buf):
+                if d_tag == DT_NULL:
+                    break
+                entries.append((d_tag, d_val))
+        return entries
+
+    def has_execstack(self):
+        """Check if the PT_GNU_STACK program header is executable"""
+        for (p_type, p_offset, p_filesz, p_flags) in self.program_headers():
+            if p_type == PT_GNU_STACK:
+                return (p_flags & PF_X) != 0
+        return False
+
+    def is_pie(self):
+        """Check if an ET_DYN file is a PIE executable like libmagic does"""
+        for (d_tag, d_val) in self.dynamic_entries():
+            if d_tag == DT_FLAGS_1:
+                return (d_val & DF_1_PIE) != 0
+        return False
+
+    def _read_str(self, offset, end):
+        """Read a NUL terminated string starting at offset and before end"""
+        if offset >= end:
+            raise ElfException("invalid string offset in '%s'" % self.fn)
+        nul = self._map.find(b"\0", offset, end)
+        if nul == -1:
+            raise ElfException("unterminated string in '%s'" % self.fn)
+        return self._map[offset:nul].decode("utf-8", errors="replace")
+
+    def section_headers(self):
+        """Return a list of (name, sh_type, sh_flags, sh_offset, sh_size,
+           sh_link, sh_info, sh_entsize)
+        """
+        if self.ei_class == ELFCLASS64:
+            shdr = struct.Struct(self.endian + "IIQQQQIIQQ")
+        else:
+            shdr = struct.Struct(self.endian + "IIIIIIIIII")
+        if self.e_shoff == 0:
+            return []
+        if self.e_shentsize < shdr.size:
+            raise ElfException("invalid section header size in '%s'" % self.fn)
+
+        # with many sections, the real count and string table index are in
+        # the first section header
+        first = shdr.unpack(self._read(self.e_shoff, shdr.size))
+        shnum = self.e_shnum if self.e_shnum != 0 else first[5]
+        shstrndx = self.e_shstrndx if self.e_shstrndx != SHN_XINDEX else first[6]
+
+        buf = self._read(self.e_shoff, self.e_shentsize * shnum)
+        raw = [shdr.unpack_from(buf, i * self.e_shentsize) for i in range(shnum)]
+        if shstrndx >= shnum:
+            raise ElfException("invalid section name index in '%s'" % self.fn)
+        strtab_off = raw[shstrndx][4]
+        strtab_end = strtab_off + raw[shstrndx][5]
+        if strtab_end > len(self._map):
+            raise ElfException("truncated ELF file '%s'" % self.fn)
+
+        shdrs = []
+        for (sh_name, sh_type, sh_flags, _, off, size, link, info, _, ent) in raw:
+            name = ""
+            if sh_type != SHT_NULL:
+                name = self._read_str(strtab_off + sh_name, strtab_end)
+            shdrs.append((name, sh_type, sh_flags, off, size, link, info, ent))
+        return shdrs
+
+    def _section_data(self, shdrs, idx):
+        """Return the contents of a section"""
+        if idx >= len(shdrs):
+            raise ElfException("invalid section index in '%s'" % self.fn)
+        (name, sh_type, sh_flags, sh_offset, sh_size) = shdrs[idx][0:5]
+        if sh_type == SHT_NOBITS:
+            return b""
+        return self._read(sh_offset, sh_size)
+
+    def _version_definitions(self, shdrs, verdef_idx):
+        """Return {vd_ndx: (vd_flags, nodename)} from .gnu.version_d"""
+        verdefs = {}
+        if verdef_idx is None:
+            return verdefs
+        (sh_offset, sh_size, sh_link, sh_info) = shdrs[verdef_idx][3:7]
+        (str_off, str_size) = shdrs[sh_link][3:5] if sh_link < len(shdrs) else (0, 0)
+        verdef = struct.Struct(self.endian + "HHHHIII")
+        verdaux = struct.Struct(self.endian + "II")
+        off = sh_offset
+        # sh_info is the number of entries
+        for i in range(sh_info):
+            (_, vd_flags, vd_ndx, vd_cnt, _, vd_aux, vd_next) = verdef.unpack(
+                self._read(off, verdef.size)
+            )
+            nodename = None
+            if vd_cnt > 0:
+                (vda_name, _) = verdaux.unpack(self._read(off + vd_aux, verdaux.size))
+                nodename = self._read_str(str_off + vda_name, str_off + str_size)
+            verdefs[vd_ndx] = (vd_flags, nodename)
+            if vd_next == 0 or off + vd_next >= sh_offset + sh_size:
+                break
+            off += vd_next
+        return verdefs
+
+    def _version_needs(self, shdrs, verneed_idx):
+        """Return {vna_other: name} from .gnu.version_r"""
+        verneeds = {}
+        if verneed_idx is None:
+            return verneeds
+        (sh_offset, sh_size, sh_link, sh_info) = shdrs[verneed_idx][3:7]
+        (str_off, str_size) = shdrs[sh_link][3:5] if sh_link < len(shdrs) else (0, 0)
+        verneed = struct.Struct(self.endian + "HHIII")
+        vernaux = struct.Struct(self.endian + "IHHII")
+        off = sh_offset
+        for i in range(sh_info):
+            (_, vn_cnt, _, vn_aux, vn_next) = verneed.unpack(
+                self._read(off, verneed.size)
+            )
+            aux_off = off + vn_aux
+            for j in range(vn_cnt):
+                (_, _, vna_other, vna_name, vna_next) = vernaux.unpack(
+                    self._read(aux_off, vernaux.size)
+                )
+                verneeds[vna_other] = self._read_str(
+                    str_off + vna_name, str_off + str_size
+                )
+                if vna_next == 0:
+                    break
+                aux_off += vna_next
+            if vn_next == 0 or off + vn_next >= sh_offset + sh_size:
+                break
+            off += vn_next
+        return verneeds
+
+    def _section_letter(self, shdr):
+        """Return the nm symbol type letter (lower case) for a section"""
+        (name, sh_type, sh_flags) = shdr[0:3]
+        has_contents = sh_type != SHT_NOBITS
+        alloc = (sh_flags & SHF_ALLOC) != 0
+        readonly = (sh_flags & SHF_WRITE) == 0
+        small = self.e_machine == EM_MIPS and (sh_flags & SHF_MIPS_GPREL) != 0
+        if sh_flags & SHF_EXECINSTR:
+            return "t"
+        elif alloc and has_contents:
+            if readonly:
+                return "r"
+            return "g" if small else "d"
+        elif not has_contents:
+            return "s" if small else "b"
+        elif not alloc and (
+            name.startswith(debug_section_prefixes) or name == ".gdb_index"
+        ):
+            return "N"
+        elif readonly:
+            return "n"
+        return "?"
+
+    def _symbol_letter(self, shdrs, st_info, st_shndx):
+        """Return the nm symbol type letter (see bfd_decode_symclass())"""
+        bind = st_info >> 4
+        stype = st_info & 0xF
+        if st_shndx == SHN_COMMON:
+            return "C"
+        elif st_shndx == SHN_UNDEF:
+            if bind == STB_WEAK:
+                return "v" if stype == STT_OBJECT else "w"
+            return "U"
+        elif stype == STT_GNU_IFUNC:
+            return "i"
+        elif bind == STB_WEAK:
+            return "V" if stype in [STT_OBJECT, STT_COMMON] else "W"
+        elif bind == STB_GNU_UNIQUE:
+            return "u"
+        elif bind not in [STB_LOCAL, STB_GLOBAL]:
+            return "?"
+
+        if st_shndx >= SHN_LORESERVE or st_shndx >= len(shdrs):
+            letter = "a"
+        elif shdrs[st_shndx][1] in [
+            SHT_NULL,
+            SHT_SYMTAB,
+            SHT_SYMTAB_SHNDX,
+        ]:
+            letter = "a"
+        else:
+            letter = self._section_letter(shdrs[st_shndx])
+        return letter.upper() if bind == STB_GLOBAL else letter
+
+    def dynamic_symbols(self, defined_only=True):
+        """Return a list of (name, type, version) for the symbols in .dynsym,
+           with the type letter and version suffix ('@@VERSION', '@VERSION'
+           or '') 'nm --dynamic --with-symbol-versions' reports, sorted
+           like nm. Names are not demangled.
+        """
+        shdrs = self.section_headers()
+        dynsym_idx = None
+        versym_idx = None
+        verdef_idx = None
+        verneed_idx = None
+        for (i, shdr) in enumerate(shdrs):
+            if shdr[1] == SHT_DYNSYM and dynsym_idx is None:
+                dynsym_idx = i
+            elif shdr[1] == SHT_GNU_VERSYM:
+                versym_idx = i
+            elif shdr[1] == SHT_GNU_VERDEF:
+                verdef_idx = i
+            elif shdr[1] == SHT_GNU_VERNEED:
+                verneed_idx = i
+        if dynsym_idx is None:
+            return []
+
+        if self.ei_class == ELFCLASS64:
+            sym = struct.Struct(self.endian + "IBBHQQ")
+        else:
+            sym = struct.Struct(self.endian + "IIIBBH")
+        (sh_size, sh_link, sh_info, sh_entsize) = shdrs[dynsym_idx][4:8]
+        if sh_entsize < sym.size:
+            raise ElfException("invalid symbol size in '%s'" % self.fn)
+        data = self._section_data(shdrs, dynsym_idx)
+        if sh_link >= len(shdrs):
+            raise ElfException("invalid symbol string table in '%s'" % self.fn)
+        (str_off, str_size) = shdrs[sh_link][3:5]
+        str_end = str_off + str_size
+        if str_end > len(self._map):
+            raise ElfException("truncated ELF file '%s'" % self.fn)
+
+        versyms = None
+        if versym_idx is not None:
+            versyms = struct.unpack(
+                "%s%dH" % (self.endian, shdrs[versym_idx][4] // 2),
+                self._section_data(shdrs, versym_idx),
+            )
+        verdefs = self._version_definitions(shdrs, verdef_idx)
+        verneeds = self._version_needs(shdrs, verneed_idx)
+        cverdefs = max(verdefs) if verdefs else 0
+
+        symbols = []
+        # the first symbol is always the undefined symbol
+        for i in range(1, sh_size // sh_entsize):
+            fields = sym.unpack_from(data, i * sh_entsize)
+            if self.ei_class == ELFCLASS64:
+                (st_name, st_info, st_other, st_shndx) = fields[0:4]
+            else:
+                (st_name, st_info, st_other, st_shndx) = (fields[0],) + fields[3:6]
+            if (st_info & 0xF) in [STT_SECTION, STT_FILE]:
+                continue  # debugging symbols
+            if defined_only and st_shndx == SHN_UNDEF:
+                continue
+            name = self._read_str(str_off + st_name, str_end)
+            letter = self._symbol_letter(shdrs, st_info, st_shndx)
+
+            # see _bfd_elf_get_symbol_version_string()
+            version = ""
+            if versyms is not None and i < len(versyms):
+                hidden = (versyms[i] & VERSYM_HIDDEN) != 0
+                vernum = versyms[i] & ~VERSYM_HIDDEN
+                nodename = None
+                if vernum == 0:
+                    pass
+                elif vernum == 1 and (
+                    vernum > cverdefs or verdefs[1][0] & VER_FLG_BASE
+                ):
+                    pass
+                elif vernum <= cverdefs:
+                    if vernum in verdefs and verdefs[vernum][1] != name:
+                        nodename = verdefs[vernum][1]
+                else:
+                    nodename = verneeds.get(vernum, "<corrupt>")
+                    hidden = True
+                if nodename:
+                    version = ("@" if hidden else "@@") + nodename
+            symbols.append((name, letter, version))
+
+        # nm sorts by name only, keeping the .dynsym order for the same name
+        # in different versions
+        return sorted(symbols, key=lambda s: s[0].encode("utf-8"))
+
+
+def elf_mime_type(fn):
+    """Return the mime type libmagic would report for an ELF file (without
+       the charset), ELF_MIME_OTHER for files libmagic wouldn't report as an
+       object, executable or shared library, or None if only libmagic can tell
+    """
+    try:
+        st = os.lstat(fn)
+    except OSError:
+        return None
+    if not stat.S_ISREG(st.st_mode):
+        return ELF_MIME_OTHER  # libmagic doesn't follow symlinks either
+
+    try:
+        with open(fn, "rb") as f:
+            head = f.read(20)
+    except OSError:
+        return None
+
+    if not head.startswith(ELF_MAGIC):
+        if head.startswith(b"\x80"):
+            return None  # maybe an OMF relocatable (application/x-object)
+        return ELF_MIME_OTHER
+
+    if len(head) < 20 or head[5] not in [ELFDATA2LSB, ELFDATA2MSB]:
+        return None
+
+    endian = "<" if head[5] == ELFDATA2LSB else ">"
+    (e_type, e_machine) = struct.unpack_from(endian + "HH", head, 16)
+    if e_type == 0xFF80 and e_machine == EM_MIPS:
+        return ELF_MIME_PS2_IOP
+    elif e_type not in elf_mime_types:
+        return ELF_MIME_OTHER
+    elif e_type != ET_DYN:
+        return elf_mime_types[e_type]
+
+    try:
+        with ElfFile(fn) as elf:
+            if elf.is_pie():
+                return ELF_MIME_PIE
+    except ElfException:
+        pass  # libmagic still calls it a shared object
+    return elf_mime_types[ET_DYN]
+
+
+def has_execstack(fn):
+    """Check if fn is an executable or shared library with an executable
+       stack, ie, what 'execstack -q' reports with 'X '. Files without
+       PT_GNU_STACK ('? ' with execstack) are not reported.
+    """
+    try:
+        with ElfFile(fn) as elf:
+            if elf.e_type not in [ET_EXEC, ET_DYN]:
+                return False
+            return elf.has_execstack()
+    except ElfException:
+        return False
+
+
+def read_dynamic_symbols(fn):
+    """Return ElfFile.dynamic_symbols() for fn or None if fn couldn't be
+       read as an ELF file
+    """
+    try:
+        with ElfFile(fn) as elf:
+            return elf.dynamic_symbols()
+    except ElfException as e:
+        debug(str(e))
+        return None
+
+
+def demangle_symbols(names):
+    """Demangle the C++ (and other) names with a single c++filt call, like
+       'nm --demangle' does. Return a dict of name to demangled name.
+    """
+    demangled = dict((name, name) for name in names)
+    # c++filt works on lines and mangled names start with '_' (or '.' for
+    # ppc64 function descriptors)
+    candidates = sorted(
+        set(n for n in names if n.startswith(("_", ".")) and "\n" not in n)
+    )
+    if len(candidates) == 0:
+        return demangled
+
+    try:
+        # -i (--no-verbose) is what nm uses
+        out = subprocess.run(
+            ["c++filt", "-i"],
+            input="\n".join(candidates) + "\n",
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            universal_newlines=True,
+            check=True,
+        ).stdout
+    except (OSError, subprocess.CalledProcessError) as e:
+        debug("could not demangle symbols: %s" % e)
+        return demangled
+
+    lines = out.splitlines()
+    if len(lines) != len(candidates):
+        debug("unexpected c++filt output (%d != %d)" % (len(lines), len(candidates)))
+        return demangled
+    for (name, line) in zip(candidates, lines):
+        demangled[name] = line
+    return demangled
+
+
+def get_dynamic_symbols(fns, demangle=True):
+    """Return {fn: [(name, type, version), ...]} for the defined dynamic
+       symbols of each file (None if the file couldn't be read). Files are
+       read in a process pool when there are several of them and all names
+       are demangled in one c++filt call.
+    """
+    fns = list(fns)
+    if len(fns) > 1 and (os.cpu_count() or 1) > 1:
+        with concurrent.futures.ProcessPoolExecutor() as executor:
+            results = list(executor.map(read_dynamic_symbols, fns, chunksize=8))
+    else:
+        results = [read_dynamic_symbols(fn) for fn in fns]
+    symbols = dict(zip(fns, results))
+
+    if demangle:
+        names = set()
+        for entries in results:
+            if entries is not None:
+                names.update(name for (name, letter, version) in entries)
+        demangled = demangle_symbols(names)
+        for fn in symbols:
+            if symbols[fn] is not None:
+                symbols[fn] = [
+                    (demangled[name], letter, version)
+                    for (name, letter, version) in symbols[fn]
+                ]
+    return symbols
+
+
+def get_symbols_abi(entries):
+    """Return the {symbol: {"type": type, "version": version}} ABI for the
+       (name, type, version) entries of get_dynamic_symbols()
+    """
+    symbols = {}
+    for (name, letter, version) in entries:
+        symbol = name + version
+        symbol_version = ""
+        idx = symbol.find("@")
+        if idx > 1:
+            symbol_version = symbol[idx:]
+            symbol = symbol[:idx]
+
+        # only global symbols (uppercase and special global 'u', 'v', 'w')
+        # skipping N (debugging) and U (undefined)
+        if symbol_type_is_global(letter) and symbol not in symbols:
+            symbols[symbol] = {"type": letter, "version": symbol_version}
+    return symbols
+
+
+def symbol_type_is_global(letter):
+    """Check if an nm symbol type letter is for a defined global symbol"""
+    return (letter.isupper() or letter in ["u", "v", "w"]) and letter not in [
+        "N",
+        "U",
+    ]
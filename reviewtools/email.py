@@ -13,10 +13,8 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from email.mime.text import MIMEText
 from email.utils import parseaddr
 import os
-import smtplib
 import sys
 
 # The From address for all emails
@@ -103,6 +101,10 @@ def send(email_to_addr, subj, body, bcc=None):
                 print("aborting email delivery for 'Subject: %s'" % subj)
                 return False
 
+        # slow to import, so only when sending
+        from email.mime.text import MIMEText
+        import smtplib
+
         # This can throw many exceptions so the caller needs to catch them and
         # skip updating seen_db
         msg = MIMEText(body)
@@ -1,8 +1,19 @@
 import reviewtools
-import imp
+import contextlib
+import importlib
 import inspect
+import io
 import os
 import pkgutil
+import traceback
+
+from reviewtools.common import (
+    DEFAULT_REVIEW_CONTEXT,
+    FatalReviewError,
+    check_selected,
+    check_selection_enabled,
+    cleanup_worker,
+)
 
 IRRELEVANT_MODULES = ["sr_common", "sr_tests", "sr_skeleton", "common"]
 
@@ -35,7 +46,11 @@ def get_modules():
     # will depend on reviewtools.__path__ order for search order. For now
     # support only one extra path. In the future, could consider a
     # colon-separated list and adding each in order.
-    if "RT_EXTRAS_PATH" in os.environ and os.path.isdir(os.environ["RT_EXTRAS_PATH"]):
+    if (
+        "RT_EXTRAS_PATH" in os.environ
+        and os.path.isdir(os.environ["RT_EXTRAS_PATH"])
+        and os.environ["RT_EXTRAS_PATH"] not in reviewtools.__path__
+    ):
         reviewtools.__path__.append(os.environ["RT_EXTRAS_PATH"])
 
     all_modules = [name for _, name, _ in pkgutil.iter_modules(reviewtools.__path__)]
@@ -47,19 +62,19 @@ def find_main_class(module_name):
     This function will find the Snap*Review class in
     the specified module.
     """
-    module = None
-    # Search the different reviewtools.__path__ directories, loading the first
-    # match (get_modules(), above, appends to reviewtools.__path__ so we can
-    # use its order for our search order. This allows utilizing RT_EXTRAS_PATH
-    # when it is defined, but not in a way that allows it to override an
-    # existing main (ie, non-extras) module.
-    for dir in reviewtools.__path__:
-        fullpath = "%s/%s.py" % (dir, module_name)
-        if os.path.isfile(fullpath):
-            module = imp.load_source(module_name, fullpath)
-            break
-
-    if module is None:
+    # Import from the reviewtools package, which searches the
+    # reviewtools.__path__ directories in order and loads the first match
+    # (get_modules(), above, appends to reviewtools.__path__ so we can use its
+    # order for our search order. This allows utilizing RT_EXTRAS_PATH when
+    # it is defined, but not in a way that allows it to override an existing
+    # main (ie, non-extras) module. Unlike loading the source, the bytecode is
+    # cached and the module is only loaded once.
+    full_name = "%s.%s" % (reviewtools.__name__, module_name)
+    try:
+        module = importlib.import_module(full_name)
+    except ModuleNotFoundError as e:
+        if e.name != full_name:
+            raise
         raise FileNotFoundError(
             "could not find '%s' in: %s" % (module_name, reviewtools.__path__)
         )
@@ -70,7 +85,7 @@ def find_main_class(module_name):
         return (
             (a[0].startswith("Click") or a[0].startswith("Snap"))
             and not a[0].endswith("Exception")
-            and a[1].__module__ == module_name
+            and a[1].__module__ == module.__name__
         )
 
     test_class = list(filter(find_test_class, classes))
@@ -80,21 +95,146 @@ def find_main_class(module_name):
     return init_object
 
 
-def init_main_class(module_name, pkg_file, overrides=None, report_type=None):
+def module_selected(module_name):
+    """
+    Check if any check of the main class of a given module is selected
+    with RT_ONLY_CHECKS and RT_SKIP_CHECKS, so modules with nothing to do
+    aren't instantiated (and don't prepare the package).
+    """
+    if not check_selection_enabled():
+        return True
+    init_object = find_main_class(module_name)
+    if not init_object:
+        return False
+    review_type = getattr(init_object, "review_type", None)
+    if review_type is None:
+        # only known once instantiated
+        return True
+    for name in getattr(init_object, "checks", {}):
+        if check_selected(review_type, name):
+            return True
+    return False
+
+
+def init_main_class(
+    module_name, pkg_file, overrides=None, report_type=None, context=None
+):
     """
     This function will instantiate the main Snap*Review
     class of a given module and instantiate it with the
-    location of the file we want to inspect.
+    location of the file we want to inspect and the
+    ReviewContext to use (if not the default one).
     """
 
     init_object = find_main_class(module_name)
     if not init_object:
         return None
     try:
-        ob = init_object(pkg_file, overrides)
+        if context is None:
+            ob = init_object(pkg_file, overrides)
+        else:
+            ob = init_object(pkg_file, overrides, context=context)
         # set the report_type separately since it is in the common class
         ob.set_report_type(report_type)
     except TypeError as e:
         print("Could not init %s: %s" % (init_object, str(e)))
         raise
     return ob
+
+
+def _run_module_worker(module_name, pkg_file, overrides, report_type, shared_dirs):
+    """
+    Run the checks of a module in a worker process forked by
+    run_modules_parallel(), which unpacked shared_dirs before forking (see
+    common.cleanup_worker()). Returns (review_report, timings, state_output,
+    stdout, exit_code, fatal, exception) where review_report is None if the
+    module has no review class, timings are the review's timings when
+    profiling, exit_code is set if the module exited, fatal is the
+    FatalReviewError that stopped the review, if any, and exception is the
+    traceback if the checks raised another exception.
+    """
+    report = None
+    timings = None
+    exit_code = None
+    fatal = None
+    exc = None
+    out = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(out):
+            review = init_main_class(
+                module_name, pkg_file, overrides=overrides, report_type=report_type
+            )
+            if review:
+                timings = review.timings
+                review.do_checks()
+                report = review.review_report
+    except SystemExit as e:
+        exit_code = e.code
+    except FatalReviewError as e:
+        fatal = e
+    except Exception:
+        exc = traceback.format_exc()
+    finally:
+        cleanup_worker(shared_dirs)
+
+    state_output = None
+    if overrides is not None and "state_output" in overrides:
+        state_output = overrides["state_output"]
+    return (report, timings, state_output, out.getvalue(), exit_code, fatal, exc)
+
+
+def run_modules_parallel(
+    module_names, pkg_file, jobs, overrides=None, report_type=None
+):
+    """
+    Run the checks of the modules in up to jobs forked worker processes.
+    The package should already be fully unpacked (see
+    common.unpack_pkg_shared()) so the workers only read it. Returns a list
+    of (module_name, review_report, timings, stdout, exit_code, fatal,
+    exception) in the order of module_names (see _run_module_worker()) and
+    applies the changes the modules made to overrides["state_output"] in that
+    order, so the results are the same as running the modules one after the
+    other.
+    """
+    # only needed with --jobs
+    import concurrent.futures
+    import multiprocessing
+
+    # what the workers share, if the package was unpacked up front
+    context = DEFAULT_REVIEW_CONTEXT
+    shared_dirs = [
+        d for d in [context.unpack_dir, context.raw_unpack_dir] if d is not None
+    ]
+
+    ctx = multiprocessing.get_context("fork")
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=jobs, mp_context=ctx
+    ) as executor:
+        futures = [
+            executor.submit(
+                _run_module_worker,
+                module_name,
+                pkg_file,
+                overrides,
+                report_type,
+                shared_dirs,
+            )
+            for module_name in module_names
+        ]
+        results = [f.result() for f in futures]
+
+    merged = []
+    orig_state = None
+    if overrides is not None and "state_output" in overrides:
+        orig_state = dict(overrides["state_output"])
+    for (module_name, res) in zip(module_names, results):
+        (report, timings, state_output, out, exit_code, fatal, exc) = res
+        if orig_state is not None and state_output is not None:
+            for key in orig_state:
+                if key not in state_output:
+                    overrides["state_output"].pop(key, None)
+            for key in state_output:
+                if key not in orig_state or state_output[key] != orig_state[key]:
+                    overrides["state_output"][key] = state_output[key]
+        merged.append((module_name, report, timings, out, exit_code, fatal, exc))
+    return merged
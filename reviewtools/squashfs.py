@@ -0,0 +1,487 @@
+"""squashfs.py: read squashfs metadata without unsquashfs"""
+#
+# Copyright (C) 2021 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Only squashfs 4.0 (the only version snapd supports) is understood. See
+# squashfs-tools/squashfs_fs.h for the on-disk format.
+
+import lzma
+import mmap
+import os
+import stat
+import struct
+import time
+import zlib
+
+from reviewtools.common import ReviewException, StatLLN
+
+SQUASHFS_MAGIC = 0x73717368
+SQUASHFS_METADATA_SIZE = 8192
+SQUASHFS_COMPRESSED_BIT = 1 << 15
+SQUASHFS_INVALID_BLK = 0xFFFFFFFFFFFFFFFF
+
+# compression ids, named as 'unsquashfs -stat' names them
+SQUASHFS_COMPRESSION = {
+    1: "gzip",
+    2: "lzma",
+    3: "lzo",
+    4: "xz",
+    5: "lz4",
+    6: "zstd",
+}
+
+# inode types
+SQUASHFS_DIR_TYPE = 1
+SQUASHFS_REG_TYPE = 2
+SQUASHFS_SYMLINK_TYPE = 3
+SQUASHFS_BLKDEV_TYPE = 4
+SQUASHFS_CHRDEV_TYPE = 5
+SQUASHFS_FIFO_TYPE = 6
+SQUASHFS_SOCKET_TYPE = 7
+SQUASHFS_LDIR_TYPE = 8
+SQUASHFS_LREG_TYPE = 9
+SQUASHFS_LSYMLINK_TYPE = 10
+SQUASHFS_LBLKDEV_TYPE = 11
+SQUASHFS_LCHRDEV_TYPE = 12
+SQUASHFS_LFIFO_TYPE = 13
+SQUASHFS_LSOCKET_TYPE = 14
+
+# inode type to ls-style file type
+squashfs_ftype = {
+    SQUASHFS_DIR_TYPE: "d",
+    SQUASHFS_REG_TYPE: "-",
+    SQUASHFS_SYMLINK_TYPE: "l",
+    SQUASHFS_BLKDEV_TYPE: "b",
+    SQUASHFS_CHRDEV_TYPE: "c",
+    SQUASHFS_FIFO_TYPE: "p",
+    SQUASHFS_SOCKET_TYPE: "s",
+    SQUASHFS_LDIR_TYPE: "d",
+    SQUASHFS_LREG_TYPE: "-",
+    SQUASHFS_LSYMLINK_TYPE: "l",
+    SQUASHFS_LBLKDEV_TYPE: "b",
+    SQUASHFS_LCHRDEV_TYPE: "c",
+    SQUASHFS_LFIFO_TYPE: "p",
+    SQUASHFS_LSOCKET_TYPE: "s",
+}
+
+# unsquashfs -lln prints the root of the image as squashfs-root
+SQUASHFS_ROOT = "squashfs-root"
+
+_superblock_fmt = struct.Struct("<IIIIIHHHHHHQQQQQQQQ")
+_inode_header_fmt = struct.Struct("<HHHHII")
+_dir_header_fmt = struct.Struct("<III")
+_dir_entry_fmt = struct.Struct("<HhHH")
+
+
+class SquashfsException(ReviewException):
+    """This class represents squashfs reader exceptions"""
+
+
+class SquashfsUnsupportedException(SquashfsException):
+    """The image is valid but can't be read in-process (eg, lzo)"""
+
+
+class SquashfsSuperblock(object):
+    """This class represents the squashfs superblock"""
+
+    def __init__(self, buf):
+        if len(buf) < _superblock_fmt.size:
+            raise SquashfsException("truncated superblock")
+
+        (
+            self.magic,
+            self.inodes,
+            self.mkfs_time,
+            self.block_size,
+            self.fragments,
+            self.compression,
+            self.block_log,
+            self.flags,
+            self.no_ids,
+            self.s_major,
+            self.s_minor,
+            self.root_inode,
+            self.bytes_used,
+            self.id_table_start,
+            self.xattr_id_table_start,
+            self.inode_table_start,
+            self.directory_table_start,
+            self.fragment_table_start,
+            self.lookup_table_start,
+        ) = _superblock_fmt.unpack_from(buf)
+
+        if self.magic != SQUASHFS_MAGIC:
+            raise SquashfsException("not a squashfs image")
+        if self.s_major != 4 or self.s_minor != 0:
+            raise SquashfsUnsupportedException(
+                "unsupported squashfs version %d.%d" % (self.s_major, self.s_minor)
+            )
+
+    @property
+    def compression_name(self):
+        """Compression algorithm as named by 'unsquashfs -stat' (or None)"""
+        if self.compression in SQUASHFS_COMPRESSION:
+            return SQUASHFS_COMPRESSION[self.compression]
+        return None
+
+    @property
+    def fstime(self):
+        """Filesystem creation time as shown by 'unsquashfs -fstime'"""
+        return self.mkfs_time
+
+    def describe_offset(self, offset):
+        """Return which part of the image offset is in"""
+        if offset < _superblock_fmt.size:
+            return "superblock"
+        elif offset >= self.bytes_used:
+            return "padding"
+
+        # the tables are written in this order after the data blocks, absent
+        # ones have SQUASHFS_INVALID_BLK as start
+        part = "data blocks"
+        for (start, name) in [
+            (self.inode_table_start, "inode table"),
+            (self.directory_table_start, "directory table"),
+            (self.fragment_table_start, "fragment table"),
+            (self.lookup_table_start, "export table"),
+            (self.id_table_start, "id table"),
+            (self.xattr_id_table_start, "xattr table"),
+        ]:
+            if start != SQUASHFS_INVALID_BLK and start <= offset:
+                part = name
+        return part
+
+
+def read_superblock(fn):
+    """Read the squashfs superblock of fn"""
+    try:
+        with open(fn, "rb") as f:
+            buf = f.read(_superblock_fmt.size)
+    except OSError as e:
+        raise SquashfsException("could not read '%s': %s" % (fn, e))
+    return SquashfsSuperblock(buf)
+
+
+def _decompressor(comp):
+    """Return a function that decompresses a block for comp (or None)"""
+    if comp == 1:
+        return zlib.decompress
+    elif comp == 2:
+        return lambda buf: lzma.decompress(buf, format=lzma.FORMAT_ALONE)
+    elif comp == 4:
+        return lambda buf: lzma.decompress(buf, format=lzma.FORMAT_XZ)
+    elif comp == 6:
+        try:
+            from compression import zstd  # python 3.14 and higher
+        except ImportError:
+            return None
+        return zstd.decompress
+    # no stdlib support for lzo and lz4
+    return None
+
+
+class _MetadataCursor(object):
+    """Sequential reader of a squashfs metadata table"""
+
+    def __init__(self, image, block, offset):
+        self.image = image
+        self.block = block
+        self.offset = offset
+
+    def read(self, length):
+        """Read length bytes, crossing metadata blocks as needed"""
+        chunks = []
+        while length > 0:
+            (buf, next_block) = self.image._metadata_block(self.block)
+            if self.offset > len(buf):
+                raise SquashfsException("metadata offset out of range")
+            elif self.offset == len(buf):
+                self.block = next_block
+                self.offset = 0
+                continue
+            chunk = buf[self.offset : self.offset + length]
+            chunks.append(chunk)
+            self.offset += len(chunk)
+            length -= len(chunk)
+        return b"".join(chunks)
+
+    def unpack(self, fmt):
+        """Read and unpack a struct.Struct"""
+        return fmt.unpack(self.read(fmt.size))
+
+
+class SquashfsImage(object):
+    """Read squashfs metadata directly from a squashfs image
+
+    Example:
+        with SquashfsImage("foo.snap") as sq:
+            print(sq.superblock.compression_name)
+            for (line, item) in sq.lln_entries():
+                print(line)
+    """
+
+    def __init__(self, fn):
+        self.fn = fn
+        self._fd = None
+        self._mm = None
+        try:
+            self._fd = open(fn, "rb")
+            self._mm = mmap.mmap(self._fd.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            self.close()
+            raise SquashfsException("could not read '%s': %s" % (fn, e))
+
+        try:
+            self.superblock = SquashfsSuperblock(self._mm[: _superblock_fmt.size])
+        except SquashfsException:
+            self.close()
+            raise
+
+        self._decompress = _decompressor(self.superblock.compression)
+        self._blocks = {}
+        self._ids = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Close the image"""
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        if self._fd is not None:
+            self._fd.close()
+            self._fd = None
+
+    def _metadata_block(self, pos):
+        """Return (data, position of next block) for metadata block at pos"""
+        if pos in self._blocks:
+            return self._blocks[pos]
+
+        if pos < 0 or pos + 2 > len(self._mm):
+            raise SquashfsException("metadata block out of range")
+        hdr = struct.unpack_from("<H", self._mm, pos)[0]
+        size = hdr & ~SQUASHFS_COMPRESSED_BIT
+        start = pos + 2
+        if size == 0 or start + size > len(self._mm):
+            raise SquashfsException("metadata block out of range")
+
+        buf = self._mm[start : start + size]
+        if not hdr & SQUASHFS_COMPRESSED_BIT:
+            if self._decompress is None:
+                raise SquashfsUnsupportedException(
+                    "unsupported compression '%s'"
+                    % (self.superblock.compression_name or self.superblock.compression)
+                )
+            try:
+                buf = self._decompress(buf)
+            except Exception as e:
+                raise SquashfsException("could not decompress metadata: %s" % e)
+            if len(buf) > SQUASHFS_METADATA_SIZE:
+                raise SquashfsException("metadata block too large")
+
+        self._blocks[pos] = (buf, start + size)
+        return self._blocks[pos]
+
+    def _id(self, idx):
+        """Look up uid/gid by index in the id table"""
+        if self._ids is None:
+            sb = self.superblock
+            if sb.id_table_start + 8 > len(self._mm):
+                raise SquashfsException("id table out of range")
+            # the id table index points to the first metadata block and the
+            # remaining blocks follow it
+            first = struct.unpack_from("<Q", self._mm, sb.id_table_start)[0]
+            cursor = _MetadataCursor(self, first, 0)
+            self._ids = struct.unpack("<%dI" % sb.no_ids, cursor.read(4 * sb.no_ids))
+        if idx >= len(self._ids):
+            raise SquashfsException("id index %d out of range" % idx)
+        return self._ids[idx]
+
+    def _read_inode(self, ref):
+        """Read the inode referenced by ref"""
+        cursor = _MetadataCursor(
+            self, self.superblock.inode_table_start + (ref >> 16), ref & 0xFFFF
+        )
+        itype, mode, uid_idx, gid_idx, mtime, inode_number = cursor.unpack(
+            _inode_header_fmt
+        )
+        if itype not in squashfs_ftype:
+            raise SquashfsException("unknown inode type %d" % itype)
+
+        inode = {
+            "type": itype,
+            "mode": mode & 0o7777,
+            "uid": self._id(uid_idx),
+            "gid": self._id(gid_idx),
+            "mtime": mtime,
+            "data": 0,
+        }
+
+        if itype == SQUASHFS_DIR_TYPE:
+            start, _, size, offset, _ = cursor.unpack(struct.Struct("<IIHHI"))
+            inode.update({"data": size, "start": start, "offset": offset})
+        elif itype == SQUASHFS_LDIR_TYPE:
+            _, size, start, _, _, offset, _ = cursor.unpack(struct.Struct("<IIIIHHI"))
+            inode.update({"data": size, "start": start, "offset": offset})
+        elif itype == SQUASHFS_REG_TYPE:
+            inode["data"] = cursor.unpack(struct.Struct("<IIII"))[3]
+        elif itype == SQUASHFS_LREG_TYPE:
+            inode["data"] = cursor.unpack(struct.Struct("<QQ"))[1]
+        elif itype in [SQUASHFS_SYMLINK_TYPE, SQUASHFS_LSYMLINK_TYPE]:
+            (_, size) = cursor.unpack(struct.Struct("<II"))
+            inode["data"] = size
+            inode["symlink"] = _decode_name(cursor.read(size))
+        elif itype in [
+            SQUASHFS_BLKDEV_TYPE,
+            SQUASHFS_CHRDEV_TYPE,
+            SQUASHFS_LBLKDEV_TYPE,
+            SQUASHFS_LCHRDEV_TYPE,
+        ]:
+            inode["data"] = cursor.unpack(struct.Struct("<II"))[1]
+
+        return inode
+
+    def _read_dir(self, inode):
+        """Yield (name, inode reference) for each directory entry"""
+        # the directory size includes the (not stored) '.' and '..'
+        remaining = inode["data"] - 3
+        cursor = _MetadataCursor(
+            self,
+            self.superblock.directory_table_start + inode["start"],
+            inode["offset"],
+        )
+        while remaining > 0:
+            count, start, _ = cursor.unpack(_dir_header_fmt)
+            remaining -= _dir_header_fmt.size
+            for i in range(count + 1):
+                offset, _, _, size = cursor.unpack(_dir_entry_fmt)
+                name = cursor.read(size + 1)
+                remaining -= _dir_entry_fmt.size + size + 1
+                if b"/" in name or name in [b".", b".."]:
+                    raise SquashfsException("invalid directory entry %r" % name)
+                yield (_decode_name(name), (start << 16) | offset)
+
+    def walk(self):
+        """Yield (path, inode) for every entry in unsquashfs order. path is
+        relative to the image root ('' for the root itself)
+        """
+        if self._decompress is None:
+            raise SquashfsUnsupportedException(
+                "unsupported compression '%s'"
+                % (self.superblock.compression_name or self.superblock.compression)
+            )
+
+        seen = set()
+        stack = [("", self.superblock.root_inode)]
+        while len(stack) > 0:
+            (path, ref) = stack.pop()
+            inode = self._read_inode(ref)
+            yield (path, inode)
+
+            if squashfs_ftype[inode["type"]] != "d":
+                continue
+            if ref in seen:
+                raise SquashfsException("directory loop at '%s'" % path)
+            seen.add(ref)
+
+            children = []
+            for (name, child_ref) in self._read_dir(inode):
+                children.append((os.path.join(path, name), child_ref))
+            # depth-first, in directory order
+            stack += reversed(children)
+
+    def lln_entries(self):
+        """Yield (line, item) like unsquashfs_lln_parse() does"""
+        for (path, inode) in self.walk():
+            yield lln_entry(path, inode)
+
+
+def _decode_name(name):
+    """Decode a name the same way common.cmd() decodes unsquashfs output"""
+    return name.decode("ascii", "ignore")
+
+
+def _modestr(mode):
+    """ls-style mode string (without the file type)"""
+    perms = ""
+    for (r, w, x, special, on, off) in [
+        (stat.S_IRUSR, stat.S_IWUSR, stat.S_IXUSR, stat.S_ISUID, "s", "S"),
+        (stat.S_IRGRP, stat.S_IWGRP, stat.S_IXGRP, stat.S_ISGID, "s", "S"),
+        (stat.S_IROTH, stat.S_IWOTH, stat.S_IXOTH, stat.S_ISVTX, "t", "T"),
+    ]:
+        perms += "r" if mode & r else "-"
+        perms += "w" if mode & w else "-"
+        if mode & special:
+            perms += on if mode & x else off
+        else:
+            perms += "x" if mode & x else "-"
+    return perms
+
+
+def lln_entry(path, inode):
+    """Return (line, item) for inode like unsquashfs_lln_parse_line()"""
+    item = {}
+    ftype = squashfs_ftype[inode["type"]]
+
+    fname = "."
+    fname_full = SQUASHFS_ROOT
+    if path != "":
+        fname = "./%s" % path
+        fname_full = "%s/%s" % (SQUASHFS_ROOT, path)
+    if ftype == "l":
+        fname += " -> %s" % inode["symlink"]
+        fname_full += " -> %s" % inode["symlink"]
+
+    item[StatLLN.FILENAME] = fname
+    item[StatLLN.FULLNAME] = fname_full
+    item[StatLLN.FILETYPE] = ftype
+    item[StatLLN.MODE] = _modestr(inode["mode"])
+    item[StatLLN.UID] = str(inode["uid"])
+    item[StatLLN.GID] = str(inode["gid"])
+    item[StatLLN.OWNER] = "%s/%s" % (item[StatLLN.UID], item[StatLLN.GID])
+
+    # squashfs-tools/unsquashfs.c:print_filename()
+    padchars = 25 - len(item[StatLLN.UID]) - len(item[StatLLN.GID])
+    if ftype in ["b", "c"]:
+        # like unsquashfs, not new_decode_dev(), so minors above 255 are
+        # listed the same way
+        major = inode["data"] >> 8
+        minor = inode["data"] & 0xFF
+        item[StatLLN.MAJOR] = str(major)
+        item[StatLLN.MINOR] = str(minor)
+        size_str = "%*s%3d,%3d" % (max(padchars - 7, 0), " ", major, minor)
+    else:
+        item[StatLLN.SIZE] = str(inode["data"])
+        size_str = "%*d" % (max(padchars, 0), inode["data"])
+
+    t = time.localtime(inode["mtime"])
+    item[StatLLN.DATE] = time.strftime("%Y-%m-%d", t)
+    item[StatLLN.TIME] = time.strftime("%H:%M", t)
+
+    line = "%s%s %s %s %s %s %s" % (
+        ftype,
+        item[StatLLN.MODE],
+        item[StatLLN.OWNER],
+        size_str,
+        item[StatLLN.DATE],
+        item[StatLLN.TIME],
+        fname_full,
+    )
+
+    return (line, item)
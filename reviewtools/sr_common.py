@@ -15,19 +15,22 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from __future__ import print_function
+import copy
 import os
 import re
-import yaml
 
 
 from reviewtools.common import (
+    DuplicateYamlKeyError,
+    ProfileTimer,
     Review,
     ReviewException,
     error,
+    get_pkg_listing,
+    get_review_context,
+    get_snapd_base_declaration,
+    load_yaml,
     open_file_read,
-    read_snapd_base_declaration,
-    unsquashfs_lln,
-    unsquashfs_lln_parse,
     verify_type,
 )
 from reviewtools.overrides import interfaces_attribs_addons
@@ -40,6 +43,47 @@ class SnapReviewException(ReviewException):
     """This class represents SnapReview exceptions"""
 
 
+class SnapState(object):
+    """The state SnapReview.__init__() prepares from a snap: its parsed
+    snap.yaml and snap/manifest.yaml, the base declaration (with the
+    in-progress interfaces) and the known interfaces. It is computed once per
+    package and shared by the reviews with the same ReviewContext, so the
+    reviews must not modify it.
+    """
+
+    def __init__(
+        self,
+        raw_snap_yaml,
+        raw_manifest_yaml,
+        pkgname,
+        snap_yaml,
+        snap_manifest_yaml,
+        base_declaration_series,
+        base_declaration,
+        interfaces,
+    ):
+        self.raw_snap_yaml = raw_snap_yaml
+        self.raw_manifest_yaml = raw_manifest_yaml
+        # the per-snap overrides of the interfaces (see overrides.py) used
+        self.pkgname = pkgname
+        self.addons = copy.deepcopy(interfaces_attribs_addons.get(pkgname))
+        self.snap_yaml = snap_yaml
+        self.snap_manifest_yaml = snap_manifest_yaml
+        self.base_declaration_series = base_declaration_series
+        self.base_declaration = base_declaration
+        self.interfaces = interfaces
+
+    def is_for(self, raw_snap_yaml, raw_manifest_yaml):
+        """Check if this is the state of a snap with this snap.yaml and
+           snap/manifest.yaml (and the same per-snap overrides)
+        """
+        if raw_snap_yaml != self.raw_snap_yaml:
+            return False
+        if raw_manifest_yaml != self.raw_manifest_yaml:
+            return False
+        return interfaces_attribs_addons.get(self.pkgname) == self.addons
+
+
 class SnapReview(Review):
     """This class represents snap reviews"""
 
@@ -370,55 +414,130 @@ class SnapReview(Review):
 
     supported_compression_algorithms = ["xz", "lzo"]
 
-    def __init__(self, fn, review_type, overrides=None):
+    def __init__(self, fn, review_type, overrides=None, context=None):
         if review_type is None:  # for using utility functions
             return
-        Review.__init__(self, fn, review_type, overrides=overrides)
+        Review.__init__(self, fn, review_type, overrides=overrides, context=context)
 
         # Anything importing this is assumed to be a snap v2 check
         if not self.is_snap2:
             return
 
+        # the parsed snap.yaml, etc are the same for all the reviews of the
+        # package, so they are prepared once and shared via the context
         snap_yaml = self._extract_snap_yaml()
-        try:
-            self.snap_yaml = yaml.safe_load(snap_yaml)
-        except Exception:  # pragma: nocover
-            error("Could not load snap.yaml. Is it properly formatted?")
+        raw_snap_yaml = snap_yaml.read()
         snap_yaml.close()
+        raw_manifest_yaml = None
+        manifest_yaml = self._extract_snap_manifest_yaml()
+        if manifest_yaml is not None:
+            raw_manifest_yaml = manifest_yaml.read()
+            manifest_yaml.close()
 
-        # read yaml again for duplicated keys check (py-yaml does not
-        # do that)
-        snap_yaml = self._extract_snap_yaml()
+        state = self.context.snap_state
+        if state is None or not state.is_for(raw_snap_yaml, raw_manifest_yaml):
+            with ProfileTimer(self.timings, "prepare"):
+                state = self._prepare_snap_state(raw_snap_yaml, raw_manifest_yaml)
+            self.context.snap_state = state
+
+        self.snap_yaml = state.snap_yaml
+        self.snap_manifest_yaml = state.snap_manifest_yaml
+        self.base_declaration_series = state.base_declaration_series
+        self.base_declaration = state.base_declaration
+        self.interfaces = state.interfaces
+
+        if "architectures" in self.snap_yaml:
+            self.pkg_arch = self.snap_yaml["architectures"]
+        else:
+            self.pkg_arch = ["all"]
+
+        self.is_snap_gadget = False
+        if "type" in self.snap_yaml and self.snap_yaml["type"] == "gadget":
+            self.is_snap_gadget = True
+
+        # cache unsquashfs -lln so we can use it all over
+        self.unsquashfs_lln_hdr = None
+        self.unsquashfs_lln_entries = None
+        if self.needs in [None, "yaml"]:
+            return
+        with ProfileTimer(self.timings, "lln"):
+            (
+                self.unsquashfs_lln_hdr,
+                self.unsquashfs_lln_entries,
+            ) = self._unsquashfs_lln(fn)
+
+    def _prepare_snap_state(self, raw_snap_yaml, raw_manifest_yaml):
+        """Parse snap.yaml and snap/manifest.yaml and gather the interfaces
+           for the SnapState of the package
+        """
         try:
-            self._verify_no_duplicated_yaml_keys(snap_yaml.read())
-        except Exception as e:
+            snap_yaml = load_yaml(raw_snap_yaml)
+        except DuplicateYamlKeyError as e:
             error("Found duplicated yaml keys in snap.yaml: %s" % e)
-        snap_yaml.close()
+        except Exception:  # pragma: nocover
+            error("Could not load snap.yaml. Is it properly formatted?")
 
-        self.snap_manifest_yaml = {}
-        manifest_yaml = self._extract_snap_manifest_yaml()
-        if manifest_yaml is not None:
+        snap_manifest_yaml = {}
+        if raw_manifest_yaml is not None:
             try:
-                self.snap_manifest_yaml = yaml.safe_load(manifest_yaml)
-                manifest_yaml.close()
-                if self.snap_manifest_yaml is None:
-                    self.snap_manifest_yaml = {}
+                snap_manifest_yaml = load_yaml(
+                    raw_manifest_yaml, allow_duplicate_keys=True
+                )
+                if snap_manifest_yaml is None:
+                    snap_manifest_yaml = {}
             except Exception:  # pragma: nocover
                 error("Could not load snap/manifest.yaml. Is it properly " "formatted?")
 
-        (
-            self.base_declaration_series,
-            self.base_declaration,
-        ) = read_snapd_base_declaration()
+        bd = get_snapd_base_declaration()
+        base_declaration_series = bd.series
+        base_declaration = self._add_inprogress_interfaces(bd.series, bd.decl)
 
-        # Add in-progress interfaces
-        if self.base_declaration_series in self.inprogress_interfaces:
-            rel = self.base_declaration_series
+        # to simplify checks, gather up all the interfaces into one dict().
+        # This is per-package since the per-snap overrides are added to it
+        interfaces = dict()
+        for side in ["plugs", "slots"]:
+            for k in base_declaration[side]:
+                if k in self.interfaces_attribs:
+                    interfaces[k] = dict(self.interfaces_attribs[k])
+                else:
+                    interfaces[k] = {}
+
+        # now add in any per-snap overrides iff they don't already exist
+        pkgname = None
+        if "name" in snap_yaml and isinstance(snap_yaml["name"], str):
+            pkgname = snap_yaml["name"]
+        if pkgname is not None and pkgname in interfaces_attribs_addons:
+            for k in interfaces_attribs_addons[pkgname]:
+                if k in interfaces:
+                    for v in interfaces_attribs_addons[pkgname][k]:
+                        if v not in interfaces[k]:
+                            interfaces[k][v] = interfaces_attribs_addons[pkgname][
+                                k
+                            ][v]
+
+        self._set_snap_yaml_defaults(snap_yaml)
+
+        return SnapState(
+            raw_snap_yaml,
+            raw_manifest_yaml,
+            pkgname,
+            snap_yaml,
+            snap_manifest_yaml,
+            base_declaration_series,
+            base_declaration,
+            interfaces,
+        )
+
+    def _add_inprogress_interfaces(self, series, base_declaration):
+        """Return base_declaration of series with the in-progress interfaces
+           added. base_declaration is shared by everything in the process, so
+           it is copied before adding any
+        """
+        decl = base_declaration
+        if series in self.inprogress_interfaces:
+            rel = series
             for side in ["plugs", "slots"]:
-                if (
-                    side not in self.base_declaration
-                    or side not in self.inprogress_interfaces[rel]
-                ):
+                if side not in decl or side not in self.inprogress_interfaces[rel]:
                     continue
 
                 if side == "plugs":
@@ -427,51 +546,19 @@ class SnapReview(Review):
                     oside = "plugs"
 
                 for iface in self.inprogress_interfaces[rel][side]:
-                    if (
-                        iface in self.base_declaration[side]
-                        or iface in self.base_declaration[oside]
-                    ):
+                    if iface in decl[side] or iface in decl[oside]:
                         # don't override anything in the base declaration
                         continue
-                    self.base_declaration[side][iface] = self.inprogress_interfaces[
-                        rel
-                    ][side][iface]
-
-        # to simplify checks, gather up all the interfaces into one dict()
-        for side in ["plugs", "slots"]:
-            for k in self.base_declaration[side]:
-                if k in self.interfaces_attribs:
-                    self.interfaces[k] = self.interfaces_attribs[k]
-                else:
-                    self.interfaces[k] = {}
-
-        # now add in any per-snap overrides iff they don't already exist
-        if (
-            "name" in self.snap_yaml
-            and isinstance(self.snap_yaml["name"], str)
-            and self.snap_yaml["name"] in interfaces_attribs_addons
-        ):
-            pkgname = self.snap_yaml["name"]
-            for k in interfaces_attribs_addons[pkgname]:
-                if k in self.interfaces:
-                    for v in interfaces_attribs_addons[pkgname][k]:
-                        if v not in self.interfaces[k]:
-                            self.interfaces[k][v] = interfaces_attribs_addons[pkgname][
-                                k
-                            ][v]
+                    if decl is base_declaration:
+                        decl = copy.deepcopy(base_declaration)
+                    decl[side][iface] = self.inprogress_interfaces[rel][side][iface]
+        return decl
 
+    def _set_snap_yaml_defaults(self, snap_yaml):
+        """Set the defaults snapd uses in the parsed snap_yaml"""
         # default to 'app'
-        if "type" not in self.snap_yaml:
-            self.snap_yaml["type"] = "app"
-
-        if "architectures" in self.snap_yaml:
-            self.pkg_arch = self.snap_yaml["architectures"]
-        else:
-            self.pkg_arch = ["all"]
-
-        self.is_snap_gadget = False
-        if "type" in self.snap_yaml and self.snap_yaml["type"] == "gadget":
-            self.is_snap_gadget = True
+        if "type" not in snap_yaml:
+            snap_yaml["type"] = "app"
 
         # snapd understands:
         #   plugs:
@@ -479,19 +566,16 @@ class SnapReview(Review):
         # but yaml.safe_load() treats 'null' as 'None', but we need a {}, so
         # we need to account for that.
         for k in ["plugs", "slots"]:
-            if k not in self.snap_yaml:
+            if k not in snap_yaml:
                 continue
-            for iface in self.snap_yaml[k]:
-                if not isinstance(self.snap_yaml[k], dict):
+            for iface in snap_yaml[k]:
+                if not isinstance(snap_yaml[k], dict):
                     # eg, top-level "plugs: [ content ]"
                     error(
                         "Invalid top-level '%s' " "(not a dict)" % k
                     )  # pragma: nocover
-                if self.snap_yaml[k][iface] is None:
-                    self.snap_yaml[k][iface] = {}
-
-        # cache unsquashfs -lln so we can use it all over
-        self.unsquashfs_lln_hdr, self.unsquashfs_lln_entries = self._unsquashfs_lln(fn)
+                if snap_yaml[k][iface] is None:
+                    snap_yaml[k][iface] = {}
 
     # Since coverage is looked at via the testsuite and the testsuite mocks
     # this out, don't cover this
@@ -513,10 +597,11 @@ class SnapReview(Review):
 
     def _unsquashfs_lln(self, snap_pkg):
         """Run unsquashfs -lln on a snap package"""
-        (rc, out) = unsquashfs_lln(snap_pkg)
-        if rc != 0:
+        # shared with the uncompressed size check and the other modules
+        listing = get_pkg_listing(snap_pkg, self.context)
+        if listing.rc != 0:
             error("Could not unsquashfs -lln failed")
-        hdr, entries = unsquashfs_lln_parse(out)
+        hdr, entries = listing.parse()
         return hdr, entries
 
     # Since coverage is looked at via the testsuite and the testsuite mocks
@@ -619,13 +704,10 @@ class SnapReview(Review):
             return True
         return False
 
-    def _verify_no_duplicated_yaml_keys(self, raw_snap_yaml):
-        """Verify there are no duplicated yaml map keys"""
-        import ruamel.yaml
 
-        yaml = ruamel.yaml.YAML(typ="safe")
-        yaml.allow_duplicate_keys = False
-        try:
-            yaml.load(raw_snap_yaml)
-        except ruamel.yaml.constructor.DuplicateKeyError as e:
-            raise SnapReviewException(e.problem)
+def prepare_snap_state(fn, context=None):
+    """Prepare the SnapState of fn for the reviews with context, eg before
+       forking workers that review it
+    """
+    SnapReview(fn, "snap-review", context=context)
+    return get_review_context(context).snap_state
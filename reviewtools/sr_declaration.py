@@ -16,11 +16,24 @@
 
 from __future__ import print_function
 from reviewtools.sr_common import SnapReview, SnapReviewException
-from reviewtools.common import error, ReviewBase, read_snapd_base_declaration
+from reviewtools.common import (
+    check_metadata,
+    error,
+    ReviewBase,
+    get_snapd_base_declaration,
+)
 from reviewtools.overrides import sec_iface_ref_overrides
 import copy
 import re
 
+# the results of verifying the base declaration, since it is the same for
+# every review: (base declaration, {<review type>: <review report>})
+BASE_DECLARATION_VERIFIED = None
+
+# the compiled base declaration, since it is the same for every review (see
+# _get_compiled_decl())
+COMPILED_BASE_DECLARATION = None
+
 # Specification for snapd:
 # https://docs.google.com/document/d/1QkglVjSzHC65lPthXV3ZlQcqPpKxuGEBL-FMuGP6ogs/edit#
 #
@@ -86,7 +99,8 @@ import re
 #       syntax so this logic ensures that if a snap adds another attribute at
 #       some later point, it is flagged for review
 #   * the type of the attribute in the snap declaration means something
-#     different than the type in the snap.yaml (see _check_attrib())
+#     different than the type in the snap.yaml (see
+#     DeclarationAttribute.match())
 # * _check_snap_type() checks if the snap type in the snap matches the snap's
 #   type as specified in snap.yaml (defaulting to "app")
 # * _check_on_classic() checks "on-classic" for "app" snaps and will flag when:
@@ -121,14 +135,198 @@ class SnapDeclarationException(SnapReviewException):
     """This class represents SnapDeclaration exceptions"""
 
 
+class DeclarationAttribute(object):
+    """An attribute of plug-attributes/slot-attributes in a declaration
+       constraint (against), compiled for matching the attribute in the snap
+       (see match())
+    """
+
+    def __init__(self, against, rules_attrib):
+        self.against = against
+        self.special = False  # $PLUG(<rules_attrib>) or $SLOT(<rules_attrib>)
+        self.regex = None
+        # raised by match() when needed, so a malformed declaration fails
+        # for the same snaps as when not compiled
+        self.error = None
+
+        if not isinstance(against, str) or against == "$MISSING":
+            return
+        try:
+            if against.startswith("$"):
+                self.special = bool(
+                    re.search(r"^\$PLUG\(%s\)$" % rules_attrib, against)
+                    or re.search(r"^\$SLOT\(%s\)$" % rules_attrib, against)
+                )
+            else:
+                self.regex = re.compile(r"^(%s)$" % against)
+        except re.error as e:
+            self.error = e
+
+    def match(self, val):
+        """Return whether or not val (ie, the attribute in the snap) matches"""
+        if type(val) not in [str, list, dict, bool]:
+            raise SnapDeclarationException("unknown type '%s'" % val)
+
+        # Keep in mind by this point each OR constraint is being iterated
+        # through such that 'against' as a list is a nested list.
+        # For now, punt on nested lists since they are impractical in use
+        # since they are a list of OR options where one option must match
+        # all of val, but if you have that you may as well just use a
+        # string. Eg for this snap.yaml:
+        #   snap.yaml:
+        #     plugs:
+        #       foo:
+        #         bar: [ baz, norf ]
+        #
+        # a snap decl that uses a list for 'bar' might be:
+        #   snap decl:
+        #     foo:
+        #       plug-attributes:
+        #         bar:
+        #         - baz|norf
+        #         - something|else
+        #
+        # but, 'something|else' is pointless so it will never match, so the
+        # decl should be rewritten more simply as:
+        #   snap decl:
+        #     foo:
+        #       plug-attributes:
+        #         bar: baz|norf
+        # Importantly, the type of the attribute in the snap decl means
+        # something different than the type in snap.yaml
+        if isinstance(self.against, list):
+            raise SnapDeclarationException(
+                "attribute lists in the declaration not supported"
+            )
+
+        matched = False
+        if isinstance(val, str) and isinstance(self.against, str):
+            if self.error is not None:
+                raise self.error
+            elif self.against.startswith("$"):
+                if self.against == "$MISSING":
+                    matched = False  # value must not be set
+                elif self.special:
+                    matched = True
+                else:
+                    raise SnapDeclarationException(
+                        "unknown special attrib '%s'" % self.against
+                    )
+            elif self.regex.search(val):
+                matched = True
+        elif isinstance(val, list):
+            # if the attribute in the snap (val) is a list and the
+            # declaration value (against) is a string, then to match,
+            # against must be a regex that matches all entries in val
+            num_matched = 0
+            for i in val:
+                if self.match(i):
+                    num_matched += 1
+            if num_matched == len(val):
+                matched = True
+        else:  # bools and dicts (TODO: nested matches for dicts)
+            matched = self.against == val
+
+        return matched
+
+
+class DeclarationConstraint(object):
+    """A constraint of a base or snap declaration (ie, the rules of eg
+       'allow-connection' or of one of its alternatives), compiled on first
+       use for the _check_*() methods. The rules are shared and must not be
+       modified
+    """
+
+    def __init__(self, rules):
+        self.rules = rules
+        self.compiled_names = {}
+        self.compiled_attributes = {}
+
+    def names(self, rules_key):
+        """Return the compiled plug-names/slot-names (rules_key): a list of
+           '$INTERFACE', anchored regexes or the exception to raise for
+           the entry
+        """
+        if rules_key not in self.compiled_names:
+            names = []
+            for matcher in self.rules[rules_key]:
+                try:
+                    if not matcher.startswith("$"):
+                        names.append(re.compile(r"^(%s)$" % matcher))
+                    elif matcher == "$INTERFACE":
+                        names.append(matcher)
+                    else:
+                        raise SnapDeclarationException(
+                            "unknown special name '%s'" % matcher
+                        )
+                except Exception as e:
+                    names.append(e)
+            self.compiled_names[rules_key] = names
+        return self.compiled_names[rules_key]
+
+    def attribute(self, rules_key, rules_attrib):
+        """Return the compiled rules_attrib of plug-attributes/slot-attributes
+           (rules_key): a DeclarationAttribute or, for alternatives, a list of
+           them
+        """
+        key = (rules_key, rules_attrib)
+        if key not in self.compiled_attributes:
+            against = self.rules[rules_key][rules_attrib]
+            if isinstance(against, list):
+                compiled = [DeclarationAttribute(i, rules_attrib) for i in against]
+            else:
+                compiled = DeclarationAttribute(against, rules_attrib)
+            self.compiled_attributes[key] = compiled
+        return self.compiled_attributes[key]
+
+
+class CompiledDeclaration(object):
+    """A base or snap declaration compiled for evaluating its constraints
+       (see constraint()). The declaration is shared and must not be
+       modified
+    """
+
+    def __init__(self, decl):
+        self.decl = decl
+        # {id(<rules>): (<rules>, DeclarationConstraint)}. Keeping <rules>
+        # ensures its id is not reused
+        self.constraints = {}
+        # indexed on first use (see base_rules())
+        self.index = None
+
+    def base_rules(self, side, iface):
+        """Return (<rules>, <origin>) for the side of iface in the base
+           declaration or (None, None) (see index_base_declaration())
+        """
+        if self.index is None:
+            self.index = index_base_declaration(self.decl)
+        return self.index.get(iface, {}).get(side, (None, None))
+
+    def constraint(self, rules):
+        """Return the DeclarationConstraint for rules from decl"""
+        key = id(rules)
+        if key not in self.constraints:
+            self.constraints[key] = (rules, DeclarationConstraint(rules))
+        return self.constraints[key][1]
+
+
 class SnapReviewDeclaration(SnapReview):
     """This class represents snap declaration reviews"""
 
-    def __init__(self, fn, overrides=None):
-        SnapReview.__init__(self, fn, "declaration-snap-v2", overrides=overrides)
+    review_type = "declaration-snap-v2"
+
+    def __init__(self, fn, overrides=None, context=None):
+        SnapReview.__init__(
+            self, fn, self.review_type, overrides=overrides, context=context
+        )
 
-        self._verify_declaration(self.base_declaration, base=True)
+        _verify_base_declaration(self, self.base_declaration)
+        self._init_declaration_overrides(overrides)
 
+    def _init_declaration_overrides(self, overrides):
+        """Setup --on-store, --on-brand and the snap declaration from the
+           overrides
+        """
         self.on_store = None
         if overrides is not None and "snap_on_store" in overrides:
             if not isinstance(overrides["snap_on_store"], str):
@@ -161,6 +359,9 @@ class SnapReviewDeclaration(SnapReview):
         # filled in during check_constraints
         self.plug_slot_names_checked = {}
 
+        # compiled on first use (see _get_compiled_decl())
+        self.compiled_snap_declaration = None
+
     def _ensure_snap_declaration_defaults(self):
         """Ensure defaults are set for non-present keys in the snap
            declaration.
@@ -595,27 +796,38 @@ class SnapReviewDeclaration(SnapReview):
     def _get_decl(self, side, iface, snapDecl):
         """Obtain the declaration for the interface. When snapDecl is False,
            get the base declaration, falling back to slots as needed.
-           Returns (found decl, [snap|base]/[<side>|fallback])
+           Returns (found decl, [snap|base]/[<side>|fallback]). The found
+           decl is shared and must not be modified
         """
         if snapDecl:
             if iface in self.snap_declaration[side]:
-                return (
-                    copy.deepcopy(self.snap_declaration[side][iface]),
-                    "snap/%s" % side,
-                )
+                return (self.snap_declaration[side][iface], "snap/%s" % side)
             else:
                 return (None, None)
 
-        if iface in self.base_declaration[side]:
-            return (copy.deepcopy(self.base_declaration[side][iface]), "base/%s" % side)
-        elif iface in self.base_declaration["slots"]:
-            # Fallback to slots in the base declaration if nothing is in plugs
-            return (
-                copy.deepcopy(self.base_declaration["slots"][iface]),
-                "base/fallback",
-            )
+        return self._get_compiled_decl(False).base_rules(side, iface)
 
-        return (None, None)
+    def _get_compiled_decl(self, snapDecl):
+        """Obtain the CompiledDeclaration of the snap declaration (when
+           snapDecl is True) or of the base declaration
+        """
+        global COMPILED_BASE_DECLARATION
+        if snapDecl:
+            if (
+                self.compiled_snap_declaration is None
+                or self.compiled_snap_declaration.decl is not self.snap_declaration
+            ):
+                self.compiled_snap_declaration = CompiledDeclaration(
+                    self.snap_declaration
+                )
+            return self.compiled_snap_declaration
+
+        if (
+            COMPILED_BASE_DECLARATION is None
+            or COMPILED_BASE_DECLARATION.decl is not self.base_declaration
+        ):
+            COMPILED_BASE_DECLARATION = CompiledDeclaration(self.base_declaration)
+        return COMPILED_BASE_DECLARATION
 
     def _is_scoped(self, rules):
         """Return whether or not the specified rules are scoped to the snap as
@@ -745,30 +957,27 @@ class SnapReviewDeclaration(SnapReview):
 
     # func checkNameConstraints() in interfaces/policy/helpers.go and
     # func compileNameConstraints() in asserts/ifacedecls.go
-    def _check_names(self, side, iref, iface, rules, cstr):
+    def _check_names(self, side, iref, iface, constraint, cstr):
         """Check if there are any matching names for this side, interface,
-           rules and constraint. A matching name consists of:
+           compiled rules and constraint. A matching name consists of:
            - the interface reference (iref) matches a list entry regex
            - the interface reference (iref) matches the interface name
              when the list entry is $INTERFACE
         """
         matched = False
         checked = False
-        for rules_key in rules:
+        for rules_key in constraint.rules:
             if not rules_key == "%s-names" % side[:-1]:
                 continue
             checked = True
 
-            for matcher in rules[rules_key]:
-                if matcher.startswith("$"):
-                    if matcher == "$INTERFACE":
-                        if "interface" in iface and iref == iface["interface"]:
-                            matched = True
-                    else:
-                        raise SnapDeclarationException(
-                            "unknown special name '%s'" % matcher
-                        )
-                elif re.search(r"^(%s)$" % matcher, iref):
+            for matcher in constraint.names(rules_key):
+                if matcher == "$INTERFACE":
+                    if "interface" in iface and iref == iface["interface"]:
+                        matched = True
+                elif isinstance(matcher, Exception):
+                    raise matcher
+                elif matcher.search(iref):
                     matched = True
 
         if checked and (
@@ -782,80 +991,11 @@ class SnapReviewDeclaration(SnapReview):
 
         return (checked, None)
 
-    def _check_attributes(self, side, iface, rules, cstr, whence):
+    def _check_attributes(self, side, iface, constraint, cstr, whence):
         """Check if there are any matching attributes for this side, interface,
-           rules and constraint.
+           compiled rules and constraint.
         """
-
-        def _check_attrib(val, against, side, rules_attrib):
-            # val = iface[rules_attrib]
-            # against = rules[rules_key][rules_attrib]
-
-            if type(val) not in [str, list, dict, bool]:
-                raise SnapDeclarationException("unknown type '%s'" % val)
-
-            # Keep in mind by this point each OR constraint is being iterated
-            # through such that 'against' as a list is a nested list.
-            # For now, punt on nested lists since they are impractical in use
-            # since they are a list of OR options where one option must match
-            # all of val, but if you have that you may as well just use a
-            # string. Eg for this snap.yaml:
-            #   snap.yaml:
-            #     plugs:
-            #       foo:
-            #         bar: [ baz, norf ]
-            #
-            # a snap decl that uses a list for 'bar' might be:
-            #   snap decl:
-            #     foo:
-            #       plug-attributes:
-            #         bar:
-            #         - baz|norf
-            #         - something|else
-            #
-            # but, 'something|else' is pointless so it will never match, so the
-            # decl should be rewritten more simply as:
-            #   snap decl:
-            #     foo:
-            #       plug-attributes:
-            #         bar: baz|norf
-            # Importantly, the type of the attribute in the snap decl means
-            # something different than the type in snap.yaml
-            if isinstance(against, list):
-                raise SnapDeclarationException(
-                    "attribute lists in the declaration not supported"
-                )
-
-            matched = False
-            if isinstance(val, str) and isinstance(against, str):
-                if against.startswith("$"):
-                    if against == "$MISSING":
-                        matched = False  # value must not be set
-                    elif re.search(r"^\$PLUG\(%s\)$" % rules_attrib, against):
-                        matched = True
-                    elif re.search(r"^\$SLOT\(%s\)$" % rules_attrib, against):
-                        matched = True
-                    else:
-                        raise SnapDeclarationException(
-                            "unknown special attrib '%s'" % against
-                        )
-                elif re.search(r"^(%s)$" % against, val):
-                    matched = True
-            elif isinstance(val, list):
-                # if the attribute in the snap (val) is a list and the
-                # declaration value (against) is a string, then to match,
-                # against must be a regex that matches all entries in val
-                num_matched = 0
-                for i in val:
-                    if _check_attrib(i, against, side, rules_attrib):
-                        num_matched += 1
-                if num_matched == len(val):
-                    matched = True
-            else:  # bools and dicts (TODO: nested matches for dicts)
-                matched = against == val
-
-            return matched
-
+        rules = constraint.rules
         # If attributes are specified in the constraint, they all must match.
         matched = False
         checked = False
@@ -940,7 +1080,7 @@ class SnapReviewDeclaration(SnapReview):
                 if rules_attrib in iface:
                     checked = True
                     val = iface[rules_attrib]
-                    against = rules[rules_key][rules_attrib]
+                    against = constraint.attribute(rules_key, rules_attrib)
 
                     if isinstance(against, list):
                         # As a practical matter, if the attribute in the
@@ -948,11 +1088,11 @@ class SnapReviewDeclaration(SnapReview):
                         # considered a list of alternatives, aka, a list of
                         # OR constraints).
                         for i in against:
-                            if _check_attrib(val, i, side, rules_attrib):
+                            if i.match(val):
                                 attributes_matched[rules_key]["matched"] += 1
                                 break
                     else:
-                        if _check_attrib(val, against, side, rules_attrib):
+                        if against.match(val):
                             attributes_matched[rules_key]["matched"] += 1
                 else:
                     # when the attribute is missing from the interface don't
@@ -1090,8 +1230,9 @@ class SnapReviewDeclaration(SnapReview):
         return (checked, None)
 
     # based on, func check*Constraints1() in interfaces/policy/helpers.go
-    def _check_constraints1(self, side, iref, iface, rules, cstr, whence):
-        """Check one constraint"""
+    def _check_constraints1(self, side, iref, iface, constraint, cstr, whence):
+        """Check one compiled constraint"""
+        rules = constraint.rules
         if isinstance(rules, bool):
             # Don't flag connection constraints in the base/fallback in
             # plugging snaps when the constraint is boolean. Normally the
@@ -1111,7 +1252,7 @@ class SnapReviewDeclaration(SnapReview):
         tmp = []
         num_checked = 0
 
-        (checked, res) = self._check_names(side, iref, iface, rules, cstr)
+        (checked, res) = self._check_names(side, iref, iface, constraint, cstr)
         if checked:
             num_checked += 1
         else:
@@ -1127,7 +1268,9 @@ class SnapReviewDeclaration(SnapReview):
         if res is not None:
             tmp.append(res)
 
-        (checked, res) = self._check_attributes(side, iface, rules, cstr, whence)
+        (checked, res) = self._check_attributes(
+            side, iface, constraint, cstr, whence
+        )
         if checked:
             num_checked += 1
         if res is not None:
@@ -1184,8 +1327,10 @@ class SnapReviewDeclaration(SnapReview):
         return None
 
     # func check*Constraints() in interfaces/policy/helpers.go
-    def _check_constraints(self, side, iref, iface, rules, cstr, whence):
-        """Check alternate constraints"""
+    def _check_constraints(self, side, iref, iface, rules, cstr, whence, compiled):
+        """Check alternate constraints, compiled with compiled (a
+           CompiledDeclaration)
+        """
         if cstr not in rules:
             return None
 
@@ -1195,7 +1340,9 @@ class SnapReviewDeclaration(SnapReview):
         if cstr.startswith("allow"):
             # With allow, the first success is a match and we allow it
             for i in rules[cstr]:
-                res = self._check_constraints1(side, iref, iface, i, cstr, whence)
+                res = self._check_constraints1(
+                    side, iref, iface, compiled.constraint(i), cstr, whence
+                )
                 if res is None:
                     return res
 
@@ -1206,22 +1353,24 @@ class SnapReviewDeclaration(SnapReview):
         else:
             # With deny, the first failure is a match and we deny it
             for i in rules[cstr]:
-                res = self._check_constraints1(side, iref, iface, i, cstr, whence)
+                res = self._check_constraints1(
+                    side, iref, iface, compiled.constraint(i), cstr, whence
+                )
                 if res is not None:
                     return res
 
             return None
 
-    def _check_rule(self, side, iref, iface, rules, cstr_type, whence):
+    def _check_rule(self, side, iref, iface, rules, cstr_type, whence, compiled):
         """Check any constraints for this set of rules"""
         res = self._check_constraints(
-            side, iref, iface, rules, "deny-%s" % cstr_type, whence
+            side, iref, iface, rules, "deny-%s" % cstr_type, whence, compiled
         )
         if res is not None:
             return res
 
         res = self._check_constraints(
-            side, iref, iface, rules, "allow-%s" % cstr_type, whence
+            side, iref, iface, rules, "allow-%s" % cstr_type, whence, compiled
         )
         if res is not None:
             return res
@@ -1250,12 +1399,28 @@ class SnapReviewDeclaration(SnapReview):
             # to the snap. If we have no scoped rules, then it is as if the
             # snap decl wasn't specified for this constraint
             if scoped and rules is not None:
-                return self._check_rule(side, iref, iface, rules, cstr_type, whence)
+                return self._check_rule(
+                    side,
+                    iref,
+                    iface,
+                    rules,
+                    cstr_type,
+                    whence,
+                    self._get_compiled_decl(True),
+                )
 
         (decl, whence) = self._get_decl(side, iface["interface"], False)
         (rules, scoped) = self._get_rules(decl, cstr_type)
         if rules is not None:
-            return self._check_rule(side, iref, iface, rules, cstr_type, whence)
+            return self._check_rule(
+                side,
+                iref,
+                iface,
+                rules,
+                cstr_type,
+                whence,
+                self._get_compiled_decl(False),
+            )
 
         # unreachable: the base declaration will have something for all
         # existing interfaces, and nonexistence tests are done elsewhere
@@ -1266,7 +1431,7 @@ class SnapReviewDeclaration(SnapReview):
         """Check for any installation constraints"""
         iface = {}
         if attribs is not None:
-            iface = copy.deepcopy(attribs)
+            iface = copy.copy(attribs)
         iface["interface"] = iname
 
         if side == "slots":
@@ -1286,7 +1451,7 @@ class SnapReviewDeclaration(SnapReview):
         """Check for any connecttion constraints"""
         iface = {}
         if attribs is not None:
-            iface = copy.deepcopy(attribs)
+            iface = copy.copy(attribs)
         iface["interface"] = iname
 
         if side == "slots":
@@ -1357,6 +1522,7 @@ class SnapReviewDeclaration(SnapReview):
             s = "OK"
             self._add_result(t, n, s)
 
+    @check_metadata(needs="yaml")
     def check_declaration(self):
         """Check base/snap declaration requires manual review for top-level
            plugs/slots
@@ -1372,7 +1538,8 @@ class SnapReviewDeclaration(SnapReview):
                 interface = iface
                 attribs = None
 
-                spec = copy.deepcopy(self.snap_yaml[side][iface])
+                # only the copy is modified (the attributes are shared)
+                spec = copy.copy(self.snap_yaml[side][iface])
                 if isinstance(spec, str):
                     # Abbreviated syntax (no attributes)
                     # <plugs|slots>:
@@ -1423,12 +1590,14 @@ class SnapReviewDeclaration(SnapReview):
 
                     self._verify_iface("%s_%s" % (key[:-1], side[:-1]), app, ref)
 
+    @check_metadata(needs="yaml")
     def check_declaration_apps(self):
         """Check base/snap declaration requires manual review for apps
            plugs/slots
         """
         self._verify_declaration_apps_hooks("apps")
 
+    @check_metadata(needs="yaml")
     def check_declaration_hooks(self):
         """Check base/snap declaration requires manual review for hooks
            plugs/slots
@@ -1436,9 +1605,80 @@ class SnapReviewDeclaration(SnapReview):
         self._verify_declaration_apps_hooks("hooks")
 
 
+class DeclarationEvaluator(SnapReviewDeclaration):
+    """This class evaluates the installation and connection constraints of
+       the base and snap declarations for a parsed snap.yaml, without a
+       package (see evaluate_snap_declaration())
+    """
+
+    def __init__(self, snap_yaml, compiled_base, overrides=None):
+        ReviewBase.__init__(self, self.review_type, overrides=overrides)
+        self._set_snap_yaml_defaults(snap_yaml)
+        self.snap_yaml = snap_yaml
+        self.base_declaration = compiled_base.decl
+        self.compiled_base_declaration = compiled_base
+        self._init_declaration_overrides(overrides)
+
+    def _get_compiled_decl(self, snapDecl):
+        """Obtain the CompiledDeclaration of the snap declaration (when
+           snapDecl is True) or the one of the base declaration given
+        """
+        if snapDecl:
+            return SnapReviewDeclaration._get_compiled_decl(self, snapDecl)
+        return self.compiled_base_declaration
+
+
 #
 # Helper functions
 #
+def index_base_declaration(decl):
+    """Return {<iface>: {<side>: (<rules>, <origin>)}} for the base
+       declaration where origin is 'base/<side>' or, for plugs that are only
+       declared with slots, 'base/fallback'
+    """
+    index = {}
+    for side in ["plugs", "slots"]:
+        for iface in decl.get(side, {}):
+            index[iface] = {}
+    for iface in index:
+        for side in ["plugs", "slots"]:
+            if iface in decl.get(side, {}):
+                index[iface][side] = (decl[side][iface], "base/%s" % side)
+            elif iface in decl.get("slots", {}):
+                # fallback to slots if nothing is in plugs
+                index[iface][side] = (decl["slots"][iface], "base/fallback")
+    return index
+
+
+def _verify_base_declaration(review, base_decl):
+    """Verify the base declaration for review like
+       review._verify_declaration(base_decl, base=True) does, but only once
+       per review type for the same base_decl (which must not be modified),
+       and add the results to review
+    """
+    global BASE_DECLARATION_VERIFIED
+    if (
+        BASE_DECLARATION_VERIFIED is None
+        or BASE_DECLARATION_VERIFIED[0] is not base_decl
+    ):
+        BASE_DECLARATION_VERIFIED = (base_decl, {})
+    verified = BASE_DECLARATION_VERIFIED[1]
+
+    if review.review_type not in verified:
+        tmp = ReviewBase(review.review_type)
+        tmp.interfaces_attribs = review.interfaces_attribs
+        tmp.valid_snap_types = review.valid_snap_types
+        SnapReviewDeclaration._verify_declaration(tmp, base_decl, base=True)
+        verified[review.review_type] = tmp.review_report
+
+    report = verified[review.review_type]
+    for result_type in report:
+        for name in report[result_type]:
+            if name not in review.review_report[result_type]:
+                review.review_report[result_type][name] = dict()
+            review.review_report[result_type][name].update(report[result_type][name])
+
+
 def verify_snap_declaration(snap_decl, base_decl=None):
     """Perform a review on the snap declaration. Returns a Review object"""
     review = ReviewBase("snap-declaration-verify_v2")
@@ -1449,9 +1689,9 @@ def verify_snap_declaration(snap_decl, base_decl=None):
 
     # Read in and verify the base declaration
     if base_decl is None:
-        base_decl_series, base_decl = read_snapd_base_declaration()
+        base_decl = get_snapd_base_declaration().decl
     try:
-        SnapReviewDeclaration._verify_declaration(review, base_decl, base=True)
+        _verify_base_declaration(review, base_decl)
     except Exception as e:  # pragma: nocover
         error("_verify_declaration() raised exception for base decl: %s" % e)
 
@@ -1478,3 +1718,16 @@ def verify_snap_declaration(snap_decl, base_decl=None):
         error("_verify_declaration() raised exception for snap decl: %s" % e)
 
     return review
+
+
+def evaluate_snap_declaration(snap_yaml, compiled_base, overrides=None):
+    """Evaluate the base declaration (a CompiledDeclaration) and the snap
+       declaration from overrides (see SnapReviewDeclaration) for the parsed
+       snap_yaml, which gets the snapd defaults. Returns a Review object with
+       the results of the declaration checks
+    """
+    review = DeclarationEvaluator(snap_yaml, compiled_base, overrides=overrides)
+    review.check_declaration()
+    review.check_declaration_apps()
+    review.check_declaration_hooks()
+    return review
@@ -16,7 +16,9 @@
 
 from __future__ import print_function
 from reviewtools.sr_common import SnapReview
-from reviewtools.common import StatLLN, cmd
+from reviewtools.analysis_cache import cached_analyses, cached_analysis
+from reviewtools.common import StatLLN, check_metadata
+from reviewtools.elf import get_dynamic_symbols, get_symbols_abi, has_execstack
 from reviewtools.overrides import (
     func_execstack_overrides,
     func_execstack_skipped_pats,
@@ -25,6 +27,7 @@ from reviewtools.overrides import (
     func_base_state_files_snaps_overrides,
     redflagged_snap_types_overrides,
 )
+import concurrent.futures
 from datetime import datetime
 import copy
 import os
@@ -34,9 +37,12 @@ import re
 class SnapReviewFunctional(SnapReview):
     """This class represents snap functional reviews"""
 
-    def __init__(self, fn, overrides=None):
-        SnapReview.__init__(self, fn, "functional-snap-v2", overrides=overrides)
-        self._list_all_compiled_binaries()
+    review_type = "functional-snap-v2"
+
+    def __init__(self, fn, overrides=None, context=None):
+        SnapReview.__init__(
+            self, fn, self.review_type, overrides=overrides, context=context
+        )
 
         # State files only for base snaps, if have -lln output and
         # --state-output is specified
@@ -53,6 +59,7 @@ class SnapReviewFunctional(SnapReview):
             )
             and self.unsquashfs_lln_entries is not None
             and "state_output" in self.overrides
+            and self.is_check_selected("check_state_base_files")
         ):
             # if the name of this changes, then this field in the last state
             # input file won't match and all previous state will be ignored
@@ -60,14 +67,26 @@ class SnapReviewFunctional(SnapReview):
                 "state_files", extra=",".join(sorted(self.pkg_arch))
             )
 
-            # read in current state
+            # read in current state, with the symbols of all the shared
+            # libraries read in one batch
+            all_symbols = self._find_all_symbols(
+                [
+                    item[StatLLN.FILENAME]
+                    for (line, item) in self.unsquashfs_lln_entries
+                    if item is not None
+                    and ".so" in os.path.basename(item[StatLLN.FILENAME])
+                ]
+            )
             self.curr_state = {}
             for (line, item) in self.unsquashfs_lln_entries:
                 if item is None:
                     continue
 
                 if ".so" in os.path.basename(item[StatLLN.FILENAME]):
-                    symbols = self._find_symbols(item[StatLLN.FILENAME])
+                    # the listing is shared with the other modules, so don't
+                    # modify it
+                    item = copy.copy(item)
+                    symbols = all_symbols.get(item[StatLLN.FILENAME])
                     if symbols is not None:
                         item["symbols"] = symbols
 
@@ -85,34 +104,29 @@ class SnapReviewFunctional(SnapReview):
                     self.overrides["state_input"][self.state_key]
                 )
 
-    def _cmd_nm(self, args):  # pragma: nocover
-        """_cmd_nm indirection for unittests"""
-        real_path = os.path.join(self.unpack_dir, args[-1])
-        if real_path not in self.pkg_bin_files:
-            return -1, ""
-        args[-1] = real_path
-
-        return cmd(["nm"] + args)
-
-    def _find_symbols(self, fn):
-        """Find the ABI for the list of files"""
-        if not fn.startswith("./"):
-            return None
-
-        symbols = {}
-        nm_args = [
-            "--format=bsd",
-            "--dynamic",
-            "--demangle",
-            "--defined-only",
-            "--with-symbol-versions",
-            fn[2:],
-        ]
-        # --format=bsd: explicitly use the bsd format
-        # --dynamic: only care about shared libraries
-        # --demangle: demangle symbols
-        # --defined-only: only show defined symbols
-        # --with-symbol-versions: also show the symbols version
+    def _get_dynamic_symbols(self, fns):  # pragma: nocover
+        """_get_dynamic_symbols indirection for unittests"""
+        bin_files = set(self.pkg_bin_files)
+        real_paths = {}
+        for fn in fns:
+            real_path = os.path.join(self.unpack_dir, fn[2:])
+            if real_path in bin_files:
+                real_paths[fn] = real_path
+
+        dynsyms = cached_analyses(
+            list(real_paths.values()), "symbols", get_dynamic_symbols
+        )
+        return dict((fn, dynsyms.get(real_paths.get(fn))) for fn in fns)
+
+    def _find_all_symbols(self, fns):
+        """Find the ABI for the list of files (as in the unsquashfs -lln
+           output). Files that aren't shared libraries map to None.
+        """
+        symbols = dict((fn, None) for fn in fns)
+        # The symbols are read from .dynsym, .gnu.version and .gnu.version_d
+        # and are what this reports:
+        # nm --format=bsd --dynamic --demangle --defined-only \
+        #    --with-symbol-versions
         #
         # Format:
         # 000000000000089a T gtk_show_uri@@Base
@@ -123,38 +137,17 @@ class SnapReviewFunctional(SnapReview):
         #  --------------------------------> address
         #
         # see 'man nm'
-        rc, report = self._cmd_nm(nm_args)
-        if rc != 0:
-            return None
-
-        for line in report.splitlines():
-            tmp = line.split(maxsplit=2)
-            if len(tmp) < 3:
-                continue
-            symbol_type = tmp[1]
-            symbol = tmp[2]
-            symbol_version = ""
-            idx = tmp[2].find("@")
-            if idx > 1:
-                symbol = tmp[2][:idx]
-                symbol_version = tmp[2][idx:]
-
-            # quick check if global symbols (uppercase and special global 'u',
-            # 'v', 'w' (note, --defined-only should remove u, v and w))
-            if symbol_type.isupper() or symbol_type in ["u", "v", "w"]:
-                # skipped symbols:
-                # * N - debugging
-                # * U - undefined (note, --defined-only should handle this)
-                if symbol_type not in ["N", "U"]:
-                    if symbol not in symbols:
-                        symbols[symbol] = {
-                            "type": symbol_type,
-                            "version": symbol_version,
-                        }
+        dynsyms = self._get_dynamic_symbols([fn for fn in fns if fn.startswith("./")])
+        for fn in dynsyms:
+            if dynsyms[fn] is not None:
+                symbols[fn] = get_symbols_abi(dynsyms[fn])
                 # ???: filter out @@GLIBC_PRIVATE?
-
         return symbols
 
+    def _find_symbols(self, fn):
+        """Find the ABI for the file"""
+        return self._find_all_symbols([fn])[fn]
+
     def _serialize(self, state):
         """Serialize a review-tools state"""
 
@@ -269,6 +262,7 @@ class SnapReviewFunctional(SnapReview):
                 return True
         return False
 
+    @check_metadata(cost="expensive", needs="binaries")
     def check_execstack(self):
         """Check execstack"""
         # core snap is known to have these due to klibc. Executable stack
@@ -276,33 +270,31 @@ class SnapReviewFunctional(SnapReview):
         if self.snap_yaml["type"] != "app":
             return
 
-        def has_execstack(fn):
-            (rc, out) = cmd(["execstack", "-q", fn])
-            if rc != 0:
-                return False
-
-            if out.startswith("X "):
-                return True
-            return False
-
         t = "info"
         n = self._get_check_name("execstack")
         s = "OK"
         link = None
         bins = []
 
-        # execstack not supported on arm64, so skip this check on arm64
-        if "SNAP_ARCH" in os.environ and os.environ["SNAP_ARCH"] == "arm64":
-            s = "OK (skipped on %s)" % os.environ["SNAP_ARCH"]
-            self._add_result(t, n, s, link=link)
-            return
-
         skipped_pats = []
         for p in func_execstack_skipped_pats:
             skipped_pats.append(re.compile(r"%s" % p))
 
-        for i in self.pkg_bin_files:
-            if has_execstack(i) and not self._in_patterns(skipped_pats, i):
+        # read the PT_GNU_STACK program headers directly rather than running
+        # 'execstack -q' for each binary
+        with concurrent.futures.ThreadPoolExecutor() as executor:
+            # reading the ELF header is cheaper than hashing the file
+            found = list(
+                executor.map(
+                    lambda fn: cached_analysis(
+                        fn, "execstack", has_execstack, hash_file=False
+                    ),
+                    self.pkg_bin_files,
+                )
+            )
+
+        for (i, execstack) in zip(self.pkg_bin_files, found):
+            if execstack and not self._in_patterns(skipped_pats, i):
                 bins.append(os.path.relpath(i, self.unpack_dir))
 
         if len(bins) > 0:
@@ -327,6 +319,7 @@ class SnapReviewFunctional(SnapReview):
 
         self._add_result(t, n, s, link=link)
 
+    @check_metadata(cost="cheap")
     def check_base_mountpoints(self):
         """Verify base snap has all the expected mountpoints"""
         if self.snap_yaml["type"] != "base":
@@ -337,6 +330,7 @@ class SnapReviewFunctional(SnapReview):
         s = "OK"
         missing = []
 
+        self._unpack_all()
         for i in self.base_required_dirs:
             # self.base_required_dirs are absolute paths
             mp = os.path.join(self.unpack_dir, i[1:])
@@ -352,6 +346,7 @@ class SnapReviewFunctional(SnapReview):
                 s += " (overridden)"
         self._add_result(t, n, s)
 
+    @check_metadata(needs="binaries")
     def check_state_base_files(self):
         """Verify base snap has the expected files"""
         # Don't check state if not a base snap or the "core" os snap (which
@@ -17,6 +17,7 @@
 from __future__ import print_function
 from reviewtools.sr_common import SnapReview
 from reviewtools.common import (
+    check_metadata,
     find_external_symlinks,
     STORE_PKGNAME_SNAPV2_MAXLEN,
     STORE_PKGNAME_SNAPV2_MINLEN,
@@ -38,9 +39,13 @@ import unicodedata
 class SnapReviewLint(SnapReview):
     """This class represents snap lint reviews"""
 
-    def __init__(self, fn, overrides=None):
+    review_type = "lint-snap-v2"
+
+    def __init__(self, fn, overrides=None, context=None):
         """Set up the class."""
-        SnapReview.__init__(self, fn, "lint-snap-v2", overrides=overrides)
+        SnapReview.__init__(
+            self, fn, self.review_type, overrides=overrides, context=context
+        )
         self.valid_architectures = ["all"] + self.valid_compiled_architectures
         self.vcs_files = [
             ".bzr*",
@@ -55,12 +60,11 @@ class SnapReviewLint(SnapReview):
         ]
         self.iffy_files = [r"^\..+\.swp$"]  # vim
 
-        self._list_all_compiled_binaries()
-
         self.redflagged_snap_types = ["base", "kernel", "gadget", "os", "snapd"]
 
         self.interface_plug_requires_desktop_file = ["unity7", "x11", "unity8"]
 
+    @check_metadata(cost="cheap", needs="yaml")
     def check_architectures(self):
         """Check architectures in snap.yaml is valid"""
         t = "info"
@@ -89,6 +93,7 @@ class SnapReviewLint(SnapReview):
                     s = "invalid multi architecture: %s" % ",".join(bad_archs)
         self._add_result(t, n, s)
 
+    @check_metadata(cost="cheap", needs="yaml")
     def check_assumes(self):
         """Check assumes in snap.yaml is valid"""
         t = "info"
@@ -144,21 +149,25 @@ class SnapReviewLint(SnapReview):
             s = "%s is too long (> %d): '%s'" % (key, maxlen, self.snap_yaml[key])
         self._add_result(t, n, s)
 
+    @check_metadata(cost="cheap", needs="yaml")
     def check_description(self):
         """Check description"""
         # snap/validate.go
         self._check_description_summary_title("description", 4096)
 
+    @check_metadata(cost="cheap", needs="yaml")
     def check_summary(self):
         """Check summary"""
         # should mirror the store, which is currently 128
         self._check_description_summary_title("summary", 128)
 
+    @check_metadata(cost="cheap", needs="yaml")
     def check_title(self):
         """Check title"""
         # snap/validate.go
         self._check_description_summary_title("title", 40)
 
+    @check_metadata(cost="cheap", needs="yaml")
     def check_name(self):
         """Check package name"""
         t = "info"
@@ -192,6 +201,7 @@ class SnapReviewLint(SnapReview):
             )
         self._add_result(t, n, s)
 
+    @check_metadata(cost="cheap", needs="yaml")
     def check_type(self):
         """Check type"""
         t = "info"
@@ -202,6 +212,7 @@ class SnapReviewLint(SnapReview):
             s = "unknown 'type': '%s'" % self.snap_yaml["type"]
         self._add_result(t, n, s)
 
+    @check_metadata(cost="cheap", needs="yaml")
     def check_type_redflagged(self):
         """Check if type is redflagged"""
         t = "info"
@@ -222,6 +233,7 @@ class SnapReviewLint(SnapReview):
                 manual_review = True
         self._add_result(t, n, s, manual_review=manual_review)
 
+    @check_metadata(cost="cheap", needs="yaml")
     def check_version(self):
         """Check package version"""
         t = "info"
@@ -244,6 +256,7 @@ class SnapReviewLint(SnapReview):
             s = "malformed 'version': '%s'" % self.snap_yaml["version"]
         self._add_result(t, n, s)
 
+    @check_metadata(cost="cheap")
     def check_valid_hook(self):
         """Check valid hook"""
         hooks = glob.glob("%s/meta/hooks/*" % self._get_unpack_dir())
@@ -281,6 +294,7 @@ class SnapReviewLint(SnapReview):
             link = "https://forum.snapcraft.io/t/supported-snap-hooks/3795"
         self._add_result(t, n, s, link=link)
 
+    @check_metadata(cost="cheap")
     def check_icon(self):
         """Check icon"""
         # see docs/meta.md and docs/gadget.md
@@ -339,6 +353,7 @@ class SnapReviewLint(SnapReview):
             s = "icon entry '%s' does not exist" % self.snap_yaml["icon"]
         self._add_result(t, n, s)
 
+    @check_metadata(cost="cheap", needs="yaml")
     def check_links(self):
         """Check links"""
         t = "info"
@@ -411,6 +426,7 @@ class SnapReviewLint(SnapReview):
                     self._add_result(t, n, s, manual_review=True)
                     return
 
+    @check_metadata(cost="cheap", needs="yaml")
     def check_unknown_entries(self):
         """Check for any unknown fields"""
         t = "info"
@@ -510,10 +526,12 @@ class SnapReviewLint(SnapReview):
                 )
             self._add_result(t, n, s)
 
+    @check_metadata(cost="cheap", needs="yaml")
     def check_apps(self):
         """Check apps"""
         self._verify_apps_and_hooks()
 
+    @check_metadata(cost="cheap", needs="yaml")
     def check_hooks(self):
         """Check hooks"""
         self._verify_apps_and_hooks(hook=True)
@@ -557,6 +575,7 @@ class SnapReviewLint(SnapReview):
                 s = "%s does not exist" % (self.snap_yaml["apps"][app][key])
         self._add_result(t, n, s)
 
+    @check_metadata(cost="cheap")
     def check_apps_command(self):
         """Check apps - command"""
         if "apps" not in self.snap_yaml:
@@ -635,6 +654,7 @@ class SnapReviewLint(SnapReview):
 
             self._add_result(t, n, s)
 
+    @check_metadata(cost="cheap")
     def check_apps_command_chain(self):
         """Check apps - command-chain"""
         if "apps" not in self.snap_yaml:
@@ -647,6 +667,7 @@ class SnapReviewLint(SnapReview):
                 continue
             self._verify_apps_hooks_command_chain(key, app)
 
+    @check_metadata(cost="cheap")
     def check_hooks_command_chain(self):
         """Check hooks - command-chain"""
         if "hooks" not in self.snap_yaml:
@@ -659,6 +680,7 @@ class SnapReviewLint(SnapReview):
                 continue
             self._verify_apps_hooks_command_chain(key, hook, hook=True)
 
+    @check_metadata(cost="cheap")
     def check_apps_reload_command(self):
         """Check apps - reload-command"""
         if "apps" not in self.snap_yaml:
@@ -672,6 +694,7 @@ class SnapReviewLint(SnapReview):
 
             self._verify_value_is_file(app, key, True)
 
+    @check_metadata(cost="cheap")
     def check_apps_stop_command(self):
         """Check apps - stop-command"""
         if "apps" not in self.snap_yaml:
@@ -685,6 +708,7 @@ class SnapReviewLint(SnapReview):
 
             self._verify_value_is_file(app, key, True)
 
+    @check_metadata(cost="cheap")
     def check_apps_post_stop_command(self):
         """Check apps - post-stop-command"""
         if "apps" not in self.snap_yaml:
@@ -734,6 +758,7 @@ class SnapReviewLint(SnapReview):
             )
         self._add_result(t, n, s)
 
+    @check_metadata(cost="cheap", needs="yaml")
     def check_apps_restart_delay(self):
         """Check apps - restart-delay"""
         if "apps" not in self.snap_yaml:
@@ -747,6 +772,7 @@ class SnapReviewLint(SnapReview):
 
             self._verify_timeout(app, key)
 
+    @check_metadata(cost="cheap", needs="yaml")
     def check_apps_start_timeout(self):
         """Check apps - start-timeout"""
         if "apps" not in self.snap_yaml:
@@ -760,6 +786,7 @@ class SnapReviewLint(SnapReview):
 
             self._verify_timeout(app, key)
 
+    @check_metadata(cost="cheap", needs="yaml")
     def check_apps_stop_timeout(self):
         """Check apps - stop-timeout"""
         if "apps" not in self.snap_yaml:
@@ -773,6 +800,7 @@ class SnapReviewLint(SnapReview):
 
             self._verify_timeout(app, key)
 
+    @check_metadata(cost="cheap", needs="yaml")
     def check_apps_watchdog_timeout(self):
         """Check apps - watchdog-timeout"""
         if "apps" not in self.snap_yaml:
@@ -804,6 +832,7 @@ class SnapReviewLint(SnapReview):
             s = "invalid %s: '%s'" % (key, self.snap_yaml["apps"][app][key])
         self._add_result(t, n, s)
 
+    @check_metadata(cost="cheap", needs="yaml")
     def check_apps_daemon(self):
         """Check apps - daemon"""
         if "apps" not in self.snap_yaml:
@@ -819,6 +848,7 @@ class SnapReviewLint(SnapReview):
 
             self._verify_valid_values(app, key, valid)
 
+    @check_metadata(cost="cheap", needs="yaml")
     def check_apps_daemon_scope(self):
         """Check apps - daemon-scope"""
         if "apps" not in self.snap_yaml:
@@ -834,6 +864,7 @@ class SnapReviewLint(SnapReview):
 
             self._verify_valid_values(app, key, valid)
 
+    @check_metadata(cost="cheap", needs="yaml")
     def check_apps_invalid_combinations(self):
         """Check apps - invalid combinations"""
         if "apps" not in self.snap_yaml:
@@ -1015,6 +1046,7 @@ class SnapReviewLint(SnapReview):
                 s = "'activatable: true' should be used with 'daemon: dbus'"
             self._add_result(t, n, s)
 
+    @check_metadata(cost="cheap", needs="yaml")
     def check_apps_restart_condition(self):
         """Check apps - restart-condition"""
         if "apps" not in self.snap_yaml:
@@ -1037,6 +1069,7 @@ class SnapReviewLint(SnapReview):
 
             self._verify_valid_values(app, key, valid)
 
+    @check_metadata(cost="cheap", needs="yaml")
     def check_apps_ports(self):
         """Check apps - ports"""
         if "apps" not in self.snap_yaml:
@@ -1303,6 +1336,7 @@ class SnapReviewLint(SnapReview):
 
         self._verify_conflicting_ifaces(iface_type, ifaces)
 
+    @check_metadata(cost="cheap", needs="yaml")
     def check_plugs(self):
         """Check plugs"""
         iface_type = "plugs"
@@ -1367,6 +1401,7 @@ class SnapReviewLint(SnapReview):
 
         self._verify_conflicting_ifaces(key, ifaces)
 
+    @check_metadata(cost="cheap", needs="yaml")
     def check_apps_plugs(self):
         """Check apps plugs"""
         if "apps" not in self.snap_yaml:
@@ -1379,6 +1414,7 @@ class SnapReviewLint(SnapReview):
 
             self._verify_app_and_hook_interfaces(app, key)
 
+    @check_metadata(cost="cheap", needs="yaml")
     def check_hooks_plugs(self):
         """Check hooks plugs"""
         if "hooks" not in self.snap_yaml:
@@ -1394,6 +1430,7 @@ class SnapReviewLint(SnapReview):
 
             self._verify_app_and_hook_interfaces(hook, key, hook=True)
 
+    @check_metadata(cost="cheap", needs="yaml")
     def check_slots(self):
         """Check slots"""
         iface_type = "slots"
@@ -1402,6 +1439,7 @@ class SnapReviewLint(SnapReview):
 
         self._verify_interfaces(iface_type)
 
+    @check_metadata(cost="cheap", needs="yaml")
     def check_apps_slots(self):
         """Check apps slots"""
         if "apps" not in self.snap_yaml:
@@ -1414,6 +1452,7 @@ class SnapReviewLint(SnapReview):
 
             self._verify_app_and_hook_interfaces(app, key)
 
+    @check_metadata(cost="cheap", needs="yaml")
     def check_hooks_slots(self):
         """Check hooks slots"""
         if "hooks" not in self.snap_yaml:
@@ -1426,6 +1465,7 @@ class SnapReviewLint(SnapReview):
 
             self._verify_app_and_hook_interfaces(hook, key, hook=True)
 
+    @check_metadata(cost="cheap")
     def check_external_symlinks(self):
         """Check snap for external symlinks"""
         # Note: unclear if gadget snaps can legitimately have external
@@ -1449,11 +1489,14 @@ class SnapReviewLint(SnapReview):
         t = "info"
         n = self._get_check_name("external_symlinks")
         s = "OK"
+        # symlinks are resolved in the unpacked package
+        self._unpack_all()
         links = find_external_symlinks(
             self._get_unpack_dir(),
             self.pkg_files,
             self.snap_yaml["name"],
             prefix_ok=prefix_ok,
+            index=self.pkg_index,
         )
         links.sort()
         if len(links) > 0:
@@ -1461,6 +1504,7 @@ class SnapReviewLint(SnapReview):
             s = "package contains external symlinks: %s" % ", ".join(links)
         self._add_result(t, n, s)
 
+    @check_metadata(needs="binaries")
     def check_architecture_all(self):
         """Check if actually architecture all"""
         if (
@@ -1495,6 +1539,7 @@ class SnapReviewLint(SnapReview):
             )
         self._add_result(t, n, s)
 
+    @check_metadata(needs="binaries")
     def check_architecture_specified_needed(self):
         """Check if the specified architecture is actually needed"""
         if "architectures" not in self.snap_yaml:
@@ -1513,6 +1558,7 @@ class SnapReviewLint(SnapReview):
                 s = "Could not find compiled binaries for architecture '%s'" % arch
             self._add_result(t, n, s)
 
+    @check_metadata(cost="cheap", needs="listing")
     def check_vcs(self):
         """Check for VCS files in the package"""
         t = "info"
@@ -1520,15 +1566,13 @@ class SnapReviewLint(SnapReview):
         s = "OK"
         found = []
         for d in self.vcs_files:
-            entries = glob.glob("%s/%s" % (self._get_unpack_dir(), d))
-            if len(entries) > 0:
-                for i in entries:
-                    found.append(os.path.relpath(i, self.unpack_dir))
+            found += self.pkg_index.glob(d)
         if len(found) > 0:
             t = "warn"
             s = "found VCS files in package: %s" % ", ".join(found)
         self._add_result(t, n, s)
 
+    @check_metadata(cost="cheap", needs="listing")
     def check_iffy(self):
         """Check for iffy files in the package"""
         t = "info"
@@ -1547,6 +1591,7 @@ class SnapReviewLint(SnapReview):
             s = "found potentially sensitive files in package: %s" % ", ".join(found)
         self._add_result(t, n, s)
 
+    @check_metadata(cost="cheap", needs="yaml")
     def check_epoch(self):
         """Check epoch"""
         if "epoch" not in self.snap_yaml:
@@ -1635,6 +1680,7 @@ class SnapReviewLint(SnapReview):
 
         self._add_result(t, n, s)
 
+    @check_metadata(cost="cheap", needs="yaml")
     def check_confinement(self):
         """Check confinement"""
         if "confinement" not in self.snap_yaml:
@@ -1716,6 +1762,7 @@ class SnapReviewLint(SnapReview):
 
             self._add_result(t, n, s, link=link)
 
+    @check_metadata(cost="cheap", needs="yaml")
     def check_grade(self):
         """Check grade"""
         if "grade" not in self.snap_yaml:
@@ -1791,6 +1838,7 @@ class SnapReviewLint(SnapReview):
                 s = "invalid environment value for '%s': %s" % (key, env[key])
             self._add_result(t, n, s)
 
+    @check_metadata(cost="cheap", needs="yaml")
     def check_environment(self):
         """Check environment"""
         if "environment" not in self.snap_yaml:
@@ -1798,6 +1846,7 @@ class SnapReviewLint(SnapReview):
 
         self._verify_env(self.snap_yaml["environment"])
 
+    @check_metadata(cost="cheap", needs="yaml")
     def check_apps_environment(self):
         """Check apps environment"""
         if "apps" not in self.snap_yaml:
@@ -1810,6 +1859,7 @@ class SnapReviewLint(SnapReview):
 
             self._verify_env(self.snap_yaml["apps"][app]["environment"], app=app)
 
+    @check_metadata(cost="cheap", needs="yaml")
     def check_hooks_environment(self):
         """Check hooks environment"""
         if "hooks" not in self.snap_yaml:
@@ -1822,6 +1872,7 @@ class SnapReviewLint(SnapReview):
 
             self._verify_env(self.snap_yaml["hooks"][app]["environment"], app=app)
 
+    @check_metadata(cost="cheap", needs="yaml")
     def check_apps_aliases(self):
         """Check apps aliases"""
         if "apps" not in self.snap_yaml:
@@ -2086,6 +2137,7 @@ class SnapReviewLint(SnapReview):
                 # we have a path in the snap (we'll perform additional checks
                 # for icon sets (ie, from meta/gui/icons) in
                 # check_valid_icon_sets()
+                self._unpack_path(real_fn)
                 if not os.path.exists(real_fn):
                     t = "error"
                     s = "nonexistent icon path"
@@ -2094,6 +2146,7 @@ class SnapReviewLint(SnapReview):
                     s = "invalid icon size > %dM" % (self.max_icon_size / 1024 / 1024)
             self._add_result(t, n, s)
 
+    @check_metadata(cost="cheap")
     def check_meta_gui_desktop(self):
         """Check meta/gui/*.desktop"""
         default_provider_is_mir = False
@@ -2111,10 +2164,9 @@ class SnapReviewLint(SnapReview):
                         default_provider_is_mir = True
 
         has_desktop_files = False
-        for f in self.pkg_files:
-            fn = os.path.relpath(f, self._get_unpack_dir())
-            if fn.startswith("meta/gui/") and fn.endswith(".desktop"):
-                self._verify_desktop_file(f)
+        for fn in self.pkg_index.with_prefix("meta/gui/"):
+            if fn.endswith(".desktop") and not self.pkg_index.isdir(fn):
+                self._verify_desktop_file(os.path.join(self._get_unpack_dir(), fn))
                 has_desktop_files = True
                 break
 
@@ -2158,6 +2210,7 @@ class SnapReviewLint(SnapReview):
 
         self._add_result(t, n, s)
 
+    @check_metadata(cost="cheap")
     def check_apps_completer(self):
         """Check apps - completer"""
         if "apps" not in self.snap_yaml:
@@ -2170,6 +2223,7 @@ class SnapReviewLint(SnapReview):
 
             self._verify_value_is_file(app, key)
 
+    @check_metadata(cost="cheap", needs="yaml")
     def check_base(self):
         """Check base"""
         if "base" not in self.snap_yaml:
@@ -2208,6 +2262,7 @@ class SnapReviewLint(SnapReview):
                 manual_review = True
             self._add_result(t, n, s, manual_review=manual_review)
 
+    @check_metadata(cost="cheap", needs="yaml")
     def check_base_interfaces(self):
         """Check base interfaces"""
         if self.snap_yaml["type"] != "base":
@@ -2233,6 +2288,7 @@ class SnapReviewLint(SnapReview):
                             s = "'%s' not allowed with base snaps" % j
                         self._add_result(t, n, s)
 
+    @check_metadata(cost="cheap", needs="yaml")
     def check_license(self):
         """Check license"""
         if "license" not in self.snap_yaml:
@@ -2250,6 +2306,7 @@ class SnapReviewLint(SnapReview):
         # TODO: validateSpdx (from snapd)
         self._add_result(t, n, s)
 
+    @check_metadata(cost="cheap", needs="yaml")
     def check_apps_sockets(self):
         """Check apps - sockets"""
         if "apps" not in self.snap_yaml:
@@ -2394,6 +2451,7 @@ class SnapReviewLint(SnapReview):
                     s = "socket-mode should not be specified with abstract or network sockets"
                 self._add_result(t, n, s)
 
+    @check_metadata(cost="cheap", needs="yaml")
     def check_apps_common_id(self):
         """Check apps - common-id"""
         if "apps" not in self.snap_yaml:
@@ -2427,6 +2485,7 @@ class SnapReviewLint(SnapReview):
             s = "%s specified more than once for: %s" % (key, ", ".join(dupes))
             self._add_result(t, n, s)
 
+    @check_metadata(cost="cheap", needs="yaml")
     def check_interface_content_slot_source(self):
         """Check content interface slot source"""
         if "slots" not in self.snap_yaml:
@@ -2497,6 +2556,7 @@ class SnapReviewLint(SnapReview):
                     s = "paths found in both read and write: %s" % ", ".join(both)
                     self._add_result(t, n, s)
 
+    @check_metadata(cost="cheap", needs="yaml")
     def check_layout(self):
         """Check layout"""
         if "layout" not in self.snap_yaml:
@@ -2702,6 +2762,7 @@ class SnapReviewLint(SnapReview):
 
                 self._add_result(t, n, s)
 
+    @check_metadata(cost="cheap", needs="yaml")
     def check_apps_install_mode(self):
         """Check apps - install-mode"""
         if "apps" not in self.snap_yaml:
@@ -2739,6 +2800,7 @@ class SnapReviewLint(SnapReview):
             s = "unknown install-mode: '%s'" % (",".join(sorted(unknown)))
         self._add_result(t, n, s)
 
+    @check_metadata(cost="cheap", needs="yaml")
     def check_apps_refresh_mode(self):
         """Check apps - refresh-mode"""
         if "apps" not in self.snap_yaml:
@@ -2776,6 +2838,7 @@ class SnapReviewLint(SnapReview):
             s = "unknown refresh-mode: '%s'" % (",".join(sorted(unknown)))
         self._add_result(t, n, s)
 
+    @check_metadata(cost="cheap", needs="yaml")
     def check_apps_stop_mode(self):
         """Check apps - stop-mode"""
         if "apps" not in self.snap_yaml:
@@ -2810,6 +2873,7 @@ class SnapReviewLint(SnapReview):
             s = "unknown stop-mode: '%s'" % (",".join(sorted(unknown)))
         self._add_result(t, n, s)
 
+    @check_metadata(cost="cheap", needs="yaml")
     def check_snap_manifest(self):
         """Check snap/manifest.yaml"""
         if len(self.snap_manifest_yaml) == 0:
@@ -2822,6 +2886,7 @@ class SnapReviewLint(SnapReview):
         (valid, t, s) = self.verify_snap_manifest(self.snap_manifest_yaml)
         self._add_result(t, n, s)
 
+    @check_metadata(cost="cheap", needs="yaml")
     def check_apps_timer(self):
         """Check apps - timer"""
         if "apps" not in self.snap_yaml:
@@ -2856,6 +2921,7 @@ class SnapReviewLint(SnapReview):
                 s = "'%s' not a valid timer" % timer
             self._add_result(t, n, s)
 
+    @check_metadata(cost="cheap", needs="yaml")
     def check_apps_before_after(self):
         """Check apps - before/after"""
         if "apps" not in self.snap_yaml:
@@ -2919,6 +2985,7 @@ class SnapReviewLint(SnapReview):
 
         return "control/private unicode characters not allowed"
 
+    @check_metadata(cost="cheap", needs="yaml")
     def check_unicode_fields(self):
         """Check various fields for valid unicode"""
         errors = []
@@ -2947,6 +3014,7 @@ class SnapReviewLint(SnapReview):
             s = "found errors in file output: %s" % ", ".join(errors)
         self._add_result(t, n, s)
 
+    @check_metadata(cost="cheap", needs="yaml")
     def check_apps_autostart(self):
         """Check apps - autostart"""
         if "apps" not in self.snap_yaml:
@@ -2987,6 +3055,7 @@ class SnapReviewLint(SnapReview):
                 )
             self._add_result(t, n, s)
 
+    @check_metadata(cost="cheap", needs="yaml")
     def check_interface_personal_system_files_plugs(self):
         """Check personal-files/system-files interface plug attributes"""
         if "plugs" not in self.snap_yaml:
@@ -3040,6 +3109,7 @@ class SnapReviewLint(SnapReview):
 
                     self._add_result(t, n, s)
 
+    @check_metadata(cost="cheap", needs="yaml")
     def check_system_usernames(self):
         """Check system-usernames"""
         if "system-usernames" not in self.snap_yaml:
@@ -3135,31 +3205,42 @@ class SnapReviewLint(SnapReview):
                 )
             self._add_result(t, n, s)
 
+    @check_metadata(cost="cheap")
     def check_valid_icon_sets(self):
         """Check valid icon sets"""
-        icons = glob.glob(
-            "%s/meta/gui/icons/**" % self._get_unpack_dir(), recursive=True
-        )
+        # like glob.glob("meta/gui/icons/**", recursive=True)
+        icons = []
+        if self.pkg_index.isdir("meta/gui/icons"):
+            icons.append("meta/gui/icons")
+        for rel in self.pkg_index.with_prefix("meta/gui/icons/"):
+            if "/." not in rel[len("meta/gui/icons") :]:
+                icons.append(rel)
+
         bad_names = []
         unsnap_names = []
         toobig_names = []
         wrongext_names = []
         count = 0
-        for fn in icons:
-            rel = os.path.relpath(fn, self._get_unpack_dir())
+        for rel in icons:
+            fn = os.path.join(self._get_unpack_dir(), rel)
             if fn != shlex.quote(fn):
                 bad_names.append(rel)
                 continue
-            elif not os.path.isfile(fn):
+            elif not self.pkg_index.isfile(rel):
                 continue
 
-            icon = os.path.basename(fn)
+            icon = os.path.basename(rel)
             count += 1
+            entry = self.pkg_index.get(rel)
             if not icon.startswith("snap.%s." % self.snap_yaml["name"]):
                 unsnap_names.append(rel)
             elif os.path.splitext(icon)[1].lower() not in [".png", ".svg"]:
                 wrongext_names.append(rel)
-            elif not self._verify_file_size(fn, self.max_icon_size):
+            elif entry.ftype == "-" and entry.size > self.max_icon_size:
+                toobig_names.append(rel)
+            elif entry.ftype == "l" and not self._verify_file_size(
+                fn, self.max_icon_size
+            ):
                 toobig_names.append(rel)
 
         t = "info"
@@ -3203,6 +3284,7 @@ class SnapReviewLint(SnapReview):
             )
             self._add_result(t, n, s)
 
+    @check_metadata(cost="cheap", needs="yaml")
     def check_audio_record_without_audio_playback(self):
         """Check audio-record used with audio-playback"""
         if "apps" not in self.snap_yaml or not self._uses_interface(
@@ -17,11 +17,22 @@
 from __future__ import print_function
 
 from reviewtools.sr_common import SnapReview
+from reviewtools.analysis_cache import (
+    get_analysis_cache,
+    get_cached_result,
+    get_inputs_digest,
+    put_cached_result,
+)
 from reviewtools.common import (
+    check_metadata,
     cmd,
     cmdIgnoreErrorStrings,
+    compare_files,
     create_tempdir,
+    debug,
+    get_squashfs_tools_version,
     open_file_write,
+    recursive_rm,
     ReviewException,
     AA_PROFILE_NAME_MAXLEN,
     AA_PROFILE_NAME_ADVLEN,
@@ -33,6 +44,7 @@ from reviewtools.common import (
     restore_lang,
     StatLLN,
 )
+from reviewtools.cpu_budget import CpuTokens, add_processors_option
 from reviewtools.overrides import (
     sec_browser_support_overrides,
     sec_iface_ref_matches_base_decl_overrides,
@@ -40,6 +52,7 @@ from reviewtools.overrides import (
     sec_mode_dev_overrides,
     sec_resquashfs_overrides,
 )
+from reviewtools.squashfs import SquashfsException, read_superblock
 import copy
 import os
 import re
@@ -50,8 +63,20 @@ import sys
 class SnapReviewSecurity(SnapReview):
     """This class represents snap security reviews"""
 
-    def __init__(self, fn, overrides=None):
-        SnapReview.__init__(self, fn, "security-snap-v2", overrides=overrides)
+    review_type = "security-snap-v2"
+
+    def __init__(self, fn, overrides=None, context=None):
+        SnapReview.__init__(
+            self, fn, self.review_type, overrides=overrides, context=context
+        )
+
+    def _squashfs_superblock(self, snap_pkg):
+        """Read the squashfs superblock of a snap package (None on error)"""
+        try:
+            return read_superblock(snap_pkg)
+        except SquashfsException as e:
+            debug("could not read squashfs superblock: %s" % e)
+            return None
 
     def _unsquashfs_stat(self, snap_pkg):
         """Run unsquashfs -stat on a snap package"""
@@ -60,6 +85,7 @@ class SnapReviewSecurity(SnapReview):
         restore_lang(origLANG, origLC_ALL)
         return rc, out
 
+    @check_metadata(cost="cheap", needs="yaml")
     def check_security_plugs_browser_support_with_daemon(self):
         """Check security plugs - browser-support not used with daemon"""
 
@@ -112,6 +138,7 @@ class SnapReviewSecurity(SnapReview):
                     n = self._get_check_name("daemon_with_browser-support", app=app)
                     self._add_result(t, n, s, manual_review=True)
 
+    @check_metadata(cost="cheap", needs="yaml")
     def check_apparmor_profile_name_length(self):
         """Check AppArmor profile name length"""
         if "apps" not in self.snap_yaml:
@@ -141,9 +168,21 @@ class SnapReviewSecurity(SnapReview):
                 )
             self._add_result(t, n, s)
 
-    def _debug_resquashfs(self, tmpdir, orig, resq):
+    def _describe_resquash_difference(self, fn, offset):
+        """Describe where the repack of fn differs"""
+        if offset is None:
+            return "checksums match"
+        try:
+            part = read_superblock(fn).describe_offset(offset)
+        except SquashfsException:
+            part = "unknown"
+        return "first difference at byte %d (in the %s)" % (offset, part)
+
+    def _debug_resquashfs(self, tmpdir, orig, resq, offset=None):
         """Provide debugging information on snap and repacked snap"""
         debug_output = ""
+        if offset is not None:
+            debug_output += self._describe_resquash_difference(orig, offset) + "\n"
         orig_lln_fn = os.path.join(tmpdir, os.path.basename(orig) + ".lln")
         resq_lln_fn = os.path.join(tmpdir, os.path.basename(resq) + ".lln")
 
@@ -178,27 +217,166 @@ class SnapReviewSecurity(SnapReview):
 
         return debug_output
 
+    def _get_resquash_source_dir(self):
+        """Return the unpacked package if the resquash can repack it as is
+           (ie, it is the same as a fresh unpack), otherwise None
+        """
+        if "SNAP_FAKEROOT_RESQUASHFS" in os.environ:
+            # the unsquashfs must run under fakeroot to save its session
+            return None
+        if "type" in self.snap_yaml and self.snap_yaml["type"] in ["base", "os"]:
+            # these may have devices and other owners, so don't rely on how
+            # the review unpacked them
+            return None
+        if not self._is_fully_unpacked():
+            return None
+        if self.context.unpack_cache_entry is not None:
+            # read-only, so the repack wouldn't have the original modes
+            return None
+        return self.unpack_dir
+
+    def _get_resquash_cache_key(self, fn, comp):
+        """Return the analysis cache key of the resquash verdict for fn, or
+           None if it can't be cached
+        """
+        if get_analysis_cache() is None:
+            return None
+        tools = get_squashfs_tools_version()
+        if tools is None:
+            return None
+        inputs = {
+            "compression": comp,
+            "mksquashfs_opts": MKSQUASHFS_OPTS,
+            "fakeroot": "SNAP_FAKEROOT_RESQUASHFS" in os.environ,
+            "squashfs_tools": tools,
+        }
+        return get_inputs_digest(fn, inputs)
+
+    def _resquash(self, fn, tmpdir, tmp_repack, comp, fstime, src_dir=None):
+        """Repack src_dir (or a fresh unpack of fn, under fakeroot with
+           SNAP_FAKEROOT_RESQUASHFS) into tmp_repack. Raises ReviewException
+           on failure
+        """
+        tmp_unpack = os.path.join(tmpdir, "squashfs-root")
+        fakeroot_env = os.path.join(tmpdir, "fakeroot.env")
+
+        # Don't use -all-root since the snap might have other users in it
+        # NOTE: adding -no-xattrs here causes resquashfs to fail (unsquashfs
+        # and mksquash use -xattrs by default. By specifying -no-xattrs to
+        # unsquashfs/mksquashfs, we enforce not supportinging them since the
+        # checksums will always be different because the original squash would
+        # have them but the repack would not). If we ever decide to support
+        # xattrs in snaps, would have to see why thre requash fails with
+        # -xattrs.
+        mksquashfs_ignore_opts = ["-all-root"]
+
+        curdir = os.getcwd()
+        os.chdir(tmpdir)
+        # ensure we don't alter the permissions from the unsquashfs
+        old_umask = os.umask(000)
+
+        fakeroot_cmd = []
+        if "SNAP_FAKEROOT_RESQUASHFS" in os.environ:
+            # We could use -l $SNAP/usr/lib/... --faked $SNAP/usr/bin/faked if
+            # os.environ['SNAP'] is set, but instead we let the snap packaging
+            # make fakeroot work correctly and keep this simple.
+            fakeroot_cmd = ["fakeroot", "--unknown-is-real"]
+
+        try:
+            fakeroot_args = []
+            mksquash_opts = copy.copy(MKSQUASHFS_OPTS)
+            if comp != MKSQUASHFS_DEFAULT_COMPRESSION:
+                idx = mksquash_opts.index(MKSQUASHFS_DEFAULT_COMPRESSION)
+                mksquash_opts[idx] = comp
+
+            if "SNAP_FAKEROOT_RESQUASHFS" in os.environ:
+                # run unsquashfs under fakeroot, saving the session to be
+                # reused by mksquashfs and thus preserving
+                # uids/gids/devices/etc
+                fakeroot_args = ["-s", fakeroot_env]
+
+                mksquash_opts = []
+                for i in MKSQUASHFS_OPTS:
+                    if i not in mksquashfs_ignore_opts:
+                        mksquash_opts.append(i)
+
+            if src_dir is None:
+                if os.path.exists(tmp_unpack):
+                    recursive_rm(tmp_unpack)
+                cmdline = (
+                    fakeroot_cmd
+                    + fakeroot_args
+                    + ["unsquashfs", "-no-progress", "-d", tmp_unpack]
+                )
+                if unsquashfs_supports_ignore_errors():
+                    cmdline.append("-ignore-errors")
+                    cmdline.append("-quiet")
+                cmdline.append(fn)
+
+                with CpuTokens() as processors:
+                    (rc, out) = cmdIgnoreErrorStrings(
+                        add_processors_option(cmdline, processors),
+                        UNSQUASHFS_IGNORED_ERRORS,
+                    )
+                if rc != 0:
+                    raise ReviewException(
+                        "could not unsquash '%s': %s" % (os.path.basename(fn), out)
+                    )
+                src_dir = tmp_unpack
+
+            fakeroot_args = []
+            if "SNAP_FAKEROOT_RESQUASHFS" in os.environ:
+                fakeroot_args = ["-i", fakeroot_env]
+
+            cmdline = (
+                fakeroot_cmd
+                + fakeroot_args
+                + ["mksquashfs", src_dir, tmp_repack, "-fstime", fstime]
+                + mksquash_opts
+            )
+
+            with CpuTokens() as processors:
+                (rc, out) = cmd(add_processors_option(cmdline, processors))
+            if rc != 0:
+                raise ReviewException(
+                    "could not mksquashfs '%s': %s" % (os.path.basename(src_dir), out)
+                )
+        finally:
+            os.umask(old_umask)
+            os.chdir(curdir)
+
+    @check_metadata(cost="expensive")
     def check_squashfs_resquash(self):
         """Check resquash of squashfs"""
         fn = os.path.abspath(self.pkg_filename)
 
         # Verify squashfs has no fragments. If it does, it will not resquash
-        # properly (LP: #1576763). This stat output for fragments has been
-        # stable for at least the last 7 years, so just parse it. If it changes
-        # we can consider examing the superblock directly.
-        (rc, out) = self._unsquashfs_stat(fn)
-        if rc != 0:
-            t = "error"
-            n = self._get_check_name("squashfs_stat")
-            s = "could not stat squashfs"
-            self._add_result(t, n, s)
-            return
-
+        # properly (LP: #1576763). Read the superblock directly and fall back
+        # to parsing the unsquashfs -stat output (which has been stable for
+        # years) if we can't.
         comp = None
-        comp_pat = re.compile(r"^Compression [a-z0-9]+$")
-        for line in out.splitlines():
-            if comp_pat.search(line):
-                comp = line.split()[1]
+        has_fragments = None
+        fstime = None
+        sb = self._squashfs_superblock(fn)
+        if sb is not None:
+            comp = sb.compression_name
+            has_fragments = sb.fragments != 0
+            fstime = str(sb.fstime)
+        else:
+            (rc, out) = self._unsquashfs_stat(fn)
+            if rc != 0:
+                t = "error"
+                n = self._get_check_name("squashfs_stat")
+                s = "could not stat squashfs"
+                self._add_result(t, n, s)
+                return
+
+            comp_pat = re.compile(r"^Compression [a-z0-9]+$")
+            for line in out.splitlines():
+                if comp_pat.search(line):
+                    comp = line.split()[1]
+            has_fragments = "\nNumber of fragments 0\n" not in out
+
         if comp is None:
             t = "error"
             n = self._get_check_name("squashfs_compression")
@@ -212,7 +390,7 @@ class SnapReviewSecurity(SnapReview):
             self._add_result(t, n, s)
             return
 
-        if "\nNumber of fragments 0\n" not in out and (
+        if has_fragments and (
             "SNAP_ENFORCE_RESQUASHFS" not in os.environ
             or (
                 "SNAP_ENFORCE_RESQUASHFS" in os.environ
@@ -241,14 +419,15 @@ class SnapReviewSecurity(SnapReview):
 
         # Verify squashfs supports the -fstime option, if not, warn (which
         # blocks in store)
-        (rc, out) = cmd(["unsquashfs", "-fstime", fn])
-        if rc != 0:
-            t = "warn"
-            n = self._get_check_name("squashfs_supports_fstime")
-            s = "could not determine fstime of squashfs"
-            self._add_result(t, n, s)
-            return
-        fstime = out.strip()
+        if fstime is None:
+            (rc, out) = cmd(["unsquashfs", "-fstime", fn])
+            if rc != 0:
+                t = "warn"
+                n = self._get_check_name("squashfs_supports_fstime")
+                s = "could not determine fstime of squashfs"
+                self._add_result(t, n, s)
+                return
+            fstime = out.strip()
 
         if (
             "SNAP_ENFORCE_RESQUASHFS" in os.environ
@@ -260,127 +439,83 @@ class SnapReviewSecurity(SnapReview):
             self._add_result(t, n, s)
             return
 
-        tmpdir = create_tempdir()  # this is autocleaned
-        tmp_unpack = os.path.join(tmpdir, "squashfs-root")
+        tmpdir = create_tempdir(self.context)  # this is autocleaned
         tmp_repack = os.path.join(tmpdir, "repack.snap")
-        fakeroot_env = os.path.join(tmpdir, "fakeroot.env")
 
-        # Don't use -all-root since the snap might have other users in it
-        # NOTE: adding -no-xattrs here causes resquashfs to fail (unsquashfs
-        # and mksquash use -xattrs by default. By specifying -no-xattrs to
-        # unsquashfs/mksquashfs, we enforce not supportinging them since the
-        # checksums will always be different because the original squash would
-        # have them but the repack would not). If we ever decide to support
-        # xattrs in snaps, would have to see why thre requash fails with
-        # -xattrs.
-        mksquashfs_ignore_opts = ["-all-root"]
-
-        curdir = os.getcwd()
-        os.chdir(tmpdir)
-        # ensure we don't alter the permissions from the unsquashfs
-        old_umask = os.umask(000)
-
-        fakeroot_cmd = []
         if "SNAP_FAKEROOT_RESQUASHFS" in os.environ:
-            # We could use -l $SNAP/usr/lib/... --faked $SNAP/usr/bin/faked if
-            # os.environ['SNAP'] is set, but instead we let the snap packaging
-            # make fakeroot work correctly and keep this simple.
-            fakeroot_cmd = ["fakeroot", "--unknown-is-real"]
-
-            if shutil.which(fakeroot_cmd[0]) is None:  # pragma: nocover
+            if shutil.which("fakeroot") is None:  # pragma: nocover
                 t = "error"
                 n = self._get_check_name("has_fakeroot")
                 s = "Could not find 'fakeroot' command"
                 self._add_result(t, n, s)
                 return
 
-        try:
-            fakeroot_args = []
-            mksquash_opts = copy.copy(MKSQUASHFS_OPTS)
-            if comp != MKSQUASHFS_DEFAULT_COMPRESSION:
-                idx = mksquash_opts.index(MKSQUASHFS_DEFAULT_COMPRESSION)
-                mksquash_opts[idx] = comp
-
-            if "SNAP_FAKEROOT_RESQUASHFS" in os.environ:
-                # run unsquashfs under fakeroot, saving the session to be
-                # reused by mksquashfs and thus preserving
-                # uids/gids/devices/etc
-                fakeroot_args = ["-s", fakeroot_env]
-
-                mksquash_opts = []
-                for i in MKSQUASHFS_OPTS:
-                    if i not in mksquashfs_ignore_opts:
-                        mksquash_opts.append(i)
+        # Repack the tree the review already unpacked when it is the same as
+        # a fresh unpack (see _get_resquash_source_dir())
+        src_dir = self._get_resquash_source_dir()
 
-            cmdline = (
-                fakeroot_cmd
-                + fakeroot_args
-                + ["unsquashfs", "-no-progress", "-d", tmp_unpack]
-            )
-            if unsquashfs_supports_ignore_errors():
-                cmdline.append("-ignore-errors")
-                cmdline.append("-quiet")
-            cmdline.append(fn)
+        t = "info"
+        n = self._get_check_name("squashfs_repack_checksum")
+        s = "OK"
+        link = None
 
-            (rc, out) = cmdIgnoreErrorStrings(cmdline, UNSQUASHFS_IGNORED_ERRORS)
-            if rc != 0:
-                raise ReviewException(
-                    "could not unsquash '%s': %s" % (os.path.basename(fn), out)
+        # The result only depends on the package and how it is repacked, so
+        # re-reviews can use the verdict of a previous review (when the
+        # analysis cache is enabled). Debugging needs the repacked snap, so
+        # always repack then.
+        cache_key = self._get_resquash_cache_key(fn, comp)
+        found = False
+        if cache_key is not None and "SNAP_DEBUG_RESQUASHFS" not in os.environ:
+            (found, verdict) = get_cached_result(cache_key, "resquash")
+            if found:
+                offset = verdict["offset"]
+                debug(
+                    "using cached resquash result for '%s': %s"
+                    % (fn, verdict["summary"])
                 )
 
-            fakeroot_args = []
-            if "SNAP_FAKEROOT_RESQUASHFS" in os.environ:
-                fakeroot_args = ["-i", fakeroot_env]
-
-            cmdline = (
-                fakeroot_cmd
-                + fakeroot_args
-                + ["mksquashfs", tmp_unpack, tmp_repack, "-fstime", fstime]
-                + mksquash_opts
-            )
+        if not found:
+            try:
+                self._resquash(fn, tmpdir, tmp_repack, comp, fstime, src_dir=src_dir)
+            except ReviewException as e:
+                t = "error"
+                n = self._get_check_name("squashfs_resquash")
+                self._add_result(t, n, str(e))
+                return
 
-            (rc, out) = cmd(cmdline)
-            if rc != 0:
-                raise ReviewException(
-                    "could not mksquashfs '%s': %s"
-                    % (os.path.relpath(tmp_unpack, tmpdir), out)
+            # Compare in-process, stopping at the first difference
+            try:
+                offset = compare_files(fn, tmp_repack)
+            except OSError as e:
+                t = "error"
+                s = "could not compare '%s' with '%s': %s" % (
+                    os.path.basename(fn),
+                    os.path.relpath(tmp_repack, tmpdir),
+                    e.strerror,
                 )
-        except ReviewException as e:
-            t = "error"
-            n = self._get_check_name("squashfs_resquash")
-            self._add_result(t, n, str(e))
-            return
-        finally:
-            os.umask(old_umask)
-            os.chdir(curdir)
-
-        # Now calculate the hashes
-        t = "info"
-        n = self._get_check_name("squashfs_repack_checksum")
-        s = "OK"
-        link = None
+                self._add_result(t, n, s)
+                return
 
-        (rc, out) = cmd(["sha512sum", fn])
-        if rc != 0:
-            t = "error"
-            s = "could not determine checksum of '%s'" % os.path.basename(fn)
-            self._add_result(t, n, s)
-            return
-        orig_sum = out.split()[0]
+            # fakeroot sporadically fails (see below), so only cache
+            # mismatches without it
+            if cache_key is not None and (
+                offset is None or "SNAP_FAKEROOT_RESQUASHFS" not in os.environ
+            ):
+                verdict = {
+                    "offset": offset,
+                    "summary": self._describe_resquash_difference(fn, offset),
+                }
+                put_cached_result(cache_key, "resquash", verdict)
 
-        (rc, out) = cmd(["sha512sum", tmp_repack])
-        if rc != 0:
-            t = "error"
-            s = "could not determine checksum of '%s'" % os.path.relpath(
-                tmp_repack, tmpdir
-            )
-            self._add_result(t, n, s)
-            return
-        repack_sum = out.split()[0]
+        # see _resquash()
+        mksquashfs_ignore_opts = ["-all-root"]
 
-        if orig_sum != repack_sum:
+        if offset is not None:
             if "SNAP_DEBUG_RESQUASHFS" in os.environ:
-                print(self._debug_resquashfs(tmpdir, fn, tmp_repack), file=sys.stderr)
+                print(
+                    self._debug_resquashfs(tmpdir, fn, tmp_repack, offset=offset),
+                    file=sys.stderr,
+                )
 
                 if os.environ["SNAP_DEBUG_RESQUASHFS"] == "2":  # pragma: nocover
                     import subprocess
@@ -504,6 +639,7 @@ class SnapReviewSecurity(SnapReview):
             owner,
         )
 
+    @check_metadata(needs="listing")
     def check_squashfs_files(self):
         """Check squashfs files"""
 
@@ -589,6 +725,7 @@ class SnapReviewSecurity(SnapReview):
             s = "found errors in file output: %s" % ", ".join(errors)
         self._add_result(t, n, s)
 
+    @check_metadata(cost="cheap", needs="yaml")
     def check_interface_reference_matches_base_decl(self):
         """Check if an interface reference matches a different interface
            in the base declaration.
@@ -31,13 +31,13 @@ TEST_PKGFMT_VERSION = "16.04"
 TEST_UNPACK_DIR = "/fake"
 TEST_UNSQUASHFS_LLN_HDR = ""
 TEST_UNSQUASHFS_LLN_ENTRIES = ("", None)
-TEST_CMD_NM = (0, "")
+TEST_DYNAMIC_SYMBOLS = []
 
 
 #
 # Mock override functions
 #
-def _mock_func(self):
+def _mock_func(self, *args, **kwargs):
     """Fake test function"""
     return
 
@@ -72,9 +72,9 @@ def _unsquashfs_lln(self, fn):
     return (TEST_UNSQUASHFS_LLN_HDR, TEST_UNSQUASHFS_LLN_ENTRIES)
 
 
-def _cmd_nm(self, args):
-    """Pretend ran nm ..."""
-    return TEST_CMD_NM
+def _get_dynamic_symbols(self, fns):
+    """Pretend we read the dynamic symbols of fns"""
+    return dict((fn, TEST_DYNAMIC_SYMBOLS) for fn in fns)
 
 
 def create_patches():
@@ -105,6 +105,9 @@ def create_patches():
     )
 
     patches.append(patch("reviewtools.common.Review._list_all_files", _mock_func))
+    patches.append(
+        patch("reviewtools.common.Review._get_lazy_unpack_items", _mock_func)
+    )
     patches.append(
         patch("reviewtools.common.Review._list_all_compiled_binaries", _mock_func)
     )
@@ -120,7 +123,10 @@ def create_patches():
 
     # sr_functional
     patches.append(
-        patch("reviewtools.sr_functional.SnapReviewFunctional._cmd_nm", _cmd_nm)
+        patch(
+            "reviewtools.sr_functional.SnapReviewFunctional._get_dynamic_symbols",
+            _get_dynamic_symbols,
+        )
     )
 
     return patches
@@ -217,9 +223,9 @@ class TestSnapReview(TestCase):
         TEST_UNSQUASHFS_LLN_HDR = hdr
         TEST_UNSQUASHFS_LLN_ENTRIES = copy.copy(entries)
 
-    def set_test_cmd_nm(self, rc, s):
-        global TEST_CMD_NM
-        TEST_CMD_NM = (rc, s)
+    def set_test_dynamic_symbols(self, entries):
+        global TEST_DYNAMIC_SYMBOLS
+        TEST_DYNAMIC_SYMBOLS = entries
 
     def setUp(self):
         """Make sure our patches are applied everywhere"""
@@ -245,8 +251,8 @@ class TestSnapReview(TestCase):
         TEST_UNSQUASHFS_LLN_HDR = ""
         global TEST_UNSQUASHFS_LLN_ENTRIES
         TEST_UNSQUASHFS_LLN_ENTRIES = ("", None)
-        global TEST_CMD_NM
-        TEST_CMD_NM = (0, "")
+        global TEST_DYNAMIC_SYMBOLS
+        TEST_DYNAMIC_SYMBOLS = []
 
         self._reset_test_data()
         os.umask(self.old_umask)
@@ -15,12 +15,12 @@
 import copy
 import pprint
 import re
-import yaml
 
 import reviewtools.debversion as debversion
 
 from reviewtools.common import (
     debug,
+    load_yaml,
     warn,
     get_os_codename,
     assign_type_to_dict_values,
@@ -241,7 +241,7 @@ def get_pkg_revisions(item, secnot_db, errors, pkg_type="snap"):
             continue
 
         try:
-            manifest = yaml.load(rev["manifest_yaml"], Loader=yaml.SafeLoader)
+            manifest = load_yaml(rev["manifest_yaml"], allow_duplicate_keys=True)
             if manifest is None:
                 continue
             if pkg_type == "snap":
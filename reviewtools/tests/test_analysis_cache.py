@@ -0,0 +1,202 @@
+"""test_analysis_cache.py: tests for the analysis_cache module"""
+#
+# Copyright (C) 2021 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import reviewtools.analysis_cache
+from reviewtools.analysis_cache import (
+    AnalysisCache,
+    cached_analyses,
+    cached_analysis,
+    close_analysis_cache,
+    get_analysis_cache,
+    get_cached_result,
+    get_file_digest,
+    get_inputs_digest,
+    put_cached_result,
+)
+
+
+class TestAnalysisCache(unittest.TestCase):
+    """Tests for the analysis_cache module"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.db = os.path.join(self.tmpdir, "cache.db")
+        self.addCleanup(close_analysis_cache)
+        close_analysis_cache()
+        self.calls = []
+
+    def _write(self, name, content):
+        fn = os.path.join(self.tmpdir, name)
+        with open(fn, "w") as f:
+            f.write(content)
+        return fn
+
+    def _analyze(self, fn):
+        self.calls.append(fn)
+        return {"len": os.path.getsize(fn)}
+
+    def test_get_put(self):
+        """Test AnalysisCache.get() and put()"""
+        cache = AnalysisCache(self.db)
+        self.assertEqual(cache.get("abc", 3, "symbols"), (False, None))
+        cache.put("abc", 3, "symbols", {"foo": {"type": "T", "version": ""}})
+        self.assertEqual(
+            cache.get("abc", 3, "symbols"),
+            (True, {"foo": {"type": "T", "version": ""}}),
+        )
+        # same digest, different analyzer or size
+        self.assertEqual(cache.get("abc", 3, "execstack"), (False, None))
+        self.assertEqual(cache.get("abc", 4, "symbols"), (False, None))
+        self.assertEqual((cache.hits, cache.misses), (1, 3))
+        cache.close()
+
+        # persistent
+        cache = AnalysisCache(self.db)
+        self.assertEqual(cache.get("abc", 3, "symbols")[0], True)
+        cache.close()
+
+    def test_analyzer_version(self):
+        """Test AnalysisCache.get() - different analyzer version"""
+        cache = AnalysisCache(self.db)
+        cache.put("abc", 3, "execstack", True)
+        with patch.dict(reviewtools.analysis_cache.ANALYZER_VERSIONS, execstack=2):
+            self.assertEqual(cache.get("abc", 3, "execstack"), (False, None))
+        self.assertEqual(cache.get("abc", 3, "execstack"), (True, True))
+        cache.close()
+
+    def test_prune(self):
+        """Test AnalysisCache.prune() evicts least recently used first"""
+        cache = AnalysisCache(self.db, max_size=1)
+        for i in range(4):
+            cache.put("%d" % i, 1, "mime", "x" * 400 * 1024)
+        # use the first one
+        cache.get("0", 1, "mime")
+        cache.close()
+
+        cache = AnalysisCache(self.db)
+        self.assertTrue(cache.get("0", 1, "mime")[0])
+        self.assertTrue(cache.get("3", 1, "mime")[0])
+        self.assertFalse(cache.get("1", 1, "mime")[0])
+        self.assertFalse(cache.get("2", 1, "mime")[0])
+        cache.close()
+
+    def test_get_file_digest(self):
+        """Test get_file_digest()"""
+        fn = self._write("foo", "foo\n")
+        self.assertIsNone(get_file_digest(fn, compute=False))
+        self.assertEqual(
+            get_file_digest(fn),
+            ("b5bb9d8014a0f9b1d61e21e796d78dccdf1352f23cd32812f4850b878ae4944c", 4),
+        )
+        self.assertIsNotNone(get_file_digest(fn, compute=False))
+        self.assertIsNone(get_file_digest(os.path.join(self.tmpdir, "nonexistent")))
+
+    def test_cached_analysis_disabled(self):
+        """Test cached_analysis() - disabled"""
+        fn = self._write("foo", "foo\n")
+        with patch.dict(os.environ, {"SNAP_REVIEW_ANALYSIS_CACHE": "0"}):
+            self.assertIsNone(get_analysis_cache())
+            for i in range(2):
+                self.assertEqual(cached_analysis(fn, "mime", self._analyze), {"len": 4})
+        self.assertEqual(len(self.calls), 2)
+
+    def test_cached_analysis(self):
+        """Test cached_analysis()"""
+        fn = self._write("foo", "foo\n")
+        # the same contents elsewhere
+        fn2 = self._write("bar", "foo\n")
+        with patch.dict(os.environ, {"SNAP_REVIEW_ANALYSIS_CACHE": self.db}):
+            self.assertEqual(cached_analysis(fn, "mime", self._analyze), {"len": 4})
+            self.assertEqual(cached_analysis(fn2, "mime", self._analyze), {"len": 4})
+            self.assertEqual(get_analysis_cache().hits, 1)
+            close_analysis_cache()
+
+            # in the next review
+            self.assertEqual(cached_analysis(fn, "mime", self._analyze), {"len": 4})
+        self.assertEqual(self.calls, [fn])
+        self.assertTrue(os.path.exists(self.db))
+
+    def test_cached_analysis_no_hash(self):
+        """Test cached_analysis() - hash_file=False"""
+        fn = self._write("foo", "foo\n")
+        with patch.dict(os.environ, {"SNAP_REVIEW_ANALYSIS_CACHE": self.db}):
+            cached_analysis(fn, "execstack", self._analyze, hash_file=False)
+            cached_analysis(fn, "execstack", self._analyze, hash_file=False)
+            self.assertEqual(len(self.calls), 2)
+
+            # once hashed by another analyzer, the result is cached
+            cached_analysis(fn, "mime", self._analyze)
+            cached_analysis(fn, "execstack", self._analyze, hash_file=False)
+            cached_analysis(fn, "execstack", self._analyze, hash_file=False)
+            self.assertEqual(len(self.calls), 4)
+
+    def test_cached_analyses(self):
+        """Test cached_analyses() only analyzes the misses"""
+        fns = [self._write("foo%d" % i, "foo%d\n" % i) for i in range(3)]
+        batches = []
+
+        def _batch(fns):
+            batches.append(fns)
+            return dict((fn, self._analyze(fn)) for fn in fns)
+
+        with patch.dict(os.environ, {"SNAP_REVIEW_ANALYSIS_CACHE": self.db}):
+            cached_analyses(fns[0:1], "symbols", _batch)
+            res = cached_analyses(fns, "symbols", _batch)
+        self.assertEqual(batches, [fns[0:1], fns[1:3]])
+        self.assertEqual(res, dict((fn, {"len": 5}) for fn in fns))
+
+    def test_cached_analysis_bad_db(self):
+        """Test cached_analysis() - unusable database"""
+        fn = self._write("foo", "foo\n")
+        db = os.path.join(self.tmpdir, "nonexistent", "cache.db")
+        with patch.dict(os.environ, {"SNAP_REVIEW_ANALYSIS_CACHE": db}):
+            self.assertEqual(cached_analysis(fn, "mime", self._analyze), {"len": 4})
+
+    def test_get_inputs_digest(self):
+        """Test get_inputs_digest()"""
+        fn = self._write("foo", "foo\n")
+        digest = get_inputs_digest(fn, {"a": 1, "b": [2]})
+        self.assertEqual(digest[1], 4)
+        self.assertNotEqual(digest, get_file_digest(fn))
+        self.assertEqual(digest, get_inputs_digest(fn, {"b": [2], "a": 1}))
+        self.assertNotEqual(digest, get_inputs_digest(fn, {"a": 2, "b": [2]}))
+        self.assertIsNone(
+            get_inputs_digest(os.path.join(self.tmpdir, "nonexistent"), {})
+        )
+
+    def test_cached_result(self):
+        """Test get_cached_result() and put_cached_result()"""
+        digest = ("abc", 3)
+        with patch.dict(os.environ, {"SNAP_REVIEW_ANALYSIS_CACHE": self.db}):
+            self.assertEqual(get_cached_result(digest, "resquash"), (False, None))
+            put_cached_result(digest, "resquash", {"offset": None})
+            close_analysis_cache()
+            self.assertEqual(
+                get_cached_result(digest, "resquash"), (True, {"offset": None})
+            )
+
+    def test_cached_result_disabled(self):
+        """Test get_cached_result() and put_cached_result() - disabled"""
+        digest = ("abc", 3)
+        put_cached_result(digest, "resquash", {"offset": None})
+        self.assertEqual(get_cached_result(digest, "resquash"), (False, None))
@@ -15,14 +15,23 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import copy
+import fcntl
+import io
+import json
 import os
 import shutil
+import subprocess
+import sys
 import tempfile
+import threading
+import time
+import yaml
+from unittest.mock import patch
 
 from reviewtools.sr_common import SnapReview, ReviewException
 import reviewtools.sr_tests as sr_tests
 import reviewtools.common
-from reviewtools.common import StatLLN
+from reviewtools.common import FatalReviewError, ProfileTimer, ReviewContext, StatLLN
 from reviewtools.tests import utils
 
 
@@ -132,6 +141,678 @@ exit 1
         self.assertEqual(rc, 1)
         self.assertTrue("unsquashfs failure" in out)
 
+    def _fake_unsquashfs(self, output_dir, lln_out):
+        """Put a fake unsquashfs in PATH that logs each invocation"""
+        unsquashfs = os.path.join(output_dir, "unsquashfs")
+        content = """#!/bin/sh
+echo "$1" >> %s/unsquashfs.log
+cat <<'EOM'
+%sEOM
+""" % (
+            output_dir,
+            lln_out,
+        )
+        with open(unsquashfs, "w") as f:
+            f.write(content)
+        os.chmod(unsquashfs, 0o775)
+
+        old_path = os.environ["PATH"]
+        os.environ["PATH"] = "%s:%s" % (output_dir, old_path)
+        self.addCleanup(os.environ.__setitem__, "PATH", old_path)
+        self.addCleanup(reviewtools.common.cleanup_unpack)
+
+        return os.path.join(output_dir, "unsquashfs.log")
+
+    def test_get_pkg_listing(self):
+        """Test get_pkg_listing() only runs unsquashfs -lln once"""
+        output_dir = self.mkdtemp()
+        log = self._fake_unsquashfs(
+            output_dir,
+            """drwxrwxr-x 0/0                27 2020-03-24 09:11 squashfs-root
+drwxr-xr-x 0/0                48 2020-03-24 09:11 squashfs-root/meta
+-rw-r--r-- 0/0              2870 2020-03-24 09:11 squashfs-root/meta/icon.png
+-rw-r--r-- 0/0                99 2020-03-24 09:11 squashfs-root/meta/snap.yaml
+lrwxrwxrwx 0/0                 6 2020-03-24 09:11 squashfs-root/link -> meta
+""",
+        )
+        package = os.path.join(output_dir, "test.snap")
+        with open(package, "w") as f:
+            f.write("fake")
+
+        listing = reviewtools.common.get_pkg_listing(package)
+        self.assertEqual(listing.rc, 0)
+        self.assertEqual(
+            reviewtools.common._calculate_snap_unsquashfs_uncompressed_size(package),
+            2969,
+        )
+        hdr, entries = listing.parse()
+        self.assertEqual(5, len(entries))
+
+        # relative and absolute paths share the same listing
+        curdir = os.getcwd()
+        os.chdir(output_dir)
+        self.addCleanup(os.chdir, curdir)
+        self.assertIs(reviewtools.common.get_pkg_listing("./test.snap"), listing)
+        self.assertIs(listing.parse()[1], entries)
+
+        with open(log) as f:
+            self.assertEqual(f.read().splitlines(), ["-lln"])
+
+        # a different package gets a new listing
+        reviewtools.common.cleanup_unpack()
+        self.assertIsNot(reviewtools.common.get_pkg_listing(package), listing)
+
+    def test_get_pkg_listing_malformed(self):
+        """Test get_pkg_listing() - malformed output"""
+        output_dir = self.mkdtemp()
+        self._fake_unsquashfs(
+            output_dir,
+            """drwxrwxr-x 0/0                27 2020-03-24 09:11 squashfs-root
+-rw-r--r-- 0/0                99 2020-03-24 09:11 squashfs-root/meta/snap.yaml
+:rwxrwxr-x 0/0                38 2016-03-11 12:25 squashfs-root/foo
+""",
+        )
+        package = os.path.join(output_dir, "test.snap")
+        with open(package, "w") as f:
+            f.write("fake")
+
+        listing = reviewtools.common.get_pkg_listing(package)
+        self.assertEqual(listing.uncompressed_size(), 99)
+        with self.assertRaises(ReviewException):
+            listing.parse()
+        # the parse error is cached
+        with self.assertRaises(ReviewException):
+            listing.parse()
+
+    def test_pkg_listing_resolve(self):
+        """Test PkgListing.paths() and PkgListing.resolve()"""
+        output_dir = self.mkdtemp()
+        self._fake_unsquashfs(
+            output_dir,
+            """drwxrwxr-x 0/0                27 2020-03-24 09:11 squashfs-root
+drwxr-xr-x 0/0                48 2020-03-24 09:11 squashfs-root/meta
+-rw-r--r-- 0/0              2870 2020-03-24 09:11 squashfs-root/meta/icon.png
+lrwxrwxrwx 0/0                15 2020-03-24 09:11 squashfs-root/meta/link -> ../usr/icon.png
+lrwxrwxrwx 0/0                 4 2020-03-24 09:11 squashfs-root/meta/loop -> loop
+lrwxrwxrwx 0/0                 9 2020-03-24 09:11 squashfs-root/meta/out -> ../../etc
+lrwxrwxrwx 0/0                 4 2020-03-24 09:11 squashfs-root/meta/abs -> /etc
+drwxr-xr-x 0/0                48 2020-03-24 09:11 squashfs-root/usr
+lrwxrwxrwx 0/0                 8 2020-03-24 09:11 squashfs-root/usr/icon.png -> ../share
+lrwxrwxrwx 0/0                 4 2020-03-24 09:11 squashfs-root/share -> meta
+""",
+        )
+        package = os.path.join(output_dir, "test.snap")
+        with open(package, "w") as f:
+            f.write("fake")
+
+        listing = reviewtools.common.get_pkg_listing(package)
+        paths = listing.paths()
+        self.assertEqual(len(paths), 9)
+        self.assertEqual(paths["meta/icon.png"], ("-", None))
+        self.assertEqual(paths["meta/link"], ("l", "../usr/icon.png"))
+
+        self.assertEqual(listing.resolve("meta/icon.png"), "meta/icon.png")
+        self.assertEqual(listing.resolve("./meta/../meta/icon.png"), "meta/icon.png")
+        self.assertEqual(listing.resolve("nonexistent/foo"), "nonexistent/foo")
+        self.assertEqual(listing.resolve("share/icon.png"), "meta/icon.png")
+        symlinks = set()
+        self.assertEqual(listing.resolve("meta/link", symlinks), "meta")
+        self.assertEqual(symlinks, set(["meta/link", "usr/icon.png", "share"]))
+        self.assertEqual(listing.resolve("meta/link/.."), "")
+        self.assertIsNone(listing.resolve("meta/loop"))
+        self.assertIsNone(listing.resolve("meta/out"))
+        self.assertIsNone(listing.resolve("meta/abs"))
+        self.assertIsNone(listing.resolve(".."))
+
+    def test_package_index_from_dir(self):
+        """Test PackageIndex.from_dir()"""
+        root = os.path.join(self.mkdtemp(), "squashfs-root")
+        self._write_file(os.path.join(root, "meta/snap.yaml"), "name: foo\n")
+        self._write_file(os.path.join(root, "meta/gui/icons/snap.foo.png"), "png")
+        self._write_file(os.path.join(root, "meta/gui/icons/.hidden"), "")
+        self._write_file(os.path.join(root, ".gitignore"), "")
+        self._write_file(os.path.join(root, "bin/foo"), "\x7fELF\x02\x01\x01")
+        os.symlink("foo", os.path.join(root, "bin/bar"))
+        os.symlink("../meta", os.path.join(root, "bin/meta"))
+        os.symlink("nonexistent", os.path.join(root, "bin/dangling"))
+        os.chmod(os.path.join(root, "bin/foo"), 0o755)
+
+        index = reviewtools.common.PackageIndex.from_dir(root)
+        walked = []
+        for (d, dirnames, filenames) in os.walk(root):
+            for f in filenames:
+                walked.append(os.path.relpath(os.path.join(d, f), root))
+        self.assertEqual(index.files(), walked)
+        self.assertEqual(len(index), 12)
+
+        entry = index.get("bin/foo")
+        self.assertEqual(entry.ftype, "-")
+        self.assertEqual(entry.size, 7)
+        self.assertEqual(entry.mode, 0o755)
+        self.assertEqual(index.get("bin/bar").target, "foo")
+        self.assertIsNone(index.get("nonexistent"))
+        self.assertTrue(index.isfile("bin/bar"))
+        self.assertTrue(index.isdir("bin/meta"))
+        self.assertEqual(index.filetype("bin/meta", follow_symlinks=False), "l")
+        self.assertEqual(index.filetype("bin/dangling"), "?")
+        self.assertEqual(
+            sorted(index.symlinks()),
+            [("bin/bar", "foo"), ("bin/dangling", "nonexistent")],
+        )
+
+        self.assertEqual(index.glob(".git*"), [".gitignore"])
+        self.assertEqual(sorted(index.glob("*")), ["bin", "meta"])
+        self.assertEqual(index.glob("*.yaml", "meta"), ["meta/snap.yaml"])
+        self.assertEqual(
+            sorted(index.with_prefix("meta/gui/")),
+            [
+                "meta/gui/icons",
+                "meta/gui/icons/.hidden",
+                "meta/gui/icons/snap.foo.png",
+            ],
+        )
+        self.assertEqual(index.with_basename("snap.yaml"), ["meta/snap.yaml"])
+
+        self.assertEqual(index.elf_class("bin/foo"), 2)
+        self.assertIsNone(index.elf_class("meta/snap.yaml"))
+        self.assertIsNone(index.elf_class("bin/bar"))
+
+    def test_package_index_from_listing(self):
+        """Test PackageIndex.from_listing()"""
+        output_dir = self.mkdtemp()
+        self._fake_unsquashfs(
+            output_dir,
+            """drwxrwxr-x 0/0                27 2020-03-24 09:11 squashfs-root
+drwxr-xr-x 0/0                48 2020-03-24 09:11 squashfs-root/meta
+-rwsr-xr-x 0/0              2870 2020-03-24 09:11 squashfs-root/meta/icon.png
+lrwxrwxrwx 0/0                15 2020-03-24 09:11 squashfs-root/meta/link -> ../usr/icon.png
+lrwxrwxrwx 0/0                 4 2020-03-24 09:11 squashfs-root/meta/abs -> /etc
+drwxr-xr-x 0/0                48 2020-03-24 09:11 squashfs-root/usr
+lrwxrwxrwx 0/0                 8 2020-03-24 09:11 squashfs-root/usr/icon.png -> ../share
+lrwxrwxrwx 0/0                 4 2020-03-24 09:11 squashfs-root/share -> meta
+-rw-r--r-- 0/0                 3 2020-03-24 09:11 squashfs-root/a
+srwxrwxrwx 0/0                 0 2020-03-24 09:11 squashfs-root/socket
+""",
+        )
+        package = os.path.join(output_dir, "test.snap")
+        with open(package, "w") as f:
+            f.write("fake")
+
+        listing = reviewtools.common.get_pkg_listing(package)
+        index = reviewtools.common.PackageIndex.from_listing(listing, output_dir)
+        self.assertEqual(index.files(), ["a", "meta/icon.png"])
+        self.assertNotIn("socket", index)
+
+        entry = index.get("meta/icon.png")
+        self.assertEqual(entry.ftype, "-")
+        self.assertEqual(entry.size, 2870)
+        self.assertEqual(entry.mode, 0o4755)
+        self.assertEqual(index.get("meta/link").target, "../usr/icon.png")
+        self.assertTrue(index.isdir("meta/link"))
+        self.assertTrue(index.isdir("meta/abs"))
+        self.assertEqual(
+            index.with_prefix("meta/"), ["meta/abs", "meta/icon.png", "meta/link"]
+        )
+
+    def test_unpack_pkg_items(self):
+        """Test unpack_pkg_items()"""
+        output_dir = self.mkdtemp()
+        unsquashfs = os.path.join(output_dir, "unsquashfs")
+        with open(unsquashfs, "w") as f:
+            f.write(
+                """#!/bin/sh
+for i in "$@"; do echo "$i"; done >> %s/unsquashfs.log
+"""
+                % output_dir
+            )
+        os.chmod(unsquashfs, 0o775)
+        old_path = os.environ["PATH"]
+        os.environ["PATH"] = "%s:%s" % (output_dir, old_path)
+        self.addCleanup(os.environ.__setitem__, "PATH", old_path)
+        self.addCleanup(reviewtools.common.cleanup_unpack)
+        # don't cache what the fake unsquashfs supports
+        self.addCleanup(
+            setattr,
+            reviewtools.common,
+            "UNSQUASHFS_SUPPORTS_IGNORE_ERRORS",
+            reviewtools.common.UNSQUASHFS_SUPPORTS_IGNORE_ERRORS,
+        )
+
+        package = os.path.join(output_dir, "test.snap")
+        self.assertTrue(
+            reviewtools.common.unpack_pkg_items(
+                package, output_dir, ["meta/icon.png", "bin/[foo]*"]
+            )
+        )
+        with open(os.path.join(output_dir, "unsquashfs.log")) as f:
+            args = f.read().splitlines()
+        self.assertEqual(args[-3:], [package, "meta/icon.png", "bin/\\[foo\\]\\*"])
+        self.assertTrue("-f" in args)
+        self.assertEqual(args[args.index("-d") + 1], output_dir)
+
+    def _write_file(self, fn, content):
+        os.makedirs(os.path.dirname(fn), exist_ok=True)
+        with open(fn, "w") as f:
+            f.write(content)
+
+    def _setup_unpack_cache(self):
+        """Enable the unpack cache in a temporary MKDTEMP_DIR"""
+        output_dir = self.mkdtemp()
+        # the cached packages are read-only
+        self.addCleanup(reviewtools.common._set_tree_writable, output_dir, True)
+        old_mkdtemp_dir = reviewtools.common.MKDTEMP_DIR
+        reviewtools.common.MKDTEMP_DIR = output_dir
+        self.addCleanup(setattr, reviewtools.common, "MKDTEMP_DIR", old_mkdtemp_dir)
+        os.environ["SNAP_REVIEW_UNPACK_CACHE"] = "1"
+        self.addCleanup(os.environ.pop, "SNAP_REVIEW_UNPACK_CACHE")
+        self.addCleanup(reviewtools.common.cleanup_unpack)
+        return os.path.join(output_dir, reviewtools.common.UNPACK_CACHE_DIRNAME)
+
+    def test_unpack_pkg_cached(self):
+        """Test unpack_pkg_cached()"""
+        cache_dir = self._setup_unpack_cache()
+        package = "./tests/test-link_0.1_all.snap"
+        unpacked = []
+
+        def _unpack_pkg(fn, dest=None, items=[], context=None):
+            unpacked.append(fn)
+            os.mkdir(dest)
+            self._write_file(os.path.join(dest, "meta/snap.yaml"), "name: test")
+
+        with patch("reviewtools.common.unpack_pkg", _unpack_pkg):
+            entry = reviewtools.common.unpack_pkg_cached(package)
+            self.assertEqual(os.path.dirname(entry), cache_dir)
+            self.assertTrue(
+                os.path.basename(entry).endswith("-%d" % os.stat(package).st_size)
+            )
+            self.assertEqual(unpacked, [os.path.abspath(package)])
+            self.assertTrue(
+                os.path.isfile(os.path.join(entry, "squashfs-root/meta/snap.yaml"))
+            )
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+            # the cached package is read-only
+            for name in ["", "meta", "meta/snap.yaml"]:
+                fn = os.path.join(entry, "squashfs-root", name)
+                self.assertEqual(os.stat(fn).st_mode & 0o222, 0, fn)
+
+            # the listing is cached too
+            listing = reviewtools.common.get_pkg_listing(package)
+            self.assertEqual(len(listing.parse()[1]), 3)
+
+            # cleanup_unpack() leaves the entry
+            context = reviewtools.common.DEFAULT_REVIEW_CONTEXT
+            context.unpack_cache_entry = entry
+            context.unpack_dir = os.path.join(entry, "squashfs-root")
+            reviewtools.common.set_unpack_cache_info("files", ["meta/snap.yaml"])
+            reviewtools.common.cleanup_unpack()
+            self.assertIsNone(context.unpack_dir)
+            self.assertTrue(os.path.isdir(entry))
+
+            # a re-review doesn't unpack again
+            self.assertEqual(reviewtools.common.unpack_pkg_cached(package), entry)
+            self.assertEqual(len(unpacked), 1)
+            context.unpack_cache_entry = entry
+            self.assertEqual(
+                reviewtools.common.get_unpack_cache_info("files"), ["meta/snap.yaml"]
+            )
+            self.assertIsNone(reviewtools.common.get_unpack_cache_info("bin_files"))
+
+    def test_set_unpack_cache_info_locked(self):
+        """Test set_unpack_cache_info() - concurrent updates"""
+        entry = self.mkdtemp()
+        context = reviewtools.common.DEFAULT_REVIEW_CONTEXT
+        context.unpack_cache_entry = entry
+        self.addCleanup(setattr, context, "unpack_cache_entry", None)
+        reviewtools.common.set_unpack_cache_info("files", ["a"])
+
+        # another review is updating it
+        fd = os.open(entry, os.O_RDONLY)
+        self.addCleanup(os.close, fd)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        t = threading.Thread(
+            target=reviewtools.common.set_unpack_cache_info, args=("bin_files", [])
+        )
+        t.start()
+        t.join(0.2)
+        self.assertTrue(t.is_alive())
+        with open(os.path.join(entry, "info.json"), "w") as f:
+            json.dump({"files": ["a"], "size": 1}, f)
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        t.join()
+
+        self.assertEqual(
+            reviewtools.common._read_unpack_cache_info(entry),
+            {"files": ["a"], "size": 1, "bin_files": []},
+        )
+
+    def test_prune_unpack_cache(self):
+        """Test prune_unpack_cache()"""
+        cache_dir = self._setup_unpack_cache()
+        os.environ["SNAP_REVIEW_UNPACK_CACHE_SIZE"] = "3"
+        self.addCleanup(os.environ.pop, "SNAP_REVIEW_UNPACK_CACHE_SIZE")
+
+        now = time.time()
+        day = 24 * 60 * 60
+        for (name, age, size) in [
+            ("recent", 60, 2),  # too recent to remove
+            ("newer", day, 1),
+            ("older", 2 * day, 1),  # over the size limit
+            ("oldest", 8 * day, 0),  # over the age limit
+            ("tmp-interrupted", day, 0),
+        ]:
+            entry = os.path.join(cache_dir, name)
+            self._write_file(
+                os.path.join(entry, "info.json"), '{"size": %d}' % (size * 1024 * 1024)
+            )
+            # with a read-only cached package
+            squashfs_root = os.path.join(entry, "squashfs-root")
+            self._write_file(os.path.join(squashfs_root, "meta/snap.yaml"), "")
+            reviewtools.common._set_tree_writable(squashfs_root, False)
+            os.utime(entry, (now - age, now - age))
+
+        reviewtools.common.prune_unpack_cache()
+        self.assertEqual(sorted(os.listdir(cache_dir)), ["newer", "recent"])
+
+    def test_get_sha512sum(self):
+        """Test get_sha512sum()"""
+        fn = os.path.join(self.mkdtemp(), "foo")
+        self._write_file(fn, "foo\n")
+        self.assertEqual(
+            reviewtools.common.get_sha512sum(fn),
+            "0cf9180a764aba863a67b6d72f0918bc131c6772642cb2dce5a34f0a702f9470"
+            "ddc2bf125c12198b1995c233c34b4afd346c54a2334c350a948a51b6e8b4e6b6",
+        )
+
+    def test_compare_files(self):
+        """Test compare_files()"""
+        output_dir = self.mkdtemp()
+        content = "".join("%d\n" % i for i in range(10000))
+        fn = os.path.join(output_dir, "orig")
+        self._write_file(fn, content)
+        for (name, other, offset) in [
+            ("same", content, None),
+            ("first", "x" + content[1:], 0),
+            ("middle", content[:5000] + "x" + content[5001:], 5000),
+            ("last", content[:-1] + "x", len(content) - 1),
+            ("shorter", content[:-10], len(content) - 10),
+            ("longer", content + "x", len(content)),
+            ("empty", "", 0),
+        ]:
+            other_fn = os.path.join(output_dir, name)
+            self._write_file(other_fn, other)
+            # use a small chunk size to compare over several reads
+            for chunk_size in [1000, reviewtools.common.COMPARE_CHUNK_SIZE]:
+                self.assertEqual(
+                    reviewtools.common.compare_files(fn, other_fn, chunk_size),
+                    offset,
+                    "%s (chunk size %d)" % (name, chunk_size),
+                )
+
+    def test_compare_files_nonexistent(self):
+        """Test compare_files() - nonexistent"""
+        fn = os.path.join(self.mkdtemp(), "foo")
+        self._write_file(fn, "foo\n")
+        with self.assertRaises(OSError):
+            reviewtools.common.compare_files(fn, fn + ".nonexistent")
+
+    def test_get_squashfs_tools_version(self):
+        """Test get_squashfs_tools_version()"""
+        output_dir = self.mkdtemp()
+        for tool in ["unsquashfs", "mksquashfs"]:
+            self._write_file(
+                os.path.join(output_dir, tool),
+                "#!/bin/sh\necho %s version 4.5 '(2021/07/25)'\n" % tool,
+            )
+            os.chmod(os.path.join(output_dir, tool), 0o775)
+
+        self.addCleanup(setattr, reviewtools.common, "SQUASHFS_TOOLS_VERSION", None)
+        old_path = os.environ["PATH"]
+        self.addCleanup(os.environ.__setitem__, "PATH", old_path)
+        os.environ["PATH"] = output_dir
+        reviewtools.common.SQUASHFS_TOOLS_VERSION = None
+        res = reviewtools.common.get_squashfs_tools_version()
+        self.assertTrue(res.startswith("unsquashfs version 4.5 (2021/07/25) ("))
+        self.assertIn("; mksquashfs version 4.5 (2021/07/25) (", res)
+
+        os.unlink(os.path.join(output_dir, "mksquashfs"))
+        self.assertEqual(reviewtools.common.get_squashfs_tools_version(), res)
+        reviewtools.common.SQUASHFS_TOOLS_VERSION = None
+        self.assertIsNone(reviewtools.common.get_squashfs_tools_version())
+
+    def test_profile_timer(self):
+        """Test ProfileTimer()"""
+        timings = {}
+        with ProfileTimer(timings, "check_foo"):
+            reviewtools.common.cmd(["true"])
+        self.assertEqual(timings, {})
+
+        os.environ["RT_PROFILE"] = "1"
+        self.addCleanup(os.environ.pop, "RT_PROFILE")
+        for i in range(2):
+            with ProfileTimer(timings, "check_foo"):
+                reviewtools.common.cmd(["true"])
+        self.assertEqual(list(timings), ["check_foo"])
+        self.assertEqual(
+            sorted(timings["check_foo"]),
+            ["children_cpu", "cpu", "max_rss_delta", "subprocesses", "wall"],
+        )
+        self.assertEqual(timings["check_foo"]["subprocesses"], 2)
+        self.assertTrue(timings["check_foo"]["wall"] > 0)
+
+    def test_do_checks_profile(self):
+        """Test do_checks() with RT_PROFILE=1"""
+
+        class FooReview(reviewtools.common.ReviewBase):
+            def check_foo(self):
+                pass
+
+            def check_bar(self):
+                pass
+
+        os.environ["RT_PROFILE"] = "1"
+        self.addCleanup(os.environ.pop, "RT_PROFILE")
+        review = FooReview("foo")
+        review.do_checks()
+        self.assertEqual(sorted(review.timings), ["check_bar", "check_foo"])
+
+    def test_check_registry(self):
+        """Test the check registry"""
+
+        class FooReview(reviewtools.common.ReviewBase):
+            @reviewtools.common.check_metadata(cost="expensive")
+            def check_foo(self):
+                pass
+
+            def check_bar(self):
+                pass
+
+            def _check_baz(self):
+                pass
+
+        class BarReview(FooReview):
+            @reviewtools.common.check_metadata(cost="cheap", needs="yaml")
+            def check_qux(self):
+                pass
+
+            check_bar = None
+
+        self.assertEqual(sorted(FooReview.checks), ["check_bar", "check_foo"])
+        self.assertEqual(
+            FooReview.checks["check_foo"],
+            reviewtools.common.CheckInfo("check_foo", "expensive", "unpack", True),
+        )
+        self.assertEqual(
+            FooReview.checks["check_bar"],
+            reviewtools.common.CheckInfo("check_bar", "normal", "unpack", True),
+        )
+        self.assertEqual(sorted(BarReview.checks), ["check_foo", "check_qux"])
+        self.assertEqual(
+            [c.name for c in BarReview.get_checks()], ["check_foo", "check_qux"]
+        )
+        self.assertEqual(
+            [c.name for c in BarReview.get_checks(fail_fast=True)],
+            ["check_qux", "check_foo"],
+        )
+
+    def test_check_metadata_invalid(self):
+        """Test check_metadata() - invalid"""
+        with self.assertRaises(ValueError):
+            reviewtools.common.check_metadata(cost="free")
+        with self.assertRaises(ValueError):
+            reviewtools.common.check_metadata(needs="network")
+
+    def test_do_checks_fail_fast(self):
+        """Test do_checks() - fail_fast"""
+        ran = []
+
+        class FooReview(reviewtools.common.ReviewBase):
+            @reviewtools.common.check_metadata(cost="cheap", blocking=False)
+            def check_foo(self):
+                ran.append("check_foo")
+                self._add_result("error", "foo", "not blocking")
+
+            @reviewtools.common.check_metadata(cost="cheap")
+            def check_bar(self):
+                ran.append("check_bar")
+                self._add_result("info", "bar", "OK")
+
+            def check_baz(self):
+                ran.append("check_baz")
+                self._add_result("error", "baz", "blocking")
+
+            @reviewtools.common.check_metadata(cost="expensive")
+            def check_qux(self):
+                ran.append("check_qux")
+
+        streamed = []
+        review = FooReview("foo")
+        self.assertFalse(review.do_checks(fail_fast=False))
+        self.assertEqual(ran, ["check_bar", "check_baz", "check_foo", "check_qux"])
+
+        ran.clear()
+        review = FooReview("foo")
+        self.assertTrue(
+            review.do_checks(
+                fail_fast=True, callback=lambda n, r: streamed.append((n, r))
+            )
+        )
+        self.assertEqual(ran, ["check_bar", "check_foo", "check_baz"])
+        self.assertEqual(streamed[0][0], "check_bar")
+        self.assertEqual(list(streamed[0][1]["info"]), ["bar"])
+        self.assertEqual(list(streamed[1][1]["error"]), ["foo"])
+        self.assertEqual(list(streamed[2][1]["error"]), ["baz"])
+
+        # only some costs
+        ran.clear()
+        review = FooReview("foo")
+        self.assertFalse(review.do_checks(costs=["expensive"], fail_fast=True))
+        self.assertEqual(ran, ["check_qux"])
+
+    def test_lazy_imports(self):
+        """Test slow modules aren't imported with the review modules"""
+        out = subprocess.check_output(
+            [
+                sys.executable,
+                "-c",
+                "import sys, reviewtools.sr_lint, reviewtools.modules; "
+                "print(' '.join(sorted(sys.modules)))",
+            ],
+            universal_newlines=True,
+        ).split()
+        for m in ["imp", "magic", "pkg_resources", "smtplib"]:
+            self.assertNotIn(m, out)
+
+    def test_get_package_data_filename(self):
+        """Test get_package_data_filename()"""
+        fn = reviewtools.common.get_package_data_filename(
+            "snapd-base-declaration.yaml"
+        )
+        self.assertTrue(os.path.isfile(fn))
+
+    def test_check_selected(self):
+        """Test check_selected()"""
+        for (only, skip, name, selected) in [
+            ("", "", "check_foo", True),
+            ("foo-v2:fo*", "", "check_foo", True),
+            ("foo-v2:fo*", "", "check_bar", False),
+            ("bar-v2:*", "", "check_foo", False),
+            ("fo*,bar", "", "check_bar", True),
+            ("", "foo", "check_foo", False),
+            ("", "foo-v2:b*", "check_foo", True),
+            ("foo-v2:*", "foo", "check_foo", False),
+        ]:
+            with patch.dict(
+                os.environ, {"RT_ONLY_CHECKS": only, "RT_SKIP_CHECKS": skip}
+            ):
+                self.assertEqual(
+                    reviewtools.common.check_selected("foo-v2", name),
+                    selected,
+                    (only, skip, name),
+                )
+
+    def test_get_needed_input(self):
+        """Test get_needed_input()"""
+
+        class FooReview(reviewtools.common.ReviewBase):
+            @reviewtools.common.check_metadata(needs="yaml")
+            def check_foo(self):
+                pass
+
+            @reviewtools.common.check_metadata(needs="listing")
+            def check_bar(self):
+                pass
+
+            def check_baz(self):
+                pass
+
+        review = FooReview("foo-v2")
+        for (only, needs) in [
+            ("", "binaries"),
+            ("foo", "yaml"),
+            ("foo,bar", "listing"),
+            ("ba*", "unpack"),
+            ("nonexistent", None),
+        ]:
+            with patch.dict(os.environ, {"RT_ONLY_CHECKS": only}):
+                self.assertEqual(review.get_needed_input(), needs, only)
+
+    def test_do_checks_selected(self):
+        """Test do_checks() with RT_SKIP_CHECKS"""
+
+        class FooReview(reviewtools.common.ReviewBase):
+            def check_foo(self):
+                self._add_result("info", "foo", "OK")
+
+            def check_bar(self):
+                self._add_result("info", "bar", "OK")
+
+        review = FooReview("foo-v2")
+        with patch.dict(os.environ, {"RT_SKIP_CHECKS": "foo-v2:bar"}):
+            review.do_checks()
+        self.assertEqual(list(review.review_report["info"]), ["foo"])
+
+    def test_format_timings(self):
+        """Test format_timings()"""
+        t = {
+            "wall": 0.5,
+            "cpu": 0.25,
+            "children_cpu": 0.0,
+            "subprocesses": 1,
+            "max_rss_delta": 12,
+        }
+        fast = dict(t, wall=0.125)
+        lines = reviewtools.common.format_timings(
+            {"snap.v2_foo": {"check_fast": fast, "check_slow": t}}
+        ).splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[0].startswith("Check "))
+        self.assertEqual(
+            lines[1].split(),
+            ["snap.v2_foo:check_slow", "0.500", "0.250", "0.000", "1", "12"],
+        )
+        self.assertTrue(lines[2].startswith("snap.v2_foo:check_fast "))
+
     def test_unsquashfs_lln_parse_good(self):
         """Test unsquashfs_lln_parse() - good"""
         input = """Parallel unsquashfs: Using 4 processors
@@ -542,9 +1223,9 @@ drwxr-xr-x 0/0                48 2020-03-24 09:11 squashfs-root/meta
     def test_unpack_rock_invalid_format(self):
         """Test unpack_rock() - invalid rock format """
         invalid_rock = "./tests/test-snapcraft-manifest-unittest_0_amd64.snap"
-        with self.assertRaises(SystemExit) as e:
+        with self.assertRaises(FatalReviewError) as e:
             reviewtools.common.unpack_rock(invalid_rock)
-        self.assertEqual(e.exception.code, 1)
+        self.assertEqual(e.exception.exit_code, 1)
 
     def test_unpack_rock_valid_format(self):
         """Test unpack_rock() - valid rock format """
@@ -557,17 +1238,17 @@ drwxr-xr-x 0/0                48 2020-03-24 09:11 squashfs-root/meta
         """Test unpack_rock() - invalid - filename starting with slash """
         # TODO: add further unit testing for tar unpacking functionality
         invalid_rock = "./tests/test-rock-invalid-1.tar"
-        with self.assertRaises(SystemExit) as e:
+        with self.assertRaises(FatalReviewError) as e:
             reviewtools.common.unpack_rock(invalid_rock)
-        self.assertEqual(e.exception.code, 1)
+        self.assertEqual(e.exception.exit_code, 1)
 
     def test_unpack_rock_invalid_format_filename_with_two_dots(self):
         """Test unpack_rock() - invalid - filename with two dots """
         # TODO: add further unit testing for tar unpacking functionality
         invalid_rock = "./tests/test-rock-invalid-2.tar"
-        with self.assertRaises(SystemExit) as e:
+        with self.assertRaises(FatalReviewError) as e:
             reviewtools.common.unpack_rock(invalid_rock)
-        self.assertEqual(e.exception.code, 1)
+        self.assertEqual(e.exception.exit_code, 1)
 
     def test_get_rock_manifest(self):
         """Test get_rock_manifest() """
@@ -699,3 +1380,212 @@ drwxr-xr-x 0/0                48 2020-03-24 09:11 squashfs-root/meta
             e.exception.value,
             "Unexpected number of layer tar archives inside layer directory: 2",
         )
+
+    def test_read_snapd_base_declaration(self):
+        """Test read_snapd_base_declaration() - parsed once"""
+        reviewtools.common.SNAPD_BASE_DECLARATION = None
+        (series, decl) = reviewtools.common.read_snapd_base_declaration()
+        self.assertEqual(series, "16")
+        self.assertIn("network", decl["slots"])
+        decl["slots"]["nonexistent"] = {}
+
+        with patch("reviewtools.common.load_yaml") as load_yaml:
+            (series, decl2) = reviewtools.common.read_snapd_base_declaration()
+        load_yaml.assert_not_called()
+        # callers get their own copy
+        self.assertNotIn("nonexistent", decl2["slots"])
+
+    def test_get_snapd_base_declaration_cache(self):
+        """Test get_snapd_base_declaration() - base declaration cache"""
+        cache_fn = os.path.join(self.mkdtemp(), "cache.json")
+        os.environ["SNAP_REVIEW_BASE_DECL_CACHE"] = cache_fn
+        self.addCleanup(os.environ.pop, "SNAP_REVIEW_BASE_DECL_CACHE")
+        self.addCleanup(setattr, reviewtools.common, "SNAPD_BASE_DECLARATION", None)
+
+        reviewtools.common.SNAPD_BASE_DECLARATION = None
+        bd = reviewtools.common.get_snapd_base_declaration()
+        self.assertTrue(os.path.exists(cache_fn))
+        self.assertIn("network", bd.decl["slots"])
+
+        # the cache is used instead of parsing the yaml
+        reviewtools.common.SNAPD_BASE_DECLARATION = None
+        with patch("reviewtools.common.load_yaml") as load_yaml:
+            bd2 = reviewtools.common.get_snapd_base_declaration()
+        load_yaml.assert_not_called()
+        self.assertIsNot(bd, bd2)
+        self.assertEqual(bd.decl, bd2.decl)
+        self.assertEqual(bd.sha256, bd2.sha256)
+
+        # but not if it is for another yaml
+        with open(cache_fn, "r") as f:
+            cached = json.load(f)
+        cached["sha256"] = "0"
+        with open(cache_fn, "w") as f:
+            json.dump(cached, f)
+        reviewtools.common.SNAPD_BASE_DECLARATION = None
+        decl = {"plugs": {}, "slots": {}}
+        with patch(
+            "reviewtools.common.load_yaml", return_value={"16": decl}
+        ) as load_yaml:
+            bd3 = reviewtools.common.get_snapd_base_declaration()
+        load_yaml.assert_called_once()
+        self.assertEqual(bd3.decl, decl)
+
+    def test_get_snapd_base_declaration_cache_invalid(self):
+        """Test get_snapd_base_declaration() - invalid base declaration cache"""
+        cache_fn = os.path.join(self.mkdtemp(), "cache.json")
+        with open(cache_fn, "w") as f:
+            f.write("invalid")
+        os.environ["SNAP_REVIEW_BASE_DECL_CACHE"] = cache_fn
+        self.addCleanup(os.environ.pop, "SNAP_REVIEW_BASE_DECL_CACHE")
+        self.addCleanup(setattr, reviewtools.common, "SNAPD_BASE_DECLARATION", None)
+
+        reviewtools.common.SNAPD_BASE_DECLARATION = None
+        bd = reviewtools.common.get_snapd_base_declaration()
+        self.assertIn("network", bd.decl["slots"])
+        # replaced
+        with open(cache_fn, "r") as f:
+            self.assertEqual(json.load(f)["sha256"], bd.sha256)
+
+    def test_read_base_declaration_file(self):
+        """Test read_base_declaration_file()"""
+        bd = reviewtools.common.get_snapd_base_declaration()
+        bd_fn = os.path.join(self.mkdtemp(), "bd.yaml")
+        with open(bd_fn, "w") as f:
+            yaml.safe_dump({"16": bd.decl}, f)
+        bd2 = reviewtools.common.read_base_declaration_file(bd_fn)
+        self.assertEqual(bd2.series, "16")
+        self.assertEqual(bd2.decl, bd.decl)
+
+    def test_read_base_declaration_file_invalid(self):
+        """Test read_base_declaration_file() - invalid"""
+        bd_fn = os.path.join(self.mkdtemp(), "bd.yaml")
+        for contents in ["{", '"16": {"plugs": {}}', '"18": {}', "[]"]:
+            with open(bd_fn, "w") as f:
+                f.write(contents)
+            with self.assertRaises(FatalReviewError) as e:
+                reviewtools.common.read_base_declaration_file(bd_fn)
+            self.assertEqual(e.exception.exit_code, 1)
+
+        with self.assertRaises(FatalReviewError):
+            reviewtools.common.read_base_declaration_file(bd_fn + ".nonexistent")
+
+    def test_load_yaml(self):
+        """Test load_yaml()"""
+        contents = """
+base: &base
+  a: 1
+  b: [1, 2]
+map:
+  <<: *base
+  b: 3
+null-value:
+"""
+        self.assertEqual(
+            reviewtools.common.load_yaml(contents), yaml.safe_load(contents)
+        )
+        self.assertEqual(
+            reviewtools.common.load_yaml(io.StringIO(contents)),
+            yaml.safe_load(contents),
+        )
+
+    def test_load_yaml_duplicated_keys(self):
+        """Test load_yaml() - duplicated keys"""
+        for contents, problem in [
+            ("a: 1\nb: 2\na: 3\n", 'found duplicate key "a" with value "3"'),
+            ("map:\n key:\n key:\n", 'found duplicate key "key"'),
+            ("map:\n k: [1]\n k: {}\n", 'found duplicate key "k" with value "{}"'),
+        ]:
+            with self.assertRaises(reviewtools.common.DuplicateYamlKeyError) as e:
+                reviewtools.common.load_yaml(contents)
+            self.assertIn(problem, str(e.exception))
+
+            # allowed, last one wins like yaml.safe_load()
+            self.assertEqual(
+                reviewtools.common.load_yaml(contents, allow_duplicate_keys=True),
+                yaml.safe_load(contents),
+            )
+
+    def test_review_context(self):
+        """Test ReviewContext - reviews with their own context"""
+        c1 = ReviewContext()
+        c2 = ReviewContext(report_output="console")
+        self.assertEqual(c1.report_output, "json")
+        self.assertEqual(c2.report_output, "console")
+
+        d1 = reviewtools.common.create_tempdir(c1)
+        d2 = reviewtools.common.create_tempdir(c2)
+        self.assertNotEqual(d1, d2)
+        self.assertEqual(reviewtools.common.create_tempdir(c1), d1)
+        self.assertIsNone(reviewtools.common.DEFAULT_REVIEW_CONTEXT.tmp_dir)
+
+        r1 = SnapReview("app.snap", "common_review_type", context=c1)
+        r2 = SnapReview("app.snap", "common_review_type", context=c2)
+        self.assertIs(r1.context, c1)
+        self.assertIs(r2.context, c2)
+        r1.set_report_type("console")
+        self.assertEqual(c1.report_output, "console")
+        self.assertIs(self.review.context, reviewtools.common.DEFAULT_REVIEW_CONTEXT)
+
+        reviewtools.common.cleanup_unpack(c1)
+        self.assertFalse(os.path.exists(d1))
+        self.assertIsNone(c1.tmp_dir)
+        # only the package state is reset
+        self.assertEqual(c1.report_output, "console")
+        self.assertTrue(os.path.isdir(d2))
+        reviewtools.common.cleanup_unpack(c2)
+        self.assertFalse(os.path.exists(d2))
+        self.assertEqual(c2.report_output, "console")
+
+    def test_cleanup_worker(self):
+        """Test cleanup_worker() - only removes what the worker unpacked"""
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        shared = os.path.join(tmpdir, "shared")
+        own = os.path.join(tmpdir, "own")
+        for d in [shared, own]:
+            os.mkdir(d)
+            os.mkdir(os.path.join(d, "raw"))
+
+        # unpacked before forking
+        context = ReviewContext()
+        context.unpack_dir = shared
+        context.raw_unpack_dir = os.path.join(shared, "raw")
+        context.pkg_files = ["foo"]
+        tmp = reviewtools.common.create_tempdir(context)
+        shared_dirs = [context.unpack_dir, context.raw_unpack_dir]
+        reviewtools.common.cleanup_worker(shared_dirs, context)
+        self.assertFalse(os.path.exists(tmp))
+        self.assertTrue(os.path.isdir(os.path.join(shared, "raw")))
+        self.assertEqual(context.unpack_dir, shared)
+        self.assertEqual(context.pkg_files, ["foo"])
+
+        # unpacked by the worker
+        context = ReviewContext()
+        context.unpack_dir = own
+        context.raw_unpack_dir = os.path.join(own, "raw")
+        reviewtools.common.cleanup_worker([], context)
+        self.assertFalse(os.path.exists(own))
+        self.assertIsNone(context.unpack_dir)
+        self.assertIsNone(context.raw_unpack_dir)
+        self.assertTrue(os.path.isdir(shared))
+
+    def test_error(self):
+        """Test error() - raises FatalReviewError"""
+        with self.assertRaises(FatalReviewError) as e:
+            reviewtools.common.error("bad", exit_code=2, output_type="console")
+        self.assertEqual(str(e.exception), "bad")
+        self.assertEqual(e.exception.exit_code, 2)
+        self.assertEqual(e.exception.output_type, "console")
+
+    def test_exit_on_fatal_error(self):
+        """Test exit_on_fatal_error()"""
+        context = ReviewContext()
+        with patch("sys.stdout", new_callable=io.StringIO) as stdout:
+            with self.assertRaises(SystemExit) as e:
+                reviewtools.common.exit_on_fatal_error(
+                    FatalReviewError("bad", 3), context
+                )
+        self.assertEqual(e.exception.code, 3)
+        report = json.loads(stdout.getvalue())
+        self.assertEqual(report["runtime-errors"]["error"]["msg"]["text"], "bad")
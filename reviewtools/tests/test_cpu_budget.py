@@ -0,0 +1,139 @@
+"""test_cpu_budget.py: tests for the cpu_budget module"""
+#
+# Copyright (C) 2021 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+
+from reviewtools.cpu_budget import CpuTokens, add_processors_option, get_cpu_budget
+
+
+class TestCpuBudget(unittest.TestCase):
+    """Tests for the cpu_budget module"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.budget_dir = os.path.join(self.tmpdir, "budget")
+
+    def test_get_cpu_budget(self):
+        """Test get_cpu_budget()"""
+        for (val, budget) in [
+            ("", None),
+            ("0", None),
+            ("4", 4),
+            ("-1", None),
+            ("four", None),
+        ]:
+            with patch.dict(os.environ, {"SNAP_REVIEW_CPUS": val}):
+                self.assertEqual(get_cpu_budget(), budget, val)
+
+    def test_add_processors_option(self):
+        """Test add_processors_option()"""
+        for (cmdline, expected) in [
+            (
+                ["unsquashfs", "-d", "dir", "foo.snap"],
+                ["unsquashfs", "-processors", "2", "-d", "dir", "foo.snap"],
+            ),
+            (
+                ["fakeroot", "-s", "env", "unsquashfs", "foo.snap"],
+                ["fakeroot", "-s", "env", "unsquashfs", "-processors", "2", "foo.snap"],
+            ),
+            (
+                ["mksquashfs", "dir", "foo.snap", "-comp", "xz"],
+                ["mksquashfs", "dir", "foo.snap", "-comp", "xz", "-processors", "2"],
+            ),
+            (
+                ["/usr/bin/mksquashfs", "dir", "foo.snap"],
+                ["/usr/bin/mksquashfs", "dir", "foo.snap", "-processors", "2"],
+            ),
+            (["ls", "-l"], ["ls", "-l"]),
+        ]:
+            self.assertEqual(add_processors_option(cmdline, 2), expected)
+        self.assertEqual(
+            add_processors_option(["unsquashfs", "foo.snap"], None),
+            ["unsquashfs", "foo.snap"],
+        )
+
+    def test_cpu_tokens_unlimited(self):
+        """Test CpuTokens - not limited"""
+        with patch.dict(os.environ, {"SNAP_REVIEW_CPUS": ""}):
+            with CpuTokens(path=self.budget_dir) as processors:
+                self.assertIsNone(processors)
+        self.assertFalse(os.path.exists(self.budget_dir))
+
+    def test_cpu_tokens(self):
+        """Test CpuTokens"""
+        with CpuTokens(4, self.budget_dir) as processors:
+            self.assertEqual(processors, 4)
+        # the client lock file is removed
+        self.assertEqual(
+            sorted(os.listdir(self.budget_dir)), ["token.%d" % i for i in range(4)]
+        )
+
+    def test_cpu_tokens_umask(self):
+        """Test CpuTokens - shared by all users whatever the umask"""
+        old_umask = os.umask(0o022)
+        self.addCleanup(os.umask, old_umask)
+        other = CpuTokens(4, self.budget_dir)
+        other._register()
+        self.addCleanup(other.release)
+        with CpuTokens(4, self.budget_dir) as processors:
+            self.assertIn(processors, [1, 2])
+            self.assertEqual(os.stat(self.budget_dir).st_mode & 0o7777, 0o1777)
+            for name in os.listdir(self.budget_dir):
+                st = os.stat(os.path.join(self.budget_dir, name))
+                self.assertEqual(st.st_mode & 0o777, 0o644, name)
+
+        # the files of another user can't be written to, but can be locked
+        for name in os.listdir(self.budget_dir):
+            os.chmod(os.path.join(self.budget_dir, name), 0o444)
+        with patch("os.getuid", return_value=os.getuid() + 1):
+            with CpuTokens(4, self.budget_dir) as processors:
+                self.assertIn(processors, [1, 2])
+
+    def test_cpu_tokens_share(self):
+        """Test CpuTokens - shared with another client"""
+        other = CpuTokens(4, self.budget_dir)
+        other._register()
+        self.addCleanup(other.release)
+        with CpuTokens(4, self.budget_dir) as processors:
+            self.assertIn(processors, [1, 2])
+
+    def test_cpu_tokens_stale_client(self):
+        """Test CpuTokens - stale client"""
+        os.makedirs(self.budget_dir)
+        stale = os.path.join(self.budget_dir, "client.stale")
+        with open(stale, "w"):
+            pass
+        with CpuTokens(4, self.budget_dir) as processors:
+            self.assertEqual(processors, 4)
+        self.assertFalse(os.path.exists(stale))
+
+    def test_cpu_tokens_wait(self):
+        """Test CpuTokens - wait for tokens"""
+        other = CpuTokens(2, self.budget_dir)
+        self.assertEqual(other.acquire(), 2)
+        timer = threading.Timer(0.3, other.release)
+        timer.start()
+        self.addCleanup(timer.cancel)
+        with CpuTokens(2, self.budget_dir) as processors:
+            # only after the other client released them
+            self.assertEqual(other._tokens, [])
+            self.assertIn(processors, [1, 2])
@@ -0,0 +1,134 @@
+"""test_daemon.py: tests for the daemon module"""
+#
+# Copyright (C) 2021 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+import reviewtools.common
+from reviewtools.daemon import ReviewDaemon, submit_review
+
+# stands in for bin/snap-review
+FAKE_SNAP_REVIEW = """
+import os
+import sys
+
+if sys.argv[1] == "--raise":
+    raise RuntimeError("oops")
+os.environ["FOO"] = "changed"
+print("%d %s %s %s" % (os.getpid(), os.getcwd(), os.environ.get("BAR"), sys.argv[1:]))
+print("warning", file=sys.stderr)
+sys.exit(int(sys.argv[1]))
+"""
+
+
+class TestDaemon(unittest.TestCase):
+    """Tests for the daemon module"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.snap_review = os.path.join(self.tmpdir, "snap-review")
+        with open(self.snap_review, "w") as f:
+            f.write(FAKE_SNAP_REVIEW)
+        self.socket_path = os.path.join(self.tmpdir, "daemon.sock")
+
+    def test_run_job(self):
+        """Test ReviewDaemon.run_job()"""
+        d = ReviewDaemon(self.socket_path, self.snap_review)
+        os.environ["FOO"] = "orig"
+        self.addCleanup(os.environ.pop, "FOO")
+        cwd = os.getcwd()
+        argv = sys.argv
+        reply = d.run_job(
+            {"args": ["3", "foo.snap"], "cwd": self.tmpdir, "env": {"BAR": "bar"}}
+        )
+        self.assertEqual(reply["rc"], 3)
+        self.assertEqual(
+            reply["output"],
+            "%d %s bar ['3', 'foo.snap']\n" % (os.getpid(), self.tmpdir),
+        )
+        self.assertEqual(reply["stderr"], "warning\n")
+        # the state of the process is restored
+        self.assertEqual(os.environ["FOO"], "orig")
+        self.assertNotIn("BAR", os.environ)
+        self.assertEqual(os.getcwd(), cwd)
+        self.assertIs(sys.argv, argv)
+        self.assertIsNone(reviewtools.common.DEFAULT_REVIEW_CONTEXT.unpack_dir)
+
+    def test_run_job_exception(self):
+        """Test ReviewDaemon.run_job() - exception"""
+        d = ReviewDaemon(self.socket_path, self.snap_review)
+        reply = d.run_job({"args": ["--raise"]})
+        self.assertEqual(reply["rc"], 1)
+        self.assertIn("RuntimeError: oops", reply["stderr"])
+
+    def test_run_job_invalid(self):
+        """Test ReviewDaemon.run_job() - invalid job"""
+        d = ReviewDaemon(self.socket_path, self.snap_review)
+        for job in [
+            [],
+            {},
+            {"args": "foo.snap"},
+            {"args": ["foo.snap", 1]},
+            {"args": [], "cwd": 1},
+            {"args": [], "env": {"FOO": 1}},
+        ]:
+            with self.assertRaises(ValueError):
+                d.run_job(job)
+
+    def test_serve(self):
+        """Test ReviewDaemon.serve() and submit_review()"""
+        p = subprocess.Popen(
+            [
+                sys.executable,
+                "-c",
+                "import sys; from reviewtools.daemon import ReviewDaemon; "
+                "ReviewDaemon(sys.argv[1], sys.argv[2], 1, 2).serve()",
+                self.socket_path,
+                self.snap_review,
+            ],
+            env=dict(os.environ, PYTHONPATH=os.getcwd()),
+        )
+        self.addCleanup(p.wait)
+        self.addCleanup(p.terminate)
+        for i in range(100):
+            if os.path.exists(self.socket_path):
+                break
+            time.sleep(0.1)
+
+        pids = []
+        for i in range(3):
+            (rc, output, stderr) = submit_review(
+                self.socket_path, ["2", "foo.snap"], cwd=self.tmpdir
+            )
+            self.assertEqual(rc, 2)
+            self.assertEqual(stderr, "warning\n")
+            (pid, rest) = output.split(" ", 1)
+            self.assertEqual(rest, "%s None ['2', 'foo.snap']\n" % self.tmpdir)
+            pids.append(pid)
+        # the worker is replaced after 2 jobs
+        self.assertEqual(pids[0], pids[1])
+        self.assertNotEqual(pids[1], pids[2])
+
+        p.send_signal(signal.SIGTERM)
+        self.assertEqual(p.wait(timeout=10), 0)
+        self.assertFalse(os.path.exists(self.socket_path))
@@ -0,0 +1,109 @@
+"""test_declaration_impact.py: tests for the declaration_impact module"""
+#
+# Copyright (C) 2021 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import copy
+import unittest
+from unittest.mock import patch
+
+import reviewtools.common
+import reviewtools.declaration_impact as declaration_impact
+from reviewtools.common import BaseDeclaration
+
+
+class TestDeclarationImpact(unittest.TestCase):
+    """Tests for the declaration_impact module"""
+
+    def setUp(self):
+        self.old_base = reviewtools.common.get_snapd_base_declaration()
+        # network-control can no longer be installed
+        decl = copy.deepcopy(self.old_base.decl)
+        decl["plugs"]["network-control"] = {"allow-installation": False}
+        self.new_base = BaseDeclaration(self.old_base.series, decl, "0")
+
+        self.db = {}
+        for (snap_id, iface) in [("id1", "network"), ("id2", "network-control")]:
+            self.db[snap_id] = {}
+            for rev in ["1", "2"]:
+                self.db[snap_id][rev] = {
+                    "name": "snap-%s" % snap_id,
+                    "yaml": {"name": "snap-%s" % snap_id, "plugs": {iface: None}},
+                }
+
+    def test_evaluate_revision(self):
+        """Test evaluate_revision()"""
+        old = declaration_impact.compile_base_declaration(self.old_base)
+        new = declaration_impact.compile_base_declaration(self.new_base)
+        snap_yaml = {"name": "foo", "plugs": {"network-control": None}}
+        self.assertEqual(declaration_impact.evaluate_revision(snap_yaml, old), {})
+
+        verdict = declaration_impact.evaluate_revision(snap_yaml, new)
+        name = "declaration-snap-v2:plugs_installation:network-control:network-control"
+        self.assertEqual(list(verdict), ["error"])
+        self.assertEqual(list(verdict["error"]), [name])
+
+        # allowed by the snap declaration, which isn't modified
+        snap_decl = {"plugs": {"network-control": {"allow-installation": True}}}
+        orig_snap_decl = copy.deepcopy(snap_decl)
+        verdict = declaration_impact.evaluate_revision(snap_yaml, new, snap_decl)
+        self.assertEqual(verdict, {})
+        self.assertEqual(snap_decl, orig_snap_decl)
+
+    def test_evaluate_revision_fatal(self):
+        """Test evaluate_revision() - fatal"""
+        old = declaration_impact.compile_base_declaration(self.old_base)
+        snap_yaml = {"name": "foo", "plugs": ["network"]}
+        verdict = declaration_impact.evaluate_revision(snap_yaml, old)
+        self.assertEqual(list(verdict), ["fatal"])
+
+    def test_evaluate_impact(self):
+        """Test evaluate_impact()"""
+        impact = declaration_impact.evaluate_impact(
+            self.db, self.old_base, self.new_base, jobs=1
+        )
+        self.assertEqual(list(impact), ["id2"])
+        self.assertEqual(sorted(impact["id2"]), ["1", "2"])
+        self.assertEqual(impact["id2"]["1"]["name"], "snap-id2")
+        self.assertEqual(impact["id2"]["1"]["old"], {})
+        self.assertIn("error", impact["id2"]["1"]["new"])
+        self.assertIsNone(declaration_impact.IMPACT_STATE)
+
+        # the same base declaration doesn't change anything
+        impact = declaration_impact.evaluate_impact(
+            self.db, self.old_base, self.old_base, jobs=1
+        )
+        self.assertEqual(impact, {})
+
+    def test_evaluate_impact_snap_declarations(self):
+        """Test evaluate_impact() - snap declarations"""
+        snap_decls = {
+            "id2": {"plugs": {"network-control": {"allow-installation": True}}}
+        }
+        impact = declaration_impact.evaluate_impact(
+            self.db, self.old_base, self.new_base, snap_decls=snap_decls, jobs=1
+        )
+        self.assertEqual(impact, {})
+
+    def test_evaluate_impact_jobs(self):
+        """Test evaluate_impact() - worker processes"""
+        expected = declaration_impact.evaluate_impact(
+            self.db, self.old_base, self.new_base, jobs=1
+        )
+        with patch("reviewtools.declaration_impact.IMPACT_CHUNK_SIZE", 1):
+            impact = declaration_impact.evaluate_impact(
+                self.db, self.old_base, self.new_base, jobs=2
+            )
+        self.assertEqual(impact, expected)
+        self.assertIsNone(declaration_impact.IMPACT_STATE)
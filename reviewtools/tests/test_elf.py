@@ -0,0 +1,425 @@
+"""test_elf.py: tests for the elf module"""
+#
+# Copyright (C) 2021 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+from reviewtools.elf import (
+    DF_1_PIE,
+    DT_FLAGS_1,
+    ELF_MIME_OTHER,
+    ELF_MIME_PIE,
+    ET_CORE,
+    ET_DYN,
+    ET_EXEC,
+    ET_REL,
+    PF_X,
+    PT_DYNAMIC,
+    PT_GNU_STACK,
+    SHN_ABS,
+    ElfException,
+    ElfFile,
+    demangle_symbols,
+    elf_mime_type,
+    get_dynamic_symbols,
+    get_symbols_abi,
+    has_execstack,
+)
+
+
+def _elf64(e_type, e_machine=62, endian="<", dynamic=None):
+    """Build a minimal 64-bit ELF file with an optional dynamic section"""
+    ei_data = 1 if endian == "<" else 2
+    ident = b"\x7fELF" + bytes([2, ei_data, 1]) + b"\x00" * 9
+    phnum = 0 if dynamic is None else 1
+    hdr = ident + struct.pack(
+        endian + "HHIQQQIHHHHHH",
+        e_type,
+        e_machine,
+        1,
+        0,
+        64 if phnum else 0,
+        0,
+        0,
+        64,
+        56,
+        phnum,
+        64,
+        0,
+        0,
+    )
+    if dynamic is None:
+        return hdr
+
+    dyn = b"".join(struct.pack(endian + "qQ", t, v) for (t, v) in dynamic)
+    dyn += struct.pack(endian + "qQ", 0, 0)
+    phdr = struct.pack(
+        endian + "IIQQQQQQ", PT_DYNAMIC, 6, 120, 0, 0, len(dyn), len(dyn), 8
+    )
+    return hdr + phdr + dyn
+
+
+def _elf_gnu_stack(ei_class, endian, p_flags, e_type=ET_EXEC):
+    """Build a minimal ELF file with a PT_GNU_STACK program header"""
+    ei_data = 1 if endian == "<" else 2
+    ident = b"\x7fELF" + bytes([ei_class, ei_data, 1]) + b"\x00" * 9
+    if ei_class == 2:
+        hdr = ident + struct.pack(
+            endian + "HHIQQQIHHHHHH", e_type, 62, 1, 0, 64, 0, 0, 64, 56, 1, 64, 0, 0
+        )
+        phdr = struct.pack(
+            endian + "IIQQQQQQ", PT_GNU_STACK, p_flags, 0, 0, 0, 0, 0, 16
+        )
+    else:
+        hdr = ident + struct.pack(
+            endian + "HHIIIIIHHHHHH", e_type, 20, 1, 0, 52, 0, 0, 52, 32, 1, 40, 0, 0
+        )
+        phdr = struct.pack(
+            endian + "IIIIIIII", PT_GNU_STACK, 0, 0, 0, 0, 0, p_flags, 16
+        )
+    return hdr + phdr
+
+
+def _elf_dynsym(symbols, verdefs=None):
+    """Build a 64-bit shared library with .text (1), .bss (2) and .dynsym
+       sections and optional .gnu.version and .gnu.version_d sections.
+       symbols is a list of (name, st_info, st_shndx, versym) and verdefs
+       a list of (vd_flags, vd_ndx, name)
+    """
+    dynstr = bytearray(b"\0")
+
+    def _str(name):
+        off = len(dynstr)
+        dynstr.extend(name.encode() + b"\0")
+        return off
+
+    dynsym = b"\0" * 24
+    versym = struct.pack("<H", 0)
+    for (name, st_info, st_shndx, vs) in symbols:
+        dynsym += struct.pack("<IBBHQQ", _str(name), st_info, 0, st_shndx, 0, 0)
+        versym += struct.pack("<H", vs)
+
+    verdef = b""
+    for (i, (vd_flags, vd_ndx, name)) in enumerate(verdefs or []):
+        vd_next = 28 if i < len(verdefs) - 1 else 0
+        verdef += struct.pack("<HHHHIII", 1, vd_flags, vd_ndx, 1, 0, 20, vd_next)
+        verdef += struct.pack("<II", _str(name), 0)
+
+    # (name, sh_type, sh_flags, data, sh_link, sh_info, sh_entsize)
+    sections = [
+        (".text", 1, 0x6, b"\xc3", 0, 0, 0),
+        (".bss", 8, 0x3, b"", 0, 0, 0),
+        (".dynsym", 11, 0x2, dynsym, 5, 1, 24),
+        (".gnu.version", 0x6FFFFFFF, 0x2, versym, 3, 0, 2),
+        (".dynstr", 3, 0x2, bytes(dynstr), 0, 0, 0),
+    ]
+    if verdefs:
+        sections.append(
+            (".gnu.version_d", 0x6FFFFFFD, 0x2, verdef, 5, len(verdefs), 0)
+        )
+    shstrtab = bytearray(b"\0")
+    names = []
+    for sec in sections + [(".shstrtab",)]:
+        names.append(len(shstrtab))
+        shstrtab.extend(sec[0].encode() + b"\0")
+    sections.append((".shstrtab", 3, 0, bytes(shstrtab), 0, 0, 0))
+
+    body = b""
+    shdrs = struct.pack("<IIQQQQIIQQ", 0, 0, 0, 0, 0, 0, 0, 0, 0, 0)
+    for (i, (name, sh_type, sh_flags, data, link, info, ent)) in enumerate(sections):
+        off = 64 + len(body)
+        body += data
+        shdrs += struct.pack(
+            "<IIQQQQIIQQ",
+            names[i],
+            sh_type,
+            sh_flags,
+            0,
+            off,
+            len(data) if sh_type != 8 else 16,
+            link,
+            info,
+            1,
+            ent,
+        )
+    ident = b"\x7fELF" + bytes([2, 1, 1]) + b"\x00" * 9
+    hdr = ident + struct.pack(
+        "<HHIQQQIHHHHHH",
+        ET_DYN,
+        62,
+        1,
+        0,
+        0,
+        64 + len(body),
+        0,
+        64,
+        56,
+        0,
+        64,
+        len(sections) + 1,
+        len(sections),
+    )
+    return hdr + body + shdrs
+
+
+class TestElf(unittest.TestCase):
+    """Tests for the elf module"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def _write(self, name, content):
+        fn = os.path.join(self.tmpdir, name)
+        with open(fn, "wb") as f:
+            f.write(content)
+        return fn
+
+    def test_elf_mime_type_rel(self):
+        """Test elf_mime_type() - relocatable"""
+        fn = self._write("foo.o", _elf64(ET_REL))
+        self.assertEqual(elf_mime_type(fn), "application/x-object")
+
+    def test_elf_mime_type_exec(self):
+        """Test elf_mime_type() - executable"""
+        fn = self._write("foo", _elf64(ET_EXEC))
+        self.assertEqual(elf_mime_type(fn), "application/x-executable")
+
+    def test_elf_mime_type_exec_big_endian(self):
+        """Test elf_mime_type() - big endian executable"""
+        fn = self._write("foo", _elf64(ET_EXEC, e_machine=22, endian=">"))
+        self.assertEqual(elf_mime_type(fn), "application/x-executable")
+
+    def test_elf_mime_type_sharedlib(self):
+        """Test elf_mime_type() - shared library"""
+        fn = self._write("libfoo.so", _elf64(ET_DYN, dynamic=[(1, 1)]))
+        self.assertEqual(elf_mime_type(fn), "application/x-sharedlib")
+
+    def test_elf_mime_type_pie(self):
+        """Test elf_mime_type() - PIE executable"""
+        fn = self._write("foo", _elf64(ET_DYN, dynamic=[(DT_FLAGS_1, DF_1_PIE)]))
+        self.assertEqual(elf_mime_type(fn), ELF_MIME_PIE)
+
+    def test_elf_mime_type_pie_big_endian(self):
+        """Test elf_mime_type() - big endian PIE executable"""
+        fn = self._write(
+            "foo", _elf64(ET_DYN, endian=">", dynamic=[(DT_FLAGS_1, DF_1_PIE)])
+        )
+        self.assertEqual(elf_mime_type(fn), ELF_MIME_PIE)
+
+    def test_elf_mime_type_truncated_dynamic(self):
+        """Test elf_mime_type() - truncated shared library"""
+        fn = self._write("libfoo.so", _elf64(ET_DYN, dynamic=[])[:130])
+        self.assertEqual(elf_mime_type(fn), "application/x-sharedlib")
+
+    def test_elf_mime_type_ps2_iop(self):
+        """Test elf_mime_type() - PS2 IRX on MIPS"""
+        fn = self._write("foo.irx", _elf64(0xFF80, e_machine=8))
+        self.assertEqual(elf_mime_type(fn), "application/x-sharedlib")
+
+    def test_elf_mime_type_core(self):
+        """Test elf_mime_type() - core file"""
+        fn = self._write("core", _elf64(ET_CORE))
+        self.assertEqual(elf_mime_type(fn), "application/x-coredump")
+
+    def test_elf_mime_type_unknown_type(self):
+        """Test elf_mime_type() - unknown e_type"""
+        fn = self._write("foo", _elf64(0x1234))
+        self.assertEqual(elf_mime_type(fn), ELF_MIME_OTHER)
+
+    def test_elf_mime_type_not_elf(self):
+        """Test elf_mime_type() - not ELF"""
+        fn = self._write("foo.sh", b"#!/bin/sh\necho hello\n")
+        self.assertEqual(elf_mime_type(fn), ELF_MIME_OTHER)
+
+    def test_elf_mime_type_empty(self):
+        """Test elf_mime_type() - empty file"""
+        fn = self._write("empty", b"")
+        self.assertEqual(elf_mime_type(fn), ELF_MIME_OTHER)
+
+    def test_elf_mime_type_omf(self):
+        """Test elf_mime_type() - possible OMF needs libmagic"""
+        fn = self._write("foo.obj", b"\x80\x07\x00\x05foo.c")
+        self.assertIsNone(elf_mime_type(fn))
+
+    def test_elf_mime_type_short(self):
+        """Test elf_mime_type() - short ELF header needs libmagic"""
+        fn = self._write("foo", _elf64(ET_EXEC)[:18])
+        self.assertIsNone(elf_mime_type(fn))
+
+    def test_elf_mime_type_bad_byte_order(self):
+        """Test elf_mime_type() - invalid byte order needs libmagic"""
+        content = bytearray(_elf64(ET_EXEC))
+        content[5] = 3
+        fn = self._write("foo", bytes(content))
+        self.assertIsNone(elf_mime_type(fn))
+
+    def test_elf_mime_type_symlink(self):
+        """Test elf_mime_type() - symlink isn't followed"""
+        fn = self._write("foo", _elf64(ET_EXEC))
+        link = os.path.join(self.tmpdir, "bar")
+        os.symlink(fn, link)
+        self.assertEqual(elf_mime_type(link), ELF_MIME_OTHER)
+
+    def test_elf_mime_type_nonexistent(self):
+        """Test elf_mime_type() - nonexistent"""
+        self.assertIsNone(elf_mime_type(os.path.join(self.tmpdir, "nonexistent")))
+
+    def test_elffile(self):
+        """Test ElfFile()"""
+        fn = self._write("foo", _elf64(ET_DYN, dynamic=[(DT_FLAGS_1, DF_1_PIE)]))
+        with ElfFile(fn) as elf:
+            self.assertEqual(elf.e_type, ET_DYN)
+            self.assertEqual(elf.e_machine, 62)
+            self.assertEqual(len(elf.program_headers()), 1)
+            self.assertEqual(elf.dynamic_entries(), [(DT_FLAGS_1, DF_1_PIE)])
+            self.assertTrue(elf.is_pie())
+
+    def test_elffile_not_elf(self):
+        """Test ElfFile() - not ELF"""
+        fn = self._write("foo", b"not an ELF file at all")
+        with self.assertRaises(ElfException):
+            ElfFile(fn)
+
+    def test_has_execstack(self):
+        """Test has_execstack()"""
+        for ei_class in [1, 2]:
+            for endian in ["<", ">"]:
+                fn = self._write("foo", _elf_gnu_stack(ei_class, endian, 6 | PF_X))
+                self.assertTrue(has_execstack(fn), (ei_class, endian))
+                fn = self._write("foo", _elf_gnu_stack(ei_class, endian, 6))
+                self.assertFalse(has_execstack(fn), (ei_class, endian))
+
+    def test_has_execstack_no_gnu_stack(self):
+        """Test has_execstack() - no PT_GNU_STACK"""
+        fn = self._write("foo", _elf64(ET_DYN, dynamic=[(1, 1)]))
+        self.assertFalse(has_execstack(fn))
+
+    def test_has_execstack_rel(self):
+        """Test has_execstack() - relocatable"""
+        fn = self._write("foo.o", _elf_gnu_stack(2, "<", 6 | PF_X, e_type=ET_REL))
+        self.assertFalse(has_execstack(fn))
+
+    def test_has_execstack_not_elf(self):
+        """Test has_execstack() - not ELF"""
+        fn = self._write("foo", b"")
+        self.assertFalse(has_execstack(fn))
+        self.assertFalse(has_execstack(os.path.join(self.tmpdir, "nonexistent")))
+
+    def test_dynamic_symbols(self):
+        """Test ElfFile.dynamic_symbols()"""
+        fn = self._write(
+            "libfoo.so",
+            _elf_dynsym(
+                [
+                    ("foo", 0x12, 1, 2),  # GLOBAL FUNC in .text
+                    ("bar", 0x11, 2, 0x8003),  # GLOBAL OBJECT in .bss, hidden
+                    ("baz", 0x22, 1, 1),  # WEAK FUNC, base version
+                    ("FOO_1.0", 0x11, SHN_ABS, 2),  # version definition
+                    ("_Z3quxv", 0x12, 1, 2),
+                    ("undef", 0x12, 0, 0),  # undefined
+                    ("local", 0x02, 1, 0),  # LOCAL FUNC
+                ],
+                verdefs=[(1, 1, "libfoo.so"), (0, 2, "FOO_1.0"), (0, 3, "FOO_0.9")],
+            ),
+        )
+        with ElfFile(fn) as elf:
+            self.assertEqual(
+                elf.dynamic_symbols(),
+                [
+                    ("FOO_1.0", "A", ""),
+                    ("_Z3quxv", "T", "@@FOO_1.0"),
+                    ("bar", "B", "@FOO_0.9"),
+                    ("baz", "W", ""),
+                    ("foo", "T", "@@FOO_1.0"),
+                    ("local", "t", ""),
+                ],
+            )
+
+    def test_dynamic_symbols_no_dynsym(self):
+        """Test ElfFile.dynamic_symbols() - no .dynsym"""
+        fn = self._write("foo", _elf64(ET_EXEC))
+        with ElfFile(fn) as elf:
+            self.assertEqual(elf.dynamic_symbols(), [])
+
+    def test_dynamic_symbols_truncated(self):
+        """Test ElfFile.dynamic_symbols() - truncated"""
+        content = _elf_dynsym([("foo", 0x12, 1, 1)])
+        fn = self._write("libfoo.so", content[:-100])
+        with ElfFile(fn) as elf:
+            with self.assertRaises(ElfException):
+                elf.dynamic_symbols()
+
+    def test_demangle_symbols(self):
+        """Test demangle_symbols()"""
+        if shutil.which("c++filt") is None:
+            self.skipTest("c++filt not available")
+        res = demangle_symbols(["foo", "_Z3quxv", "_ZdaPv", "_Znot_mangled"])
+        self.assertEqual(res["foo"], "foo")
+        self.assertEqual(res["_Z3quxv"], "qux()")
+        self.assertEqual(res["_ZdaPv"], "operator delete[](void*)")
+        self.assertEqual(res["_Znot_mangled"], "_Znot_mangled")
+
+    def test_get_dynamic_symbols(self):
+        """Test get_dynamic_symbols()"""
+        fns = []
+        for i in range(3):
+            fns.append(
+                self._write(
+                    "libfoo%d.so" % i,
+                    _elf_dynsym(
+                        [("_Z3quxv", 0x12, 1, 2), ("foo%d" % i, 0x12, 1, 2)],
+                        verdefs=[(1, 1, "libfoo.so"), (0, 2, "FOO_1.0")],
+                    ),
+                )
+            )
+        fns.append(self._write("libbad.so", b"not an ELF file at all"))
+        res = get_dynamic_symbols(fns, demangle=False)
+        self.assertEqual(len(res), 4)
+        self.assertIsNone(res[fns[3]])
+        for i in range(3):
+            self.assertEqual(
+                res[fns[i]],
+                [("_Z3quxv", "T", "@@FOO_1.0"), ("foo%d" % i, "T", "@@FOO_1.0")],
+            )
+
+        if shutil.which("c++filt") is not None:
+            res = get_dynamic_symbols(fns[0:1])
+            self.assertEqual(res[fns[0]][0], ("qux()", "T", "@@FOO_1.0"))
+
+    def test_get_symbols_abi(self):
+        """Test get_symbols_abi()"""
+        res = get_symbols_abi(
+            [
+                ("crypt", "T", "@GLIBC_2.2.5"),
+                ("crypt", "T", "@@XCRYPT_2.0"),
+                ("operator delete[](void*)", "T", "@@GLIBCXX_3.4"),
+                ("local", "t", ""),
+                ("debug", "N", ""),
+                ("unique", "u", ""),
+            ]
+        )
+        self.assertEqual(
+            res,
+            {
+                "crypt": {"type": "T", "version": "@GLIBC_2.2.5"},
+                "operator delete[](void*)": {"type": "T", "version": "@@GLIBCXX_3.4"},
+                "unique": {"type": "u", "version": ""},
+            },
+        )
@@ -1,6 +1,11 @@
 import glob
+import os
+import shutil
+import tempfile
+
 import reviewtools
 from reviewtools import modules, sr_tests
+from reviewtools.common import FatalReviewError
 
 
 class TestModules(sr_tests.TestSnapReview):
@@ -35,3 +40,87 @@ class TestModules(sr_tests.TestSnapReview):
             "Not all files in reviewtools/sr_*.py contain "
             "classes named Snap*Review.",
         )
+
+    def test_find_main_class(self):
+        """Verify find_main_class() imports the module once"""
+        import reviewtools.sr_lint
+
+        review = modules.find_main_class("sr_lint")
+        self.assertIs(review, reviewtools.sr_lint.SnapReviewLint)
+        self.assertIs(modules.find_main_class("sr_lint"), review)
+
+    def test_find_main_class_nonexistent(self):
+        """Verify find_main_class() with a nonexistent module"""
+        with self.assertRaises(FileNotFoundError):
+            modules.find_main_class("sr_nonexistent")
+
+    def test_module_selected(self):
+        """Verify modules without selected checks are skipped"""
+        self.assertTrue(modules.module_selected("sr_lint"))
+        os.environ["RT_ONLY_CHECKS"] = "security-snap-v2:squashfs_*"
+        self.addCleanup(os.environ.pop, "RT_ONLY_CHECKS")
+        self.assertFalse(modules.module_selected("sr_lint"))
+        self.assertTrue(modules.module_selected("sr_security"))
+
+    def test_run_modules_parallel(self):
+        """Verify running modules in parallel gives the same reports"""
+        module_names = ["sr_lint", "sr_declaration", "sr_functional"]
+        expected = []
+        for module_name in module_names:
+            review = modules.init_main_class(module_name, self.test_name)
+            review.do_checks()
+            expected.append(
+                (module_name, review.review_report, {}, "", None, None, None)
+            )
+
+        res = modules.run_modules_parallel(module_names, self.test_name, 2)
+        self.assertEqual(res, expected)
+
+    def test_run_modules_parallel_state(self):
+        """Verify running modules in parallel merges the state output"""
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        reviewtools.__path__.append(tmpdir)
+        self.addCleanup(reviewtools.__path__.remove, tmpdir)
+        for (name, action) in [
+            ("sr_teststatea", "state['a'] = 1; del state['old']"),
+            ("sr_teststateb", "state['b'] = 2; print('b')"),
+            ("sr_teststatec", "raise ValueError('c')"),
+            ("sr_teststated", "reviewtools.common.error('d')"),
+        ]:
+            with open(os.path.join(tmpdir, name + ".py"), "w") as f:
+                f.write(
+                    "import reviewtools.common\n"
+                    "class SnapReviewTestState(object):\n"
+                    "    def __init__(self, fn, overrides):\n"
+                    "        self.overrides = overrides\n"
+                    "        self.review_report = {'info': {}}\n"
+                    "        self.timings = {}\n"
+                    "    def set_report_type(self, report_type):\n"
+                    "        pass\n"
+                    "    def do_checks(self):\n"
+                    "        state = self.overrides['state_output']\n"
+                    "        %s\n" % action
+                )
+
+        overrides = {"state_output": {"format": 1, "old": 0}}
+        res = modules.run_modules_parallel(
+            ["sr_teststatea", "sr_teststateb", "sr_teststatec", "sr_teststated"],
+            self.test_name,
+            3,
+            overrides=overrides,
+        )
+        self.assertEqual(overrides["state_output"], {"format": 1, "a": 1, "b": 2})
+        self.assertEqual(
+            res[0], ("sr_teststatea", {"info": {}}, {}, "", None, None, None)
+        )
+        self.assertEqual(
+            res[1], ("sr_teststateb", {"info": {}}, {}, "b\n", None, None, None)
+        )
+        self.assertEqual(res[2][0:6], ("sr_teststatec", None, {}, "", None, None))
+        self.assertIn("ValueError: c", res[2][6])
+        # fatal errors are passed on for the caller to report
+        self.assertEqual(res[3][0:5], ("sr_teststated", None, {}, "", None))
+        self.assertIsInstance(res[3][5], FatalReviewError)
+        self.assertEqual((res[3][5].value, res[3][5].exit_code), ("d", 1))
+        self.assertIsNone(res[3][6])
@@ -0,0 +1,176 @@
+"""test_squashfs.py: tests for the squashfs module"""
+#
+# Copyright (C) 2021 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import unittest
+
+import reviewtools.common
+from reviewtools.common import StatLLN, unsquashfs_lln_parse_line
+from reviewtools.squashfs import (
+    SQUASHFS_CHRDEV_TYPE,
+    SquashfsException,
+    SquashfsImage,
+    SquashfsUnsupportedException,
+    lln_entry,
+    read_superblock,
+)
+
+TESTS_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))),
+    "tests",
+)
+
+
+class TestSquashfs(unittest.TestCase):
+    """Tests for the squashfs module"""
+
+    def _pkg(self, name):
+        return os.path.join(TESTS_DIR, name)
+
+    def _entries(self, name):
+        with SquashfsImage(self._pkg(name)) as sq:
+            return list(sq.lln_entries())
+
+    def test_read_superblock(self):
+        """Test read_superblock()"""
+        sb = read_superblock(self._pkg("hello-world_25.snap"))
+        self.assertEqual(sb.compression_name, "xz")
+        self.assertEqual(sb.fstime, 1457720806)
+        self.assertEqual(sb.fragments, 0)
+        self.assertEqual(sb.inodes, 11)
+
+    def test_describe_offset(self):
+        """Test SquashfsSuperblock.describe_offset()"""
+        sb = read_superblock(self._pkg("hello-world_25.snap"))
+        for (offset, part) in [
+            (0, "superblock"),
+            (95, "superblock"),
+            (96, "data blocks"),
+            (19711, "inode table"),
+            (19925, "directory table"),
+            (20100, "fragment table"),
+            (20180, "export table"),
+            (20199, "id table"),
+            (20200, "padding"),
+        ]:
+            self.assertEqual(sb.describe_offset(offset), part)
+
+    def test_read_superblock_fragments(self):
+        """Test read_superblock() - fragments"""
+        sb = read_superblock(self._pkg("test-no-fragments_4.snap"))
+        self.assertEqual(sb.fragments, 3)
+        self.assertEqual(sb.fstime, 1523623053)
+
+    def test_read_superblock_gzip(self):
+        """Test read_superblock() - gzip"""
+        sb = read_superblock(self._pkg("test-gzip_1.snap"))
+        self.assertEqual(sb.compression_name, "gzip")
+
+    def test_read_superblock_lzo(self):
+        """Test read_superblock() - lzo"""
+        sb = read_superblock(self._pkg("test-lzo_1.snap"))
+        self.assertEqual(sb.compression_name, "lzo")
+
+    def test_read_superblock_not_squashfs(self):
+        """Test read_superblock() - not squashfs"""
+        with self.assertRaises(SquashfsException):
+            read_superblock(self._pkg("hello-world_1.0.6_all.snap"))
+
+    def test_read_superblock_nonexistent(self):
+        """Test read_superblock() - nonexistent"""
+        with self.assertRaises(SquashfsException):
+            read_superblock(self._pkg("nonexistent.snap"))
+
+    def test_lln_entries(self):
+        """Test lln_entries()"""
+        entries = self._entries("test-link_0.1_all.snap")
+        self.assertEqual(len(entries), 3)
+        (line, item) = entries[0]
+        self.assertEqual(item[StatLLN.FILETYPE], "d")
+        self.assertEqual(item[StatLLN.FULLNAME], "squashfs-root")
+        self.assertEqual(item[StatLLN.FILENAME], ".")
+
+    def test_lln_entries_roundtrip(self):
+        """Test lln_entries() matches unsquashfs_lln_parse_line()"""
+        for name in [
+            "hello-world_25.snap",
+            "test-gzip_1.snap",
+            "test-base-devnull_1.0_all.snap",
+            "notify-send_1_amd64.snap",
+            "test-state-base_1_amd64.snap",
+        ]:
+            for (line, item) in self._entries(name):
+                self.assertEqual(unsquashfs_lln_parse_line(line), item)
+
+    def test_lln_entries_symlink(self):
+        """Test lln_entries() - symlink"""
+        found = False
+        for (line, item) in self._entries("pc.canonical_5.snap"):
+            if item[StatLLN.FILETYPE] != "l":
+                continue
+            found = True
+            self.assertEqual(item[StatLLN.FILENAME], "./grub.conf -> grub.cfg")
+            self.assertEqual(item[StatLLN.MODE], "rwxrwxrwx")
+            self.assertEqual(item[StatLLN.SIZE], "8")
+        self.assertTrue(found)
+
+    def test_lln_entries_device(self):
+        """Test lln_entries() - device"""
+        found = False
+        for (line, item) in self._entries("test-base-devnull_1.0_all.snap"):
+            if item[StatLLN.FILETYPE] != "c":
+                continue
+            found = True
+            self.assertTrue(line.startswith("crw-rw-rw- 0/0 "))
+            self.assertIn(" 1,  3 ", line)
+            self.assertEqual(item[StatLLN.MAJOR], "1")
+            self.assertEqual(item[StatLLN.MINOR], "3")
+            self.assertEqual(item[StatLLN.FULLNAME], "squashfs-root/dev/null")
+        self.assertTrue(found)
+
+    def test_lln_entry_device_large_minor(self):
+        """Test lln_entry() - device with a minor above 255"""
+        # mksquashfs stores makedev(4, 300) as new_encode_dev() does
+        data = 300 & 0xFF | (4 << 8) | ((300 & ~0xFF) << 12)
+        inode = {
+            "type": SQUASHFS_CHRDEV_TYPE,
+            "mode": 0o620,
+            "uid": 0,
+            "gid": 5,
+            "data": data,
+            "mtime": 0,
+        }
+        (line, item) = lln_entry("dev/tty300", inode)
+        # 'unsquashfs -lln' prints data >> 8 and data & 0xff
+        self.assertEqual(item[StatLLN.MAJOR], str(data >> 8))
+        self.assertEqual(item[StatLLN.MINOR], "44")
+        self.assertIn(" %d, 44 " % (data >> 8), line)
+        self.assertEqual(unsquashfs_lln_parse_line(line), item)
+
+    def test_lln_entries_lzo(self):
+        """Test lln_entries() - unsupported compression"""
+        with SquashfsImage(self._pkg("test-lzo_1.snap")) as sq:
+            with self.assertRaises(SquashfsUnsupportedException):
+                list(sq.lln_entries())
+
+    def test_get_pkg_listing(self):
+        """Test get_pkg_listing() reads the image directly"""
+        self.addCleanup(reviewtools.common.cleanup_unpack)
+        listing = reviewtools.common.get_pkg_listing(self._pkg("hello-world_25.snap"))
+        self.assertEqual(listing.rc, 0)
+        (hdr, entries) = listing.parse()
+        self.assertEqual(hdr, [])
+        self.assertEqual(len(entries), 11)
@@ -14,6 +14,9 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from unittest.mock import patch
+
+from reviewtools.common import FatalReviewError, ReviewContext
 from reviewtools.sr_common import SnapReview
 import reviewtools.sr_tests as sr_tests
 
@@ -54,7 +57,7 @@ class TestSnapReviewCommon(sr_tests.TestSnapReview):
             self.assertFalse(self.review._verify_pkgversion(nok))
 
     def test_no_duplicated_yaml_keys(self):
-        """Check _no_duplicated_yaml_keys"""
+        """Check duplicated snap.yaml keys are fatal"""
         b1 = """
 map:
  key:
@@ -63,6 +66,34 @@ map:
         for ok in [
             b1,
         ]:
-            with self.assertRaises(Exception) as e:
-                self.review._verify_no_duplicated_yaml_keys(ok)
+            with self.assertRaises(FatalReviewError) as e:
+                self.review._prepare_snap_state(ok, None)
             self.assertRegex(str(e.exception), r'found duplicate key "key".*')
+
+    def test_snap_state_shared(self):
+        """Check the SnapState is shared by the reviews with a context"""
+        context = ReviewContext()
+        c1 = SnapReview("app.snap", "sr_common_review_type", context=context)
+        with patch("reviewtools.sr_common.get_snapd_base_declaration") as read:
+            with patch("reviewtools.sr_common.load_yaml") as load_yaml:
+                c2 = SnapReview("app.snap", "sr_common_review_type2", context=context)
+        read.assert_not_called()
+        load_yaml.assert_not_called()
+        self.assertIs(c1.snap_yaml, c2.snap_yaml)
+        self.assertIs(c1.base_declaration, c2.base_declaration)
+        self.assertIs(c1.interfaces, c2.interfaces)
+
+        # not shared with the reviews with another context
+        c3 = SnapReview("app.snap", "sr_common_review_type", context=ReviewContext())
+        self.assertIsNot(c1.snap_yaml, c3.snap_yaml)
+        self.assertEqual(c1.snap_yaml, c3.snap_yaml)
+
+    def test_snap_state_changed(self):
+        """Check the SnapState is prepared again for another snap.yaml"""
+        context = ReviewContext()
+        c1 = SnapReview("app.snap", "sr_common_review_type", context=context)
+        self.set_test_snap_yaml("version", "2.0")
+        c2 = SnapReview("app.snap", "sr_common_review_type", context=context)
+        self.assertIsNot(c1.snap_yaml, c2.snap_yaml)
+        self.assertEqual(c2.snap_yaml["version"], "2.0")
+        self.assertIs(context.snap_state.snap_yaml, c2.snap_yaml)
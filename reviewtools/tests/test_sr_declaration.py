@@ -15,12 +15,19 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from reviewtools.sr_declaration import (
+    CompiledDeclaration,
+    DeclarationAttribute,
     SnapReviewDeclaration,
     SnapDeclarationException,
+    evaluate_snap_declaration,
+    index_base_declaration,
     verify_snap_declaration,
 )
+import copy
 import reviewtools.sr_tests as sr_tests
+import re
 from unittest import TestCase
+from unittest.mock import patch
 import yaml
 
 
@@ -205,6 +212,116 @@ slots:
         self.assertTrue(res1["allow-connection"])
         self.assertTrue(res2 == "base/fallback")
 
+    def test__get_compiled_decl(self):
+        """Test _get_compiled_decl()"""
+        overrides = {"snap_decl_plugs": {"foo": {"allow-connection": True}}}
+        c = SnapReviewDeclaration(self.test_name, overrides=overrides)
+        compiled = c._get_compiled_decl(True)
+        self.assertIs(compiled.decl, c.snap_declaration)
+        self.assertIs(c._get_compiled_decl(True), compiled)
+
+        # the compiled base declaration is shared by the reviews
+        base = c._get_compiled_decl(False)
+        self.assertIs(base.decl, c.base_declaration)
+        c2 = SnapReviewDeclaration(self.test_name)
+        self.assertIs(c2._get_compiled_decl(False), base)
+
+        # but not when it is another base declaration
+        decl = {"plugs": {}, "slots": {"foo": {"allow-connection": True}}}
+        self._set_base_declaration(c2, decl)
+        self.assertIs(c2._get_compiled_decl(False).decl, decl)
+
+    def test_compiled_declaration_constraint(self):
+        """Test CompiledDeclaration.constraint()"""
+        rules = {
+            "plug-names": ["foo|bar", "$INTERFACE", "$BAD", "("],
+            "plug-attributes": {"a": "b.*", "c": ["d", "$PLUG(c)"]},
+        }
+        decl = {"plugs": {"iface": {"allow-connection": rules}}}
+        compiled = CompiledDeclaration(decl)
+        constraint = compiled.constraint(rules)
+        self.assertIs(compiled.constraint(rules), constraint)
+        self.assertIs(constraint.rules, rules)
+
+        names = constraint.names("plug-names")
+        self.assertIs(constraint.names("plug-names"), names)
+        self.assertTrue(names[0].search("bar"))
+        self.assertFalse(names[0].search("foobar"))
+        self.assertEqual(names[1], "$INTERFACE")
+        self.assertIsInstance(names[2], SnapDeclarationException)
+        self.assertIsInstance(names[3], re.error)
+
+        attrib = constraint.attribute("plug-attributes", "a")
+        self.assertIs(constraint.attribute("plug-attributes", "a"), attrib)
+        self.assertTrue(attrib.match("baz"))
+        self.assertTrue(attrib.match(["b", "bb"]))
+        self.assertFalse(attrib.match(["b", "a"]))
+        self.assertFalse(attrib.match(True))
+        alternatives = constraint.attribute("plug-attributes", "c")
+        self.assertEqual(len(alternatives), 2)
+        self.assertFalse(alternatives[0].match("dd"))
+        self.assertTrue(alternatives[1].match("anything"))
+
+    def test_declaration_attribute_invalid(self):
+        """Test DeclarationAttribute.match() - invalid declaration"""
+        for against in ["$BAD", "("]:
+            attrib = DeclarationAttribute(against, "a")
+            # only raised when matching a string, like when not compiled
+            self.assertFalse(attrib.match(True))
+            with self.assertRaises(Exception):
+                attrib.match("foo")
+        with self.assertRaises(SnapDeclarationException):
+            DeclarationAttribute("b", "a").match(None)
+        with self.assertRaises(SnapDeclarationException):
+            DeclarationAttribute(["b"], "a").match(True)
+
+    def test_index_base_declaration(self):
+        """Test index_base_declaration()"""
+        decl = {
+            "plugs": {"foo": {"allow-installation": False}},
+            "slots": {"bar": {"deny-connection": True}, "foo": {}},
+        }
+        index = index_base_declaration(decl)
+        self.assertEqual(sorted(index), ["bar", "foo"])
+        self.assertEqual(index["foo"]["plugs"], (decl["plugs"]["foo"], "base/plugs"))
+        self.assertEqual(index["foo"]["slots"], (decl["slots"]["foo"], "base/slots"))
+        self.assertEqual(
+            index["bar"]["plugs"], (decl["slots"]["bar"], "base/fallback")
+        )
+        self.assertEqual(index["bar"]["slots"], (decl["slots"]["bar"], "base/slots"))
+
+        # through the compiled declaration, like _get_decl()
+        compiled = CompiledDeclaration(decl)
+        self.assertEqual(compiled.base_rules("plugs", "bar"), index["bar"]["plugs"])
+        self.assertEqual(compiled.base_rules("slots", "nonexistent"), (None, None))
+
+    def test_evaluate_snap_declaration(self):
+        """Test evaluate_snap_declaration()"""
+        plugs = {"iface": {"interface": "docker-support"}}
+        slots = {"iface2": {"interface": "docker-support"}}
+        self.set_test_snap_yaml("plugs", plugs)
+        self.set_test_snap_yaml("slots", slots)
+        self.set_test_snap_yaml("type", None)
+        overrides = {
+            "snap_decl_plugs": {"docker-support": {"allow-installation": True}}
+        }
+        # the reviews add the defaults to the snap declaration
+        c = SnapReviewDeclaration(self.test_name, overrides=copy.deepcopy(overrides))
+        self._use_test_base_declaration(c)
+        c.check_declaration()
+        c.check_declaration_apps()
+        c.check_declaration_hooks()
+
+        # only needs the snap.yaml
+        snap_yaml = {"name": "foo", "plugs": plugs, "slots": slots}
+        review = evaluate_snap_declaration(
+            snap_yaml, CompiledDeclaration(c.base_declaration), overrides
+        )
+        self.assertEqual(review.snap_yaml["type"], "app")
+        self.assertEqual(review.review_report, c.review_report)
+        expected_counts = {"info": 2, "warn": 0, "error": 1}
+        self.check_results(review.review_report, expected_counts)
+
     def test__is_scoped(self):
         """Test _is_scoped()"""
         c = SnapReviewDeclaration(self.test_name)
@@ -8318,3 +8435,26 @@ class TestSnapDeclarationVerify(TestCase):
 
                 pprint.pprint(r)
                 raise
+
+    def test_verify_snap_declaration_base_verified_once(self):
+        """Test verify_snap_declaration() - base declaration verified once"""
+        base = {
+            "plugs": {},
+            "slots": {"foo": {"allow-auto-connection": {"plugs-per-slot": "*"}}},
+        }
+        name = "snap-declaration-verify_v2:valid_slots:foo:allow-auto-connection"
+        verify = SnapReviewDeclaration._verify_declaration
+        with patch.object(
+            SnapReviewDeclaration, "_verify_declaration", autospec=True
+        ) as mock:
+            mock.side_effect = verify
+            for i in range(2):
+                c = verify_snap_declaration({"slots": {"foo": {}}}, base_decl=base)
+                # the results of verifying the base declaration are still
+                # reported
+                self.assertEqual(
+                    c.review_report["warn"][name]["text"],
+                    "plugs-per-slot not supported yet",
+                )
+        bases = [call[1].get("base") for call in mock.call_args_list]
+        self.assertEqual(bases, [True, False, False])
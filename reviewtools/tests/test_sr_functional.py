@@ -27,7 +27,7 @@ from reviewtools.common import check_results as common_check_results
 from reviewtools.sr_functional import SnapReviewFunctional
 import reviewtools.sr_tests as sr_tests
 from reviewtools.tests import utils
-from reviewtools.common import STATE_FORMAT_VERSION, StatLLN, cmd, unsquashfs_lln_parse
+from reviewtools.common import STATE_FORMAT_VERSION, StatLLN, unsquashfs_lln_parse
 
 
 class TestSnapReviewFunctional(sr_tests.TestSnapReview):
@@ -144,10 +144,11 @@ drwxr-xr-x 0/0                73 2020-03-23 14:23 squashfs-root/bin
                 },
             },
         }
-        self.set_test_cmd_nm(
-            0,
-            """000000000000089a T foo@@Base
-0000000000000708 T bar@@Base""",
+        self.set_test_dynamic_symbols(
+            [
+                ("foo", "T", "@@Base"),
+                ("bar", "T", "@@Base"),
+            ]
         )
 
         return exp_state, exp_override, exp_override_state
@@ -164,19 +165,23 @@ drwxr-xr-x 0/0                73 2020-03-23 14:23 squashfs-root/bin
 
     def test_find_symbols_good(self):
         """Test _find_symbols()"""
-        self.set_test_cmd_nm(
-            0,
-            """00000000000559f0 T a64l@@GLIBC_2.2.5
-00000000001ed920 B __abort_msg@@GLIBC_PRIVATE
-00000000001eeb20 V __after_morecore_hook@@GLIBC_2.2.5
-0000000000049830 W clearenv@@GLIBC_2.2.5
-00000000001eb700 D __ctype32_b@GLIBC_2.2.5
-00000000001ed920 B foo@@Base
-0000000000000000 A CXXABI_1.3@@CXXABI_1.3
-00000000000a8e90 T operator delete[](void*)@@GLIBCXX_3.4
-00000000000a9b70 T __gxx_personality_v0@@CXXABI_1.3
-00000000000d15f0 T transaction clone for std::logic_error::~logic_error()@@GLIBCXX_3.4.22
-""",
+        self.set_test_dynamic_symbols(
+            [
+                ("a64l", "T", "@@GLIBC_2.2.5"),
+                ("__abort_msg", "B", "@@GLIBC_PRIVATE"),
+                ("__after_morecore_hook", "V", "@@GLIBC_2.2.5"),
+                ("clearenv", "W", "@@GLIBC_2.2.5"),
+                ("__ctype32_b", "D", "@GLIBC_2.2.5"),
+                ("foo", "B", "@@Base"),
+                ("CXXABI_1.3", "A", "@@CXXABI_1.3"),
+                ("operator delete[](void*)", "T", "@@GLIBCXX_3.4"),
+                ("__gxx_personality_v0", "T", "@@CXXABI_1.3"),
+                (
+                    "transaction clone for std::logic_error::~logic_error()",
+                    "T",
+                    "@@GLIBCXX_3.4.22",
+                ),
+            ]
         )
 
         c = SnapReviewFunctional(self.test_name)
@@ -204,11 +209,11 @@ drwxr-xr-x 0/0                73 2020-03-23 14:23 squashfs-root/bin
 
     def test_find_symbols_skipped(self):
         """Test _find_symbols() - debug"""
-        self.set_test_cmd_nm(
-            0,
-            """00000000001eb700 N foo@@Base
-00000000001eb700 U bar@@Base
-""",
+        self.set_test_dynamic_symbols(
+            [
+                ("foo", "N", "@@Base"),
+                ("bar", "U", "@@Base"),
+            ]
         )
         c = SnapReviewFunctional(self.test_name)
         res = c._find_symbols("./foo.so")
@@ -217,15 +222,39 @@ drwxr-xr-x 0/0                73 2020-03-23 14:23 squashfs-root/bin
 
     def test_find_symbols_cpp_demangled(self):
         """Test _find_symbols() - c++ demangled"""
-        self.set_test_cmd_nm(
-            0,
-            """00000000000d15f0 T transaction clone for std::logic_error::~logic_error()@@GLIBCXX_3.4.22
-00000000000d15d0 T transaction clone for std::logic_error::~logic_error()@@GLIBCXX_3.4.22
-00000000000d15d0 T transaction clone for std::logic_error::~logic_error()@@GLIBCXX_3.4.22
-00000000000aae00 T __cxxabiv1::__pbase_type_info::~__pbase_type_info()@@CXXABI_1.3
-00000000000aade0 T __cxxabiv1::__pbase_type_info::~__pbase_type_info()@@CXXABI_1.3
-00000000000aade0 T __cxxabiv1::__pbase_type_info::~__pbase_type_info()@@CXXABI_1.3
-""",
+        self.set_test_dynamic_symbols(
+            [
+                (
+                    "transaction clone for std::logic_error::~logic_error()",
+                    "T",
+                    "@@GLIBCXX_3.4.22",
+                ),
+                (
+                    "transaction clone for std::logic_error::~logic_error()",
+                    "T",
+                    "@@GLIBCXX_3.4.22",
+                ),
+                (
+                    "transaction clone for std::logic_error::~logic_error()",
+                    "T",
+                    "@@GLIBCXX_3.4.22",
+                ),
+                (
+                    "__cxxabiv1::__pbase_type_info::~__pbase_type_info()",
+                    "T",
+                    "@@CXXABI_1.3",
+                ),
+                (
+                    "__cxxabiv1::__pbase_type_info::~__pbase_type_info()",
+                    "T",
+                    "@@CXXABI_1.3",
+                ),
+                (
+                    "__cxxabiv1::__pbase_type_info::~__pbase_type_info()",
+                    "T",
+                    "@@CXXABI_1.3",
+                ),
+            ]
         )
         c = SnapReviewFunctional(self.test_name)
         res = c._find_symbols("./foo.so")
@@ -246,9 +275,9 @@ drwxr-xr-x 0/0                73 2020-03-23 14:23 squashfs-root/bin
             self.assertEqual(symbol_type, res[symbol]["type"])
             self.assertEqual(symbol_version, res[symbol]["version"])
 
-    def test_find_symbols_bad_rc(self):
-        """Test _find_symbols() - bad rc"""
-        self.set_test_cmd_nm(-1, "error")
+    def test_find_symbols_bad_elf(self):
+        """Test _find_symbols() - bad ELF file"""
+        self.set_test_dynamic_symbols(None)
         c = SnapReviewFunctional(self.test_name)
         res = c._find_symbols("./foo.so")
         self.assertTrue(res is None)
@@ -260,9 +289,9 @@ drwxr-xr-x 0/0                73 2020-03-23 14:23 squashfs-root/bin
         print(res)
         self.assertTrue(res is None)
 
-    def test_find_symbols_bad_result(self):
-        """Test _find_symbols() - bad result"""
-        self.set_test_cmd_nm(0, "000000000000089a T")
+    def test_find_symbols_no_symbols(self):
+        """Test _find_symbols() - no symbols"""
+        self.set_test_dynamic_symbols([])
         c = SnapReviewFunctional(self.test_name)
         res = c._find_symbols("./foo.so")
         self.assertEqual(len(res), 0)
@@ -638,6 +667,13 @@ crw-rw-rw- 0/0             1,  3 2020-03-14 18:21 squashfs-root/dev/null
                 self.assertTrue(k in serial2[j])
                 self.assertEqual(serial[j][k], serial2[j][k])
 
+    def test_check_state_base_files_needs(self):
+        """Test check_state_base_files() - needs the compiled binaries"""
+        os.environ["RT_ONLY_CHECKS"] = "functional-snap-v2:state_base_files"
+        self.addCleanup(os.environ.pop, "RT_ONLY_CHECKS")
+        c = SnapReviewFunctional(self.test_name)
+        self.assertEqual(c.needs, "binaries")
+
     def test_check_state_base_files_app(self):
         """Test check_state_base_files() - app"""
         self._set_default_state()
@@ -1303,12 +1339,10 @@ class TestSnapReviewFunctionalNoMock(TestCase):
     """Tests without mocks where they are not needed."""
 
     def setUp(self):
-        # XXX cleanup_unpack() is required because global variables
-        # UNPACK_DIR, RAW_UNPACK_DIR, PKG_FILES and PKG_BIN_FILES are
-        # initialised to None at module load time, but updated when a real
-        # (non-Mock) test runs, such as here. While, at the same time, two of
-        # the existing tests using mocks depend on both global vars being None.
-        # Ideally, those global vars should be refactored away.
+        # cleanup_unpack() is required because these reviews use
+        # DEFAULT_REVIEW_CONTEXT, which is updated (unpack dirs, package files,
+        # ...) when a real (non-Mock) test runs, such as here, while the
+        # tests using mocks depend on it being unset.
         self.addCleanup(cleanup_unpack)
         super().setUp()
 
@@ -1323,42 +1357,8 @@ class TestSnapReviewFunctionalNoMock(TestCase):
     ):
         common_check_results(self, report, expected_counts, expected)
 
-    def _execstack_has_lp1850861(self):
-        """See if execstack breaks on LP: 1850861"""
-        fn = os.path.join(self.mkdtemp(), "ls")
-        shutil.copyfile("/bin/ls", fn)
-        (rc, out) = cmd(["execstack", "--set-execstack", fn])
-        if rc != 0:
-            return True
-
-    def test_check_execstack_inject_link(self):
-        """Workaround the fact that newer releases don't have a functional
-           execstack (LP: #1850861). This isn't an actual check but rather
-           an injection so collect-check-names-from-tests returns consistent
-           results when the testsuite is run on systems with and without a
-           functional execstack.
-        """
-        if not self._execstack_has_lp1850861():
-            return
-        package = utils.make_snap2(output_dir=self.mkdtemp())
-        c = SnapReviewFunctional(package)
-        c._add_result(
-            "info",
-            "functional-snap-v2:execstack",
-            "OK (faked via test_check_execstack_inject_link())",
-            manual_review=False,
-            link="https://forum.snapcraft.io/t/snap-and-executable-stacks/1812",
-        )
-        report = c.review_report
-        expected_counts = {"info": 1, "warn": 0, "error": 0}
-        self.check_results(report, expected_counts)
-
     def test_check_execstack(self):
         """Test check_execstack() - execstack found execstack binary"""
-        os.environ["SNAP_ARCH"] = utils.debian_architecture()
-        if os.environ["SNAP_ARCH"] == "arm64":  # pragma: nocover
-            return
-
         # copy /bin/ls nonexecstack.bin
         package = utils.make_snap2(
             output_dir=self.mkdtemp(), extra_files=["/bin/ls:nonexecstack.bin"]
@@ -1371,18 +1371,11 @@ class TestSnapReviewFunctionalNoMock(TestCase):
 
     def test_check_execstack_found_binary(self):
         """Test check_execstack() - execstack found execstack binary"""
-        os.environ["SNAP_ARCH"] = utils.debian_architecture()
-        if os.environ["SNAP_ARCH"] == "arm64":  # pragma: nocover
-            return
-        elif self._execstack_has_lp1850861():
-            print("SKIPPING: execstack failed (LP: #1850861)")
-            return
-
         output_dir = self.mkdtemp()
         fn = os.path.join(output_dir, "hasexecstack.bin")
         shutil.copyfile("/bin/ls", fn)
         # create a /bin/ls with executable stack
-        cmd(["execstack", "--set-execstack", fn])
+        utils.set_execstack(fn)
 
         package = utils.make_snap2(output_dir=output_dir)
         c = SnapReviewFunctional(package)
@@ -1404,18 +1397,11 @@ class TestSnapReviewFunctionalNoMock(TestCase):
 
     def test_check_execstack_found_binary_devmode(self):
         """Test check_execstack() - execstack found execstack binary - devmode"""
-        os.environ["SNAP_ARCH"] = utils.debian_architecture()
-        if os.environ["SNAP_ARCH"] == "arm64":  # pragma: nocover
-            return
-        elif self._execstack_has_lp1850861():
-            print("SKIPPING: execstack failed (LP: #1850861)")
-            return
-
         output_dir = self.mkdtemp()
         fn = os.path.join(output_dir, "hasexecstack.bin")
         shutil.copyfile("/bin/ls", fn)
         # create a /bin/ls with executable stack
-        cmd(["execstack", "--set-execstack", fn])
+        utils.set_execstack(fn)
 
         yaml = """architectures: [ all ]
 name: test
@@ -1444,18 +1430,11 @@ confinement: devmode
 
     def test_check_execstack_found_binary_override(self):
         """Test check_execstack() - execstack found execstack binary - override"""
-        os.environ["SNAP_ARCH"] = utils.debian_architecture()
-        if os.environ["SNAP_ARCH"] == "arm64":  # pragma: nocover
-            return
-        elif self._execstack_has_lp1850861():
-            print("SKIPPING: execstack failed (LP: #1850861)")
-            return
-
         output_dir = self.mkdtemp()
         fn = os.path.join(output_dir, "hasexecstack.bin")
         shutil.copyfile("/bin/ls", fn)
         # create a /bin/ls with executable stack
-        cmd(["execstack", "--set-execstack", fn])
+        utils.set_execstack(fn)
         package = utils.make_snap2(name="test-override", output_dir=output_dir)
         c = SnapReviewFunctional(package)
         c.pkg_bin_files = [fn]
@@ -1483,18 +1462,11 @@ confinement: devmode
 
     def test_check_execstack_os(self):
         """Test check_execstack() - os snap"""
-        os.environ["SNAP_ARCH"] = utils.debian_architecture()
-        if os.environ["SNAP_ARCH"] == "arm64":  # pragma: nocover
-            return
-        elif self._execstack_has_lp1850861():
-            print("SKIPPING: execstack failed (LP: #1850861)")
-            return
-
         output_dir = self.mkdtemp()
         fn = os.path.join(output_dir, "hasexecstack.bin")
         shutil.copyfile("/bin/ls", fn)
         # create a /bin/ls with executable stack
-        cmd(["execstack", "--set-execstack", fn])
+        utils.set_execstack(fn)
 
         yaml = """architectures: [ all ]
 name: test
@@ -1513,10 +1485,6 @@ type: os
 
     def test_check_execstack_rc_nonzero(self):
         """Test check_execstack() - execstack returns non-zero"""
-        os.environ["SNAP_ARCH"] = utils.debian_architecture()
-        if os.environ["SNAP_ARCH"] == "arm64":  # pragma: nocover
-            return
-
         package = utils.make_snap2(output_dir=self.mkdtemp())
         c = SnapReviewFunctional(package)
         c.pkg_bin_files = ["path/to/nonexistent/file"]
@@ -1528,13 +1496,6 @@ type: os
     def test_check_execstack_binary_skip(self):
         """Test check_execstack() - execstack found only skipped execstack
            binaries"""
-        os.environ["SNAP_ARCH"] = utils.debian_architecture()
-        if os.environ["SNAP_ARCH"] == "arm64":  # pragma: nocover
-            return
-        elif self._execstack_has_lp1850861():
-            print("SKIPPING: execstack failed (LP: #1850861)")
-            return
-
         test_files = [
             "boot/memtest86+_multiboot.bin",
             "lib/klibc-T5LXP1hTwH_ezt-1EUSxPbNR_es.so",
@@ -1562,7 +1523,7 @@ type: os
             fn = os.path.join(output_dir, f)
             shutil.copyfile("/bin/ls", fn)
             # create a /bin/ls with executable stack
-            cmd(["execstack", "--set-execstack", fn])
+            utils.set_execstack(fn)
             pkg_bin_files.append(fn)
 
         package = utils.make_snap2(output_dir=output_dir)
@@ -1575,13 +1536,6 @@ type: os
 
     def test_check_execstack_found_with_binary_skip(self):
         """Test check_execstack() - execstack found skipped execstack binary"""
-        os.environ["SNAP_ARCH"] = utils.debian_architecture()
-        if os.environ["SNAP_ARCH"] == "arm64":  # pragma: nocover
-            return
-        elif self._execstack_has_lp1850861():
-            print("SKIPPING: execstack failed (LP: #1850861)")
-            return
-
         test_files = ["hasexecstack.bin", "usr/lib/klibc/bin/cat"]
         output_dir = self.mkdtemp()
 
@@ -1593,7 +1547,7 @@ type: os
             fn = os.path.join(output_dir, f)
             shutil.copyfile("/bin/ls", fn)
             # create a /bin/ls with executable stack
-            cmd(["execstack", "--set-execstack", fn])
+            utils.set_execstack(fn)
             pkg_bin_files.append(fn)
 
         package = utils.make_snap2(output_dir=output_dir)
@@ -1616,23 +1570,22 @@ type: os
         self.assertTrue("hasexecstack.bin" in report["warn"][name]["text"])
         self.assertTrue("klibc" not in report["warn"][name]["text"])
 
-    def test_check_execstack_skipped_arm64(self):
-        """Test check_execstack() - skipped on arm64"""
+    def test_check_execstack_arm64(self):
+        """Test check_execstack() - arm64"""
         os.environ["SNAP_ARCH"] = "arm64"
 
-        package = utils.make_snap2()
+        output_dir = self.mkdtemp()
+        fn = os.path.join(output_dir, "hasexecstack.bin")
+        shutil.copyfile("/bin/ls", fn)
+        utils.set_execstack(fn)
+        package = utils.make_snap2(output_dir=output_dir)
         c = SnapReviewFunctional(package)
+        c.pkg_bin_files = [fn]
         c.check_execstack()
         report = c.review_report
-        expected_counts = {"info": 1, "warn": 0, "error": 0}
+        expected_counts = {"info": None, "warn": 1, "error": 0}
         self.check_results(report, expected_counts)
 
-        self.assertTrue("info" in report)
-        name = "functional-snap-v2:execstack"
-        self.assertTrue(name in report["info"])
-        self.assertTrue("text" in report["info"][name])
-        self.assertTrue(report["info"][name]["text"] == ("OK (skipped on arm64)"))
-
     def test_check_base_mountpoints(self):
         """Test check_base_mountpoints()"""
         test_files = [
@@ -15,6 +15,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from unittest import TestCase
+from unittest.mock import patch
 import os
 import platform
 import shutil
@@ -153,6 +154,23 @@ class TestSnapReviewLint(sr_tests.TestSnapReview):
         expected_counts = {"info": 1, "warn": 0, "error": 0}
         self.check_results(r, expected_counts)
 
+    def test_check_name_only(self):
+        """Test check_name - only yaml checks selected"""
+        self.set_test_snap_yaml("name", "foo")
+        os.environ["RT_ONLY_CHECKS"] = "lint-snap-v2:name"
+        self.addCleanup(os.environ.pop, "RT_ONLY_CHECKS")
+        with patch("reviewtools.common.raw_unpack_pkg") as raw_unpack_pkg:
+            c = SnapReviewLint(self.test_name)
+        # the package isn't listed or raw unpacked
+        self.assertEqual(c.pkg_files, [])
+        self.assertIsNone(c.unsquashfs_lln_entries)
+        raw_unpack_pkg.assert_not_called()
+        self.assertIsNone(c.raw_unpack_dir)
+        c.do_checks()
+        r = c.review_report
+        expected_counts = {"info": 1, "warn": 0, "error": 0}
+        self.check_results(r, expected_counts)
+
     def test_check_name_toplevel_startswith_number(self):
         """Test check_name - toplevel starts with number"""
         self.set_test_snap_yaml("name", "01game")
@@ -3059,6 +3077,24 @@ class TestSnapReviewLint(sr_tests.TestSnapReview):
         expected_counts = {"info": 4, "warn": 0, "error": 1}
         self.check_results(r, expected_counts)
 
+    def test_check_plugs_unknown_attrib_overridden_next_review(self):
+        """Test check_plugs() - unknown attrib (overridden in previous review)"""
+        plugs = {"test": {"interface": "content", "target": "foo", "ovrd": "abc"}}
+        self.set_test_snap_yaml("plugs", plugs)
+        from reviewtools.overrides import interfaces_attribs_addons
+
+        interfaces_attribs_addons["foo"] = {"content": {"ovrd/plugs": ""}}
+        SnapReviewLint(self.test_name)
+        del interfaces_attribs_addons["foo"]
+
+        # the override isn't used by later reviews in the same process
+        c = SnapReviewLint(self.test_name)
+        self.assertNotIn("ovrd/plugs", SnapReviewLint.interfaces_attribs["content"])
+        c.check_plugs()
+        r = c.review_report
+        expected_counts = {"info": 4, "warn": 0, "error": 1}
+        self.check_results(r, expected_counts)
+
     def test_check_plugs_bad_attrib_content(self):
         """Test check_plugs() - bad attrib - content"""
         plugs = {"test": {"interface": "content", "target": ["invalid"]}}
@@ -6198,12 +6234,10 @@ class TestSnapReviewLintNoMock(TestCase):
     """Tests without mocks where they are not needed."""
 
     def setUp(self):
-        # XXX cleanup_unpack() is required because global variables
-        # UNPACK_DIR, RAW_UNPACK_DIR, PKG_FILES, and PKG_BIN_FILES are
-        # initialised to None at module load time, but updated when a real
-        # (non-Mock) test runs, such as here. While, at the same time, two of
-        # the existing tests using mocks depend on both global vars being None.
-        # Ideally, those global vars should be refactored away.
+        # cleanup_unpack() is required because these reviews use
+        # DEFAULT_REVIEW_CONTEXT, which is updated (unpack dirs, package files,
+        # ...) when a real (non-Mock) test runs, such as here, while the
+        # tests using mocks depend on it being unset.
         self.addCleanup(cleanup_unpack)
         super().setUp()
         self.maxDiff = None
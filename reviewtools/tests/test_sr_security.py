@@ -16,12 +16,15 @@
 
 from __future__ import print_function
 from unittest import TestCase
+from unittest.mock import patch
 import os
 import re
 import shutil
 import tempfile
 import yaml
 
+from reviewtools.analysis_cache import close_analysis_cache
+import reviewtools.common
 from reviewtools.common import cleanup_unpack
 from reviewtools.common import check_results as common_check_results
 from reviewtools.common import unsquashfs_lln_parse as common_unsquashfs_lln_parse
@@ -1083,17 +1086,91 @@ slots:
             if p is not None:
                 del sec_mode_overrides[p]
 
+    def test__get_resquash_source_dir(self):
+        """Test _get_resquash_source_dir()"""
+        c = SnapReviewSecurity(self.test_name)
+        c.unpack_dir = "/fake"
+        c._is_fully_unpacked = lambda: True
+        self.assertEqual(c._get_resquash_source_dir(), "/fake")
+
+    def test__get_resquash_source_dir_not_unpacked(self):
+        """Test _get_resquash_source_dir() - not fully unpacked"""
+        c = SnapReviewSecurity(self.test_name)
+        c.unpack_dir = "/fake"
+        c._is_fully_unpacked = lambda: False
+        self.assertIsNone(c._get_resquash_source_dir())
+
+    def test__get_resquash_source_dir_base(self):
+        """Test _get_resquash_source_dir() - base"""
+        self.set_test_snap_yaml("type", "base")
+        c = SnapReviewSecurity(self.test_name)
+        c.unpack_dir = "/fake"
+        c._is_fully_unpacked = lambda: True
+        self.assertIsNone(c._get_resquash_source_dir())
+
+    def test__get_resquash_source_dir_fakeroot(self):
+        """Test _get_resquash_source_dir() - fakeroot"""
+        c = SnapReviewSecurity(self.test_name)
+        c.unpack_dir = "/fake"
+        c._is_fully_unpacked = lambda: True
+        os.environ["SNAP_FAKEROOT_RESQUASHFS"] = "1"
+        self.addCleanup(os.environ.pop, "SNAP_FAKEROOT_RESQUASHFS", None)
+        self.assertIsNone(c._get_resquash_source_dir())
+
+    def test__get_resquash_source_dir_unpack_cache(self):
+        """Test _get_resquash_source_dir() - unpack cache entry"""
+        c = SnapReviewSecurity(self.test_name)
+        c.unpack_dir = "/fake"
+        c._is_fully_unpacked = lambda: True
+        c.context.unpack_cache_entry = "/fake-entry"
+        self.addCleanup(setattr, c.context, "unpack_cache_entry", None)
+        self.assertIsNone(c._get_resquash_source_dir())
+
+    def test__get_resquash_cache_key(self):
+        """Test _get_resquash_cache_key()"""
+        output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output_dir)
+        fn = os.path.join(output_dir, "test.snap")
+        with open(fn, "w") as f:
+            f.write("test")
+        c = SnapReviewSecurity(self.test_name)
+
+        os.environ["SNAP_REVIEW_ANALYSIS_CACHE"] = os.path.join(output_dir, "db")
+        self.addCleanup(os.environ.pop, "SNAP_REVIEW_ANALYSIS_CACHE")
+        self.addCleanup(close_analysis_cache)
+        tools = "mksquashfs version 4.5"
+        with patch(
+            "reviewtools.sr_security.get_squashfs_tools_version", lambda: tools
+        ):
+            key = c._get_resquash_cache_key(fn, "xz")
+            self.assertIsNotNone(key)
+            self.assertEqual(key, c._get_resquash_cache_key(fn, "xz"))
+            self.assertNotEqual(key, c._get_resquash_cache_key(fn, "gzip"))
+            os.environ["SNAP_FAKEROOT_RESQUASHFS"] = "1"
+            res = c._get_resquash_cache_key(fn, "xz")
+            os.environ.pop("SNAP_FAKEROOT_RESQUASHFS")
+            self.assertNotEqual(key, res)
+
+            tools = "mksquashfs version 4.6"
+            self.assertNotEqual(key, c._get_resquash_cache_key(fn, "xz"))
+
+            tools = None
+            self.assertIsNone(c._get_resquash_cache_key(fn, "xz"))
+
+    def test__get_resquash_cache_key_disabled(self):
+        """Test _get_resquash_cache_key() - analysis cache disabled"""
+        c = SnapReviewSecurity(self.test_name)
+        self.assertIsNone(c._get_resquash_cache_key(self.test_name, "xz"))
+
 
 class TestSnapReviewSecurityNoMock(TestCase):
     """Tests without mocks where they are not needed."""
 
     def setUp(self):
-        # XXX cleanup_unpack() is required because global variables
-        # UNPACK_DIR, RAW_UNPACK_DIR, PKG_FILES and PKG_BIN_FILES are
-        # initialised to None at module load time, but updated when a real
-        # (non-Mock) test runs, such as here. While, at the same time, two of
-        # the existing tests using mocks depend on both global vars being None.
-        # Ideally, those global vars should be refactored away.
+        # cleanup_unpack() is required because these reviews use
+        # DEFAULT_REVIEW_CONTEXT, which is updated (unpack dirs, package files,
+        # ...) when a real (non-Mock) test runs, such as here, while the
+        # tests using mocks depend on it being unset.
         self.addCleanup(cleanup_unpack)
         super().setUp()
 
@@ -1154,6 +1231,8 @@ class TestSnapReviewSecurityNoMock(TestCase):
         output_dir = self.mkdtemp()
         package = utils.make_snap2(output_dir=output_dir)
         c = SnapReviewSecurity(package)
+        # don't read the superblock so the fake unsquashfs -stat is used
+        c._squashfs_superblock = lambda fn: None
 
         # fake unsquashfs
         unsquashfs = os.path.join(output_dir, "unsquashfs")
@@ -1191,6 +1270,8 @@ exit 1
         output_dir = self.mkdtemp()
         package = utils.make_snap2(output_dir=output_dir)
         c = SnapReviewSecurity(package)
+        # don't read the superblock so the fake unsquashfs -stat is used
+        c._squashfs_superblock = lambda fn: None
 
         # fake unsquashfs
         unsquashfs = os.path.join(output_dir, "unsquashfs")
@@ -1222,6 +1303,8 @@ exit 1
         output_dir = self.mkdtemp()
         package = utils.make_snap2(output_dir=output_dir)
         c = SnapReviewSecurity(package)
+        # don't read the superblock so the fake unsquashfs -stat is used
+        c._squashfs_superblock = lambda fn: None
 
         # fake unsquashfs
         unsquashfs = os.path.join(output_dir, "unsquashfs")
@@ -1274,6 +1357,8 @@ exit 1
         output_dir = self.mkdtemp()
         package = utils.make_snap2(output_dir=output_dir)
         c = SnapReviewSecurity(package)
+        # don't read the superblock so the fake unsquashfs -stat is used
+        c._squashfs_superblock = lambda fn: None
 
         # fake unsquashfs
         unsquashfs = os.path.join(output_dir, "unsquashfs")
@@ -1369,6 +1454,8 @@ exit 1
         output_dir = self.mkdtemp()
         package = utils.make_snap2(output_dir=output_dir)
         c = SnapReviewSecurity(package)
+        # don't read the superblock so the fake unsquashfs -stat is used
+        c._squashfs_superblock = lambda fn: None
 
         # fake unsquashfs
         unsquashfs = os.path.join(output_dir, "unsquashfs")
@@ -1443,25 +1530,116 @@ exit 1
         expected_counts = {"info": None, "warn": 0, "error": 1}
         self.check_results(report, expected_counts)
 
-    def test_check_squashfs_resquash_sha512sum_fail(self):
-        """Test check_squashfs_resquash() - sha512sum failure"""
+    def test_check_squashfs_resquash_reuse_unpack(self):
+        """Test check_squashfs_resquash() - repack the review's unpack"""
         output_dir = self.mkdtemp()
         package = utils.make_snap2(output_dir=output_dir)
         c = SnapReviewSecurity(package)
+        c._unpack_all()
 
-        # fake sha512sum
-        sha512sum = os.path.join(output_dir, "sha512sum")
+        # fake unsquashfs, which isn't needed
+        unsquashfs = os.path.join(output_dir, "unsquashfs")
+        content = """#!/bin/sh
+echo test error: unsquashfs failure
+exit 1
+"""
+        with open(unsquashfs, "w") as f:
+            f.write(content)
+        os.chmod(unsquashfs, 0o775)
+
+        old_path = os.environ["PATH"]
+        if old_path:
+            os.environ["PATH"] = "%s:%s" % (output_dir, os.environ["PATH"])
+        else:
+            os.environ["PATH"] = output_dir  # pragma: nocover
+
+        os.environ["SNAP_ENFORCE_RESQUASHFS"] = "1"
+        c.check_squashfs_resquash()
+        os.environ.pop("SNAP_ENFORCE_RESQUASHFS")
+        os.environ["PATH"] = old_path
+        report = c.review_report
+        expected_counts = {"info": 1, "warn": 0, "error": 0}
+        self.check_results(report, expected_counts)
+
+    def test_check_squashfs_resquash_reuse_unpack_differs(self):
+        """Test check_squashfs_resquash() - review's unpack differs"""
+        output_dir = self.mkdtemp()
+        package = utils.make_snap2(output_dir=output_dir)
+        c = SnapReviewSecurity(package)
+        c._unpack_all()
+        # the review's unpack is the same as a fresh unpack, so the mismatch
+        # is reported without repacking again
+        with open(os.path.join(c.unpack_dir, "meta/snap.yaml"), "a") as f:
+            f.write("# modified\n")
+
+        with patch.object(c, "_resquash", wraps=c._resquash) as resquash:
+            c.check_squashfs_resquash()
+        self.assertEqual(resquash.call_count, 1)
+        report = c.review_report
+        expected_counts = {"info": None, "warn": 0, "error": 1}
+        self.check_results(report, expected_counts)
+
+    def test_check_squashfs_resquash_unpack_cache(self):
+        """Test check_squashfs_resquash() - package in the unpack cache"""
+        output_dir = self.mkdtemp()
+        package = utils.make_snap2(output_dir=output_dir)
+        os.environ["SNAP_REVIEW_UNPACK_CACHE"] = "1"
+        self.addCleanup(os.environ.pop, "SNAP_REVIEW_UNPACK_CACHE")
+        os.environ["SNAP_ENFORCE_RESQUASHFS"] = "1"
+        self.addCleanup(os.environ.pop, "SNAP_ENFORCE_RESQUASHFS")
+        old_mkdtemp_dir = reviewtools.common.MKDTEMP_DIR
+        reviewtools.common.MKDTEMP_DIR = output_dir
+        self.addCleanup(setattr, reviewtools.common, "MKDTEMP_DIR", old_mkdtemp_dir)
+        # the cached packages are read-only
+        self.addCleanup(reviewtools.common._set_tree_writable, output_dir, True)
+
+        c = SnapReviewSecurity(package)
+        self.assertIsNotNone(c.context.unpack_cache_entry)
+        # the first repack, of a fresh unpack, matches
+        with patch.object(c, "_resquash", wraps=c._resquash) as resquash:
+            c.check_squashfs_resquash()
+        self.assertEqual(resquash.call_count, 1)
+        self.assertIsNone(resquash.call_args[1]["src_dir"])
+        report = c.review_report
+        expected_counts = {"info": 1, "warn": 0, "error": 0}
+        self.check_results(report, expected_counts)
+
+    def test_check_squashfs_resquash_cached(self):
+        """Test check_squashfs_resquash() - cached result"""
+        output_dir = self.mkdtemp()
+        package = utils.make_snap2(output_dir=output_dir)
+        os.environ["SNAP_REVIEW_ANALYSIS_CACHE"] = os.path.join(output_dir, "db")
+        self.addCleanup(os.environ.pop, "SNAP_REVIEW_ANALYSIS_CACHE")
+        os.environ["SNAP_ENFORCE_RESQUASHFS"] = "1"
+        self.addCleanup(os.environ.pop, "SNAP_ENFORCE_RESQUASHFS")
+
+        c = SnapReviewSecurity(package)
+        c.check_squashfs_resquash()
+        cleanup_unpack()
+
+        # the re-review doesn't repack
+        c = SnapReviewSecurity(package)
+        with patch.object(c, "_resquash", side_effect=AssertionError):
+            c.check_squashfs_resquash()
+        cleanup_unpack()
+        report = c.review_report
+        expected_counts = {"info": 1, "warn": 0, "error": 0}
+        self.check_results(report, expected_counts)
+
+    def test_check_squashfs_resquash_compare_fail(self):
+        """Test check_squashfs_resquash() - compare failure"""
+        output_dir = self.mkdtemp()
+        package = utils.make_snap2(output_dir=output_dir)
+        c = SnapReviewSecurity(package)
+
+        # fake mksquashfs that doesn't create the repack
+        mksquashfs = os.path.join(output_dir, "mksquashfs")
         content = """#!/bin/sh
-bn=`basename "$1"`
-if [ "$bn" = "test_1.0_all.snap" ]; then
-    echo test error: sha512sum failure
-    exit 1
-fi
 exit 0
 """
-        with open(sha512sum, "w") as f:
+        with open(mksquashfs, "w") as f:
             f.write(content)
-        os.chmod(sha512sum, 0o775)
+        os.chmod(mksquashfs, 0o775)
 
         old_path = os.environ["PATH"]
         if old_path:
@@ -1477,26 +1655,21 @@ exit 0
         expected_counts = {"info": None, "warn": 0, "error": 1}
         self.check_results(report, expected_counts)
 
-    def test_check_squashfs_resquash_sha512sum_fail_repacked(self):
-        """Test check_squashfs_resquash() - sha512sum failure (repacked)"""
+    def test_check_squashfs_resquash_compare_fail_directory(self):
+        """Test check_squashfs_resquash() - compare failure (directory)"""
         output_dir = self.mkdtemp()
         package = utils.make_snap2(output_dir=output_dir)
         c = SnapReviewSecurity(package)
 
-        # fake sha512sum
-        sha512sum = os.path.join(output_dir, "sha512sum")
+        # fake mksquashfs that creates a directory instead of the repack
+        mksquashfs = os.path.join(output_dir, "mksquashfs")
         content = """#!/bin/sh
-bn=`basename "$1"`
-if [ "$bn" != "test_1.0_all.snap" ]; then
-    echo test error: sha512sum failure
-    exit 1
-fi
-echo deadbeef $1
+mkdir "$2"
 exit 0
 """
-        with open(sha512sum, "w") as f:
+        with open(mksquashfs, "w") as f:
             f.write(content)
-        os.chmod(sha512sum, 0o775)
+        os.chmod(mksquashfs, 0o775)
 
         old_path = os.environ["PATH"]
         if old_path:
@@ -1512,26 +1685,21 @@ exit 0
         expected_counts = {"info": None, "warn": 0, "error": 1}
         self.check_results(report, expected_counts)
 
-    def test_check_squashfs_resquash_sha512sum_mismatch(self):
-        """Test check_squashfs_resquash() - sha512sum mismatch (no enforce)"""
+    def test_check_squashfs_resquash_checksum_mismatch(self):
+        """Test check_squashfs_resquash() - checksum mismatch (no enforce)"""
         output_dir = self.mkdtemp()
         package = utils.make_snap2(output_dir=output_dir)
         c = SnapReviewSecurity(package)
 
-        # fake sha512sum
-        sha512sum = os.path.join(output_dir, "sha512sum")
+        # fake mksquashfs
+        mksquashfs = os.path.join(output_dir, "mksquashfs")
         content = """#!/bin/sh
-bn=`basename "$1"`
-if [ "$bn" = "test_1.0_all.snap" ]; then
-    echo beefeeee $1
-else
-    echo deadbeef $1
-fi
+echo test repack > "$2"
 exit 0
 """
-        with open(sha512sum, "w") as f:
+        with open(mksquashfs, "w") as f:
             f.write(content)
-        os.chmod(sha512sum, 0o775)
+        os.chmod(mksquashfs, 0o775)
 
         old_path = os.environ["PATH"]
         if old_path:
@@ -1547,26 +1715,21 @@ exit 0
         expected_counts = {"info": 1, "warn": 0, "error": 0}
         self.check_results(report, expected_counts)
 
-    def test_check_squashfs_resquash_sha512sum_mismatch_enforce(self):
-        """Test check_squashfs_resquash() - sha512sum mismatch - enforce"""
+    def test_check_squashfs_resquash_checksum_mismatch_enforce(self):
+        """Test check_squashfs_resquash() - checksum mismatch - enforce"""
         output_dir = self.mkdtemp()
         package = utils.make_snap2(output_dir=output_dir)
         c = SnapReviewSecurity(package)
 
-        # fake sha512sum
-        sha512sum = os.path.join(output_dir, "sha512sum")
+        # fake mksquashfs
+        mksquashfs = os.path.join(output_dir, "mksquashfs")
         content = """#!/bin/sh
-bn=`basename "$1"`
-if [ "$bn" = "test_1.0_all.snap" ]; then
-    echo beefeeee $1
-else
-    echo deadbeef $1
-fi
+echo test repack > "$2"
 exit 0
 """
-        with open(sha512sum, "w") as f:
+        with open(mksquashfs, "w") as f:
             f.write(content)
-        os.chmod(sha512sum, 0o775)
+        os.chmod(mksquashfs, 0o775)
 
         old_path = os.environ["PATH"]
         if old_path:
@@ -1594,26 +1757,21 @@ exit 0
         }
         self.check_results(report, expected=expected)
 
-    def test_check_squashfs_resquash_sha512sum_mismatch_override(self):
-        """Test check_squashfs_resquash() - sha512sum mismatch - overridden"""
+    def test_check_squashfs_resquash_checksum_mismatch_override(self):
+        """Test check_squashfs_resquash() - checksum mismatch - overridden"""
         output_dir = self.mkdtemp()
         package = utils.make_snap2(output_dir=output_dir)
         c = SnapReviewSecurity(package)
 
-        # fake sha512sum
-        sha512sum = os.path.join(output_dir, "sha512sum")
+        # fake mksquashfs
+        mksquashfs = os.path.join(output_dir, "mksquashfs")
         content = """#!/bin/sh
-bn=`basename "$1"`
-if [ "$bn" = "test_1.0_all.snap" ]; then
-    echo beefeeee $1
-else
-    echo deadbeef $1
-fi
+echo test repack > "$2"
 exit 0
 """
-        with open(sha512sum, "w") as f:
+        with open(mksquashfs, "w") as f:
             f.write(content)
-        os.chmod(sha512sum, 0o775)
+        os.chmod(mksquashfs, 0o775)
 
         old_path = os.environ["PATH"]
         if old_path:
@@ -1649,8 +1807,8 @@ exit 0
         }
         self.check_results(report, expected=expected)
 
-    def test_check_squashfs_resquash_sha512sum_mismatch_enforce_os(self):
-        """Test check_squashfs_resquash() - sha512sum mismatch - enforce os"""
+    def test_check_squashfs_resquash_checksum_mismatch_enforce_os(self):
+        """Test check_squashfs_resquash() - checksum mismatch - enforce os"""
         output_dir = self.mkdtemp()
         package = utils.make_snap2(output_dir=output_dir)
         sy_path = os.path.join(output_dir, "snap.yaml")
@@ -1671,20 +1829,15 @@ type: os
 
         c = SnapReviewSecurity(package)
 
-        # fake sha512sum
-        sha512sum = os.path.join(output_dir, "sha512sum")
+        # fake mksquashfs
+        mksquashfs = os.path.join(output_dir, "mksquashfs")
         content = """#!/bin/sh
-bn=`basename "$1"`
-if [ "$bn" = "test_1.0_all.snap" ]; then
-    echo beefeeee $1
-else
-    echo deadbeef $1
-fi
+echo test repack > "$2"
 exit 0
 """
-        with open(sha512sum, "w") as f:
+        with open(mksquashfs, "w") as f:
             f.write(content)
-        os.chmod(sha512sum, 0o775)
+        os.chmod(mksquashfs, 0o775)
 
         old_path = os.environ["PATH"]
         if old_path:
@@ -1710,8 +1863,8 @@ exit 0
         }
         self.check_results(report, expected=expected)
 
-    def test_check_squashfs_resquash_sha512sum_mismatch_enforce_app_override(self):
-        """Test check_squashfs_resquash() - sha512sum mismatch - enforce app
+    def test_check_squashfs_resquash_checksum_mismatch_enforce_app_override(self):
+        """Test check_squashfs_resquash() - checksum mismatch - enforce app
            with override.
         """
         output_dir = self.mkdtemp()
@@ -1733,20 +1886,15 @@ architectures: [ amd64 ]
 
         c = SnapReviewSecurity(package)
 
-        # fake sha512sum
-        sha512sum = os.path.join(output_dir, "sha512sum")
+        # fake mksquashfs
+        mksquashfs = os.path.join(output_dir, "mksquashfs")
         content = """#!/bin/sh
-bn=`basename "$1"`
-if [ "$bn" = "test_1.0_all.snap" ]; then
-    echo beefeeee $1
-else
-    echo deadbeef $1
-fi
+echo test repack > "$2"
 exit 0
 """
-        with open(sha512sum, "w") as f:
+        with open(mksquashfs, "w") as f:
             f.write(content)
-        os.chmod(sha512sum, 0o775)
+        os.chmod(mksquashfs, 0o775)
 
         old_path = os.environ["PATH"]
         if old_path:
@@ -1772,8 +1920,8 @@ exit 0
         }
         self.check_results(report, expected=expected)
 
-    def test_check_squashfs_resquash_sha512sum_mismatch_enforce_app_override_list(self):
-        """Test check_squashfs_resquash() - sha512sum mismatch - enforce app
+    def test_check_squashfs_resquash_checksum_mismatch_enforce_app_override_list(self):
+        """Test check_squashfs_resquash() - checksum mismatch - enforce app
            with override (list).
         """
         # update the overrides
@@ -1800,20 +1948,15 @@ architectures: [ amd64 ]
 
         c = SnapReviewSecurity(package)
 
-        # fake sha512sum
-        sha512sum = os.path.join(output_dir, "sha512sum")
+        # fake mksquashfs
+        mksquashfs = os.path.join(output_dir, "mksquashfs")
         content = """#!/bin/sh
-bn=`basename "$1"`
-if [ "$bn" = "test_1.0_all.snap" ]; then
-    echo beefeeee $1
-else
-    echo deadbeef $1
-fi
+echo test repack > "$2"
 exit 0
 """
-        with open(sha512sum, "w") as f:
+        with open(mksquashfs, "w") as f:
             f.write(content)
-        os.chmod(sha512sum, 0o775)
+        os.chmod(mksquashfs, 0o775)
 
         old_path = os.environ["PATH"]
         if old_path:
@@ -15,10 +15,12 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from reviewtools.common import MKSQUASHFS_DEFAULT_COMPRESSION, MKSQUASHFS_OPTS, cmd
+from reviewtools.elf import ELFCLASS64, PT_GNU_STACK, PF_X, ElfFile
 import copy
 import json
 import os
 import shutil
+import struct
 import subprocess
 import tempfile
 
@@ -357,3 +359,26 @@ def debian_architecture():
     if rc != 0:
         raise ValueError("Could not determined DEB_BUILD_ARCH")
     return out.strip()
+
+
+def set_execstack(fn):
+    """Set the executable stack flag like 'execstack --set-execstack' for an
+       ELF file with PT_GNU_STACK
+    """
+    with ElfFile(fn) as elf:
+        # p_flags is the second field with 64-bit and the seventh with 32-bit
+        flags_offset = 4 if elf.ei_class == ELFCLASS64 else 24
+        flags_fmt = elf.endian + "I"
+        offsets = []
+        for (i, phdr) in enumerate(elf.program_headers()):
+            if phdr[0] == PT_GNU_STACK:
+                offsets.append(
+                    (elf.e_phoff + i * elf.e_phentsize + flags_offset, phdr[3])
+                )
+    if len(offsets) == 0:
+        raise ValueError("'%s' has no PT_GNU_STACK" % fn)
+
+    with open(fn, "r+b") as f:
+        for (offset, flags) in offsets:
+            f.seek(offset)
+            f.write(struct.pack(flags_fmt, flags | PF_X))
@@ -14,7 +14,6 @@
 
 import os
 import re
-from pkg_resources import resource_filename
 
 import reviewtools.common as common
 import reviewtools.debversion as debversion
@@ -63,8 +62,8 @@ def read_usn_db(fn, support_non_lts=False):
 
     unmatched_vers_fn = "./reviewtools/data/ubuntu-unmatched-bin-versions.json"
     if not os.path.exists(unmatched_vers_fn):  # pragma: nocover
-        unmatched_vers_fn = resource_filename(
-            __name__, "data/ubuntu-unmatched-bin-versions.json"
+        unmatched_vers_fn = common.get_package_data_filename(
+            "ubuntu-unmatched-bin-versions.json"
         )
         if not os.path.exists(unmatched_vers_fn):
             unmatched_vers_fn = None
@@ -0,0 +1,131 @@
+#!/usr/bin/python3
+"""test-startup.py: check the startup time of the bin/ entry points"""
+#
+# Copyright (C) 2021 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# snap-check-notices and rock-check-notices run one of the entry points per
+# package, so their startup cost adds up. This runs each entry point with
+# 'python3 -X importtime <entry point> --help' and fails if the time spent
+# importing modules (less what the interpreter imports by itself) is over
+# the budget or if a module known to be slow to import is imported up front.
+#
+# Usage: ./tests/test-startup.py [--budget <ms>] [--runs <n>] [-v]
+
+import argparse
+import os
+import subprocess
+import sys
+
+ENTRY_POINTS = [
+    "snap-review",
+    "snap-review-daemon",
+    "snap-check-declaration",
+    "snap-check-lint",
+    "snap-check-security",
+    "snap-updates-available",
+    "snap-check-notices",
+    "rock-updates-available",
+    "rock-check-notices",
+]
+
+# only import these when needed
+SLOW_MODULES = ["imp", "magic", "pkg_resources", "requests", "smtplib"]
+
+# milliseconds of imports per entry point
+STARTUP_BUDGET = 100
+
+topdir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+def import_times(args):
+    """Run python3 -X importtime with args and return {module: (self,
+       cumulative)} in microseconds
+    """
+    env = os.environ.copy()
+    env["PYTHONPATH"] = topdir
+    # measure with cached bytecode, like when installed
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    p = subprocess.run(
+        [sys.executable, "-X", "importtime"] + args,
+        cwd=topdir,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    times = {}
+    for line in p.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        (self_us, cumulative, name) = line[len("import time:") :].split("|")
+        times[name.strip()] = (int(self_us), int(cumulative))
+    return times
+
+
+def startup_time(entry_point, baseline, runs):
+    """Return (milliseconds, times) of the fastest of runs imports of the
+       entry point
+    """
+    best = None
+    for i in range(runs):
+        times = import_times([os.path.join("bin", entry_point), "--help"])
+        total = sum(t[0] for (name, t) in times.items() if name not in baseline)
+        if best is None or total < best[0]:
+            best = (total, times)
+    return (best[0] / 1000.0, best[1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--budget",
+        type=float,
+        default=float(os.environ.get("RT_STARTUP_BUDGET", STARTUP_BUDGET)),
+        help="milliseconds of imports allowed per entry point (default: %d)"
+        % STARTUP_BUDGET,
+    )
+    parser.add_argument("--runs", type=int, default=3, help="runs per entry point")
+    parser.add_argument(
+        "-v", "--verbose", action="store_true", help="show the slowest imports"
+    )
+    args = parser.parse_args()
+
+    baseline = import_times(["-c", "pass"])
+    failed = False
+    for entry_point in ENTRY_POINTS:
+        (ms, times) = startup_time(entry_point, baseline, args.runs)
+        problems = []
+        if ms > args.budget:
+            problems.append("over budget of %.0fms" % args.budget)
+        slow = [m for m in SLOW_MODULES if m in times and m not in baseline]
+        if slow:
+            problems.append("imports %s" % ", ".join(slow))
+        status = "FAIL (%s)" % "; ".join(problems) if problems else "ok"
+        print("%-24s %7.1fms  %s" % (entry_point, ms, status))
+        if args.verbose:
+            slowest = sorted(
+                [(t[1], name) for (name, t) in times.items() if name not in baseline],
+                reverse=True,
+            )
+            for (cumulative, name) in slowest[:10]:
+                print("    %7.1fms  %s" % (cumulative / 1000.0, name))
+        failed = failed or len(problems) > 0
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()